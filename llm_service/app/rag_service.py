@@ -1,25 +1,48 @@
-from fastapi import FastAPI, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 import time
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Tuple, Any, AsyncIterator, Mapping
 import json
 import requests
-from dataclasses import dataclass, asdict
+import asyncio
+import httpx
+from dataclasses import dataclass, asdict, field, fields, replace
 from enum import Enum
 import re
+import unicodedata
+import hashlib
+import sqlite3
+import threading
+import sys
+import math
+from abc import ABC, abstractmethod
+from contextlib import aclosing, contextmanager, nullcontext
+import random
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+import mmap
+import operator
+import struct
+from types import MappingProxyType
+from itertools import groupby, product
+
+import numpy as np
 
 import firebase_admin
 from firebase_admin import credentials, firestore, initialize_app
 
+LOG_FILE = os.getenv("RAG_LOG_FILE", "/app/logs/rag_system.log")
+os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+
 logging.basicConfig(
-    level=logging.INFO,
+    level=getattr(logging, os.getenv("RAG_LOG_LEVEL", "INFO").upper(), logging.INFO),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('/app/logs/rag_system.log', mode='a')
+        logging.FileHandler(LOG_FILE, mode='a')
     ]
 )
 logger = logging.getLogger(__name__)
@@ -30,6 +53,183 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# ============================================================================
+# UTILIDADES DE TEXTO
+# ============================================================================
+
+def fold_accents(text: str) -> str:
+    """Minúsculas sin tildes ni diacríticos ("José" -> "jose")"""
+    normalized = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in normalized if not unicodedata.combining(char))
+
+def tokenize(text: str) -> List[str]:
+    """Tokens alfanuméricos de un texto ya normalizado"""
+    return re.findall(r"[a-z0-9]+", text)
+
+SPANISH_STOPWORDS = {
+    'a', 'al', 'de', 'del', 'el', 'la', 'las', 'los', 'lo', 'en', 'que', 'y', 'e', 'o', 'u',
+    'por', 'con', 'un', 'una', 'unos', 'unas', 'se', 'es', 'son', 'hay', 'su', 'sus',
+    'para', 'le', 'les', 'me', 'mi', 'cual', 'cuales', 'quien', 'quienes', 'como',
+    'esta', 'estan', 'este', 'estos', 'estas', 'ese', 'esa', 'tiene', 'tienen', 'tengan',
+    'sean', 'fue', 'fueron', 'existen', 'existe', 'hubo', 'actualmente'
+}
+
+def estimate_tokens(text: str) -> int:
+    """Estimación conservadora de tokens (~3.5 caracteres por token en español)"""
+    return int(len(text) / 3.5) + 1
+
+# Conectores lógicos: "hombres y mujeres" no pide lo mismo que "hombres o mujeres"
+QUERY_CONNECTIVES = {'y', 'e', 'o', 'u', 'ni', 'no', 'sin'}
+
+def normalize_query(query: str) -> str:
+    """Forma canónica de una consulta: sin mayúsculas, tildes, puntuación ni stopwords (salvo conectores)"""
+    return ' '.join(
+        token for token in tokenize(fold_accents(query))
+        if token not in SPANISH_STOPWORDS or token in QUERY_CONNECTIVES
+    )
+
+# ============================================================================
+# INSTRUMENTACIÓN DE LATENCIA
+# ============================================================================
+
+class LatencyHistogram:
+    """Histograma de buckets logarítmicos (~4% de error relativo, 10µs a ~100s), al estilo HDR"""
+    
+    MIN_VALUE = 1e-5
+    MAX_VALUE = 100.0
+    GROWTH = 2 ** (1 / 16)
+    BUCKETS = int(math.ceil(math.log(MAX_VALUE / MIN_VALUE) / math.log(GROWTH))) + 1
+    
+    def __init__(self):
+        self.counts = np.zeros(self.BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    @classmethod
+    def upper_bound(cls, index: int) -> float:
+        return cls.MIN_VALUE * cls.GROWTH ** index
+    
+    def record(self, seconds: float) -> None:
+        if seconds <= self.MIN_VALUE:
+            index = 0
+        else:
+            # Misma tolerancia que cumulative_at: un valor justo en el límite queda en ese bucket
+            index = min(self.BUCKETS - 1, int(math.ceil(math.log(seconds / self.MIN_VALUE) / math.log(self.GROWTH) - 1e-9)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+    
+    def percentile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(fraction * self.count)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        if index == self.BUCKETS - 1:
+            # El último bucket también recoge lo que supera MAX_VALUE: su límite no acota nada
+            return self.max
+        return min(self.upper_bound(index), self.max)
+    
+    def cumulative_at(self, bound: float) -> int:
+        """Observaciones cuyo bucket termina en 'bound' o antes (para buckets 'le' de Prometheus)"""
+        index = int(math.floor(math.log(bound / self.MIN_VALUE) / math.log(self.GROWTH) + 1e-9))
+        return int(self.counts[:max(0, min(index, self.BUCKETS - 1)) + 1].sum())
+    
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+class LatencyTelemetry:
+    """Histogramas por etapa y contadores por ruta/complejidad, con exposición en formato Prometheus"""
+    
+    PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.query_counts: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.record(seconds)
+    
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+    
+    def record_query(self, result: Dict[str, Any], seconds: float) -> None:
+        """Cuenta la consulta por ruta y complejidad y registra su latencia total"""
+        metadata = result.get("metadata", {}) if isinstance(result, dict) else {}
+        labels = (metadata.get("query_path", "unknown"), metadata.get("query_complexity", "unknown"))
+        with self._lock:
+            self.query_counts[labels] = self.query_counts.get(labels, 0) + 1
+        self.observe("total", seconds)
+        self.observe(f"total_{labels[0]}", seconds)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stages": {stage: histogram.summary() for stage, histogram in sorted(self.histograms.items())},
+                "queries": [
+                    {"query_path": path, "complexity": complexity, "count": count}
+                    for (path, complexity), count in sorted(self.query_counts.items())
+                ]
+            }
+    
+    def render_prometheus(self, gauges: Dict[str, Tuple[str, float]]) -> str:
+        """Texto de exposición de Prometheus: histogramas, cuantiles precalculados, contadores y gauges"""
+        lines = [
+            "# HELP rag_stage_duration_seconds Duración de cada etapa del procesamiento de consultas",
+            "# TYPE rag_stage_duration_seconds histogram"
+        ]
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            query_counts = sorted(self.query_counts.items())
+            for stage, histogram in histograms:
+                for bound in self.PROMETHEUS_BUCKETS:
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {histogram.cumulative_at(bound)}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+            
+            lines += [
+                "# HELP rag_stage_duration_quantile_seconds Percentiles p50/p95/p99 por etapa",
+                "# TYPE rag_stage_duration_quantile_seconds gauge"
+            ]
+            for stage, histogram in histograms:
+                for quantile in (0.5, 0.95, 0.99):
+                    lines.append(f'rag_stage_duration_quantile_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                                 f'{histogram.percentile(quantile):.6f}')
+            
+            lines += [
+                "# HELP rag_queries_total Consultas atendidas por ruta y complejidad",
+                "# TYPE rag_queries_total counter"
+            ]
+            for (path, complexity), count in query_counts:
+                lines.append(f'rag_queries_total{{query_path="{path}",complexity="{complexity}"}} {count}')
+        
+        for name, (description, value) in gauges.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value):g}")
+        return '\n'.join(lines) + '\n'
+
+telemetry = LatencyTelemetry()
+
 # ============================================================================
 # CONFIGURACIÓN Y CONEXIONES
 # ============================================================================
@@ -48,6 +248,12 @@ class SystemMetrics:
     failed_queries: int = 0
     avg_response_time: float = 0.0
     cache_hit_rate: float = 0.0
+    streamed_queries: int = 0
+    avg_time_to_first_token: float = 0.0
+    coalesced_queries: int = 0
+    fallback_queries: int = 0
+    batched_queries: int = 0
+    batch_llm_calls: int = 0
     last_updated: datetime = None
 
 class FirebaseManager:
@@ -58,6 +264,10 @@ class FirebaseManager:
         self.collection = None
         self.logs_collection = None
         self.status = "disconnected"
+    
+    def connect(self) -> None:
+        """Establece la conexión; se invoca en segundo plano tras el arranque"""
+        self.status = "connecting"
         self._initialize_connection()
     
     def _initialize_connection(self) -> None:
@@ -77,8 +287,11 @@ class FirebaseManager:
                 "client_x509_cert_url": os.environ.get('FIREBASE_CLIENT_CERT_URL')
             }
 
-            cred = credentials.Certificate(cred_dict)
-            firebase_app = initialize_app(cred, {'projectId': project_id})
+            try:
+                firebase_app = firebase_admin.get_app()
+            except ValueError:
+                cred = credentials.Certificate(cred_dict)
+                firebase_app = initialize_app(cred, {'projectId': project_id})
 
             self.db = firestore.client()
             self.collection = self.db.collection('personas')
@@ -98,22 +311,431 @@ class FirebaseManager:
         """Verifica salud de la conexión"""
         return self.status == "connected" and self.db is not None
 
+# ============================================================================
+# REGISTRO DE CONSULTAS EN SEGUNDO PLANO
+# ============================================================================
+
+class QueryLogWriter:
+    """Cola acotada de logs de consultas que un hilo vuelca a Firestore con escrituras en lote"""
+    
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    FIRESTORE_BATCH_LIMIT = 500
+    
+    def __init__(self, firebase_manager: FirebaseManager, max_queue: int = 1000, batch_size: int = 100,
+                 flush_interval: float = 2.0, drop_policy: str = DROP_OLDEST):
+        self.firebase_manager = firebase_manager
+        self.max_queue = max_queue
+        self.batch_size = min(batch_size, self.FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy if drop_policy in (self.DROP_OLDEST, self.DROP_NEWEST) else self.DROP_OLDEST
+        
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._worker: Optional[threading.Thread] = None
+        
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_duration = 0.0
+    
+    def start(self) -> None:
+        with self._condition:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+            self._worker.start()
+    
+    def enqueue(self, entry: Dict[str, Any]) -> bool:
+        """No bloquea: con la cola llena descarta según la política y lo cuenta"""
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                if self.drop_policy == self.DROP_NEWEST:
+                    return False
+                self._queue.popleft()
+            self._queue.append(entry)
+            self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+        return True
+    
+    def stop(self, timeout: float = 10.0) -> None:
+        """Detiene el hilo tras vaciar la cola (con plazo máximo)"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join(timeout)
+            if self._worker.is_alive():
+                logger.warning(f"⚠️ Logs: {len(self._queue)} registros sin escribir al cerrar")
+        else:
+            self._drain()
+    
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            
+            self._drain()
+            if stopping:
+                return
+    
+    def _drain(self) -> None:
+        while True:
+            with self._condition:
+                if not self._queue:
+                    return
+                entries = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._write_batch(entries)
+    
+    def _write_batch(self, entries: List[Dict[str, Any]]) -> None:
+        if not self.firebase_manager.is_healthy():
+            self.failed += len(entries)
+            return
+        
+        started = time.time()
+        try:
+            batch = self.firebase_manager.db.batch()
+            for entry in entries:
+                batch.set(self.firebase_manager.logs_collection.document(), entry)
+            batch.commit()
+            self.written += len(entries)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(entries)
+            logger.warning(f"⚠️ Error logging ({len(entries)} registros): {e}")
+        self.last_flush_duration = time.time() - started
+        telemetry.observe("log_flush", self.last_flush_duration)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            queue_depth = len(self._queue)
+        return {
+            "queue_depth": queue_depth,
+            "max_queue": self.max_queue,
+            "drop_policy": self.drop_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_ms": round(self.last_flush_duration * 1000, 2),
+            "worker_alive": self._worker is not None and self._worker.is_alive()
+        }
+
+# ============================================================================
+# CONTROL DE TASA HACIA GROQ
+# ============================================================================
+
+class RateLimitExceeded(Exception):
+    """La petición no obtuvo turno dentro de la espera máxima o la cola está llena"""
+
+class RateLimitGovernor:
+    """Token buckets de peticiones/min y tokens/min con cola acotada y bloqueo por Retry-After"""
+    
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_concurrency: int,
+                 max_queue_depth: int, max_queue_wait: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        
+        self._request_level = float(requests_per_minute)
+        self._token_level = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._active = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        
+        self.granted = 0
+        self.rejected = 0
+        self.rate_limited_responses = 0
+        self.max_queue_depth_seen = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+    
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._request_level = min(self.requests_per_minute, self._request_level + elapsed * self.requests_per_minute / 60)
+        self._token_level = min(self.tokens_per_minute, self._token_level + elapsed * self.tokens_per_minute / 60)
+    
+    def _try_acquire(self, estimated_tokens: int) -> float:
+        """0 si se concede el turno; si no, segundos estimados hasta poder reintentar"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            
+            tokens = min(estimated_tokens, self.tokens_per_minute)
+            waits = [self._blocked_until - now]
+            if self._request_level < 1:
+                waits.append((1 - self._request_level) * 60 / self.requests_per_minute)
+            if self._token_level < tokens:
+                waits.append((tokens - self._token_level) * 60 / self.tokens_per_minute)
+            if self._active >= self.max_concurrency:
+                waits.append(0.05)
+            
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            
+            self._request_level -= 1
+            self._token_level -= tokens
+            self._active += 1
+            return 0.0
+    
+    async def acquire(self, estimated_tokens: int, deadline_at: Optional[float] = None) -> None:
+        """Espera turno con jitter; falla si la espera supera el máximo o el plazo de la petición"""
+        with self._lock:
+            if self._waiting >= self.max_queue_depth:
+                self.rejected += 1
+                raise RateLimitExceeded(f"Cola de peticiones llena ({self._waiting})")
+            self._waiting += 1
+            self.max_queue_depth_seen = max(self.max_queue_depth_seen, self._waiting)
+        
+        started = time.monotonic()
+        give_up_at = started + self.max_queue_wait
+        if deadline_at is not None:
+            give_up_at = min(give_up_at, deadline_at)
+        
+        try:
+            while True:
+                wait = self._try_acquire(estimated_tokens)
+                if wait <= 0:
+                    break
+                if time.monotonic() + wait > give_up_at:
+                    with self._lock:
+                        self.rejected += 1
+                    raise RateLimitExceeded(f"Sin turno disponible en {self.max_queue_wait:.0f}s (espera estimada {wait:.1f}s)")
+                await asyncio.sleep(wait * random.uniform(1.0, 1.25))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        
+        waited = time.monotonic() - started
+        telemetry.observe("llm_rate_limit_wait", waited)
+        with self._lock:
+            self.granted += 1
+            self.total_wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+    
+    def release(self, estimated_tokens: int, used_tokens: Optional[int] = None) -> None:
+        """Libera el turno y corrige el bucket con el consumo real informado por la API"""
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            if used_tokens is not None:
+                self._token_level = min(self.tokens_per_minute,
+                                        self._token_level + min(estimated_tokens, self.tokens_per_minute) - used_tokens)
+    
+    def observe_response(self, status_code: int, headers: httpx.Headers) -> None:
+        """Sincroniza los buckets con las cabeceras x-ratelimit-* y bloquea ante un 429"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            
+            remaining_requests = self._header_number(headers.get("x-ratelimit-remaining-requests"))
+            if remaining_requests is not None:
+                self._request_level = min(self._request_level, remaining_requests)
+            remaining_tokens = self._header_number(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_tokens is not None:
+                self._token_level = min(self._token_level, remaining_tokens)
+            
+            if status_code == 429:
+                self.rate_limited_responses += 1
+                retry_after = self._header_duration(headers.get("retry-after"))
+                if retry_after is None:
+                    resets = [self._header_duration(headers.get(name))
+                              for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+                    retry_after = max([reset for reset in resets if reset is not None], default=1.0)
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+    
+    def _header_number(self, value: Optional[str]) -> Optional[float]:
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+    
+    def _header_duration(self, value: Optional[str]) -> Optional[float]:
+        """Acepta '12', '12.5', '7.66s', '2m59.56s' o '250ms'"""
+        if not value:
+            return None
+        number = self._header_number(value)
+        if number is not None:
+            return number
+        parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value.strip())
+        if not parts:
+            return None
+        scale = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+        return sum(float(amount) * scale[unit] for amount, unit in parts)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "available_requests": round(self._request_level, 2),
+                "available_tokens": int(self._token_level),
+                "in_flight": self._active,
+                "queue_depth": self._waiting,
+                "max_queue_depth_seen": self.max_queue_depth_seen,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "rate_limited_responses": self.rate_limited_responses,
+                "avg_wait_ms": round(self.total_wait_time / self.granted * 1000, 2) if self.granted else 0.0,
+                "max_wait_ms": round(self.max_wait_time * 1000, 2),
+                "blocked_for_s": round(max(0.0, self._blocked_until - time.monotonic()), 2)
+            }
+
+# ============================================================================
+# CIRCUIT BREAKER
+# ============================================================================
+
+class CircuitState(Enum):
+    """Estados del circuit breaker hacia el LLM"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: la petición se rechaza sin llamar a la API"""
+
+class CircuitBreaker:
+    """Abre tras N fallos consecutivos, rechaza de inmediato y deja pasar una sonda al vencer el reposo"""
+    
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    @property
+    def is_open(self) -> bool:
+        """Abierto y todavía dentro del reposo (no admite ni siquiera una sonda)"""
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == CircuitState.HALF_OPEN and self._probe_in_flight
+    
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = CircuitState.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info("🔌 Groq: Circuito semiabierto, enviando sonda")
+            if self.state == CircuitState.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+    
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CircuitState.CLOSED:
+                logger.info("✅ Groq: Circuito cerrado, servicio recuperado")
+            self.state = CircuitState.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._open()
+    
+    def release_probe(self) -> None:
+        """La petición admitida terminó sin resultado atribuible al servicio (p. ej. no obtuvo turno)"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def trip(self) -> None:
+        """Abre el circuito de inmediato (p. ej. falló la verificación de arranque)"""
+        with self._lock:
+            self._open()
+    
+    def _open(self) -> None:
+        if self.state != CircuitState.OPEN:
+            self.times_opened += 1
+            logger.warning(f"🔌 Groq: Circuito abierto tras {self.consecutive_failures} fallos; "
+                           f"reintento en {self.reset_timeout:.0f}s")
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = self.reset_timeout - (time.monotonic() - self.opened_at) if self.state == CircuitState.OPEN else 0.0
+            return {
+                "state": self.state.value,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "times_opened": self.times_opened,
+                "rejected_requests": self.rejected,
+                "retry_in_s": round(max(0.0, retry_in), 2)
+            }
+
 # ============================================================================
 # CLIENTE LLM CON GROQ
 # ============================================================================
 
+@dataclass
+class LLMCompletion:
+    """Texto generado y datos de uso de una respuesta del LLM"""
+    text: str
+    model: str
+    completion_tokens: Optional[int] = None
+    finish_reason: Optional[str] = None
+
 class GroqLLMClient:
     """Cliente optimizado para Groq API con reintentos y métricas"""
     
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY")
-        self.base_url = "https://api.groq.com/openai/v1/chat/completions"
-        self.model = "llama3-8b-8192"
+        self.base_url = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1/chat/completions")
+        self.model = os.getenv("GROQ_MODEL", "llama3-8b-8192")
         self.max_retries = 3
         self.timeout = 30
-        self.is_available = False
-        
+        self.request_deadline = float(os.getenv("GROQ_REQUEST_DEADLINE", "45"))
+        self.pool_limits = httpx.Limits(
+            max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=30
+        )
+        self.governor = RateLimitGovernor(
+            requests_per_minute=int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30")),
+            tokens_per_minute=int(os.getenv("GROQ_TOKENS_PER_MINUTE", "30000")),
+            max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", "8")),
+            max_queue_depth=int(os.getenv("GROQ_MAX_QUEUE_DEPTH", "100")),
+            max_queue_wait=float(os.getenv("GROQ_MAX_QUEUE_WAIT", "20"))
+        )
+        self.system_prompt_tokens = estimate_tokens(self._get_system_prompt())
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("GROQ_BREAKER_FAILURES", "3")),
+            reset_timeout=float(os.getenv("GROQ_BREAKER_RESET_SECONDS", "30"))
+        )
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self.ready = False
+    
+    def initialize(self) -> None:
+        """Valida configuración y prueba conectividad; se invoca en segundo plano tras el arranque"""
         self._validate_configuration()
+        self.ready = True
         self._test_connectivity()
     
     def _validate_configuration(self) -> None:
@@ -134,13 +756,20 @@ class GroqLLMClient:
             )
             
             if test_response and "OK" in test_response.upper():
-                self.is_available = True
                 logger.info("✅ Groq: Conectividad verificada")
-            else:
+            elif test_response:
                 logger.warning("⚠️ Groq: Respuesta de prueba inesperada")
+            else:
+                self.breaker.trip()
                 
         except Exception as e:
             logger.error(f"❌ Groq: Error en prueba de conectividad - {e}")
+            self.breaker.trip()
+    
+    @property
+    def is_available(self) -> bool:
+        """Disponible una vez inicializado y mientras el circuito no esté abierto"""
+        return self.ready and not self.breaker.is_open
     
     def _make_request_with_retry(self, prompt: str, max_tokens: int = 600) -> Optional[str]:
         """Realiza petición con reintentos automáticos"""
@@ -154,8 +783,10 @@ class GroqLLMClient:
                     
             except requests.exceptions.RequestException as e:
                 last_error = e
-                wait_time = 2 ** attempt  
-                logger.warning(f"⚠️ Groq: Intento {attempt + 1} falló, reintentando en {wait_time}s")
+                wait_time = random.uniform(0, 2 ** attempt)
+                if e.response is not None and e.response.status_code == 429:
+                    wait_time = self.governor._header_duration(e.response.headers.get("retry-after")) or wait_time
+                logger.warning(f"⚠️ Groq: Intento {attempt + 1} falló, reintentando en {wait_time:.2f}s")
                 time.sleep(wait_time)
             
             except Exception as e:
@@ -167,12 +798,226 @@ class GroqLLMClient:
     
     def _make_single_request(self, prompt: str, max_tokens: int) -> Optional[str]:
         """Realiza una petición individual a Groq"""
-        payload = {
-            "model": self.model,
+        response = requests.post(
+            self.base_url,
+            headers=self._build_headers(),
+            json=self._build_payload(prompt, max_tokens),
+            timeout=self.timeout
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            return data["choices"][0]["message"]["content"].strip()
+        else:
+            logger.error(f"Groq API Error: {response.status_code} - {response.text}")
+            response.raise_for_status()
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Cliente HTTP asíncrono compartido con pool de conexiones keep-alive"""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                limits=self.pool_limits,
+                timeout=httpx.Timeout(self.timeout, connect=5.0)
+            )
+        return self._async_client
+    
+    async def _make_request_with_retry_async(self, prompt: str, max_tokens: int = 600,
+                                             deadline: Optional[float] = None,
+                                             model: Optional[str] = None) -> Optional[str]:
+        """Como complete(), pero solo el texto"""
+        completion = await self.complete(prompt, max_tokens, deadline, model)
+        return completion.text if completion is not None else None
+    
+    async def complete(self, prompt: str, max_tokens: int = 600, deadline: Optional[float] = None,
+                       model: Optional[str] = None, raise_rejections: bool = False,
+                       system_prompt: Optional[str] = None) -> Optional[LLMCompletion]:
+        """Petición asíncrona con circuit breaker, turno del governor, backoff con jitter y plazo total.
+        
+        Con raise_rejections, si el circuito o el governor la rechazan sin llamar a la API se propaga
+        CircuitOpenError / RateLimitExceeded para que el llamador responda con el respaldo local.
+        system_prompt sustituye al prompt de sistema por defecto (p. ej. el de lotes empaquetados)."""
+        deadline_at = time.monotonic() + (deadline or self.request_deadline)
+        estimated_tokens = self._estimate_request_tokens(prompt, max_tokens, system_prompt)
+        last_error = None
+        
+        for attempt in range(self.max_retries):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                logger.warning("⚠️ Groq: Plazo de la petición agotado")
+                break
+            
+            if not self.breaker.allow_request():
+                last_error = CircuitOpenError("Circuito abierto")
+                logger.warning("⚡ Groq: Circuito abierto, petición rechazada sin llamar a la API")
+                break
+            
+            try:
+                await self.governor.acquire(estimated_tokens, deadline_at)
+            except RateLimitExceeded as e:
+                self.breaker.release_probe()
+                last_error = e
+                logger.warning(f"⚠️ Groq: {e}")
+                break
+            
+            used_tokens = None
+            try:
+                completion, used_tokens = await self._make_single_request_async(
+                    prompt, max_tokens, timeout=min(self.timeout, deadline_at - time.monotonic()), model=model,
+                    system_prompt=system_prompt
+                )
+                self.breaker.record_success()
+                if completion is not None and completion.text:
+                    return completion
+            
+            except httpx.HTTPStatusError as e:
+                last_error = e
+                status_code = e.response.status_code
+                if status_code < 500:
+                    # El servicio respondió: 429 no es una caída y los demás 4xx no se arreglan reintentando
+                    self.breaker.record_success()
+                    if status_code != 429:
+                        break
+                else:
+                    self.breaker.record_failure()
+                if attempt == self.max_retries - 1 or self.breaker.is_open:
+                    break
+                if status_code == 429:
+                    # El governor ya quedó bloqueado hasta Retry-After: el siguiente acquire espera lo necesario
+                    logger.warning(f"⚠️ Groq: Límite de tasa alcanzado (intento {attempt + 1})")
+                    continue
+                if not await self._backoff(attempt, deadline_at):
+                    break
+                    
+            except httpx.HTTPError as e:
+                last_error = e
+                self.breaker.record_failure()
+                if attempt == self.max_retries - 1 or self.breaker.is_open or not await self._backoff(attempt, deadline_at):
+                    break
+            
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.error(f"❌ Groq: Error no recuperable - {e}")
+                break
+            
+            finally:
+                self.governor.release(estimated_tokens, used_tokens)
+        
+        if raise_rejections and isinstance(last_error, (CircuitOpenError, RateLimitExceeded)):
+            raise last_error
+        logger.error(f"❌ Groq: Todos los reintentos fallaron. Último error: {last_error}")
+        return None
+    
+    async def _backoff(self, attempt: int, deadline_at: float) -> bool:
+        """Full jitter sobre 2^intento para no sincronizar reintentos; False si no cabe en el plazo"""
+        wait_time = random.uniform(0, 2 ** attempt)
+        if time.monotonic() + wait_time >= deadline_at:
+            return False
+        logger.warning(f"⚠️ Groq: Intento {attempt + 1} falló, reintentando en {wait_time:.2f}s")
+        await asyncio.sleep(wait_time)
+        return True
+    
+    def _estimate_request_tokens(self, prompt: str, max_tokens: int, system_prompt: Optional[str] = None) -> int:
+        system_tokens = self.system_prompt_tokens if system_prompt is None else estimate_tokens(system_prompt)
+        return system_tokens + estimate_tokens(prompt) + max_tokens
+    
+    async def _make_single_request_async(self, prompt: str, max_tokens: int, timeout: Optional[float] = None,
+                                         model: Optional[str] = None,
+                                         system_prompt: Optional[str] = None) -> Tuple[Optional[LLMCompletion], Optional[int]]:
+        """Realiza una petición individual asíncrona a Groq; devuelve (respuesta, tokens consumidos)"""
+        client = self._get_async_client()
+        response = await client.post(
+            self.base_url,
+            headers=self._build_headers(),
+            json=self._build_payload(prompt, max_tokens, model=model, system_prompt=system_prompt),
+            timeout=timeout or self.timeout
+        )
+        self.governor.observe_response(response.status_code, response.headers)
+        
+        if response.status_code == 200:
+            data = response.json()
+            usage = data.get("usage") or {}
+            choice = data["choices"][0]
+            return LLMCompletion(
+                text=choice["message"]["content"].strip(),
+                model=data.get("model") or model or self.model,
+                completion_tokens=usage.get("completion_tokens"),
+                finish_reason=choice.get("finish_reason")
+            ), usage.get("total_tokens")
+        else:
+            logger.error(f"Groq API Error: {response.status_code} - {response.text}")
+            response.raise_for_status()
+    
+    async def stream_completion(self, prompt: str, max_tokens: int = 600,
+                                model: Optional[str] = None) -> AsyncIterator[str]:
+        """Emite los fragmentos de texto de la API de streaming a medida que llegan"""
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Circuito abierto")
+        
+        estimated_tokens = self._estimate_request_tokens(prompt, max_tokens)
+        try:
+            await self.governor.acquire(estimated_tokens)
+        except RateLimitExceeded:
+            self.breaker.release_probe()
+            raise
+        
+        try:
+            async for delta in self._stream_deltas(prompt, max_tokens, model):
+                yield delta
+            self.breaker.record_success()
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            raise
+        except (httpx.HTTPError, json.JSONDecodeError):
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.breaker.release_probe()
+            self.governor.release(estimated_tokens)
+    
+    async def _stream_deltas(self, prompt: str, max_tokens: int, model: Optional[str] = None) -> AsyncIterator[str]:
+        client = self._get_async_client()
+        async with client.stream(
+            "POST",
+            self.base_url,
+            headers=self._build_headers(),
+            json=self._build_payload(prompt, max_tokens, stream=True, model=model),
+            timeout=self.timeout
+        ) as response:
+            self.governor.observe_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                body = await response.aread()
+                logger.error(f"Groq API Error: {response.status_code} - {body.decode(errors='replace')}")
+                response.raise_for_status()
+            
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                
+                chunk = json.loads(data)
+                choices = chunk.get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    
+    async def aclose(self) -> None:
+        """Cierra el pool de conexiones asíncrono"""
+        if self._async_client is not None and not self._async_client.is_closed:
+            await self._async_client.aclose()
+    
+    def _build_payload(self, prompt: str, max_tokens: int, stream: bool = False,
+                       model: Optional[str] = None, system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "model": model or self.model,
             "messages": [
                 {
                     "role": "system",
-                    "content": self._get_system_prompt()
+                    "content": system_prompt or self._get_system_prompt()
                 },
                 {
                     "role": "user",
@@ -182,27 +1027,14 @@ class GroqLLMClient:
             "max_tokens": max_tokens,
             "temperature": 0.1,
             "top_p": 0.9,
-            "stream": False
+            "stream": stream
         }
-        
-        headers = {
+    
+    def _build_headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
-        response = requests.post(
-            self.base_url,
-            headers=headers,
-            json=payload,
-            timeout=self.timeout
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data["choices"][0]["message"]["content"].strip()
-        else:
-            logger.error(f"Groq API Error: {response.status_code} - {response.text}")
-            response.raise_for_status()
     
     def _get_system_prompt(self) -> str:
         return """Eres un asistente especializado en análisis de datos demográficos.
@@ -212,8 +1044,8 @@ REGLAS FUNDAMENTALES:
 2. NO des resúmenes generales del sistema
 3. NO menciones "puedes preguntar por..." o capacidades
 4. Usa SOLO los datos proporcionados en el prompt del usuario
-5. Para nombres: usa el campo "nombre_completo" exacto
-6. Para edades: usa "edad_anos" solo si "tiene_edad_valida" es true
+5. Para nombres: usa la columna "n" (nombre completo) exacta
+6. Para edades: usa la columna "e"; si está vacía la edad es desconocida
 
 TIPOS DE CONSULTA Y FORMATO DE RESPUESTA:
 - Búsqueda de nombres: "Sí, hay X persona(s) llamada(s) [nombre]: [nombre_completo]" o "No hay ninguna persona registrada con el nombre [nombre]"
@@ -230,41 +1062,719 @@ PROHIBIDO:
 - Palabras como "análisis", "metodología"
 
 Si no hay datos suficientes, responde: "No hay información suficiente para responder esta pregunta"."""
+    
+    def _get_packed_system_prompt(self) -> str:
+        return """Eres un asistente especializado en análisis de datos demográficos.
+Recibirás varias consultas independientes, cada una con su propio bloque de datos.
+
+REGLAS FUNDAMENTALES:
+1. Responde TODAS las consultas, cada una en UNA sola línea con el formato "[número] respuesta"
+2. Cada respuesta: EXACTAMENTE lo que se pregunta, máximo 2 oraciones, sin saltos de línea
+3. Usa SOLO los datos del bloque de esa consulta; no mezcles datos entre bloques
+4. Para nombres: usa la columna "n" (nombre completo) exacta
+5. Para edades: usa la columna "e"; si está vacía la edad es desconocida
+6. Sin texto antes, entre ni después de las líneas numeradas
+
+PROHIBIDO:
+- Dar resúmenes del sistema
+- Mencionar capacidades no solicitadas
+- Explicaciones metodológicas
+
+Si un bloque no tiene datos suficientes, responde en su línea: "No hay información suficiente para responder esta pregunta"."""
 
 # ============================================================================
-# GESTOR DE DATOS CON CACHE INTELIGENTE
+# BACKENDS DE ESTADO COMPARTIDO
 # ============================================================================
 
-@dataclass
-class PersonRecord:
-    """Registro estructurado de persona con todos los campos calculados"""
-    nombre_completo: str
-    primer_nombre: str
-    segundo_nombre: str
-    apellidos: str
-    documento: str
-    genero: str
-    correo: str
-    celular: str
+class StateBackend(ABC):
+    """Almacén clave/valor con contadores y locks; 'shared' indica si lo ven varios workers"""
     
-    edad: Optional[int] = None
-    mes_nacimiento: Optional[int] = None
-    mes_nacimiento_nombre: Optional[str] = None
-    año_nacimiento: Optional[int] = None
-    rango_edad: Optional[str] = None
-    es_mayor_edad: Optional[bool] = None
+    shared = False
     
-    fecha_registro: Optional[datetime] = None
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+    
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ...
+    
+    @abstractmethod
+    def incr(self, key: str, amount: float = 1.0) -> None:
+        ...
+    
+    @abstractmethod
+    def counters(self, prefix: str) -> Dict[str, float]:
+        ...
+    
+    @abstractmethod
+    def acquire_lock(self, name: str, ttl: float) -> bool:
+        ...
+    
+    @abstractmethod
+    def release_lock(self, name: str) -> None:
+        ...
+    
+    @abstractmethod
+    def purge_expired(self) -> int:
+        """Elimina las claves vencidas; devuelve cuántas"""
+    
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__, "shared": self.shared}
+    
+    def _owner(self) -> str:
+        return f"{os.getpid()}:{threading.get_ident()}"
 
-class IntelligentDataManager:
-    """Gestor de datos con cache inteligente y procesamiento optimizado"""
+class InProcessBackend(StateBackend):
+    """Estado local del proceso (un solo worker)"""
     
-    def __init__(self, firebase_manager: FirebaseManager):
-        self.firebase = firebase_manager
-        self.cache = {}
-        self.cache_metadata = {}
-        self.cache_duration = timedelta(minutes=10)
-        
+    def __init__(self):
+        self._values: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._values[key]
+                return None
+            return entry[0]
+    
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+    
+    def incr(self, key: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+    
+    def counters(self, prefix: str) -> Dict[str, float]:
+        with self._lock:
+            return {key: value for key, value in self._counters.items() if key.startswith(prefix)}
+    
+    def acquire_lock(self, name: str, ttl: float) -> bool:
+        with self._lock:
+            entry = self._values.get(f"lock:{name}")
+            if entry is not None and entry[1] > time.time():
+                return False
+            self._values[f"lock:{name}"] = (self._owner().encode(), time.time() + ttl)
+            return True
+    
+    def release_lock(self, name: str) -> None:
+        with self._lock:
+            entry = self._values.get(f"lock:{name}")
+            if entry is not None and entry[0] == self._owner().encode():
+                del self._values[f"lock:{name}"]
+    
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._values.items() if expires_at is not None and expires_at <= now]
+            for key in expired:
+                del self._values[key]
+            return len(expired)
+
+class SQLiteBackend(StateBackend):
+    """Estado compartido entre los workers de un host a través de un archivo SQLite en modo WAL"""
+    
+    shared = True
+    
+    def __init__(self, path: str, busy_timeout: float = 2.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Una conexión por hilo; autocommit para que cada sentencia sea su propia transacción.
+        
+        busy_timeout corto: quien llama falla rápido (y sigue sin el estado compartido) en vez de
+        quedarse esperando a que otro worker suelte el archivo."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+    
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row is not None else None
+    
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._connection().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, sqlite3.Binary(value), time.time() + ttl if ttl else None)
+        )
+    
+    def incr(self, key: str, amount: float = 1.0) -> None:
+        self._connection().execute(
+            "INSERT INTO counters (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = counters.value + excluded.value",
+            (key, amount)
+        )
+    
+    def counters(self, prefix: str) -> Dict[str, float]:
+        rows = self._connection().execute(
+            "SELECT key, value FROM counters WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        ).fetchall()
+        return dict(rows)
+    
+    def acquire_lock(self, name: str, ttl: float) -> bool:
+        """Toma el lock si no existe o venció; el dueño queda registrado para liberarlo"""
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at <= ?",
+            (f"lock:{name}", self._owner().encode(), now + ttl, now)
+        )
+        return cursor.rowcount == 1
+    
+    def release_lock(self, name: str) -> None:
+        self._connection().execute(
+            "DELETE FROM kv WHERE key = ? AND value = ?", (f"lock:{name}", self._owner().encode())
+        )
+    
+    def purge_expired(self) -> int:
+        cursor = self._connection().execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        return cursor.rowcount
+    
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "path": self.path}
+
+def create_state_backend() -> StateBackend:
+    """STATE_BACKEND=memory (por defecto) o sqlite para compartir estado entre workers"""
+    kind = os.getenv("STATE_BACKEND", "memory").lower()
+    if kind == "sqlite":
+        path = os.getenv("STATE_BACKEND_PATH", "/app/state/rag_state.db")
+        logger.info(f"🗄️ Estado compartido en SQLite: {path}")
+        return SQLiteBackend(path, busy_timeout=float(os.getenv("STATE_BACKEND_BUSY_TIMEOUT_SECONDS", "2")))
+    if kind != "memory":
+        logger.warning(f"⚠️ STATE_BACKEND desconocido '{kind}', se usa memoria del proceso")
+    return InProcessBackend()
+
+class StateBackendWriter:
+    """Hilo de mantenimiento del backend: vuelca en lote los contadores acumulados y purga claves vencidas.
+    
+    incr() solo suma en memoria, así que el event loop nunca espera al archivo SQLite."""
+    
+    def __init__(self, backend: StateBackend, flush_interval: float = 2.0, purge_interval: float = 300.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        
+        self._pending: Dict[str, float] = {}
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._worker: Optional[threading.Thread] = None
+        self._purged_at = time.monotonic()
+        
+        self.flushes = 0
+        self.flush_failures = 0
+        self.purged = 0
+    
+    def start(self) -> None:
+        with self._condition:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name="state-backend-writer", daemon=True)
+            self._worker.start()
+    
+    def incr(self, key: str, amount: float = 1.0) -> None:
+        with self._condition:
+            self._pending[key] = self._pending.get(key, 0.0) + amount
+    
+    def pending(self, prefix: str = "") -> Dict[str, float]:
+        """Incrementos de este proceso que aún no llegaron al backend"""
+        with self._condition:
+            return {key: value for key, value in self._pending.items() if key.startswith(prefix)}
+    
+    def stop(self, timeout: float = 10.0) -> None:
+        """Detiene el hilo con un último volcado"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        else:
+            self.flush()
+    
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._stopping:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            
+            self.flush()
+            if not stopping and time.monotonic() - self._purged_at >= self.purge_interval:
+                self.purge()
+            if stopping:
+                return
+    
+    def flush(self) -> None:
+        with self._condition:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        items = list(pending.items())
+        written = 0
+        try:
+            for key, amount in items:
+                self.backend.incr(key, amount)
+                written += 1
+            self.flushes += 1
+        except Exception as e:
+            # Lo no escrito vuelve al acumulado para el siguiente volcado
+            self.flush_failures += 1
+            with self._condition:
+                for key, amount in items[written:]:
+                    self._pending[key] = self._pending.get(key, 0.0) + amount
+            logger.warning(f"⚠️ Métricas compartidas no disponibles: {e}")
+    
+    def purge(self) -> None:
+        self._purged_at = time.monotonic()
+        try:
+            self.purged += self.backend.purge_expired()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron purgar las claves vencidas del backend: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            "pending_counters": pending,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "purged_keys": self.purged,
+            "worker_alive": self._worker is not None and self._worker.is_alive()
+        }
+
+# ============================================================================
+# GESTOR DE DATOS CON CACHE INTELIGENTE
+# ============================================================================
+
+@dataclass(slots=True)
+class PersonRecord:
+    """Registro estructurado de persona con todos los campos calculados"""
+    nombre_completo: str
+    primer_nombre: str
+    segundo_nombre: str
+    apellidos: str
+    documento: str
+    genero: str
+    correo: str
+    celular: str
+    
+    edad: Optional[int] = None
+    mes_nacimiento: Optional[int] = None
+    mes_nacimiento_nombre: Optional[str] = None
+    año_nacimiento: Optional[int] = None
+    rango_edad: Optional[str] = None
+    es_mayor_edad: Optional[bool] = None
+    
+    fecha_registro: Optional[datetime] = None
+    doc_id: str = ""
+
+PERSON_RECORD_FIELDS = tuple(record_field.name for record_field in fields(PersonRecord))
+
+# ============================================================================
+# FUENTES DE CAMBIOS PARA SINCRONIZACIÓN INCREMENTAL
+# ============================================================================
+
+@dataclass
+class DocumentChange:
+    """Cambio de un documento de 'personas': ADDED, MODIFIED o REMOVED"""
+    kind: str
+    doc_id: str
+    data: Optional[Dict[str, Any]] = None
+
+class FirestoreChangeSource:
+    """Escucha la colección con on_snapshot y entrega los cambios por documento"""
+    
+    def __init__(self, collection):
+        self.collection = collection
+        self._watch = None
+    
+    def subscribe(self, callback) -> None:
+        def on_snapshot(col_snapshot, changes, read_time):
+            callback([
+                DocumentChange(
+                    kind=change.type.name,
+                    doc_id=change.document.id,
+                    data=change.document.to_dict() if change.type.name != 'REMOVED' else None
+                )
+                for change in changes
+            ])
+        
+        self._watch = self.collection.on_snapshot(on_snapshot)
+    
+    def unsubscribe(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+class InMemoryChangeSource:
+    """Sustituto local de Firestore: emite los mismos cambios sin red"""
+    
+    def __init__(self, documents: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.documents: Dict[str, Dict[str, Any]] = dict(documents or {})
+        self._callbacks = []
+    
+    def subscribe(self, callback) -> None:
+        self._callbacks.append(callback)
+        callback([DocumentChange('ADDED', doc_id, dict(data)) for doc_id, data in self.documents.items()])
+    
+    def unsubscribe(self) -> None:
+        self._callbacks.clear()
+    
+    def set(self, doc_id: str, data: Dict[str, Any]) -> None:
+        kind = 'MODIFIED' if doc_id in self.documents else 'ADDED'
+        self.documents[doc_id] = dict(data)
+        self._emit([DocumentChange(kind, doc_id, dict(data))])
+    
+    def remove(self, doc_id: str) -> None:
+        if self.documents.pop(doc_id, None) is not None:
+            self._emit([DocumentChange('REMOVED', doc_id)])
+    
+    def _emit(self, changes: List[DocumentChange]) -> None:
+        for callback in list(self._callbacks):
+            callback(changes)
+
+# ============================================================================
+# ENRIQUECIMIENTO MASIVO
+# ============================================================================
+
+# Formatos que acepta el enriquecimiento; los analizadores rápidos cubren su forma con ceros a la
+# izquierda y strptime el resto ("1990-5-3"), para aceptar exactamente las mismas fechas
+BIRTH_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S')
+
+def _parse_iso_date(text: str) -> datetime:
+    """'AAAA-MM-DD' por cortes de cadena, sin strptime"""
+    if len(text) != 10 or text[4] != '-' or text[7] != '-' or not (text[0:4] + text[5:7] + text[8:10]).isdigit():
+        raise ValueError(text)
+    return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+
+def _parse_day_first_date(text: str) -> datetime:
+    """'DD/MM/AAAA', el formato de los registros antiguos"""
+    if len(text) != 10 or text[2] != '/' or text[5] != '/' or not (text[0:2] + text[3:5] + text[6:10]).isdigit():
+        raise ValueError(text)
+    return datetime(int(text[6:10]), int(text[3:5]), int(text[0:2]))
+
+def _parse_iso_datetime(text: str) -> datetime:
+    """'AAAA-MM-DDTHH:MM:SS'"""
+    if len(text) != 19 or text[10] != 'T' or text[13] != ':' or text[16] != ':':
+        raise ValueError(text)
+    time_digits = text[11:13] + text[14:16] + text[17:19]
+    if not time_digits.isdigit():
+        raise ValueError(text)
+    return _parse_iso_date(text[:10]).replace(hour=int(text[11:13]), minute=int(text[14:16]), second=int(text[17:19]))
+
+class BulkEnricher:
+    """Construye PersonRecord en bloque: formato de fecha detectado una vez por lote y edades por tabla"""
+    
+    DATE_PARSERS = (_parse_iso_date, _parse_day_first_date, _parse_iso_datetime)
+    MAX_AGE = 150
+    
+    def __init__(self, age_ranges: List[Tuple[int, int, str]], month_names: Dict[int, str], current_date: datetime):
+        self.month_names = month_names
+        self.current_key = (current_date.year, current_date.month, current_date.day)
+        self.age_labels = ["Edad no categorizada"] * (self.MAX_AGE + 1)
+        for min_age, max_age, category in reversed(age_ranges):
+            for age in range(min_age, min(max_age, self.MAX_AGE) + 1):
+                self.age_labels[age] = category
+        self._parser_order = list(self.DATE_PARSERS)
+        self.rejected: Dict[str, int] = {}
+        self.sample_rejections: List[str] = []
+    
+    def enrich(self, documents) -> List[PersonRecord]:
+        """documents: iterable de (doc_id, datos); los descartes se cuentan en self.rejected"""
+        records = []
+        for doc_id, raw_data in documents:
+            record = self.build(doc_id, raw_data)
+            if record is not None:
+                records.append(record)
+        return records
+    
+    def build(self, doc_id: str, raw_data: Optional[Dict]) -> Optional[PersonRecord]:
+        if not raw_data:
+            return self._reject(doc_id, "vacío")
+        if 'primerNombre' not in raw_data or 'apellidos' not in raw_data or 'nroDocumento' not in raw_data:
+            return self._reject(doc_id, "campos obligatorios")
+        
+        try:
+            first = (raw_data.get('primerNombre') or '').strip()
+            second = (raw_data.get('segundoNombre') or '').strip()
+            surnames = (raw_data.get('apellidos') or '').strip()
+            if first and second and surnames:
+                full_name = f"{first} {second} {surnames}"
+            else:
+                full_name = ' '.join(part for part in (first, second, surnames) if part)
+            record = PersonRecord(
+                nombre_completo=full_name,
+                primer_nombre=first,
+                segundo_nombre=second,
+                apellidos=surnames,
+                documento=raw_data.get('nroDocumento', ''),
+                genero=raw_data.get('genero', ''),
+                correo=raw_data.get('correo', ''),
+                celular=raw_data.get('celular', ''),
+                doc_id=doc_id
+            )
+        except (AttributeError, TypeError):
+            return self._reject(doc_id, "tipos inválidos")
+        
+        birth_value = raw_data.get('fechaNacimiento')
+        if birth_value:
+            birth_date = self.parse_date(birth_value)
+            if birth_date is None:
+                self._count("fecha de nacimiento inválida", doc_id)
+            else:
+                month = birth_date.month
+                age = self.current_key[0] - birth_date.year
+                if self.current_key[1:] < (month, birth_date.day):
+                    age -= 1
+                age = max(0, age)
+                record.edad = age
+                record.mes_nacimiento = month
+                record.mes_nacimiento_nombre = self.month_names.get(month, f"mes_{month}")
+                record.año_nacimiento = birth_date.year
+                record.es_mayor_edad = age >= 18
+                record.rango_edad = self.age_labels[age] if age <= self.MAX_AGE else "Edad no categorizada"
+        
+        created_at = raw_data.get('createdAt')
+        if created_at:
+            if hasattr(created_at, 'todate'):
+                record.fecha_registro = created_at.todate()
+            elif isinstance(created_at, datetime):
+                record.fecha_registro = created_at
+            elif isinstance(created_at, str):
+                try:
+                    record.fecha_registro = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+                except ValueError:
+                    self._count("fecha de registro inválida", doc_id)
+        return record
+    
+    def parse_date(self, value) -> Optional[datetime]:
+        """Prueba primero el último formato que funcionó: en un lote casi todos comparten formato"""
+        if hasattr(value, 'todate'):
+            return value.todate()
+        if isinstance(value, datetime):
+            return value
+        if not isinstance(value, str):
+            return None
+        
+        order = self._parser_order
+        for position, parser in enumerate(order):
+            try:
+                parsed = parser(value)
+            except ValueError:
+                continue
+            if position:
+                order.insert(0, order.pop(position))
+            return parsed
+        for date_format in BIRTH_DATE_FORMATS:
+            try:
+                return datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+        return None
+    
+    def _reject(self, doc_id: str, reason: str) -> None:
+        self._count(reason, doc_id)
+        return None
+    
+    def _count(self, reason: str, doc_id: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if len(self.sample_rejections) < 5:
+            self.sample_rejections.append(doc_id)
+
+def _enrich_chunk(payload) -> Tuple[List[PersonRecord], Dict[str, int]]:
+    """Tarea de un proceso del pool: enriquece un trozo y devuelve los registros y los descartes"""
+    documents, age_ranges, month_names, current_date = payload
+    enricher = BulkEnricher(age_ranges, month_names, current_date)
+    return enricher.enrich(documents), enricher.rejected
+
+# ============================================================================
+# CARGA MASIVA DESDE FIRESTORE
+# ============================================================================
+
+ENRICHMENT_FIELDS = ('primerNombre', 'segundoNombre', 'apellidos', 'nroDocumento', 'genero',
+                     'correo', 'celular', 'fechaNacimiento', 'createdAt')
+
+class FirestoreBulkLoader:
+    """Lectura paginada y proyectada de una colección, repartida en rangos de id leídos en paralelo.
+    
+    Los puntos de corte salen, por orden de preferencia, de una muestra de ids ya conocidos (la
+    carga anterior), de PartitionQuery sobre el collection group o, en último caso, del alfabeto
+    de los ids automáticos ([0-9A-Za-z] uniformes). Ese último reparto solo equilibra ids
+    automáticos: con ids propios (p. ej. números de documento) la primera carga puede quedar en
+    una sola partición. La primera y la última partición quedan abiertas, así que ningún id se
+    pierde sea cual sea el reparto. Cada página se entrega a page_handler en cuanto llega.
+    """
+    
+    ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+    
+    def __init__(self, collection, fields: Tuple[str, ...] = ENRICHMENT_FIELDS, partitions: int = 4,
+                 page_size: int = 1000, max_workers: Optional[int] = None, sample_ids: Sequence[str] = ()):
+        self.collection = collection
+        self.fields = list(fields)
+        self.partitions = max(1, min(partitions, len(self.ID_ALPHABET)))
+        self.page_size = max(1, page_size)
+        self.max_workers = max(1, max_workers or self.partitions)
+        self.sample_ids = sample_ids
+        self.split_source: Optional[str] = None
+        self.pages_by_partition: List[int] = []
+        self.documents_by_partition: List[int] = []
+    
+    @property
+    def pages(self) -> int:
+        return sum(self.pages_by_partition)
+    
+    @property
+    def documents(self) -> int:
+        return sum(self.documents_by_partition)
+    
+    def boundaries(self) -> List[Tuple[Optional[str], Optional[str]]]:
+        """Rangos [inicio, fin) de ids; None deja el extremo abierto"""
+        cuts, self.split_source = self._sampled_cuts(), "sampled_ids"
+        if not cuts and self.partitions > 1:
+            cuts, self.split_source = self._partition_query_cuts(), "partition_query"
+        if not cuts:
+            cuts, self.split_source = self._alphabet_cuts(), "id_alphabet"
+        starts = [None] + cuts
+        ends = cuts + [None]
+        return list(zip(starts, ends))
+    
+    def _sampled_cuts(self) -> List[str]:
+        """Cuantiles de la muestra: reparte por igual los ids que ya existían"""
+        ids = sorted({doc_id for doc_id in self.sample_ids if doc_id})
+        if len(ids) < self.partitions or self.partitions == 1:
+            return []
+        return [ids[len(ids) * i // self.partitions] for i in range(1, self.partitions)]
+    
+    def _partition_query_cuts(self) -> List[str]:
+        """Puntos de corte que calcula Firestore; solo valen los de esta misma colección"""
+        client = getattr(self.collection, "_client", None)
+        collection_id = getattr(self.collection, "id", None)
+        if client is None or not isinstance(collection_id, str):
+            return []
+        parent = getattr(self.collection, "parent", None)
+        try:
+            partitions = client.collection_group(collection_id).get_partitions(self.partitions - 1)
+            cuts = {partition.end_at.id for partition in partitions
+                    if partition.end_at is not None and partition.end_at.parent.parent == parent}
+        except Exception as e:
+            logger.warning(f"⚠️ Firebase: PartitionQuery no disponible, se reparte por alfabeto: {e}")
+            return []
+        return sorted(cuts)
+    
+    def _alphabet_cuts(self) -> List[str]:
+        size = len(self.ID_ALPHABET)
+        return [self.ID_ALPHABET[round(size * i / self.partitions)] for i in range(1, self.partitions)]
+    
+    def load(self, page_handler) -> List[Any]:
+        """page_handler(documentos) -> resultado por página; devuelve los resultados en orden de id"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        ranges = self.boundaries()
+        self.pages_by_partition = [0] * len(ranges)
+        self.documents_by_partition = [0] * len(ranges)
+        if len(ranges) == 1:
+            return self._load_range(0, *ranges[0], page_handler)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="firestore-load") as pool:
+            futures = [pool.submit(self._load_range, index, start, end, page_handler)
+                       for index, (start, end) in enumerate(ranges)]
+            results = []
+            for future in futures:
+                results.extend(future.result())
+        return results
+    
+    def _load_range(self, index: int, start: Optional[str], end: Optional[str], page_handler) -> List[Any]:
+        query = self.collection.select(self.fields).order_by("__name__")
+        if start is not None:
+            query = query.start_at({"__name__": start})
+        if end is not None:
+            query = query.end_before({"__name__": end})
+        query = query.limit(self.page_size)
+        
+        results, last = [], None
+        while True:
+            page_query = query if last is None else query.start_after(last)
+            snapshots = list(page_query.stream())
+            if not snapshots:
+                break
+            last = snapshots[-1]
+            self.pages_by_partition[index] += 1
+            self.documents_by_partition[index] += len(snapshots)
+            results.append(page_handler([(doc.id, doc.to_dict()) for doc in snapshots]))
+            if len(snapshots) < self.page_size:
+                break
+        return results
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "partitions": self.partitions,
+            "split_source": self.split_source,
+            "max_workers": self.max_workers,
+            "page_size": self.page_size,
+            "pages": self.pages,
+            "documents_by_partition": list(self.documents_by_partition)
+        }
+
+class IntelligentDataManager:
+    """Gestor de datos con cache inteligente y procesamiento optimizado"""
+    
+    def __init__(self, firebase_manager: FirebaseManager, state_backend: Optional[StateBackend] = None):
+        self.firebase = firebase_manager
+        self.state_backend = state_backend or InProcessBackend()
+        self.shared_refresh_wait = float(os.getenv("SHARED_REFRESH_WAIT_SECONDS", "30"))
+        self.shared_adoptions = 0
+        self.cache = {}
+        self.cache_metadata = {}
+        self.cache_duration = timedelta(minutes=10)
+        self.max_staleness = timedelta(seconds=int(os.getenv("DATASET_MAX_STALENESS_SECONDS", "1800")))
+        self.refresh_ahead = timedelta(seconds=int(os.getenv("DATASET_REFRESH_AHEAD_SECONDS", "60")))
+        self.dataset_version: Optional[str] = None
+        self._refresh_guard = threading.Lock()
+        self._refresh_done: Optional[threading.Event] = None
+        self.refresh_count = 0
+        self.last_refresh_duration: Optional[float] = None
+        
+        self.change_source = None
+        self.incremental_active = False
+        self.records_by_id: Dict[str, PersonRecord] = {}
+        self._fingerprint_acc = 0
+        self._records_dirty = False
+        self._initial_sync_done = False
+        self._synced_on = None
+        self._sync_lock = threading.RLock()
+        self._resync_thread: Optional[threading.Thread] = None
+        self._resync_touched: Optional[set] = None
+        self._resync_attempted_at: Optional[datetime] = None
+        self.resync_retry = timedelta(seconds=int(os.getenv("DATASET_RESYNC_RETRY_SECONDS", "300")))
+        self._columns: Optional['PersonColumns'] = None
+        self._columns_lock = threading.Lock()
+        self.aggregates: Optional['AggregateSnapshot'] = None
+        
         self.month_names = {
             1: 'enero', 2: 'febrero', 3: 'marzo', 4: 'abril',
             5: 'mayo', 6: 'junio', 7: 'julio', 8: 'agosto',
@@ -279,200 +1789,2655 @@ class IntelligentDataManager:
             (51, 65, "Adulto maduro (51-65)"),
             (66, 999, "Adulto mayor (65+)")
         ]
+        
+        self.enrich_processes = int(os.getenv("ENRICH_PROCESSES", "0")) or 1
+        self.enrich_process_threshold = int(os.getenv("ENRICH_PROCESS_THRESHOLD", "200000"))
+        self.enrich_chunk_size = int(os.getenv("ENRICH_CHUNK_SIZE", "50000"))
+        self.last_enrichment: Dict[str, Any] = {}
+        self.load_partitions = int(os.getenv("FIRESTORE_LOAD_PARTITIONS", "4"))
+        self.load_page_size = int(os.getenv("FIRESTORE_PAGE_SIZE", "1000"))
+        self.load_workers = int(os.getenv("FIRESTORE_LOAD_WORKERS", "0")) or None
+        
+        self.snapshot_path = os.getenv("DATASET_SNAPSHOT_PATH", "")
+        self.snapshot_max_age = timedelta(seconds=int(os.getenv("DATASET_SNAPSHOT_MAX_AGE_SECONDS", "86400")))
+        self.snapshot_status: Dict[str, Any] = {"enabled": bool(self.snapshot_path)}
+        self._snapshot_version: Optional[str] = None
+        self._snapshot_writer = threading.Lock()
+        self._pending_reconcile = False
+        if self.state_backend.shared and not self.snapshot_path:
+            logger.warning("⚠️ Backend compartido sin DATASET_SNAPSHOT_PATH: cada worker leerá Firestore por su cuenta")
     
     def get_enriched_dataset(self, force_refresh: bool = False) -> List[PersonRecord]:
         """Obtiene dataset enriquecido con cache inteligente"""
         cache_key = "enriched_persons"
         current_time = datetime.now()
         
-        if not force_refresh and self._is_cache_valid(cache_key, current_time):
-            logger.info("📋 Cache: Utilizando datos en cache")
-            return self.cache[cache_key]
+        if self.incremental_active and self._initial_sync_done and not force_refresh:
+            return self._get_incremental_dataset(cache_key, current_time)
+        
+        if force_refresh:
+            return self._refresh_single_flight(cache_key, wait=True)
+        
+        cache_age = self._cache_age(cache_key, current_time)
+        if cache_age is None or cache_age >= self.max_staleness:
+            return self._refresh_single_flight(cache_key, wait=True)
+        
+        if cache_age >= self.cache_duration - self.refresh_ahead:
+            self._refresh_single_flight(cache_key, wait=False)
+            if cache_age >= self.cache_duration:
+                logger.info("📋 Cache: Sirviendo datos previos mientras se actualiza en segundo plano")
+                return self.cache[cache_key]
         
-        logger.info("🔄 Cache: Actualizando desde Firebase")
-        fresh_data = self._fetch_and_enrich_data()
+        logger.info("📋 Cache: Utilizando datos en cache")
+        return self.cache[cache_key]
+    
+    def _refresh_single_flight(self, cache_key: str, wait: bool) -> List[PersonRecord]:
+        """Una sola actualización en curso; el resto espera o sigue con los datos previos"""
+        with self._refresh_guard:
+            refresh_done = self._refresh_done
+            is_leader = refresh_done is None
+            if is_leader:
+                refresh_done = threading.Event()
+                self._refresh_done = refresh_done
+        
+        if is_leader and wait:
+            self._run_refresh(cache_key, refresh_done)
+        elif is_leader:
+            threading.Thread(
+                target=self._run_refresh, args=(cache_key, refresh_done),
+                name="dataset-refresh", daemon=True
+            ).start()
+        elif wait:
+            refresh_done.wait()
+        
+        return self.cache.get(cache_key, [])
+    
+    def _run_refresh(self, cache_key: str, refresh_done: threading.Event) -> None:
+        started_at = datetime.now()
+        try:
+            with telemetry.stage("dataset_refresh"):
+                if self._shares_snapshot():
+                    self._refresh_shared(cache_key, started_at)
+                else:
+                    logger.info("🔄 Cache: Actualizando desde Firebase")
+                    self._install_fresh(cache_key, self._load_enriched_data(), started_at)
+            self.refresh_count += 1
+            self.last_refresh_duration = (datetime.now() - started_at).total_seconds()
+            
+            logger.info(f"✅ Dataset: {len(self.cache[cache_key])} registros enriquecidos (versión {self.dataset_version})")
+            self._build_columns()
+        except Exception as e:
+            if cache_key in self.cache:
+                logger.error(f"❌ Error actualizando dataset, se conservan los datos previos: {e}")
+            else:
+                logger.error(f"❌ Error obteniendo datos de Firebase: {e}")
+                self.cache[cache_key] = []
+                self.cache_metadata[cache_key] = started_at
+        finally:
+            with self._refresh_guard:
+                self._refresh_done = None
+            refresh_done.set()
+    
+    def _build_columns(self) -> None:
+        """Columnas e índices (también el de nombres) de la versión nueva, antes de que llegue una consulta"""
+        try:
+            with telemetry.stage("dataset_indexes"):
+                self.get_columnar_dataset()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron construir los índices del dataset: {e}")
+    
+    def _install_fresh(self, cache_key: str, fresh_data: List[PersonRecord], loaded_at: datetime,
+                       write_snapshot: bool = True) -> None:
+        fresh_version = self._compute_fingerprint(fresh_data)
+        if fresh_version == self.dataset_version and isinstance(self.cache.get(cache_key), SnapshotRecords):
+            # Firestore coincide con el snapshot mapeado: se sigue sirviendo desde el archivo
+            self.cache_metadata[cache_key] = loaded_at
+            logger.info("📦 Snapshot local al día con Firestore")
+            return
         
         self.cache[cache_key] = fresh_data
-        self.cache_metadata[cache_key] = current_time
+        self.cache_metadata[cache_key] = loaded_at
+        self.dataset_version = fresh_version
+        self._rebuild_aggregates(fresh_data)
+        if write_snapshot:
+            self._schedule_snapshot_write()
+    
+    def _shares_snapshot(self) -> bool:
+        """Los workers comparten el dataset a través del snapshot en disco y su versión en el backend"""
+        return self.state_backend.shared and bool(self.snapshot_path)
+    
+    def _refresh_shared(self, cache_key: str, started_at: datetime) -> None:
+        """Un solo worker lee Firestore y publica su snapshot; el resto mapea ese mismo archivo"""
+        if self._adopt_shared_snapshot(cache_key):
+            return
+        
+        lock_name = f"refresh:{cache_key}"
+        if self.state_backend.acquire_lock(lock_name, ttl=self.shared_refresh_wait * 2):
+            try:
+                # Otro worker pudo publicar entre la primera lectura y el lock
+                if self._adopt_shared_snapshot(cache_key):
+                    return
+                logger.info("🔄 Cache: Actualizando desde Firebase (snapshot compartido)")
+                self._install_fresh(cache_key, self._load_enriched_data(), started_at, write_snapshot=False)
+                self._write_snapshot()
+                self._publish_shared_snapshot(cache_key, started_at)
+            finally:
+                self.state_backend.release_lock(lock_name)
+            return
+        
+        give_up_at = time.monotonic() + self.shared_refresh_wait
+        while time.monotonic() < give_up_at:
+            time.sleep(0.25)
+            if self._adopt_shared_snapshot(cache_key):
+                return
+        
+        logger.warning("⚠️ Cache: Otro worker no publicó el snapshot a tiempo, leyendo Firebase")
+        self._install_fresh(cache_key, self._load_enriched_data(), started_at)
+    
+    def _adopt_shared_snapshot(self, cache_key: str) -> bool:
+        """Mapea el snapshot que publicó otro worker, si es más reciente que el local y sigue vigente"""
+        meta = self.state_backend.get(f"dataset:{cache_key}:meta")
+        if meta is None:
+            return False
+        
+        published = json.loads(meta)
+        loaded_at = datetime.fromtimestamp(published["loaded_at"])
+        local_loaded_at = self.cache_metadata.get(cache_key)
+        if local_loaded_at is not None and loaded_at <= local_loaded_at:
+            return False
+        if datetime.now() - loaded_at >= self.cache_duration - self.refresh_ahead:
+            return False
         
-        logger.info(f"✅ Dataset: {len(fresh_data)} registros enriquecidos")
-        return fresh_data
+        if published["version"] == self.dataset_version and cache_key in self.cache:
+            # Mismo contenido que ya se sirve: solo se renueva su antigüedad
+            self.cache_metadata[cache_key] = loaded_at
+        else:
+            try:
+                mapped = DatasetSnapshotFile.open(published["path"])
+            except Exception as e:
+                logger.warning(f"⚠️ Snapshot compartido ilegible ({published['path']}): {e}")
+                return False
+            if mapped is None or mapped.version != published["version"]:
+                return False
+            self._install_mapped(cache_key, mapped, loaded_at)
+        
+        self.shared_adoptions += 1
+        logger.info(f"📋 Cache: Snapshot compartido adoptado (versión {published['version']})")
+        return True
     
-    def _is_cache_valid(self, cache_key: str, current_time: datetime) -> bool:
-        """Verifica validez del cache"""
+    def _publish_shared_snapshot(self, cache_key: str, loaded_at: datetime) -> None:
+        """Solo ruta y versión: los demás workers mapean el archivo en vez de copiar los registros"""
+        if self._snapshot_version != self.dataset_version:
+            logger.warning("⚠️ Snapshot compartido no publicado: el archivo no corresponde a la versión vigente")
+            return
+        meta = {"loaded_at": loaded_at.timestamp(), "version": self._snapshot_version, "path": self.snapshot_path}
+        self.state_backend.set(f"dataset:{cache_key}:meta", json.dumps(meta).encode(), self.max_staleness.total_seconds())
+    
+    def _cache_age(self, cache_key: str, current_time: datetime) -> Optional[timedelta]:
         if cache_key not in self.cache or cache_key not in self.cache_metadata:
+            return None
+        return current_time - self.cache_metadata[cache_key]
+    
+    def refresh_status(self) -> Dict[str, Any]:
+        cache_age = self._cache_age("enriched_persons", datetime.now())
+        return {
+            "refresh_in_progress": self._refresh_done is not None,
+            "refresh_count": self.refresh_count,
+            "last_refresh_duration_s": self.last_refresh_duration,
+            "cache_age_s": round(cache_age.total_seconds(), 1) if cache_age is not None else None,
+            "max_staleness_s": self.max_staleness.total_seconds(),
+            "refresh_ahead_s": self.refresh_ahead.total_seconds(),
+            "shared_snapshot_adoptions": self.shared_adoptions,
+            "last_enrichment": self.last_enrichment,
+            "snapshot": self.snapshot_status
+        }
+    
+    def load_snapshot(self) -> bool:
+        """Adopta el snapshot local para servir sin esperar a Firestore; la reconciliación llega después"""
+        cache_key = "enriched_persons"
+        if not self.snapshot_path or cache_key in self.cache:
+            return False
+        
+        try:
+            mapped = DatasetSnapshotFile.open(self.snapshot_path)
+        except Exception as e:
+            logger.warning(f"⚠️ Snapshot local ilegible ({self.snapshot_path}): {e}")
+            return False
+        if mapped is None:
+            return False
+        
+        age = datetime.now() - mapped.loaded_at
+        if age > self.snapshot_max_age:
+            logger.info(f"📦 Snapshot local descartado por antigüedad ({int(age.total_seconds())}s)")
             return False
         
-        cache_time = self.cache_metadata[cache_key]
-        return (current_time - cache_time) < self.cache_duration
+        self._install_mapped(cache_key, mapped, datetime.now())
+        self._pending_reconcile = True
+        self.snapshot_status.update({
+            "adopted_version": mapped.version,
+            "adopted_records": len(mapped.records),
+            "adopted_age_s": round(age.total_seconds(), 1),
+            "file_bytes": mapped.file_bytes
+        })
+        logger.info(f"📦 Snapshot local mapeado: {len(mapped.records)} registros "
+                    f"(versión {mapped.version}, {int(age.total_seconds())}s de antigüedad)")
+        return True
     
-    def _fetch_and_enrich_data(self) -> List[PersonRecord]:
-        """Obtiene y enriquece datos desde Firebase"""
+    def _install_mapped(self, cache_key: str, mapped: 'MappedDataset', loaded_at: datetime) -> None:
+        aggregates = mapped.aggregates
+        self._attach_records(aggregates)
+        mapped.columns.aggregates = aggregates
+        mapped.columns.indexes.build_names()
+        self.dataset_version = mapped.version
+        self.aggregates = aggregates
+        self._columns = mapped.columns
+        self.cache[cache_key] = mapped.records
+        self.cache_metadata[cache_key] = loaded_at
+        self._snapshot_version = mapped.version
+    
+    def reconcile_snapshot(self) -> None:
+        """Con Firestore disponible, relee la colección en segundo plano si se arrancó desde el snapshot"""
+        if self._pending_reconcile:
+            self._pending_reconcile = False
+            self._refresh_single_flight("enriched_persons", wait=False)
+    
+    def _schedule_snapshot_write(self) -> None:
+        if self.snapshot_path and self.dataset_version != self._snapshot_version:
+            threading.Thread(target=self._write_snapshot, name="dataset-snapshot", daemon=True).start()
+    
+    def _write_snapshot(self) -> None:
+        """Persiste columnas, índices y agregados de la versión vigente para el próximo arranque"""
+        if not self._snapshot_writer.acquire(blocking=False):
+            return
         try:
-            if not self.firebase.is_healthy():
-                raise ConnectionError("Firebase no disponible")
-            
-            snapshot = self.firebase.collection.get()
-            enriched_records = []
-            current_date = datetime.now()
-            
-            logger.info(f"📊 Firebase: {len(snapshot)} documentos encontrados")
-            
-            for doc in snapshot:
-                if not doc.exists:
-                    logger.warning(f"⚠️ Documento {doc.id} no existe")
-                    continue
-                    
-                try:
-                    raw_data = doc.to_dict()  
-                    if not raw_data:
-                        logger.warning(f"⚠️ Documento {doc.id} está vacío")
-                        continue
-                    
-                    required_fields = ['primerNombre', 'apellidos', 'nroDocumento']
-                    if not all(field in raw_data for field in required_fields):
-                        logger.warning(f"⚠️ Documento {doc.id} falta campos obligatorios")
-                        continue
-                    
-                    record = self._create_basic_record(raw_data)
-                    
-                    self._enrich_temporal_data(record, raw_data, current_date)
-                    self._enrich_demographic_data(record)
-                    
-                    enriched_records.append(record)
-                    
-                except Exception as e:
-                    logger.warning(f"⚠️ Error procesando registro {doc.id}: {e}")
+            columns = self.get_columnar_dataset()
+            if columns.aggregates is None or columns.version == self._snapshot_version:
+                return
+            started = time.perf_counter()
+            loaded_at = self.cache_metadata.get("enriched_persons", datetime.now())
+            file_bytes = DatasetSnapshotFile.write(self.snapshot_path, columns, columns.aggregates, loaded_at)
+            self._snapshot_version = columns.version
+            self.snapshot_status.update({
+                "written_version": columns.version,
+                "write_duration_s": round(time.perf_counter() - started, 3),
+                "file_bytes": file_bytes
+            })
+            logger.info(f"📦 Snapshot local escrito: {len(columns)} registros, {file_bytes / 1e6:.1f} MB")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo escribir el snapshot local: {e}")
+        finally:
+            self._snapshot_writer.release()
+    
+    def get_columnar_dataset(self) -> 'PersonColumns':
+        """Vista columnar del dataset vigente, reconstruida solo cuando cambia"""
+        dataset = self.get_enriched_dataset()
+        columns = self._columns
+        if columns is None or columns.records is not dataset:
+            with self._columns_lock:
+                columns = self._columns
+                if columns is None or columns.records is not dataset:
+                    columns = PersonColumns.from_records(dataset, version=self.dataset_version)
+                    columns.build_indexes()
+                    columns.indexes.build_names()
+                    self._columns = columns
+        aggregates = self.aggregates
+        columns.aggregates = aggregates if aggregates is not None and aggregates.version == columns.version else None
+        return columns
+    
+    def _rebuild_aggregates(self, records: List[PersonRecord]) -> None:
+        """Snapshot de agregados calculado una vez por versión del dataset"""
+        aggregates = AggregateSnapshot.from_records(records, self.age_ranges, self.dataset_version)
+        self._attach_records(aggregates)
+        self.aggregates = aggregates
+    
+    def _attach_records(self, aggregates: 'AggregateSnapshot') -> None:
+        """El snapshot relee los registros vigentes (y toma el lock de sync) si pierde un extremo de registro"""
+        aggregates.records_provider = self._current_records
+        aggregates.records_lock = self._sync_lock
+    
+    def _current_records(self) -> List[PersonRecord]:
+        # Se decide al leer: el snapshot puede haberse creado antes de activar el sync incremental
+        if self.incremental_active:
+            return list(self.records_by_id.values())
+        return self.cache.get("enriched_persons", [])
+    
+    def _compute_fingerprint(self, records: List[PersonRecord]) -> str:
+        """Huella del contenido: XOR de hashes por registro, independiente del orden"""
+        fingerprint = 0
+        for record in records:
+            fingerprint ^= self._record_hash(record)
+        self._fingerprint_acc = fingerprint
+        return f"{len(records)}-{fingerprint:016x}"
+    
+    def _record_hash(self, record: PersonRecord) -> int:
+        # Tupla superficial de los campos: mismo repr que astuple() sin sus copias profundas
+        values = tuple(getattr(record, name) for name in PERSON_RECORD_FIELDS)
+        digest = hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+    
+    def start_incremental_sync(self, change_source) -> None:
+        """Mantiene el dataset en memoria aplicando cambios por documento"""
+        with self._sync_lock:
+            self.stop_incremental_sync()
+            self.records_by_id = {}
+            self._fingerprint_acc = 0
+            self.incremental_active = True
+            self._rebuild_aggregates([])
+            self._initial_sync_done = False
+            self.change_source = change_source
+            self._synced_on = datetime.now().date()
+            change_source.subscribe(self._apply_changes)
+        logger.info("🔁 Sync incremental: escuchando cambios de la colección")
+    
+    def stop_incremental_sync(self) -> None:
+        with self._sync_lock:
+            if self.change_source is not None:
+                self.change_source.unsubscribe()
+            self.change_source = None
+            self.incremental_active = False
+    
+    def _apply_changes(self, changes: List[DocumentChange]) -> None:
+        """Aplica altas/modificaciones/bajas re-enriqueciendo solo los documentos afectados"""
+        current_date = datetime.now()
+        with self._sync_lock:
+            aggregates = self.aggregates.copy()
+            for change in changes:
+                if self._resync_touched is not None:
+                    self._resync_touched.add(change.doc_id)
+                previous = self.records_by_id.pop(change.doc_id, None)
+                if previous is not None:
+                    self._fingerprint_acc ^= self._record_hash(previous)
+                    aggregates.remove(previous)
+                
+                if change.kind == 'REMOVED' or not change.data:
                     continue
+                
+                record = self._build_record(change.doc_id, change.data, current_date)
+                if record is not None:
+                    self.records_by_id[change.doc_id] = record
+                    self._fingerprint_acc ^= self._record_hash(record)
+                    aggregates.add(record)
             
-            logger.info(f"✅ Dataset: {len(enriched_records)} registros enriquecidos correctamente")
-            return enriched_records
+            self._records_dirty = True
+            self._initial_sync_done = True
+            self.dataset_version = f"{len(self.records_by_id)}-{self._fingerprint_acc:016x}"
+            aggregates.version = self.dataset_version
+            self.aggregates = aggregates
+        logger.info(f"🔁 Sync incremental: {len(changes)} cambios aplicados")
+    
+    def _start_resync(self, current_time: datetime) -> None:
+        """Lanza la relectura diaria en segundo plano (una a la vez, con espera entre reintentos fallidos)"""
+        if self._resync_thread is not None:
+            return
+        if self._resync_attempted_at is not None and current_time - self._resync_attempted_at < self.resync_retry:
+            return
+        self._resync_attempted_at = current_time
+        self._resync_touched = set()
+        self._resync_thread = threading.Thread(
+            target=self._resync_all, args=(current_time,), name="dataset-resync", daemon=True
+        )
+        self._resync_thread.start()
+    
+    def _resync_all(self, current_time: datetime) -> None:
+        """Relectura completa fuera del lock; al instalarla prevalecen los cambios llegados mientras tanto"""
+        try:
+            records = self._fetch_and_enrich_data()
+            with self._sync_lock:
+                if not self.incremental_active or (not records and self.records_by_id):
+                    return
+                fresh = {record.doc_id: record for record in records}
+                for doc_id in self._resync_touched:
+                    current = self.records_by_id.get(doc_id)
+                    if current is None:
+                        fresh.pop(doc_id, None)
+                    else:
+                        fresh[doc_id] = current
+                self.records_by_id = fresh
+                records = list(fresh.values())
+                self.dataset_version = self._compute_fingerprint(records)
+                self._rebuild_aggregates(records)
+                self._records_dirty = True
+                self._synced_on = current_time.date()
+            logger.info(f"🔁 Sync incremental: relectura diaria completa ({len(records)} registros)")
+        finally:
+            with self._sync_lock:
+                self._resync_thread = None
+                self._resync_touched = None
+    
+    def _get_incremental_dataset(self, cache_key: str, current_time: datetime) -> List[PersonRecord]:
+        with self._sync_lock:
+            if self._synced_on != current_time.date():
+                # Las edades dependen de la fecha actual: se recalculan una vez al día, en segundo
+                # plano; mientras tanto se sirve el dataset vigente
+                self._start_resync(current_time)
             
+            if self._records_dirty or cache_key not in self.cache:
+                self.cache[cache_key] = list(self.records_by_id.values())
+                self.cache_metadata[cache_key] = current_time
+                self._records_dirty = False
+            return self.cache[cache_key]
+    
+    def _fetch_and_enrich_data(self) -> List[PersonRecord]:
+        """Obtiene y enriquece datos desde Firebase"""
+        try:
+            return self._load_enriched_data()
         except Exception as e:
             logger.error(f"❌ Error obteniendo datos de Firebase: {e}")
             return []
     
-    def _create_basic_record(self, raw_data: Dict) -> PersonRecord:
-        """Crea registro básico desde datos raw"""
-        return PersonRecord(
-            nombre_completo=self._build_full_name(raw_data),
-            primer_nombre=raw_data.get('primerNombre', '').strip(),
-            segundo_nombre=raw_data.get('segundoNombre', '').strip(),
-            apellidos=raw_data.get('apellidos', '').strip(),
-            documento=raw_data.get('nroDocumento', ''),
-            genero=raw_data.get('genero', ''),
-            correo=raw_data.get('correo', ''),
-            celular=raw_data.get('celular', '')
-        )
+    def _load_enriched_data(self) -> List[PersonRecord]:
+        """Lectura completa de la colección; propaga los errores de conexión"""
+        if not self.firebase.is_healthy():
+            raise ConnectionError("Firebase no disponible")
+        
+        started = time.perf_counter()
+        current_date = datetime.now()
+        loader = FirestoreBulkLoader(self.firebase.collection, partitions=self.load_partitions,
+                                     page_size=self.load_page_size, max_workers=self.load_workers,
+                                     sample_ids=self._sample_doc_ids())
+        
+        if self.enrich_processes > 1:
+            # Con pool de procesos se decide al final, con el tamaño real: enrich_documents aplica
+            # el umbral y los bloques grandes en vez de pagar IPC por cada página de 1000 documentos
+            documents = [document for page in loader.load(lambda page: page) for document in page]
+            enriched_records = self.enrich_documents(documents, current_date, started=started,
+                                                     firestore_load=loader.stats())
+        else:
+            # En un solo proceso cada página se enriquece en el hilo que la leyó, solapada con la red
+            enriched_records, rejected = [], {}
+            for page_records, page_rejected in loader.load(
+                    lambda page: _enrich_chunk((page, self.age_ranges, self.month_names, current_date))):
+                enriched_records.extend(page_records)
+                self._merge_rejected(rejected, page_rejected)
+            self._record_enrichment(loader.documents, enriched_records, rejected, 1, started,
+                                    firestore_load=loader.stats())
+        
+        logger.info(f"📊 Firebase: {loader.documents} documentos en {loader.pages} páginas "
+                    f"({loader.partitions} particiones)")
+        logger.info(f"✅ Dataset: {len(enriched_records)} registros enriquecidos correctamente")
+        return enriched_records
+    
+    def _sample_doc_ids(self, sample_size: int = 1000) -> List[str]:
+        """Ids repartidos a lo largo del dataset vigente para situar los cortes de la próxima lectura"""
+        dataset = self.cache.get("enriched_persons")
+        if not dataset:
+            return []
+        step = max(1, len(dataset) // sample_size)
+        return [dataset[index].doc_id for index in range(0, len(dataset), step)]
     
-    def _enrich_temporal_data(self, record: PersonRecord, raw_data: Dict, current_date: datetime) -> None:
-        """CORRECCIÓN: Asegurar que se asignen todos los campos temporales"""
-        birth_date = raw_data.get('fechaNacimiento')
+    def enrich_documents(self, documents: List[Tuple[str, Optional[Dict]]], current_date: datetime,
+                         started: Optional[float] = None, **stats) -> List[PersonRecord]:
+        """Enriquecimiento en bloque; con colecciones muy grandes se reparte en un pool de procesos"""
+        started = time.perf_counter() if started is None else started
+        processes = self.enrich_processes if len(documents) >= self.enrich_process_threshold else 1
+        rejected: Dict[str, int] = {}
         
-        if birth_date:
-            try:
-                if hasattr(birth_date, 'todate'):
-                    birth_date = birth_date.todate()
-                elif isinstance(birth_date, str):
-                    for date_format in ['%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S']:
-                        try:
-                            birth_date = datetime.strptime(birth_date, date_format)
-                            break
-                        except ValueError:
-                            continue
+        if processes > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            chunk_size = max(1, min(self.enrich_chunk_size, -(-len(documents) // processes)))
+            payloads = [
+                (documents[offset:offset + chunk_size], self.age_ranges, self.month_names, current_date)
+                for offset in range(0, len(documents), chunk_size)
+            ]
+            records = []
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                for chunk_records, chunk_rejected in pool.map(_enrich_chunk, payloads):
+                    records.extend(chunk_records)
+                    self._merge_rejected(rejected, chunk_rejected)
+        else:
+            enricher = BulkEnricher(self.age_ranges, self.month_names, current_date)
+            records = enricher.enrich(documents)
+            rejected = enricher.rejected
+            if enricher.sample_rejections:
+                logger.debug(f"Documentos descartados (muestra): {enricher.sample_rejections}")
+        
+        self._record_enrichment(len(documents), records, rejected, processes, started, **stats)
+        return records
+    
+    def _merge_rejected(self, total: Dict[str, int], partial: Dict[str, int]) -> None:
+        for reason, count in partial.items():
+            total[reason] = total.get(reason, 0) + count
+    
+    def _record_enrichment(self, documents: int, records: List[PersonRecord], rejected: Dict[str, int],
+                           processes: int, started: float, **extra) -> None:
+        elapsed = time.perf_counter() - started
+        self.last_enrichment = {
+            "documents": documents,
+            "records": len(records),
+            "rejected": rejected,
+            "processes": processes,
+            "duration_s": round(elapsed, 4),
+            "records_per_s": round(documents / elapsed) if elapsed > 0 else None,
+            **extra
+        }
+        if rejected:
+            logger.warning(f"⚠️ Enriquecimiento: documentos con problemas {rejected}")
+    
+    def _build_record(self, doc_id: str, raw_data: Optional[Dict], current_date: datetime) -> Optional[PersonRecord]:
+        """Enriquece un documento individual (sincronización incremental)"""
+        enricher = BulkEnricher(self.age_ranges, self.month_names, current_date)
+        record = enricher.build(doc_id, raw_data)
+        if enricher.rejected:
+            logger.warning(f"⚠️ Documento {doc_id}: {', '.join(enricher.rejected)}")
+        return record
+
+# ============================================================================
+# ALMACÉN COLUMNAR
+# ============================================================================
+
+class PersonColumns:
+    """Vista columnar del dataset: arreglos NumPy para agregados y filtros vectorizados"""
+    
+    UNKNOWN, MALE, FEMALE = 0, 1, 2
+    MONTH_NAMES = {
+        1: 'enero', 2: 'febrero', 3: 'marzo', 4: 'abril', 5: 'mayo', 6: 'junio',
+        7: 'julio', 8: 'agosto', 9: 'septiembre', 10: 'octubre', 11: 'noviembre', 12: 'diciembre'
+    }
+    
+    def __init__(self, records: List[PersonRecord], version: Optional[str] = None):
+        size = len(records)
+        self.records = records
+        self.version = version
+        
+        self.edad = np.full(size, -1, dtype=np.int16)
+        self.mes_nacimiento = np.zeros(size, dtype=np.int8)
+        self.año_nacimiento = np.zeros(size, dtype=np.int16)
+        self.registro_ts = np.full(size, np.nan, dtype=np.float64)
+        self.has_correo = np.zeros(size, dtype=bool)
+        self.has_celular = np.zeros(size, dtype=bool)
+        self.valid = np.zeros(size, dtype=bool)
+        
+        self.nombre_completo: List[str] = [None] * size
+        self.genero_values: List[str] = []
+        self.genero_index = np.zeros(size, dtype=np.int16)
+        genero_lookup: Dict[str, int] = {}
+        
+        for i, record in enumerate(records):
+            self.nombre_completo[i] = sys.intern(record.nombre_completo) if record.nombre_completo else ''
+            self.valid[i] = bool(record.nombre_completo and record.nombre_completo.strip())
+            if record.edad is not None and record.edad >= 0:
+                self.edad[i] = record.edad
+            if record.mes_nacimiento:
+                self.mes_nacimiento[i] = record.mes_nacimiento
+            if record.año_nacimiento:
+                self.año_nacimiento[i] = record.año_nacimiento
+            if record.fecha_registro:
+                self.registro_ts[i] = record.fecha_registro.timestamp()
+            self.has_correo[i] = bool(record.correo and record.correo.strip() and "@" in record.correo)
+            self.has_celular[i] = bool(record.celular and record.celular.strip())
+            
+            genero = record.genero or ''
+            if genero not in genero_lookup:
+                genero_lookup[genero] = len(self.genero_values)
+                self.genero_values.append(sys.intern(genero))
+            self.genero_index[i] = genero_lookup[genero]
+        
+        value_codes = np.array([self._gender_code(value) for value in self.genero_values] or [self.UNKNOWN], dtype=np.int8)
+        self.genero_code = value_codes[self.genero_index]
+        self.has_age = self.edad >= 0
+        self._indexes: Optional['DatasetIndexes'] = None
+        self.aggregates: Optional['AggregateSnapshot'] = None
+    
+    @classmethod
+    def from_records(cls, records: List[PersonRecord], version: Optional[str] = None) -> 'PersonColumns':
+        return cls(records, version)
+    
+    @classmethod
+    def from_arrays(cls, records, version: Optional[str], arrays: Dict[str, Any],
+                    genero_values: List[str]) -> 'PersonColumns':
+        """Columnas ya materializadas (snapshot mapeado): no recorre los registros"""
+        columns = cls.__new__(cls)
+        columns.records = records
+        columns.version = version
+        for name in ('edad', 'mes_nacimiento', 'año_nacimiento', 'registro_ts', 'has_correo',
+                     'has_celular', 'valid', 'genero_index'):
+            setattr(columns, name, arrays[name])
+        columns.nombre_completo = arrays['nombre_completo']
+        columns.genero_values = list(genero_values)
+        value_codes = np.array([columns._gender_code(value) for value in genero_values] or [cls.UNKNOWN], dtype=np.int8)
+        columns.genero_code = value_codes[columns.genero_index]
+        columns.has_age = columns.edad >= 0
+        columns._indexes = None
+        columns.aggregates = None
+        return columns
+    
+    def __len__(self) -> int:
+        return len(self.records)
+    
+    @property
+    def indexes(self) -> 'DatasetIndexes':
+        if self._indexes is None:
+            self.build_indexes()
+        return self._indexes
+    
+    def build_indexes(self) -> None:
+        self._indexes = DatasetIndexes(self)
+    
+    def _gender_code(self, genero: str) -> int:
+        genero_lower = genero.lower()
+        if genero_lower in MALE_VALUES:
+            return self.MALE
+        if genero_lower in FEMALE_VALUES:
+            return self.FEMALE
+        return self.UNKNOWN
+    
+    def _filter_mask(self, query_filter: 'QueryFilter', ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """Evalúa un filtro sobre todas las filas o solo sobre los ids dados"""
+        rows = slice(None) if ids is None else ids
+        size = len(self.records) if ids is None else len(ids)
+        
+        if query_filter.field == 'genero':
+            code = self.MALE if query_filter.value == 'M' else self.FEMALE
+            return self.genero_code[rows] == code
+        
+        if query_filter.field == 'edad':
+            column = self.edad[rows]
+            present = column >= 0
+        elif query_filter.field == 'mes_nacimiento':
+            column = self.mes_nacimiento[rows]
+            present = column > 0
+        elif query_filter.field == 'año_nacimiento':
+            column = self.año_nacimiento[rows]
+            present = column > 0
+        else:
+            return np.zeros(size, dtype=bool)
+        
+        op, target = query_filter.op, query_filter.value
+        if op == 'eq':
+            return present & (column == target)
+        if op == 'gt':
+            return present & (column > target)
+        if op == 'ge':
+            return present & (column >= target)
+        if op == 'lt':
+            return present & (column < target)
+        if op == 'le':
+            return present & (column <= target)
+        if op == 'between':
+            return present & (column >= target[0]) & (column <= target[1])
+        return np.zeros(size, dtype=bool)
+    
+    def records_at(self, indices: np.ndarray) -> List[PersonRecord]:
+        return [self.records[i] for i in indices]
+    
+    def names_at(self, indices: np.ndarray) -> List[str]:
+        return [self.nombre_completo[i] for i in indices]
+    
+    def statistics(self, ids: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Estadísticas para el LLM calculadas en pasadas vectorizadas sobre todas las filas o sobre ids"""
+        if ids is None:
+            ids = np.arange(len(self.records))
+        
+        total_personas = int(ids.size)
+        gender_counts = np.bincount(self.genero_code[ids], minlength=3)
+        hombres, mujeres = int(gender_counts[self.MALE]), int(gender_counts[self.FEMALE])
+        
+        edades = self.edad[ids]
+        edades = edades[edades >= 0]
+        stats_edad = {}
+        if edades.size:
+            stats_edad = {
+                "edad_minima": int(edades.min()),
+                "edad_maxima": int(edades.max()),
+                "promedio_edad": round(float(edades.mean()), 1),
+                "personas_mayor_edad": int(np.count_nonzero(edades >= 18)),
+                "personas_menor_edad": int(np.count_nonzero(edades < 18))
+            }
+        
+        meses = self.mes_nacimiento[ids]
+        month_counts = np.bincount(meses[meses > 0], minlength=13)
+        distribucion_meses = {
+            self.MONTH_NAMES.get(month, f"mes_{month}"): int(month_counts[month])
+            for month in np.flatnonzero(month_counts)
+        }
+        
+        fecha_registro_info = {}
+        timestamps = self.registro_ts[ids]
+        registered = ids[~np.isnan(timestamps)]
+        if registered.size:
+            timestamps = self.registro_ts[registered]
+            # Empates de instante por doc_id, igual que AggregateSnapshot mantenido incrementalmente
+            first = min((self.records[row] for row in registered[timestamps == timestamps.min()]),
+                        key=lambda record: record.doc_id or '')
+            last = max((self.records[row] for row in registered[timestamps == timestamps.max()]),
+                       key=lambda record: record.doc_id or '')
+            fecha_registro_info = {
+                "primera_persona_registrada": {
+                    "nombre": first.nombre_completo,
+                    "fecha": first.fecha_registro.strftime("%Y-%m-%d")
+                },
+                "ultima_persona_registrada": {
+                    "nombre": last.nombre_completo,
+                    "fecha": last.fecha_registro.strftime("%Y-%m-%d")
+                }
+            }
+        
+        return {
+            "conteos_generales": {
+                "total_personas": total_personas,
+                "total_hombres": hombres,
+                "total_mujeres": mujeres,
+                "personas_con_edad_valida": int(edades.size),
+                "personas_con_correo": int(np.count_nonzero(self.has_correo[ids])),
+                "personas_con_telefono": int(np.count_nonzero(self.has_celular[ids]))
+            },
+            "estadisticas_edad": stats_edad,
+            "distribucion_meses_nacimiento": distribucion_meses,
+            "informacion_registro": fecha_registro_info,
+            "porcentajes_genero": {
+                "porcentaje_hombres": round((hombres / total_personas) * 100, 1) if total_personas > 0 else 0,
+                "porcentaje_mujeres": round((mujeres / total_personas) * 100, 1) if total_personas > 0 else 0
+            }
+        }
+
+class DatasetIndexes:
+    """Índices secundarios sobre PersonColumns; los filtros intersectan listas de ids ordenadas"""
+    
+    EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+    NUMBER_PATTERN = re.compile(r"\d{5,}")
+    
+    def __init__(self, columns: 'PersonColumns'):
+        self.columns = columns
+        self.valid_ids = np.flatnonzero(columns.valid)
+        
+        self.by_gender = {
+            code: np.flatnonzero(columns.valid & (columns.genero_code == code))
+            for code in (PersonColumns.MALE, PersonColumns.FEMALE)
+        }
+        self.by_month = {
+            month: np.flatnonzero(columns.valid & (columns.mes_nacimiento == month))
+            for month in range(1, 13)
+        }
+        
+        aged = np.flatnonzero(columns.valid & columns.has_age)
+        order = np.argsort(columns.edad[aged], kind='stable')
+        self.ids_by_age = aged[order]
+        self.sorted_ages = columns.edad[self.ids_by_age]
+        
+        self.by_documento: Dict[str, List[int]] = {}
+        self.by_correo: Dict[str, List[int]] = {}
+        self.by_celular: Dict[str, List[int]] = {}
+        name_postings: Dict[str, List[int]] = {}
+        
+        for i in self.valid_ids.tolist():
+            record = columns.records[i]
+            if record.documento:
+                self.by_documento.setdefault(str(record.documento).strip(), []).append(i)
+            if columns.has_correo[i]:
+                self.by_correo.setdefault(record.correo.strip().lower(), []).append(i)
+            if columns.has_celular[i]:
+                self.by_celular.setdefault(re.sub(r"\D", "", record.celular), []).append(i)
+            for token in set(tokenize(fold_accents(record.nombre_completo))):
+                name_postings.setdefault(token, []).append(i)
+        
+        self.by_name_token = {token: np.array(ids, dtype=np.int64) for token, ids in name_postings.items()}
+        self._names: Optional['NameSearchIndex'] = None
+        self._names_lock = threading.Lock()
+    
+    @classmethod
+    def from_arrays(cls, columns: 'PersonColumns', valid_ids: np.ndarray, by_gender: Dict[int, np.ndarray],
+                    by_month: Dict[int, np.ndarray], ids_by_age: np.ndarray, sorted_ages: np.ndarray,
+                    identifiers: Dict[str, Any], by_name_token: Dict[str, np.ndarray]) -> 'DatasetIndexes':
+        """Índices leídos de un snapshot; las búsquedas por identificador van contra el archivo mapeado"""
+        indexes = cls.__new__(cls)
+        indexes.columns = columns
+        indexes.valid_ids = valid_ids
+        indexes.by_gender = by_gender
+        indexes.by_month = by_month
+        indexes.ids_by_age = ids_by_age
+        indexes.sorted_ages = sorted_ages
+        indexes.by_documento = identifiers['by_documento']
+        indexes.by_correo = identifiers['by_correo']
+        indexes.by_celular = identifiers['by_celular']
+        indexes.by_name_token = by_name_token
+        indexes._names = None
+        indexes._names_lock = threading.Lock()
+        return indexes
+    
+    def lookup(self, filters: Tuple['QueryFilter', ...]) -> np.ndarray:
+        """Ids válidos que cumplen todos los filtros: recorre la lista más corta y verifica el resto por columna"""
+        if not filters:
+            return self.valid_ids
+        
+        driver = min(filters, key=self._estimate_size)
+        candidates = self._postings_for(driver)
+        for query_filter in filters:
+            if query_filter is driver or not candidates.size:
+                continue
+            candidates = candidates[self.columns._filter_mask(query_filter, candidates)]
+        return candidates
+    
+    def _estimate_size(self, query_filter: 'QueryFilter') -> int:
+        if query_filter.field == 'genero':
+            code = PersonColumns.MALE if query_filter.value == 'M' else PersonColumns.FEMALE
+            return len(self.by_gender[code])
+        if query_filter.field == 'mes_nacimiento' and query_filter.op == 'eq':
+            return len(self.by_month.get(query_filter.value, ()))
+        if query_filter.field == 'edad':
+            low, high = self._age_bounds(query_filter.op, query_filter.value)
+            return high - low
+        return len(self.valid_ids)
+    
+    def _postings_for(self, query_filter: 'QueryFilter') -> np.ndarray:
+        if query_filter.field == 'genero':
+            code = PersonColumns.MALE if query_filter.value == 'M' else PersonColumns.FEMALE
+            return self.by_gender[code]
+        if query_filter.field == 'mes_nacimiento' and query_filter.op == 'eq':
+            return self.by_month.get(query_filter.value, np.empty(0, dtype=np.int64))
+        if query_filter.field == 'edad':
+            return np.sort(self._age_range(query_filter.op, query_filter.value))
+        return self.valid_ids[self.columns._filter_mask(query_filter, self.valid_ids)]
+    
+    def _age_bounds(self, op: str, value: Any) -> Tuple[int, int]:
+        """Posiciones [inicio, fin) del rango de edad en el índice ordenado"""
+        ages, size = self.sorted_ages, len(self.sorted_ages)
+        if op == 'gt':
+            return int(np.searchsorted(ages, value, 'right')), size
+        if op == 'ge':
+            return int(np.searchsorted(ages, value, 'left')), size
+        if op == 'lt':
+            return 0, int(np.searchsorted(ages, value, 'left'))
+        if op == 'le':
+            return 0, int(np.searchsorted(ages, value, 'right'))
+        if op == 'eq':
+            return int(np.searchsorted(ages, value, 'left')), int(np.searchsorted(ages, value, 'right'))
+        if op == 'between':
+            return int(np.searchsorted(ages, value[0], 'left')), int(np.searchsorted(ages, value[1], 'right'))
+        return 0, 0
+    
+    def _age_range(self, op: str, value: Any) -> np.ndarray:
+        low, high = self._age_bounds(op, value)
+        return self.ids_by_age[low:high]
+    
+    def age_extreme(self, youngest: bool) -> Tuple[int, np.ndarray]:
+        """Edad mínima/máxima y los ids que la comparten, sin recorrer el dataset"""
+        target = int(self.sorted_ages[0] if youngest else self.sorted_ages[-1])
+        return target, np.sort(self._age_range('eq', target))
+    
+    def build_names(self) -> 'NameSearchIndex':
+        """Construye una sola vez el índice aproximado de nombres; el gestor de datos lo llama al refrescar"""
+        with self._names_lock:
+            if self._names is None:
+                self._names = NameSearchIndex(self.by_name_token)
+            return self._names
+    
+    @property
+    def names(self) -> 'NameSearchIndex':
+        """Índice aproximado de nombres; tras un refresco del dataset ya está construido"""
+        names = self._names
+        return names if names is not None else self.build_names()
+    
+    def identifier_hits(self, text: str) -> List[int]:
+        """Ids referidos por correos, documentos o celulares presentes en el texto"""
+        hits: List[int] = []
+        for email in self.EMAIL_PATTERN.findall(text.lower()):
+            hits.extend(self.by_correo.get(email, []))
+        for number in self.NUMBER_PATTERN.findall(text):
+            hits.extend(self.by_documento.get(number, []))
+            hits.extend(self.by_celular.get(number, []))
+        return hits
+
+# ============================================================================
+# AGREGADOS MATERIALIZADOS
+# ============================================================================
+
+class AggregateSnapshot:
+    """Sumas y conteos del dataset válido, mantenidos incrementalmente; las lecturas son O(1).
+    
+    Las edades hasta MAX_AGE van al histograma; las mayores (datos atípicos) se cuentan por edad
+    exacta en age_outliers para que promedio, mínimo y máximo coincidan con PersonColumns.statistics.
+    """
+    
+    MAX_AGE = 150
+    
+    def __init__(self, age_ranges: List[Tuple[int, int, str]], version: Optional[str] = None):
+        self.age_ranges = age_ranges
+        self.version = version
+        self.record_count = 0
+        self.total = 0
+        self.gender_counts = np.zeros(3, dtype=np.int64)
+        self.age_histogram = np.zeros((3, self.MAX_AGE + 1), dtype=np.int64)
+        self.age_outliers: List[Dict[int, int]] = [{}, {}, {}]
+        self.month_histogram = np.zeros((3, 13), dtype=np.int64)
+        self.with_email = 0
+        self.with_phone = 0
+        self.first_registered: Optional[Tuple[float, str, str, str]] = None
+        self.last_registered: Optional[Tuple[float, str, str, str]] = None
+        self._registration_dirty = False
+        self.records_provider = None
+        self.records_lock = None
+    
+    @classmethod
+    def from_records(cls, records: List[PersonRecord], age_ranges: List[Tuple[int, int, str]],
+                     version: Optional[str] = None) -> 'AggregateSnapshot':
+        snapshot = cls(age_ranges, version)
+        for record in records:
+            snapshot.add(record)
+        return snapshot
+    
+    def copy(self) -> 'AggregateSnapshot':
+        clone = AggregateSnapshot(self.age_ranges, self.version)
+        clone.record_count = self.record_count
+        clone.total = self.total
+        clone.gender_counts = self.gender_counts.copy()
+        clone.age_histogram = self.age_histogram.copy()
+        clone.age_outliers = [dict(outliers) for outliers in self.age_outliers]
+        clone.month_histogram = self.month_histogram.copy()
+        clone.with_email = self.with_email
+        clone.with_phone = self.with_phone
+        clone.first_registered = self.first_registered
+        clone.last_registered = self.last_registered
+        clone._registration_dirty = self._registration_dirty
+        clone.records_provider = self.records_provider
+        clone.records_lock = self.records_lock
+        return clone
+    
+    def _gender_code(self, genero: Optional[str]) -> int:
+        genero_lower = (genero or '').lower()
+        if genero_lower in MALE_VALUES:
+            return PersonColumns.MALE
+        if genero_lower in FEMALE_VALUES:
+            return PersonColumns.FEMALE
+        return PersonColumns.UNKNOWN
+    
+    def add(self, record: PersonRecord) -> None:
+        self._apply(record, 1)
+        if record.nombre_completo and record.nombre_completo.strip() and record.fecha_registro:
+            entry = self._registration_entry(record)
+            if self.first_registered is None or entry[:2] < self.first_registered[:2]:
+                self.first_registered = entry
+            if self.last_registered is None or entry[:2] > self.last_registered[:2]:
+                self.last_registered = entry
+    
+    def remove(self, record: PersonRecord) -> None:
+        self._apply(record, -1)
+        for extreme in (self.first_registered, self.last_registered):
+            if extreme is not None and extreme[1] == record.doc_id:
+                self._registration_dirty = True
+    
+    def _apply(self, record: PersonRecord, sign: int) -> None:
+        self.record_count += sign
+        if not (record.nombre_completo and record.nombre_completo.strip()):
+            return
+        
+        code = self._gender_code(record.genero)
+        self.total += sign
+        self.gender_counts[code] += sign
+        if record.edad is not None and 0 <= record.edad <= self.MAX_AGE:
+            self.age_histogram[code, record.edad] += sign
+        elif record.edad is not None and record.edad > self.MAX_AGE:
+            outliers = self.age_outliers[code]
+            remaining = outliers.get(record.edad, 0) + sign
+            if remaining:
+                outliers[record.edad] = remaining
+            else:
+                outliers.pop(record.edad, None)
+        if record.mes_nacimiento:
+            self.month_histogram[code, record.mes_nacimiento] += sign
+        if record.correo and record.correo.strip() and "@" in record.correo:
+            self.with_email += sign
+        if record.celular and record.celular.strip():
+            self.with_phone += sign
+    
+    def _registration_entry(self, record: PersonRecord) -> Tuple[float, str, str, str]:
+        # (instante, doc_id) ordena también los empates, igual que PersonColumns.statistics
+        return (record.fecha_registro.timestamp(), record.doc_id or '', record.nombre_completo,
+                record.fecha_registro.strftime("%Y-%m-%d"))
+    
+    def _refresh_registration(self) -> None:
+        """Recalcula primera/última persona solo si se eliminó uno de los extremos"""
+        if not self._registration_dirty or self.records_provider is None:
+            return
+        with self.records_lock or nullcontext():
+            if not self._registration_dirty:
+                return
+            first = last = None
+            for record in self.records_provider():
+                if record.nombre_completo and record.nombre_completo.strip() and record.fecha_registro:
+                    entry = self._registration_entry(record)
+                    if first is None or entry[:2] < first[:2]:
+                        first = entry
+                    if last is None or entry[:2] > last[:2]:
+                        last = entry
+            self.first_registered, self.last_registered = first, last
+            self._registration_dirty = False
+    
+    def _outliers(self, code: Optional[int] = None) -> Dict[int, int]:
+        if code is not None:
+            return self.age_outliers[code]
+        merged: Dict[int, int] = {}
+        for outliers in self.age_outliers:
+            for age, count in outliers.items():
+                merged[age] = merged.get(age, 0) + count
+        return merged
+    
+    def age_count(self, code: Optional[int] = None) -> int:
+        histogram = self.age_histogram.sum(axis=0) if code is None else self.age_histogram[code]
+        return int(histogram.sum()) + sum(self._outliers(code).values())
+    
+    def mean_age(self, code: Optional[int] = None) -> Optional[float]:
+        histogram = self.age_histogram.sum(axis=0) if code is None else self.age_histogram[code]
+        outliers = self._outliers(code)
+        count = int(histogram.sum()) + sum(outliers.values())
+        if not count:
+            return None
+        total = int(np.dot(histogram, np.arange(self.MAX_AGE + 1))) + sum(age * n for age, n in outliers.items())
+        return total / count
+    
+    def age_bounds(self) -> Optional[Tuple[int, int]]:
+        present = np.flatnonzero(self.age_histogram.sum(axis=0))
+        outliers = self._outliers()
+        if not present.size and not outliers:
+            return None
+        low = int(present[0]) if present.size else min(outliers)
+        high = max(outliers) if outliers else int(present[-1])
+        return low, high
+    
+    def age_range_counts(self) -> Dict[str, int]:
+        histogram = self.age_histogram.sum(axis=0)
+        return {
+            label: int(histogram[low:min(high, self.MAX_AGE) + 1].sum())
+            for low, high, label in self.age_ranges
+        }
+    
+    def month_counts(self, code: Optional[int] = None) -> np.ndarray:
+        return self.month_histogram.sum(axis=0) if code is None else self.month_histogram[code]
+    
+    def as_statistics(self) -> Dict[str, Any]:
+        """Mismo formato que PersonColumns.statistics sobre todos los registros válidos"""
+        hombres = int(self.gender_counts[PersonColumns.MALE])
+        mujeres = int(self.gender_counts[PersonColumns.FEMALE])
+        histogram = self.age_histogram.sum(axis=0)
+        outlier_count = sum(self._outliers().values())
+        
+        stats_edad = {}
+        bounds = self.age_bounds()
+        if bounds is not None:
+            stats_edad = {
+                "edad_minima": bounds[0],
+                "edad_maxima": bounds[1],
+                "promedio_edad": round(self.mean_age(), 1),
+                "personas_mayor_edad": int(histogram[18:].sum()) + outlier_count,
+                "personas_menor_edad": int(histogram[:18].sum())
+            }
+        
+        months = self.month_counts()
+        distribucion_meses = {
+            PersonColumns.MONTH_NAMES.get(month, f"mes_{month}"): int(months[month])
+            for month in np.flatnonzero(months)
+        }
+        
+        self._refresh_registration()
+        fecha_registro_info = {}
+        if self.first_registered and self.last_registered:
+            fecha_registro_info = {
+                "primera_persona_registrada": {
+                    "nombre": self.first_registered[2],
+                    "fecha": self.first_registered[3]
+                },
+                "ultima_persona_registrada": {
+                    "nombre": self.last_registered[2],
+                    "fecha": self.last_registered[3]
+                }
+            }
+        
+        return {
+            "conteos_generales": {
+                "total_personas": self.total,
+                "total_hombres": hombres,
+                "total_mujeres": mujeres,
+                "personas_con_edad_valida": int(histogram.sum()) + outlier_count,
+                "personas_con_correo": self.with_email,
+                "personas_con_telefono": self.with_phone
+            },
+            "estadisticas_edad": stats_edad,
+            "distribucion_meses_nacimiento": distribucion_meses,
+            "informacion_registro": fecha_registro_info,
+            "porcentajes_genero": {
+                "porcentaje_hombres": round((hombres / self.total) * 100, 1) if self.total > 0 else 0,
+                "porcentaje_mujeres": round((mujeres / self.total) * 100, 1) if self.total > 0 else 0
+            }
+        }
+    
+    def summary(self) -> Dict[str, Any]:
+        mean_age = self.mean_age()
+        return {
+            "version": self.version,
+            "total_personas": self.total,
+            "total_hombres": int(self.gender_counts[PersonColumns.MALE]),
+            "total_mujeres": int(self.gender_counts[PersonColumns.FEMALE]),
+            "promedio_edad": round(mean_age, 1) if mean_age is not None else None,
+            "promedio_edad_hombres": self._rounded(self.mean_age(PersonColumns.MALE)),
+            "promedio_edad_mujeres": self._rounded(self.mean_age(PersonColumns.FEMALE)),
+            "rangos_edad": self.age_range_counts(),
+            "distribucion_meses": {
+                PersonColumns.MONTH_NAMES[month]: int(count)
+                for month, count in enumerate(self.month_counts()) if month and count
+            }
+        }
+    
+    def _rounded(self, value: Optional[float]) -> Optional[float]:
+        return round(value, 1) if value is not None else None
+
+# ============================================================================
+# SNAPSHOT LOCAL DEL DATASET
+# ============================================================================
+
+class MappedStrings(Sequence):
+    """Columna de texto sobre el archivo: bytes UTF-8 concatenados y offsets; decodifica bajo demanda"""
+    
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+class MappedPostings:
+    """Índice clave -> ids con claves ordenadas de ancho fijo; búsqueda binaria sin cargar un dict"""
+    
+    def __init__(self, keys: np.ndarray, offsets: np.ndarray, ids: np.ndarray):
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    def get(self, key: str, default=None):
+        encoded = key.encode('utf-8')
+        if not len(self.keys) or len(encoded) > self.keys.dtype.itemsize:
+            return default
+        position = int(np.searchsorted(self.keys, encoded))
+        if position < len(self.keys) and self.keys[position] == encoded:
+            return self.ids[self.offsets[position]:self.offsets[position + 1]]
+        return default
+
+class SnapshotRecords(Sequence):
+    """Registros del snapshot: cada PersonRecord se reconstruye desde las columnas al accederlo"""
+    
+    TEXT_FIELDS = ('nombre_completo', 'primer_nombre', 'segundo_nombre', 'apellidos',
+                   'documento', 'correo', 'celular', 'doc_id')
+    
+    def __init__(self, arrays: Dict[str, Any], genero_values: List[str], rango_values: List[str]):
+        self.arrays = arrays
+        self.genero_values = genero_values
+        self.rango_values = rango_values
+        self.size = len(arrays['edad'])
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        index = operator.index(index)
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        
+        arrays = self.arrays
+        text = {name: arrays[name][index] for name in self.TEXT_FIELDS}
+        record = PersonRecord(genero=self.genero_values[arrays['genero_index'][index]], **text)
+        
+        edad = int(arrays['edad'][index])
+        if edad >= 0:
+            record.edad = edad
+            record.es_mayor_edad = edad >= 18
+            record.rango_edad = self.rango_values[arrays['rango_index'][index]]
+        month = int(arrays['mes_nacimiento'][index])
+        if month:
+            record.mes_nacimiento = month
+            record.mes_nacimiento_nombre = PersonColumns.MONTH_NAMES.get(month, f"mes_{month}")
+        year = int(arrays['año_nacimiento'][index])
+        if year:
+            record.año_nacimiento = year
+        timestamp = float(arrays['registro_ts'][index])
+        if not math.isnan(timestamp):
+            record.fecha_registro = (datetime.fromtimestamp(timestamp, timezone.utc) if arrays['registro_utc'][index]
+                                     else datetime.fromtimestamp(timestamp))
+        return record
+
+@dataclass
+class MappedDataset:
+    """Lo que devuelve la apertura de un snapshot: columnas, índices y agregados listos para servir"""
+    version: str
+    loaded_at: datetime
+    records: SnapshotRecords
+    columns: 'PersonColumns'
+    aggregates: 'AggregateSnapshot'
+    path: str
+    file_bytes: int
+
+class DatasetSnapshotFile:
+    """Archivo columnar versionado: cabecera JSON y secciones NumPy alineadas que se abren con mmap.
+    
+    Disposición: MAGIC (8 bytes) | formato u32 | reservado u32 | longitud de cabecera u64 |
+    cabecera JSON | secciones alineadas a ALIGNMENT con offsets relativos al fin de la cabecera.
+    """
+    
+    MAGIC = b"RAGSNAP\0"
+    FORMAT_VERSION = 1
+    ALIGNMENT = 64
+    PRELUDE = struct.Struct("<8sIIQ")
+    NUMERIC_COLUMNS = ('edad', 'mes_nacimiento', 'año_nacimiento', 'registro_ts', 'has_correo',
+                       'has_celular', 'valid', 'genero_index')
+    IDENTIFIER_INDEXES = ('by_documento', 'by_correo', 'by_celular')
+    
+    # ------------------------------------------------------------------ escritura
+    
+    @classmethod
+    def write(cls, path: str, columns: 'PersonColumns', aggregates: 'AggregateSnapshot', loaded_at: datetime) -> int:
+        """Escribe a un temporal y lo renombra: los lectores nunca ven un archivo a medias"""
+        sections: Dict[str, np.ndarray] = {}
+        records = columns.records
+        
+        for name in cls.NUMERIC_COLUMNS:
+            sections[f"col.{name}"] = getattr(columns, name)
+        rango_values = [label for _, _, label in aggregates.age_ranges] + ["Edad no categorizada"]
+        rango_lookup = {label: code for code, label in enumerate(rango_values)}
+        rango_index = np.zeros(len(records), dtype=np.int8)
+        registro_utc = np.zeros(len(records), dtype=bool)
+        text_columns: Dict[str, List[str]] = {name: [] for name in SnapshotRecords.TEXT_FIELDS}
+        for i, record in enumerate(records):
+            for name, values in text_columns.items():
+                value = getattr(record, name)
+                values.append(value if isinstance(value, str) else str(value or ''))
+            if record.rango_edad is not None:
+                rango_index[i] = rango_lookup.get(record.rango_edad, len(rango_values) - 1)
+            if record.fecha_registro is not None and record.fecha_registro.tzinfo is not None:
+                registro_utc[i] = True
+        sections["col.rango_index"] = rango_index
+        sections["col.registro_utc"] = registro_utc
+        for name, values in text_columns.items():
+            sections[f"str.{name}.blob"], sections[f"str.{name}.offsets"] = cls._encode_strings(values)
+        
+        indexes = columns.indexes
+        sections["idx.valid_ids"] = indexes.valid_ids
+        sections["idx.gender_male"] = indexes.by_gender[PersonColumns.MALE]
+        sections["idx.gender_female"] = indexes.by_gender[PersonColumns.FEMALE]
+        months = [indexes.by_month[month] for month in range(1, 13)]
+        sections["idx.by_month.ids"] = np.concatenate(months).astype(np.int64)
+        sections["idx.by_month.offsets"] = np.cumsum([0] + [len(ids) for ids in months]).astype(np.int64)
+        sections["idx.ids_by_age"] = indexes.ids_by_age
+        sections["idx.sorted_ages"] = indexes.sorted_ages
+        for name in cls.IDENTIFIER_INDEXES:
+            keys, offsets, ids = cls._encode_postings(getattr(indexes, name))
+            sections[f"idx.{name}.keys"], sections[f"idx.{name}.offsets"], sections[f"idx.{name}.ids"] = keys, offsets, ids
+        tokens = sorted(indexes.by_name_token)
+        sections["idx.name_token.blob"], sections["idx.name_token.offsets"] = cls._encode_strings(tokens)
+        sections["idx.name_token.ids"] = (np.concatenate([indexes.by_name_token[token] for token in tokens]).astype(np.int64)
+                                          if tokens else np.empty(0, dtype=np.int64))
+        sections["idx.name_token.id_offsets"] = np.cumsum([0] + [len(indexes.by_name_token[token]) for token in tokens]).astype(np.int64)
+        
+        sections["agg.gender_counts"] = aggregates.gender_counts
+        sections["agg.age_histogram"] = aggregates.age_histogram
+        sections["agg.month_histogram"] = aggregates.month_histogram
+        
+        layout, offset = {}, 0
+        for name, array in sections.items():
+            array = np.ascontiguousarray(array)
+            sections[name] = array
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset, "nbytes": array.nbytes}
+            offset = cls._aligned(offset + array.nbytes)
+        
+        header = json.dumps({
+            "dataset_version": columns.version,
+            "loaded_at": loaded_at.timestamp(),
+            "written_at": time.time(),
+            "record_count": len(records),
+            "genero_values": columns.genero_values,
+            "rango_values": rango_values,
+            "age_ranges": [list(entry) for entry in aggregates.age_ranges],
+            "aggregates": {
+                "version": aggregates.version,
+                "record_count": aggregates.record_count,
+                "total": aggregates.total,
+                "with_email": aggregates.with_email,
+                "with_phone": aggregates.with_phone,
+                "first_registered": aggregates.first_registered,
+                "last_registered": aggregates.last_registered,
+                "age_outliers": [[code, age, count] for code, outliers in enumerate(aggregates.age_outliers)
+                                 for age, count in sorted(outliers.items())]
+            },
+            "sections": layout
+        }, ensure_ascii=False).encode('utf-8')
+        data_start = cls._aligned(cls.PRELUDE.size + len(header))
+        
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as handle:
+            handle.write(cls.PRELUDE.pack(cls.MAGIC, cls.FORMAT_VERSION, 0, len(header)))
+            handle.write(header)
+            for name, array in sections.items():
+                handle.seek(data_start + layout[name]["offset"])
+                handle.write(array.tobytes())
+            handle.truncate(data_start + offset)
+        os.replace(temporary, path)
+        return data_start + offset
+    
+    @classmethod
+    def _aligned(cls, offset: int) -> int:
+        return -(-offset // cls.ALIGNMENT) * cls.ALIGNMENT
+    
+    @staticmethod
+    def _encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [value.encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+    
+    @staticmethod
+    def _encode_postings(postings: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        entries = sorted((key.encode('utf-8'), ids) for key, ids in postings.items() if key)
+        width = max((len(key) for key, _ in entries), default=1)
+        keys = np.array([key for key, _ in entries], dtype=f"S{width}")
+        offsets = np.cumsum([0] + [len(ids) for _, ids in entries]).astype(np.int64)
+        ids = (np.concatenate([np.asarray(ids, dtype=np.int64) for _, ids in entries])
+               if entries else np.empty(0, dtype=np.int64))
+        return keys, offsets, ids
+    
+    # ------------------------------------------------------------------ lectura
+    
+    @classmethod
+    def read_header(cls, path: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """Cabecera y comienzo de los datos, o None si el archivo no es un snapshot compatible"""
+        with open(path, "rb") as handle:
+            prelude = handle.read(cls.PRELUDE.size)
+            if len(prelude) < cls.PRELUDE.size:
+                return None
+            magic, format_version, _, header_length = cls.PRELUDE.unpack(prelude)
+            if magic != cls.MAGIC or format_version != cls.FORMAT_VERSION:
+                return None
+            header = json.loads(handle.read(header_length).decode('utf-8'))
+        return header, cls._aligned(cls.PRELUDE.size + header_length)
+    
+    @classmethod
+    def open(cls, path: str) -> Optional[MappedDataset]:
+        """Mapea el archivo en memoria; las columnas son vistas de solo lectura sobre las páginas del archivo"""
+        if not os.path.exists(path):
+            return None
+        parsed = cls.read_header(path)
+        if parsed is None:
+            logger.warning(f"⚠️ Snapshot {path} con formato incompatible, se ignora")
+            return None
+        header, data_start = parsed
+        
+        file_bytes = os.path.getsize(path)
+        layout = header["sections"]
+        expected = max((data_start + entry["offset"] + entry["nbytes"] for entry in layout.values()), default=data_start)
+        if file_bytes < expected:
+            logger.warning(f"⚠️ Snapshot {path} truncado, se ignora")
+            return None
+        
+        with open(path, "rb") as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        def section(name: str) -> np.ndarray:
+            entry = layout[name]
+            dtype = np.dtype(entry["dtype"])
+            count = entry["nbytes"] // dtype.itemsize if dtype.itemsize else 0
+            return np.frombuffer(mapped, dtype=dtype, count=count,
+                                 offset=data_start + entry["offset"]).reshape(entry["shape"])
+        
+        arrays: Dict[str, Any] = {name: section(f"col.{name}") for name in cls.NUMERIC_COLUMNS}
+        arrays['rango_index'] = section("col.rango_index")
+        arrays['registro_utc'] = section("col.registro_utc")
+        for name in SnapshotRecords.TEXT_FIELDS:
+            arrays[name] = MappedStrings(section(f"str.{name}.blob"), section(f"str.{name}.offsets"))
+        
+        records = SnapshotRecords(arrays, header["genero_values"], header["rango_values"])
+        columns = PersonColumns.from_arrays(records, header["dataset_version"], arrays, header["genero_values"])
+        
+        month_ids, month_offsets = section("idx.by_month.ids"), section("idx.by_month.offsets")
+        token_names = MappedStrings(section("idx.name_token.blob"), section("idx.name_token.offsets"))
+        token_ids, token_offsets = section("idx.name_token.ids"), section("idx.name_token.id_offsets")
+        columns._indexes = DatasetIndexes.from_arrays(
+            columns,
+            valid_ids=section("idx.valid_ids"),
+            by_gender={PersonColumns.MALE: section("idx.gender_male"), PersonColumns.FEMALE: section("idx.gender_female")},
+            by_month={month: month_ids[month_offsets[month - 1]:month_offsets[month]] for month in range(1, 13)},
+            ids_by_age=section("idx.ids_by_age"),
+            sorted_ages=section("idx.sorted_ages"),
+            identifiers={
+                name: MappedPostings(section(f"idx.{name}.keys"), section(f"idx.{name}.offsets"), section(f"idx.{name}.ids"))
+                for name in cls.IDENTIFIER_INDEXES
+            },
+            by_name_token={token_names[i]: token_ids[token_offsets[i]:token_offsets[i + 1]] for i in range(len(token_names))}
+        )
+        
+        stored = header["aggregates"]
+        aggregates = AggregateSnapshot([tuple(entry) for entry in header["age_ranges"]], stored["version"])
+        aggregates.record_count = stored["record_count"]
+        aggregates.total = stored["total"]
+        aggregates.with_email = stored["with_email"]
+        aggregates.with_phone = stored["with_phone"]
+        aggregates.first_registered = tuple(stored["first_registered"]) if stored["first_registered"] else None
+        aggregates.last_registered = tuple(stored["last_registered"]) if stored["last_registered"] else None
+        aggregates.gender_counts = section("agg.gender_counts").copy()
+        aggregates.age_histogram = section("agg.age_histogram").copy()
+        for code, age, count in stored.get("age_outliers", []):
+            aggregates.age_outliers[code][age] = count
+        aggregates.month_histogram = section("agg.month_histogram").copy()
+        
+        return MappedDataset(
+            version=header["dataset_version"],
+            loaded_at=datetime.fromtimestamp(header["loaded_at"]),
+            records=records,
+            columns=columns,
+            aggregates=aggregates,
+            path=path,
+            file_bytes=file_bytes
+        )
+    
+    @classmethod
+    def describe(cls, path: str) -> Dict[str, Any]:
+        """Resumen del archivo sin mapearlo: versión, antigüedad y bytes por grupo de secciones"""
+        parsed = cls.read_header(path)
+        if parsed is None:
+            return {"path": path, "compatible": False}
+        header, data_start = parsed
+        groups: Dict[str, int] = {}
+        for name, entry in header["sections"].items():
+            group = {"col": "numeric_columns", "str": "text_columns", "idx": "indexes", "agg": "aggregates"}[name.split(".", 1)[0]]
+            groups[group] = groups.get(group, 0) + entry["nbytes"]
+        record_count = header["record_count"]
+        file_bytes = os.path.getsize(path)
+        return {
+            "path": path,
+            "compatible": True,
+            "format_version": cls.FORMAT_VERSION,
+            "dataset_version": header["dataset_version"],
+            "record_count": record_count,
+            "loaded_at": datetime.fromtimestamp(header["loaded_at"]).isoformat(),
+            "written_at": datetime.fromtimestamp(header["written_at"]).isoformat(),
+            "file_bytes": file_bytes,
+            "header_bytes": data_start,
+            "bytes_by_group": groups,
+            "bytes_per_record": round(file_bytes / record_count, 1) if record_count else None,
+            "sections": {name: entry["nbytes"] for name, entry in header["sections"].items()}
+        }
+
+# ============================================================================
+# BÚSQUEDA APROXIMADA DE NOMBRES
+# ============================================================================
+
+BITMAP_INTERSECT_MIN = 4096
+
+def within_one_edit(a: str, b: str) -> bool:
+    """True si a y b difieren en a lo sumo una inserción, borrado, sustitución o transposición adyacente"""
+    if a == b:
+        return True
+    length_a, length_b = len(a), len(b)
+    if abs(length_a - length_b) > 1:
+        return False
+    i = len(os.path.commonprefix((a, b)))
+    if length_a == length_b:
+        return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i] == b[i + 1] and a[i + 1] == b[i])
+    if length_a > length_b:
+        return a[i + 1:] == b[i:]
+    return a[i:] == b[i + 1:]
+
+def intersect_sorted(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersección de dos listas de ids ordenadas.
+    
+    Si la corta es pequeña, búsqueda binaria en la larga; si ambas son grandes, un mapa de bits
+    sobre la larga (lineal, sin los log n de la búsqueda binaria).
+    """
+    if a.size > b.size:
+        a, b = b, a
+    if not a.size:
+        return a
+    if a.size >= BITMAP_INTERSECT_MIN:
+        present = np.zeros(int(b[-1]) + 1, dtype=bool)
+        present[b] = True
+        a = a[:np.searchsorted(a, b[-1], 'right')]
+        return a[present[a]]
+    positions = np.minimum(np.searchsorted(b, a), b.size - 1)
+    return a[b[positions] == a]
+
+def difference_sorted(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Ids de a (ordenada) que no están en b (ordenada)"""
+    if not a.size or not b.size:
+        return a
+    positions = np.minimum(np.searchsorted(b, a), b.size - 1)
+    return a[b[positions] != a]
+
+def first_common(lists: Sequence[np.ndarray], count: int,
+                 excluded: Optional[np.ndarray] = None) -> np.ndarray:
+    """Los count ids más bajos presentes en todas las listas (ordenadas), fuera de excluded.
+    
+    Recorre la lista más corta por bloques crecientes y corta en cuanto tiene count ids,
+    así que con listas de cientos de miles solo se intersecta el principio.
+    """
+    lists = sorted(lists, key=len)
+    driver, others = lists[0], lists[1:]
+    found: List[np.ndarray] = []
+    total, offset, step = 0, 0, max(64, count * 4)
+    while total < count and offset < driver.size:
+        chunk = driver[offset:offset + step]
+        for ids in others:
+            chunk = intersect_sorted(chunk, ids)
+            if not chunk.size:
+                break
+        if excluded is not None and chunk.size:
+            chunk = difference_sorted(chunk, excluded)
+        found.append(chunk)
+        total += chunk.size
+        offset += step
+        step *= 2
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(found)[:count]
+
+@dataclass
+class NameMatches:
+    """Coincidencias de una búsqueda por nombre: exactas y aproximadas, ambas ya ordenadas"""
+    terms: Tuple[str, ...]
+    exact: np.ndarray
+    approximate: np.ndarray
+    
+    @property
+    def ranked(self) -> np.ndarray:
+        return np.concatenate([self.exact, self.approximate])
+
+class NameSearchIndex:
+    """Búsqueda tolerante a errores sobre los tokens de nombre (primer y segundo nombre, apellidos).
+    
+    El vocabulario sale de by_name_token, ya plegado sin tildes ("José"/"Josè" -> "jose").
+    Cada token se indexa junto con sus variantes de un borrado (vecindario de borrado): dos
+    palabras a distancia de Damerau-Levenshtein 1 siempre comparten alguna variante, así que
+    buscar es generar las variantes de la consulta y hacer búsqueda binaria en un arreglo de
+    hashes, sin recorrer el vocabulario.
+    """
+    
+    MIN_FUZZY_LENGTH = 4
+    EXPANSION_CACHE_SIZE = 4096
+    MAX_COMBINATIONS = 32
+    
+    def __init__(self, postings: Dict[str, np.ndarray]):
+        started = time.perf_counter()
+        self.postings = postings
+        self.vocabulary: List[str] = list(postings)
+        
+        hashes: List[int] = []
+        owners: List[int] = []
+        for token_id, token in enumerate(self.vocabulary):
+            if len(token) < self.MIN_FUZZY_LENGTH - 1:
+                continue
+            for variant in self._variants(token):
+                hashes.append(hash(variant))
+                owners.append(token_id)
+        variant_hashes = np.array(hashes, dtype=np.int64)
+        order = np.argsort(variant_hashes, kind='stable')
+        self.variant_hashes = variant_hashes[order]
+        self.variant_owners = np.array(owners, dtype=np.int32)[order]
+        
+        # Se consulta desde hilos de asyncio.to_thread: el OrderedDict no tolera move_to_end concurrentes
+        self._expansions: "OrderedDict[str, List[Tuple[str, int]]]" = OrderedDict()
+        self._expansions_lock = threading.Lock()
+        self.build_seconds = round(time.perf_counter() - started, 4)
+        logger.info(f"🔤 Índice de nombres: {len(self.vocabulary)} tokens, {len(self.variant_hashes)} variantes "
+                    f"en {self.build_seconds:.2f}s")
+    
+    @staticmethod
+    def _variants(token: str) -> set:
+        return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+    
+    def expand(self, term: str) -> List[Tuple[str, int]]:
+        """Tokens del vocabulario iguales (distancia 0) o a una edición (distancia 1) de term"""
+        with self._expansions_lock:
+            cached = self._expansions.get(term)
+            if cached is not None:
+                self._expansions.move_to_end(term)
+                return cached
+        
+        matches = [(term, 0)] if term in self.postings else []
+        if len(term) >= self.MIN_FUZZY_LENGTH and self.variant_hashes.size:
+            keys = np.array([hash(variant) for variant in self._variants(term)], dtype=np.int64)
+            low = np.searchsorted(self.variant_hashes, keys, 'left')
+            high = np.searchsorted(self.variant_hashes, keys, 'right')
+            owners = {int(owner) for start, end in zip(low.tolist(), high.tolist())
+                      for owner in self.variant_owners[start:end]}
+            close = sorted(token for token in (self.vocabulary[owner] for owner in owners)
+                           if token != term and within_one_edit(term, token))
+            matches.extend((token, 1) for token in close)
+        
+        with self._expansions_lock:
+            self._expansions[term] = matches
+            if len(self._expansions) > self.EXPANSION_CACHE_SIZE:
+                self._expansions.popitem(last=False)
+        return matches
+    
+    def search(self, terms: Sequence[str], candidate_ids: Optional[np.ndarray] = None,
+               limit: int = 50) -> NameMatches:
+        """Registros cuyo nombre contiene todos los términos. Las coincidencias exactas van primero.
+        Las aproximadas solo se calculan si faltan para llegar a limit, ordenadas por ediciones totales
+        y sin pasar de limit: no se materializa la unión de listas de tokens parecidos."""
+        terms = tuple(terms)
+        empty = np.empty(0, dtype=np.int64)
+        if not terms:
+            return NameMatches(terms, empty, empty)
+        
+        expansions = [self.expand(term) for term in terms]
+        exact_lists = [self.postings[term] if term in self.postings else empty for term in terms]
+        restrict = [] if candidate_ids is None else [candidate_ids]
+        exact = self._intersect(exact_lists + restrict)
+        needed = limit - int(exact.size)
+        if needed <= 0 or not any(distance for matches in expansions for _, distance in matches):
+            return NameMatches(terms, exact, empty)
+        
+        # Combinaciones de un token por término con al menos una edición, de menos a más ediciones;
+        # dentro del mismo número de ediciones se ordena por id.
+        combinations = sorted(
+            (combination for combination in product(*expansions)
+             if any(distance for _, distance in combination)),
+            key=lambda combination: sum(distance for _, distance in combination)
+        )[:self.MAX_COMBINATIONS]
+        approximate: List[np.ndarray] = []
+        for _, group in groupby(combinations, key=lambda combination: sum(d for _, d in combination)):
+            level = [first_common([self.postings[token] for token, _ in combination] + restrict,
+                                  needed, excluded=exact)
+                     for combination in group]
+            level_ids = np.unique(np.concatenate(level))[:needed] if level else empty
+            if approximate and level_ids.size:
+                level_ids = difference_sorted(level_ids, np.sort(np.concatenate(approximate)))
+            approximate.append(level_ids)
+            needed -= int(level_ids.size)
+            if needed <= 0:
+                break
+        return NameMatches(terms, exact, np.concatenate(approximate) if approximate else empty)
+    
+    @staticmethod
+    def _intersect(lists: List[np.ndarray]) -> np.ndarray:
+        lists = sorted(lists, key=len)
+        result = lists[0]
+        for ids in lists[1:]:
+            if not result.size:
+                break
+            result = intersect_sorted(result, ids)
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vocabulary": len(self.vocabulary),
+            "variants": int(self.variant_hashes.size),
+            "build_seconds": self.build_seconds,
+            "cached_expansions": len(self._expansions)
+        }
+
+# ============================================================================
+# RECUPERACIÓN POR RELEVANCIA
+# ============================================================================
+
+class RelevanceRetriever:
+    """Ordena los registros filtrados según su relevancia para la consulta y devuelve el top-k"""
+    
+    IDENTIFIER_SCORE = 10.0
+    EXACT_NAME_SCORE = 3.0
+    FUZZY_NAME_SCORE = 2.0
+    ORDER_SCORE = 1.0
+    MAX_FUZZY_EXPANSIONS = 3
+    
+    YOUNG_WORDS = {'joven', 'jovenes', 'menor', 'menores', 'pequeno', 'pequena'}
+    OLD_WORDS = {'mayor', 'mayores', 'viejo', 'vieja', 'viejos', 'viejas', 'anciano', 'anciana'}
+    RECENT_WORDS = {'ultima', 'ultimo', 'ultimas', 'ultimos', 'reciente', 'recientes', 'nueva', 'nuevo'}
+    OLDEST_REGISTRATION_WORDS = {'primera', 'primero', 'primeras', 'primeros', 'antigua', 'antiguo'}
+    
+    def rank(self, query_text: str, columns: PersonColumns, candidate_ids: np.ndarray, k: int) -> np.ndarray:
+        """Top-k de candidate_ids por puntaje; a igual puntaje se conserva el orden del dataset"""
+        if candidate_ids.size <= 1:
+            return candidate_ids[:k]
+        
+        scores = self.score(query_text, columns)
+        candidate_scores = scores[candidate_ids]
+        order = np.argsort(-candidate_scores, kind='stable')[:k]
+        return candidate_ids[order]
+    
+    def matches(self, query_text: str, columns: PersonColumns, candidate_ids: np.ndarray) -> np.ndarray:
+        """Candidatos con el mejor puntaje por identificador o nombre (el desempate no cuenta como coincidencia)"""
+        scores = self.score(query_text, columns)[candidate_ids]
+        if not scores.size:
+            return candidate_ids
+        threshold = max(self.FUZZY_NAME_SCORE, float(scores.max()) - self.ORDER_SCORE)
+        order = np.argsort(-scores, kind='stable')
+        return candidate_ids[order][scores[order] >= threshold]
+    
+    def score(self, query_text: str, columns: PersonColumns) -> np.ndarray:
+        """Puntaje de relevancia de cada registro del dataset para la consulta"""
+        indexes = columns.indexes
+        scores = np.zeros(len(columns), dtype=np.float32)
+        
+        identifier_hits = indexes.identifier_hits(query_text)
+        if identifier_hits:
+            scores[np.array(identifier_hits, dtype=np.int64)] += self.IDENTIFIER_SCORE
+        
+        tokens = [
+            token for token in tokenize(fold_accents(query_text))
+            if len(token) > 2 and token not in SPANISH_STOPWORDS
+        ]
+        for token in tokens:
+            exact = indexes.by_name_token.get(token)
+            if exact is not None:
+                scores[exact] += self.EXACT_NAME_SCORE
+            else:
+                for close, _ in indexes.names.expand(token)[:self.MAX_FUZZY_EXPANSIONS]:
+                    scores[indexes.by_name_token[close]] += self.FUZZY_NAME_SCORE
+        
+        token_set = set(tokens)
+        self._add_order_score(scores, columns, token_set)
+        return scores
+    
+    def _add_order_score(self, scores: np.ndarray, columns: PersonColumns, tokens: set) -> None:
+        """Desempate por edad o fecha de registro cuando la consulta pide extremos"""
+        if tokens & self.YOUNG_WORDS or tokens & self.OLD_WORDS:
+            ages = columns.edad.astype(np.float32)
+            max_age = max(float(ages.max()), 1.0)
+            if tokens & self.YOUNG_WORDS:
+                scores += np.where(columns.has_age, self.ORDER_SCORE * (1 - ages / max_age), 0)
+            else:
+                scores += np.where(columns.has_age, self.ORDER_SCORE * ages / max_age, 0)
+        
+        if tokens & self.RECENT_WORDS or tokens & self.OLDEST_REGISTRATION_WORDS:
+            timestamps = columns.registro_ts
+            present = ~np.isnan(timestamps)
+            if present.any():
+                low, high = np.nanmin(timestamps), np.nanmax(timestamps)
+                span = max(high - low, 1.0)
+                position = np.where(present, (timestamps - low) / span, 0)
+                if tokens & self.RECENT_WORDS:
+                    scores += np.where(present, self.ORDER_SCORE * position, 0).astype(np.float32)
                 else:
-                    logger.warning(f"⚠️ No se pudo parsear fecha de nacimiento: {birth_date}")
-                    birth_date = None
+                    scores += np.where(present, self.ORDER_SCORE * (1 - position), 0).astype(np.float32)
+
+# ============================================================================
+# MOTOR DE CONSULTAS ESTRUCTURADAS
+# ============================================================================
+
+MALE_VALUES = {"masculino", "hombre", "m"}
+FEMALE_VALUES = {"femenino", "mujer", "f"}
+
+@dataclass(frozen=True)
+class QueryFilter:
+    """Condición tipada sobre un campo de PersonRecord"""
+    field: str
+    op: str
+    value: Any
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """Plan de filtrado + agregación ejecutable sin LLM"""
+    aggregate: str
+    filters: Tuple[QueryFilter, ...] = ()
+    group_by: Optional[str] = None
+    terms: Tuple[str, ...] = ()
+
+class StructuredQueryEngine:
+    """Resuelve localmente conteos, promedios, extremos de edad y filtros simples"""
+    
+    NEUTRAL_WORDS = {
+        'persona', 'personas', 'gente', 'registrada', 'registradas', 'registrado', 'registrados',
+        'sistema', 'base', 'datos', 'todas', 'todos', 'edad', 'edades', 'ano', 'anos',
+        'nacida', 'nacidas', 'nacido', 'nacidos', 'nacieron', 'nacio', 'mes', 'genero', 'sexo',
+        'dame', 'dime', 'muestra', 'muestrame', 'lista', 'listado', 'nombres', 'nombre',
+        'alguien', 'alguna', 'alguno', 'algun', 'ninguna', 'ninguno', 'ningun'
+    }
+    COUNT_WORDS = {'cuantos', 'cuantas', 'cantidad', 'numero', 'total', 'cuenta'}
+    AVERAGE_WORDS = {'promedio', 'media'}
+    GENDER_WORDS = {
+        'hombre': 'M', 'hombres': 'M', 'varon': 'M', 'varones': 'M',
+        'masculino': 'M', 'masculinos': 'M', 'masculina': 'M',
+        'mujer': 'F', 'mujeres': 'F', 'femenino': 'F', 'femeninos': 'F',
+        'femenina': 'F', 'femeninas': 'F'
+    }
+    MONTHS = {
+        'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+        'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
+    }
+    MONTH_NAMES = {
+        1: 'enero', 2: 'febrero', 3: 'marzo', 4: 'abril', 5: 'mayo', 6: 'junio',
+        7: 'julio', 8: 'agosto', 9: 'septiembre', 10: 'octubre', 11: 'noviembre', 12: 'diciembre'
+    }
+    NAME_TRAILING_WORDS = {
+        'persona', 'personas', 'registrada', 'registradas', 'registrado', 'registrados',
+        'nacida', 'nacidas', 'nacido', 'nacidos', 'nacieron', 'nacio', 'sistema', 'base', 'datos'
+    }
+    # Delante de "llamado X" solo se admite preguntar si existe o cuántos hay
+    NAME_PREFIX_WORDS = {
+        'hay', 'existe', 'existen', 'quien', 'quienes', 'alguien', 'alguna', 'alguno', 'algun',
+        'ninguna', 'ninguno', 'ningun', 'persona', 'personas', 'gente', 'registrada', 'registradas',
+        'registrado', 'registrados', 'nacida', 'nacidas', 'nacido', 'nacidos', 'dame', 'dime',
+        'muestra', 'muestrame', 'lista', 'listado', 'nombres', 'todas', 'todos', 'actualmente',
+        'a', 'al', 'de', 'del', 'el', 'la', 'las', 'los', 'en', 'un', 'una', 'unos', 'unas', 'se', 'es', 'son'
+    }
+    # Tras el nombre, estas palabras abren otra cláusula ("y cuál es su correo", "que vivan en...")
+    NAME_CLAUSE_BOUNDARIES = {
+        'y', 'e', 'o', 'u', 'que', 'con', 'cual', 'cuales', 'quien', 'quienes', 'como', 'por', 'para',
+        'su', 'sus', 'le', 'les', 'me', 'mi', 'tiene', 'tienen', 'tengan', 'sean', 'fue', 'fueron'
+    }
+    MAX_NAME_TERMS = 4
+    MAX_LISTED_NAMES = 10
+    
+    def __init__(self):
+        self.known_words = (SPANISH_STOPWORDS | self.NEUTRAL_WORDS | self.COUNT_WORDS | self.AVERAGE_WORDS
+                            | set(self.GENDER_WORDS) | set(self.MONTHS))
+        self.name_trailing_words = ((SPANISH_STOPWORDS - self.NAME_CLAUSE_BOUNDARIES) | self.NAME_TRAILING_WORDS
+                                    | set(self.GENDER_WORDS) | set(self.MONTHS))
+        self.name_prefix_words = (self.NAME_PREFIX_WORDS | self.COUNT_WORDS
+                                  | set(self.GENDER_WORDS) | set(self.MONTHS))
+        self.age_patterns = [
+            (re.compile(r"\bentre (\d{1,3}) y (\d{1,3})(?: anos)?\b"), 'between'),
+            (re.compile(r"\b(\d{1,3}) anos o mas\b"), 'ge'),
+            (re.compile(r"\b(\d{1,3}) anos o menos\b"), 'le'),
+            (re.compile(r"\b(?:mas de|mayores de|mayor de|por encima de) (\d{1,3})(?: anos)?\b"), 'gt'),
+            (re.compile(r"\b(?:menos de|menores de|menor de|por debajo de) (\d{1,3})(?: anos)?\b"), 'lt'),
+            (re.compile(r"\b(?:de|con|tienen|tengan) (\d{1,3}) anos\b"), 'eq'),
+            (re.compile(r"\bmayores de edad\b"), 'adult'),
+            (re.compile(r"\bmenores de edad\b"), 'minor'),
+        ]
+        self.superlative_patterns = [
+            (re.compile(r"\b(?:mas joven(?:es)?|de menor edad|con menor edad|con menos edad|menor de todas?)\b"), 'youngest'),
+            (re.compile(r"\b(?:mas (?:viej[oa]s?|ancian[oa]s?)|de mayor edad|con mayor edad|con mas edad|mayor de todas?)\b"), 'oldest'),
+            (re.compile(r"\b(?:persona|hombre|mujer) (?:mayor)\b(?! de)"), 'oldest'),
+        ]
+        self.group_by_pattern = re.compile(r"\bpor (?:genero|sexo)\b")
+        self.name_pattern = re.compile(
+            r"\b(?:llamad[oa]s?|se llam(?:a|an|e|en)|de nombre|con (?:el )?nombre(?: de)?|nombrad[oa]s?)\b"
+        )
+    
+    def extract_filters(self, query: str) -> Tuple[Tuple[QueryFilter, ...], str]:
+        """Extrae filtros de género, edad y mes; devuelve el texto no consumido"""
+        text = fold_accents(query)
+        filters: List[QueryFilter] = []
+        
+        for pattern, op in self.age_patterns:
+            match = pattern.search(text)
+            if not match:
+                continue
+            if op == 'between':
+                low, high = sorted((int(match.group(1)), int(match.group(2))))
+                filters.append(QueryFilter('edad', 'between', (low, high)))
+            elif op == 'adult':
+                filters.append(QueryFilter('edad', 'ge', 18))
+            elif op == 'minor':
+                filters.append(QueryFilter('edad', 'lt', 18))
+            else:
+                filters.append(QueryFilter('edad', op, int(match.group(1))))
+            text = text[:match.start()] + ' ' + text[match.end():]
+        
+        genders = {self.GENDER_WORDS[token] for token in tokenize(text) if token in self.GENDER_WORDS}
+        if len(genders) == 1:
+            filters.append(QueryFilter('genero', 'eq', genders.pop()))
+        
+        months = {self.MONTHS[token] for token in tokenize(text) if token in self.MONTHS}
+        if len(months) == 1:
+            filters.append(QueryFilter('mes_nacimiento', 'eq', months.pop()))
+        
+        return tuple(filters), text
+    
+    def build_plan(self, query: str) -> Optional[QueryPlan]:
+        """Construye un plan solo si toda la consulta es comprendida; si no, None"""
+        return self.plan_from_filters(*self.extract_filters(query))
+    
+    def plan_from_filters(self, filters: Tuple[QueryFilter, ...], text: str) -> Optional[QueryPlan]:
+        """Completa el plan a partir de filtros ya extraídos y del texto que no consumieron"""
+        terms: Tuple[str, ...] = ()
+        name_match = self.name_pattern.search(text)
+        if name_match:
+            terms = self._name_terms(text, name_match)
+            if not terms:
+                return None
+            text = text[:name_match.start()]
+        
+        aggregates = set()
+        for pattern, aggregate in self.superlative_patterns:
+            match = pattern.search(text)
+            if match:
+                aggregates.add(aggregate)
+                text = text[:match.start()] + ' ' + text[match.end():]
+        
+        group_by = None
+        group_match = self.group_by_pattern.search(text)
+        if group_match:
+            group_by = 'genero'
+            text = text[:group_match.start()] + ' ' + text[group_match.end():]
+        
+        tokens = tokenize(text)
+        if any(token in self.AVERAGE_WORDS for token in tokens):
+            aggregates.add('avg_age')
+        if any(token in self.COUNT_WORDS for token in tokens):
+            aggregates.add('count')
+        
+        if any(token not in self.known_words for token in tokens):
+            return None
+        if terms:
+            if aggregates - {'count'} or group_by:
+                return None
+            return QueryPlan(aggregate='name_lookup', filters=filters, terms=terms)
+        
+        genders_mentioned = {self.GENDER_WORDS[t] for t in tokens if t in self.GENDER_WORDS}
+        months_mentioned = {t for t in tokens if t in self.MONTHS}
+        if len(months_mentioned) > 1:
+            return None
+        if len(genders_mentioned) > 1:
+            if aggregates != {'count'}:
+                return None
+            group_by = 'genero'
+        
+        if len(aggregates) > 1:
+            return None
+        if not aggregates:
+            if not filters:
+                return None
+            aggregates.add('list')
+        
+        aggregate = aggregates.pop()
+        if group_by and aggregate not in ('count', 'avg_age'):
+            return None
+        
+        return QueryPlan(aggregate=aggregate, filters=filters, group_by=group_by)
+    
+    def _name_terms(self, text: str, name_match: re.Match) -> Tuple[str, ...]:
+        """Términos del nombre tras "llamado"/"se llama"; vacío si la consulta pide algo más que
+        existencia o conteo, o si tras el nombre sigue algo que no es un filtro ya extraído"""
+        if any(token not in self.name_prefix_words for token in tokenize(text[:name_match.start()])):
+            return ()
+        
+        terms: List[str] = []
+        name_open = True
+        for token in re.findall(r"\w+|[^\w\s]", text[name_match.end():]):
+            if not token.isalpha():
+                name_open = False
+            elif name_open and token not in self.known_words:
+                terms.append(token)
+            elif token in self.name_trailing_words:
+                name_open = False
+            else:
+                return ()
+        if len(terms) > self.MAX_NAME_TERMS:
+            return ()
+        return tuple(terms)
+    
+    def execute(self, plan: QueryPlan, columns: 'PersonColumns') -> str:
+        """Ejecuta el plan intersectando índices y agregando sobre las columnas"""
+        if plan.aggregate == 'name_lookup':
+            return self._answer_name_lookup(plan, columns)
+        if columns.aggregates is not None:
+            answer = self._answer_from_aggregates(plan, columns.aggregates)
+            if answer is not None:
+                return answer
+        
+        ids = columns.indexes.lookup(plan.filters)
+        
+        if plan.aggregate == 'count':
+            if plan.group_by == 'genero':
+                return self._answer_count_by_gender(plan, columns, ids)
+            return self._answer_count(plan, int(ids.size))
+        if plan.aggregate == 'avg_age':
+            return self._answer_average_age(plan, columns, ids)
+        if plan.aggregate in ('youngest', 'oldest'):
+            return self._answer_extreme_age(plan, columns, ids)
+        return self._answer_list(plan, columns, ids)
+    
+    def _answer_from_aggregates(self, plan: QueryPlan, snapshot: 'AggregateSnapshot') -> Optional[str]:
+        """Conteos y promedios sin filtros (o solo por género) se leen del snapshot en O(1)"""
+        if any(query_filter.field != 'genero' for query_filter in plan.filters):
+            return None
+        
+        gender = self._gender(plan)
+        code = {'M': PersonColumns.MALE, 'F': PersonColumns.FEMALE}.get(gender)
+        
+        if plan.aggregate == 'count':
+            if plan.group_by == 'genero':
+                men = int(snapshot.gender_counts[PersonColumns.MALE])
+                women = int(snapshot.gender_counts[PersonColumns.FEMALE])
+                return f"Hay {men} hombres y {women} mujeres {self._registered(plan, True)}{self._qualifiers(plan)}"
+            total = snapshot.total if code is None else int(snapshot.gender_counts[code])
+            return self._answer_count(plan, total)
+        
+        if plan.aggregate == 'avg_age':
+            if plan.group_by == 'genero':
+                parts = []
+                for gender_code, label in ((PersonColumns.MALE, 'hombres'), (PersonColumns.FEMALE, 'mujeres')):
+                    mean_age = snapshot.mean_age(gender_code)
+                    if mean_age is not None:
+                        parts.append(f"{label} {round(mean_age, 1)} años")
+                if not parts:
+                    return "No hay información suficiente para responder esta pregunta"
+                return f"El promedio de edad por género es: {', '.join(parts)}"
             
-                if birth_date and isinstance(birth_date, datetime):
-                    record.edad = self._calculate_exact_age(birth_date, current_date)
-                    record.mes_nacimiento = birth_date.month
-                    record.mes_nacimiento_nombre = self.month_names.get(birth_date.month, f"mes_{birth_date.month}")
-                    record.año_nacimiento = birth_date.year
-                    
-                    logger.info(f"🔍 DEBUG - Persona: {record.nombre_completo}, Edad: {record.edad}, Mes: {record.mes_nacimiento}")
+            mean_age = snapshot.mean_age(code)
+            if mean_age is None:
+                return "No hay información suficiente para responder esta pregunta"
+            article = 'los' if gender == 'M' else 'las'
+            return f"El promedio de edad de {article} {self._describe(plan, plural=True)} es {round(mean_age, 1)} años"
+        
+        return None
+    
+    def _answer_count(self, plan: QueryPlan, total: int) -> str:
+        if not total:
+            return f"No hay {self._describe(plan, plural=True)} {self._registered(plan, True)}"
+        plural = total != 1
+        return f"Hay {total} {self._describe(plan, plural=plural)} {self._registered(plan, plural)}"
+    
+    def _answer_count_by_gender(self, plan: QueryPlan, columns: 'PersonColumns', ids: np.ndarray) -> str:
+        counts = np.bincount(columns.genero_code[ids], minlength=3)
+        men, women = int(counts[PersonColumns.MALE]), int(counts[PersonColumns.FEMALE])
+        return f"Hay {men} hombres y {women} mujeres {self._registered(plan, True)}{self._qualifiers(plan)}"
+    
+    def _answer_average_age(self, plan: QueryPlan, columns: 'PersonColumns', ids: np.ndarray) -> str:
+        with_age = ids[columns.has_age[ids]]
+        if plan.group_by == 'genero':
+            parts = []
+            for code, label in ((PersonColumns.MALE, 'hombres'), (PersonColumns.FEMALE, 'mujeres')):
+                ages = columns.edad[with_age[columns.genero_code[with_age] == code]]
+                if ages.size:
+                    parts.append(f"{label} {round(float(ages.mean()), 1)} años")
+            if not parts:
+                return "No hay información suficiente para responder esta pregunta"
+            return f"El promedio de edad por género es: {', '.join(parts)}"
+        
+        ages = columns.edad[with_age]
+        if not ages.size:
+            return "No hay información suficiente para responder esta pregunta"
+        article = 'los' if self._gender(plan) == 'M' else 'las'
+        return f"El promedio de edad de {article} {self._describe(plan, plural=True)} es {round(float(ages.mean()), 1)} años"
+    
+    def _answer_extreme_age(self, plan: QueryPlan, columns: 'PersonColumns', ids: np.ndarray) -> str:
+        with_age = ids[columns.has_age[ids]]
+        if not with_age.size:
+            return "No hay información suficiente para responder esta pregunta"
+        
+        if plan.filters:
+            ages = columns.edad[with_age]
+            target_age = int(ages.min() if plan.aggregate == 'youngest' else ages.max())
+            tied = with_age[ages == target_age]
+        else:
+            target_age, tied = columns.indexes.age_extreme(youngest=plan.aggregate == 'youngest')
+        
+        names = columns.names_at(tied[:self.MAX_LISTED_NAMES])
+        subject = self._describe(plan, plural=False)
+        adjective = 'más joven' if plan.aggregate == 'youngest' else 'mayor'
+        article = 'El' if self._gender(plan) == 'M' else 'La'
+        
+        if tied.size == 1:
+            return f"{article} {subject} {adjective} es {names[0]} con {target_age} años"
+        extreme = 'menor' if plan.aggregate == 'youngest' else 'mayor'
+        return f"{tied.size} personas comparten la {extreme} edad ({target_age} años): {self._join_names(names, tied.size)}"
+    
+    def _answer_list(self, plan: QueryPlan, columns: 'PersonColumns', ids: np.ndarray) -> str:
+        if not ids.size:
+            return f"No hay {self._describe(plan, plural=True)} {self._registered(plan, True)}"
+        plural = ids.size != 1
+        names = columns.names_at(ids[:self.MAX_LISTED_NAMES])
+        return f"Hay {ids.size} {self._describe(plan, plural=plural)}: {self._join_names(names, ids.size)}"
+    
+    def _answer_name_lookup(self, plan: QueryPlan, columns: 'PersonColumns') -> str:
+        """Lista exacta de coincidencias del índice de nombres; si no hay, los nombres más parecidos"""
+        candidate_ids = columns.indexes.lookup(plan.filters) if plan.filters else None
+        matches = columns.indexes.names.search(plan.terms, candidate_ids, limit=self.MAX_LISTED_NAMES)
+        name = ' '.join(plan.terms).title()
+        suffix = 'o' if self._gender(plan) == 'M' else 'a'
+        
+        if matches.exact.size:
+            plural = matches.exact.size != 1
+            names = columns.names_at(matches.exact[:self.MAX_LISTED_NAMES])
+            return (f"Sí, hay {matches.exact.size} {self._describe(plan, plural=plural)} "
+                    f"llamad{suffix}{'s' if plural else ''} {name}: {self._join_names(names, matches.exact.size)}")
+        
+        answer = (f"No hay {'ningún' if suffix == 'o' else 'ninguna'} {self._describe(plan, plural=False)} "
+                  f"{self._registered(plan, False)} con el nombre {name}")
+        if matches.approximate.size:
+            answer += f"; nombres parecidos: {', '.join(columns.names_at(matches.approximate))}"
+        return answer
+    
+    def _join_names(self, names: List[str], total: int) -> str:
+        text = ', '.join(names[:self.MAX_LISTED_NAMES])
+        if total > min(len(names), self.MAX_LISTED_NAMES):
+            text += f" y {total - min(len(names), self.MAX_LISTED_NAMES)} más"
+        return text
+    
+    def _gender(self, plan: QueryPlan) -> Optional[str]:
+        for query_filter in plan.filters:
+            if query_filter.field == 'genero':
+                return query_filter.value
+        return None
+    
+    def _registered(self, plan: QueryPlan, plural: bool) -> str:
+        suffix = 'os' if self._gender(plan) == 'M' else 'as'
+        return f"registrad{suffix if plural else suffix[0]}"
+    
+    def _describe(self, plan: QueryPlan, plural: bool) -> str:
+        """Sujeto + calificadores legibles del plan ("mujeres nacidas en abril")"""
+        gender = self._gender(plan)
+        if gender == 'M':
+            noun = 'hombres' if plural else 'hombre'
+        elif gender == 'F':
+            noun = 'mujeres' if plural else 'mujer'
+        else:
+            noun = 'personas' if plural else 'persona'
+        return noun + self._qualifiers(plan, plural)
+    
+    def _qualifiers(self, plan: QueryPlan, plural: bool = True) -> str:
+        gender_suffix = 'o' if self._gender(plan) == 'M' else 'a'
+        parts = []
+        for query_filter in plan.filters:
+            op, value = query_filter.op, query_filter.value
+            if query_filter.field == 'mes_nacimiento':
+                parts.append(f"nacid{gender_suffix}{'s' if plural else ''} en {self.MONTH_NAMES[value]}")
+            elif query_filter.field == 'edad':
+                if op == 'between':
+                    parts.append(f"entre {value[0]} y {value[1]} años")
+                elif op == 'gt':
+                    parts.append(f"con más de {value} años")
+                elif op == 'ge':
+                    parts.append(f"con {value} años o más")
+                elif op == 'lt':
+                    parts.append(f"con menos de {value} años")
+                elif op == 'le':
+                    parts.append(f"con {value} años o menos")
                 else:
-                    logger.warning(f"⚠️ Fecha de nacimiento inválida para {record.nombre_completo}: {raw_data.get('fechaNacimiento')}")
-                    
+                    parts.append(f"con {value} años")
+        return (' ' + ', '.join(parts)) if parts else ''
+
+# ============================================================================
+# RESPUESTA LOCAL DE RESPALDO
+# ============================================================================
+
+class LocalFallbackEngine:
+    """Respuesta determinista sin LLM para cuando el circuito hacia Groq está abierto"""
+    
+    MAX_DETAILED = 5
+    
+    def __init__(self, query_engine: StructuredQueryEngine, retriever: RelevanceRetriever):
+        self.query_engine = query_engine
+        self.retriever = retriever
+    
+    def answer(self, user_query: str, columns: PersonColumns) -> Tuple[str, str]:
+        """Devuelve (respuesta, estrategia): coincidencias por nombre/identificador, conteo filtrado o resumen"""
+        filters, remaining_text = self.query_engine.extract_filters(user_query)
+        plan = QueryPlan('count', filters)
+        candidate_ids = columns.indexes.lookup(filters)
+        
+        matched = self.retriever.matches(remaining_text, columns, candidate_ids)
+        if matched.size:
+            details = '; '.join(self._describe_record(record) for record in columns.records_at(matched[:self.MAX_DETAILED]))
+            noun = 'registro coincide' if matched.size == 1 else 'registros coinciden'
+            extra = f" (se muestran {self.MAX_DETAILED})" if matched.size > self.MAX_DETAILED else ''
+            return f"{matched.size} {noun} con la consulta{extra}: {details}", "record_match"
+        
+        if filters:
+            return self.query_engine._answer_count(plan, int(candidate_ids.size)), "filtered_count"
+        
+        statistics = columns.aggregates.as_statistics() if columns.aggregates is not None else columns.statistics()
+        conteos = statistics["conteos_generales"]
+        answer = (f"Hay {conteos['total_personas']} personas registradas "
+                  f"({conteos['total_hombres']} hombres y {conteos['total_mujeres']} mujeres)")
+        if statistics["estadisticas_edad"]:
+            answer += f", con un promedio de edad de {statistics['estadisticas_edad']['promedio_edad']} años"
+        return answer, "dataset_summary"
+    
+    def _describe_record(self, record: PersonRecord) -> str:
+        details = []
+        if record.edad is not None and record.edad >= 0:
+            details.append(f"{record.edad} años")
+        if record.documento:
+            details.append(f"documento {record.documento}")
+        if record.correo and "@" in record.correo:
+            details.append(f"correo {record.correo}")
+        if record.celular and record.celular.strip():
+            details.append(f"celular {record.celular.strip()}")
+        return f"{record.nombre_completo} ({', '.join(details)})" if details else record.nombre_completo
+
+# ============================================================================
+# CONSTRUCCIÓN DE PROMPTS CON PRESUPUESTO DE TOKENS
+# ============================================================================
+
+class CompactContextEncoder:
+    """Codifica estadísticas y registros en tablas compactas dentro de un presupuesto de tokens"""
+    
+    COLUMNS = [
+        ('n', 'nombre completo'),
+        ('e', 'edad en años'),
+        ('g', 'género'),
+        ('doc', 'documento'),
+        ('c', 'correo'),
+        ('t', 'celular'),
+        ('mn', 'mes de nacimiento 1-12'),
+        ('an', 'año de nacimiento'),
+        ('fr', 'fecha de registro')
+    ]
+    INSTRUCTIONS = """INSTRUCCIONES:
+- Conteos, promedios y meses: usa ESTADÍSTICAS.
+- Más joven/mayor y filtros por edad: compara la columna e de REGISTROS.
+- Nombres, documentos, correos y teléfonos: busca en REGISTROS.
+- Primera/última persona registrada: usa la línea registro."""
+    RESPONSE_SUFFIX = f"\n\n{INSTRUCTIONS}\n\nRESPUESTA:"
+    PACKED_ANSWER = re.compile(r'^[ \t]*\[(\d+)\][ \t]*(.+?)[ \t]*$', re.MULTILINE)
+    
+    def __init__(self, system_prompt: str, token_budget: int = 1500, max_records: int = 50):
+        self.system_tokens = estimate_tokens(system_prompt)
+        self.token_budget = token_budget
+        self.max_records = max_records
+    
+    def encode_statistics(self, statistics: Dict[str, Any]) -> str:
+        lines = []
+        conteos = statistics.get("conteos_generales", {})
+        if conteos:
+            lines.append("conteos: " + ' '.join(f"{key}={value}" for key, value in conteos.items()))
+        if statistics.get("estadisticas_edad"):
+            lines.append("edad: " + ' '.join(f"{key}={value}" for key, value in statistics["estadisticas_edad"].items()))
+        if statistics.get("distribucion_meses_nacimiento"):
+            lines.append("meses: " + ' '.join(f"{key}={value}" for key, value in statistics["distribucion_meses_nacimiento"].items()))
+        registro = statistics.get("informacion_registro", {})
+        if registro:
+            lines.append("registro: " + '; '.join(
+                f"{key.split('_')[0]}={value['nombre']} ({value['fecha']})" for key, value in registro.items()
+            ))
+        if statistics.get("porcentajes_genero") and conteos.get("total_personas"):
+            lines.append("porcentajes: " + ' '.join(f"{key}={value}" for key, value in statistics["porcentajes_genero"].items()))
+        return '\n'.join(lines)
+    
+    def encode_row(self, record: 'PersonRecord') -> List[str]:
+        return [
+            record.nombre_completo,
+            str(record.edad) if record.edad is not None and record.edad >= 0 else '',
+            record.genero or '',
+            str(record.documento or ''),
+            record.correo if record.correo and "@" in record.correo else '',
+            record.celular.strip() if record.celular and record.celular.strip() else '',
+            str(record.mes_nacimiento) if record.mes_nacimiento else '',
+            str(record.año_nacimiento) if record.año_nacimiento else '',
+            record.fecha_registro.strftime("%Y-%m-%d") if record.fecha_registro else ''
+        ]
+    
+    def encode_table(self, rows: List[List[str]]) -> Tuple[str, str]:
+        """Tabla separada por '|' sin las columnas vacías en todas las filas; devuelve (leyenda, tabla)"""
+        used = [i for i in range(len(self.COLUMNS)) if any(row[i] for row in rows)]
+        legend = ', '.join(f"{self.COLUMNS[i][0]}={self.COLUMNS[i][1]}" for i in used)
+        header = '|'.join(self.COLUMNS[i][0] for i in used)
+        body = '\n'.join('|'.join(row[i].replace('|', '/') for i in used) for row in rows)
+        return legend, f"{header}\n{body}" if rows else header
+    
+    def build(self, user_query: str, records: list, statistics: Dict[str, Any],
+              total_records: int) -> Tuple[str, Dict[str, Any]]:
+        """Elige cuántos registros (ya ordenados por relevancia) caben en el presupuesto y arma el prompt"""
+        rows = [self.encode_row(record) for record in records[:self.max_records]]
+        
+        count = len(rows)
+        prompt = self._render(user_query, rows, total_records, statistics)
+        prompt_tokens = self.system_tokens + estimate_tokens(prompt)
+        
+        if prompt_tokens > self.token_budget and count:
+            row_tokens = [estimate_tokens('|'.join(row)) + 1 for row in rows]
+            excess = prompt_tokens - self.token_budget
+            while count and excess > 0:
+                count -= 1
+                excess -= row_tokens[count]
+            prompt = self._render(user_query, rows[:count], total_records, statistics)
+            prompt_tokens = self.system_tokens + estimate_tokens(prompt)
+            # Las estimaciones por fila redondean distinto que la del prompt completo: se ajusta fila a fila
+            while count and prompt_tokens > self.token_budget:
+                count -= 1
+                prompt = self._render(user_query, rows[:count], total_records, statistics)
+                prompt_tokens = self.system_tokens + estimate_tokens(prompt)
+        
+        return prompt, {
+            "prompt_tokens_estimate": prompt_tokens,
+            "prompt_token_budget": self.token_budget,
+            "records_in_prompt": count,
+            "records_available": total_records
+        }
+    
+    def context_of(self, prompt: str) -> str:
+        """Bloque de datos de un prompt individual, sin instrucciones finales"""
+        return prompt[:-len(self.RESPONSE_SUFFIX)] if prompt.endswith(self.RESPONSE_SUFFIX) else prompt
+    
+    def pack(self, contexts: List[str]) -> str:
+        """Agrupa varias consultas independientes en un solo prompt con respuestas numeradas"""
+        blocks = '\n\n'.join(f"### CONSULTA {number}\n{context}" for number, context in enumerate(contexts, 1))
+        return f"""Responde por separado cada una de las {len(contexts)} consultas usando SOLO los datos de su bloque.
+
+{blocks}
+
+{self.INSTRUCTIONS}
+- Formato: una línea por consulta, "[número] respuesta", sin texto adicional.
+
+RESPUESTAS:"""
+    
+    def unpack(self, text: str, count: int) -> List[Optional[str]]:
+        """Separa las respuestas numeradas; None para las que el modelo no devolvió"""
+        answers: List[Optional[str]] = [None] * count
+        for match in self.PACKED_ANSWER.finditer(text or ''):
+            number = int(match.group(1))
+            if 1 <= number <= count and answers[number - 1] is None and match.group(2).strip():
+                answers[number - 1] = match.group(2).strip()
+        return answers
+    
+    def _render_context(self, user_query: str, rows: List[List[str]], total_records: int,
+                        statistics: Dict[str, Any]) -> str:
+        legend, table = self.encode_table(rows)
+        return f"""PREGUNTA: {user_query}
+
+ESTADÍSTICAS:
+{self.encode_statistics(statistics)}
+
+REGISTROS ({len(rows)} de {total_records}; {legend}; vacío = sin dato):
+{table}"""
+    
+    def _render(self, user_query: str, rows: List[List[str]], total_records: int, statistics: Dict[str, Any]) -> str:
+        return self._render_context(user_query, rows, total_records, statistics) + self.RESPONSE_SUFFIX
+
+# ============================================================================
+# CACHE DE RESPUESTAS
+# ============================================================================
+
+class ResponseCache:
+    """Cache LRU+TTL de respuestas del LLM por consulta normalizada y versión del dataset.
+    
+    El nivel local es un OrderedDict en memoria; el compartido (si el backend lo es) se lee y escribe
+    en un hilo y, si falla o está ocupado, la consulta sigue como si no hubiera entrada."""
+    
+    def __init__(self, max_entries: int = 512, ttl: timedelta = timedelta(minutes=10),
+                 backend: Optional[StateBackend] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend if backend is not None and backend.shared else None
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self.entries: "OrderedDict[str, Tuple[datetime, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def build_key(self, query: str, dataset_version: Optional[str]) -> str:
+        return f"{dataset_version or 'sin-version'}:{normalize_query(query)}"
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None and datetime.now() - entry[0] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        
+        if entry is not None:
+            del self.entries[key]
+        
+        if self.backend is not None:
+            try:
+                payload = await asyncio.to_thread(self.backend.get, f"response:{key}")
             except Exception as e:
-                logger.warning(f"⚠️ Error procesando fecha de nacimiento para {record.nombre_completo}: {e}")
+                self.shared_errors += 1
+                logger.warning(f"⚠️ Cache compartida no disponible (lectura): {e}")
+                payload = None
+            if payload is not None:
+                response = json.loads(payload)
+                self._store(key, response)
+                self.hits += 1
+                self.shared_hits += 1
+                return response
         
-        created_at = raw_data.get('createdAt')
-        if created_at:
+        self.misses += 1
+        return None
+    
+    async def put(self, key: str, response: Dict[str, Any]) -> None:
+        self._store(key, response)
+        if self.backend is not None:
+            payload = json.dumps(response, ensure_ascii=False, default=str).encode()
             try:
-                if hasattr(created_at, 'todate'):
-                    record.fecha_registro = created_at.todate()
-                elif isinstance(created_at, str):
-                    record.fecha_registro = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+                await asyncio.to_thread(self.backend.set, f"response:{key}", payload, self.ttl.total_seconds())
             except Exception as e:
-                logger.warning(f"⚠️ Error procesando fecha de registro para {record.nombre_completo}: {e}")
-
-    def _enrich_demographic_data(self, record: PersonRecord) -> None:
-        """Enriquece con datos demográficos"""
-        if record.edad is not None:
-            record.es_mayor_edad = record.edad >= 18
-            record.rango_edad = self._categorize_age(record.edad)
-    
-    def _calculate_exact_age(self, birth_date: datetime, current_date: datetime) -> int:
-        """Calcula edad exacta considerando mes y día"""
-        age = current_date.year - birth_date.year
-        
-        if (current_date.month < birth_date.month or 
-            (current_date.month == birth_date.month and current_date.day < birth_date.day)):
-            age -= 1
-        
-        return max(0, age)
-    
-    def _categorize_age(self, age: int) -> str:
-        """Categoriza edad en rangos académicos"""
-        for min_age, max_age, category in self.age_ranges:
-            if min_age <= age <= max_age:
-                return category
-        return "Edad no categorizada"
-    
-    def _build_full_name(self, raw_data: Dict) -> str:
-        """Construye nombre completo normalizado"""
-        parts = [
-            raw_data.get('primerNombre', ''),
-            raw_data.get('segundoNombre', ''),
-            raw_data.get('apellidos', '')
-        ]
+                self.shared_errors += 1
+                logger.warning(f"⚠️ Cache compartida no disponible (escritura): {e}")
+    
+    def _store(self, key: str, response: Dict[str, Any]) -> None:
+        self.entries[key] = (datetime.now(), response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl.total_seconds(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "shared_errors": self.shared_errors,
+            "hit_rate": self.hit_rate
+        }
+
+# ============================================================================
+# ENRUTAMIENTO DE MODELOS
+# ============================================================================
+
+class InvalidLLMAnswer(Exception):
+    """La respuesta del LLM no pasó la validación, tampoco en el reintento: no se sirve ni se cachea"""
+
+@dataclass
+class ModelRoute:
+    """Modelo y tope de tokens de salida elegidos para una consulta"""
+    query_class: str
+    model: str
+    max_tokens: int
+    learned: bool = False
+
+class ModelRouter:
+    """Clase de consulta -> modelo y max_tokens, con presupuesto aprendido y respaldo a un modelo mayor"""
+    
+    DEFAULT_MAX_TOKENS = {
+        'count': 80,
+        'filter': 150,
+        'lookup': 150,
+        'multi_filter': 200,
+        'statistical': 200
+    }
+    OFF_POLICY_PHRASES = ('puedes preguntar', 'puede preguntar', 'metodologia', 'como modelo de lenguaje')
+    
+    def __init__(self, default_model: str, fallback_model: str = "", routes: Optional[Dict[str, Any]] = None,
+                 fallback_max_tokens: int = 400, percentile: float = 95.0, headroom: float = 1.25,
+                 min_samples: int = 20, window: int = 500, min_tokens: int = 32):
+        self.routes: Dict[str, Tuple[str, int]] = {
+            query_class: (default_model, max_tokens) for query_class, max_tokens in self.DEFAULT_MAX_TOKENS.items()
+        }
+        for query_class, route in (routes or {}).items():
+            if query_class not in self.routes:
+                logger.warning(f"⚠️ Ruta de modelo para clase desconocida ignorada: {query_class}")
+                continue
+            model, max_tokens = self.routes[query_class]
+            self.routes[query_class] = (route.get("model", model), int(route.get("max_tokens", max_tokens)))
+        self.fallback_model = fallback_model
+        self.fallback_max_tokens = fallback_max_tokens
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.min_tokens = min_tokens
+        self.samples: Dict[str, deque] = {query_class: deque(maxlen=window) for query_class in self.routes}
+        self.counters: Dict[str, Dict[str, int]] = {
+            query_class: {"requests": 0, "validation_failures": 0, "fallbacks": 0, "recovered": 0}
+            for query_class in self.routes
+        }
+        self.failure_reasons: Dict[str, int] = {}
+    
+    @staticmethod
+    def classify(analysis: Mapping[str, Any]) -> str:
+        patterns = analysis.get('detected_patterns', ())
+        if analysis.get('is_statistical_query'):
+            return 'statistical'
+        if analysis.get('requires_multiple_filters'):
+            return 'multi_filter'
+        if 'simple_count' in patterns:
+            return 'count'
+        if any(pattern_type in patterns for pattern_type in AcademicQueryAnalyzer.FILTER_PATTERNS):
+            return 'filter'
+        return 'lookup'
+    
+    def route(self, analysis: Mapping[str, Any]) -> ModelRoute:
+        query_class = self.classify(analysis)
+        model, ceiling = self.routes[query_class]
+        self.counters[query_class]["requests"] += 1
+        learned = self.learned_budget(query_class)
+        if learned is None:
+            return ModelRoute(query_class, model, ceiling)
+        return ModelRoute(query_class, model, min(ceiling, learned), learned=True)
+    
+    def learned_budget(self, query_class: str) -> Optional[int]:
+        """Percentil de las salidas observadas con margen; None hasta tener muestras suficientes"""
+        samples = self.samples[query_class]
+        if len(samples) < self.min_samples:
+            return None
+        observed = float(np.percentile(np.fromiter(samples, dtype=np.int32, count=len(samples)), self.percentile))
+        return max(self.min_tokens, int(math.ceil(observed * self.headroom)))
+    
+    def validate(self, text: Optional[str], finish_reason: Optional[str] = None) -> Optional[str]:
+        """Motivo por el que la respuesta no es aceptable, o None si pasa"""
+        if not text or not text.strip():
+            return 'empty'
+        if finish_reason == 'length':
+            return 'truncated'
+        folded = fold_accents(text)
+        if any(phrase in folded for phrase in self.OFF_POLICY_PHRASES):
+            return 'off_policy'
+        return None
+    
+    def can_fall_back(self, model: str) -> bool:
+        return bool(self.fallback_model) and self.fallback_model != model
+    
+    def retry_route(self, model: str, max_tokens: int, failure: str) -> Optional[Tuple[str, int]]:
+        """Segundo intento tras una validación fallida; None si no hay con qué reintentar.
         
-        clean_parts = [part.strip() for part in parts if part and part.strip()]
-        return ' '.join(clean_parts)
+        Una respuesta truncada solo necesitaba más espacio: mismo modelo con más max_tokens."""
+        if failure == 'truncated':
+            return model, max(self.fallback_max_tokens, max_tokens * 2)
+        if self.can_fall_back(model):
+            return self.fallback_model, self.fallback_max_tokens
+        return None
+    
+    def observe(self, query_class: str, output_tokens: int) -> None:
+        """Longitud de una respuesta aceptada"""
+        self.samples[query_class].append(max(1, output_tokens))
+    
+    def record_failure(self, query_class: str, reason: str, fell_back: bool, recovered: bool) -> None:
+        counters = self.counters[query_class]
+        counters["validation_failures"] += 1
+        self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+        if fell_back:
+            counters["fallbacks"] += 1
+        if recovered:
+            counters["recovered"] += 1
+    
+    @property
+    def fallbacks(self) -> int:
+        return sum(counters["fallbacks"] for counters in self.counters.values())
+    
+    def stats(self) -> Dict[str, Any]:
+        classes = {}
+        for query_class, (model, ceiling) in self.routes.items():
+            samples = self.samples[query_class]
+            observed = np.fromiter(samples, dtype=np.int32, count=len(samples))
+            classes[query_class] = {
+                "model": model,
+                "max_tokens": ceiling,
+                "learned_max_tokens": self.learned_budget(query_class),
+                "samples": len(samples),
+                "output_tokens_p50": round(float(np.percentile(observed, 50)), 1) if observed.size else None,
+                "output_tokens_p95": round(float(np.percentile(observed, 95)), 1) if observed.size else None,
+                **self.counters[query_class]
+            }
+        return {
+            "fallback_model": self.fallback_model or None,
+            "fallback_max_tokens": self.fallback_max_tokens,
+            "budget_percentile": self.percentile,
+            "budget_headroom": self.headroom,
+            "min_samples": self.min_samples,
+            "failure_reasons": dict(self.failure_reasons),
+            "classes": classes
+        }
 
 # ============================================================================
 # PROCESADOR RAG ACADÉMICO
 # ============================================================================
 
 class AcademicQueryAnalyzer:
-    """Analizador de consultas académicas con clasificación automática"""
+    """Analizador de consultas académicas compilado: tildes plegadas, tokens por palabra y una sola pasada"""
+    
+    PATTERN_KEYWORDS = {
+        'simple_count': ['cuántas', 'cuántos', 'total', 'cantidad', 'número'],
+        'gender_filter': list(StructuredQueryEngine.GENDER_WORDS) + ['género', 'sexo'],
+        'age_filter': ['años', 'edad', 'edades', 'mayor', 'mayores', 'menor', 'menores',
+                       'joven', 'jóvenes', 'adulto', 'adultos', 'adulta', 'adultas',
+                       'viejo', 'viejos', 'vieja', 'viejas', 'mayores de edad', 'menores de edad'],
+        'temporal_filter': list(StructuredQueryEngine.MONTHS) + [
+            'mes', 'meses', 'nacido', 'nacidos', 'nacida', 'nacidas', 'nacieron', 'nació', 'cumpleaños'],
+        'statistical': ['promedio', 'media', 'distribución', 'estadística', 'estadísticas',
+                        'porcentaje', 'proporción', 'desviación estándar'],
+    }
+    FILTER_PATTERNS = ('gender_filter', 'age_filter', 'temporal_filter')
     
     def __init__(self):
-        self.query_patterns = {
-            'simple_count': ['cuántas', 'cuántos', 'total', 'cantidad'],
-            'gender_filter': ['hombre', 'mujer', 'masculino', 'femenino', 'género'],
-            'age_filter': ['años', 'edad', 'mayor', 'menor', 'joven', 'adulto'],
-            'temporal_filter': ['abril', 'mayo', 'enero', 'mes', 'nacido', 'nacieron'],
-            'statistical': ['promedio', 'media', 'distribución', 'estadística'],
-            'complex_combination': ['y', 'con', 'que sean', 'de más de', 'menores de']
-        }
+        self.automaton: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        for pattern_type, keywords in self.PATTERN_KEYWORDS.items():
+            for keyword in keywords:
+                key = tuple(tokenize(fold_accents(keyword)))
+                self.automaton[key] = self.automaton.get(key, ()) + (pattern_type,)
+        self.max_phrase = max(len(key) for key in self.automaton)
+        self.order = {pattern_type: position for position, pattern_type in enumerate(self.PATTERN_KEYWORDS)}
     
     def analyze_complexity(self, query: str) -> Dict[str, Any]:
-        query_lower = query.lower()
+        return self.analyze_tokens(tokenize(fold_accents(query)))
+    
+    def analyze_tokens(self, tokens: Sequence[str]) -> Dict[str, Any]:
+        """Recorre los tokens una vez probando frases de hasta max_phrase palabras contra el autómata"""
+        detected = set()
+        numbers: List[int] = []
+        months: List[int] = []
+        genders: List[str] = []
         
-        detected_patterns = []
-        for pattern_type, keywords in self.query_patterns.items():
-            if any(keyword in query_lower for keyword in keywords):
-                detected_patterns.append(pattern_type)
+        for position, token in enumerate(tokens):
+            if token.isdigit():
+                numbers.append(int(token))
+            elif token in StructuredQueryEngine.MONTHS:
+                months.append(StructuredQueryEngine.MONTHS[token])
+            elif token in StructuredQueryEngine.GENDER_WORDS:
+                genders.append(StructuredQueryEngine.GENDER_WORDS[token])
+            for length in range(1, min(self.max_phrase, len(tokens) - position) + 1):
+                classes = self.automaton.get(tuple(tokens[position:position + length]))
+                if classes:
+                    detected.update(classes)
         
-        complexity_score = len(detected_patterns)
+        # Solo hay combinación real cuando la consulta filtra por más de una dimensión
+        # ("y"/"con" aparecen en casi cualquier frase y no indican nada por sí solos)
+        if sum(1 for pattern_type in self.FILTER_PATTERNS if pattern_type in detected) > 1:
+            detected.add('complex_combination')
+        detected_patterns = sorted(detected, key=lambda pattern_type: self.order.get(pattern_type, len(self.order)))
         
         return {
-            'complexity_level': self._get_complexity_level(complexity_score),
+            'complexity_level': self._get_complexity_level(len(detected_patterns)),
             'detected_patterns': detected_patterns,
-            'requires_multiple_filters': 'complex_combination' in detected_patterns,
-            'is_statistical_query': 'statistical' in detected_patterns
+            'requires_multiple_filters': 'complex_combination' in detected,
+            'is_statistical_query': 'statistical' in detected,
+            'parameters': {
+                'numbers': numbers,
+                'months': sorted(set(months)),
+                'genders': sorted(set(genders))
+            }
         }
     
     def _get_complexity_level(self, score: int) -> str:
@@ -483,247 +4448,925 @@ class AcademicQueryAnalyzer:
         else:
             return "complex"
 
+@dataclass(frozen=True)
+class CompiledQuery:
+    """Resultado memoizable de comprender una consulta: análisis, filtros y plan estructurado.
+    
+    Se comparte entre peticiones con la misma forma canónica, así que el análisis es de solo
+    lectura; query es el texto original de esta petición (con '@', '.', etc.) para la recuperación.
+    """
+    canonical: str
+    analysis: Mapping[str, Any]
+    filters: Tuple[QueryFilter, ...]
+    remaining_text: str
+    plan: Optional[QueryPlan]
+    query: str = ""
+
+class QueryPlanCache:
+    """Pipeline de comprensión de consultas con LRU por consulta canónica: las repetidas no se reanalizan"""
+    
+    def __init__(self, analyzer: AcademicQueryAnalyzer, query_engine: StructuredQueryEngine, max_entries: int = 2048):
+        self.analyzer = analyzer
+        self.query_engine = query_engine
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, CompiledQuery]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def canonical_form(query: str) -> Tuple[str, List[str]]:
+        """Tokens plegados conservando stopwords ("de", "o", "por" cambian el operador del filtro)"""
+        tokens = tokenize(fold_accents(query))
+        return ' '.join(tokens), tokens
+    
+    def compile(self, query: str) -> CompiledQuery:
+        canonical, tokens = self.canonical_form(query)
+        compiled = self.entries.get(canonical)
+        if compiled is not None:
+            self.entries.move_to_end(canonical)
+            self.hits += 1
+            return compiled if compiled.query == query else replace(compiled, query=query)
+        
+        self.misses += 1
+        filters, remaining_text = self.query_engine.extract_filters(canonical)
+        compiled = CompiledQuery(
+            canonical=canonical,
+            analysis=self._frozen(self.analyzer.analyze_tokens(tokens)),
+            filters=filters,
+            remaining_text=remaining_text,
+            plan=self.query_engine.plan_from_filters(filters, remaining_text),
+            query=query
+        )
+        if self.max_entries > 0:
+            self.entries[canonical] = compiled
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return compiled
+    
+    @classmethod
+    def _frozen(cls, value: Any) -> Any:
+        """Copia de solo lectura: dicts como MappingProxyType y listas como tuplas"""
+        if isinstance(value, dict):
+            return MappingProxyType({key: cls._frozen(item) for key, item in value.items()})
+        if isinstance(value, list):
+            return tuple(cls._frozen(item) for item in value)
+        return value
+    
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate
+        }
+
+@dataclass
+class LLMRequest:
+    """Petición al LLM preparada por el procesador"""
+    prompt: str
+    max_tokens: int
+    cache_key: str
+    analysis: Mapping[str, Any]
+    dataset_size: int
+    prompt_info: Dict[str, Any] = field(default_factory=dict)
+    user_query: str = ""
+    columns: Optional[PersonColumns] = None
+    query_class: str = "lookup"
+    model: Optional[str] = None
+    routing: Dict[str, Any] = field(default_factory=dict)
+
+class InflightCallCancelled(Exception):
+    """La llamada idéntica que se esperaba se canceló (cliente desconectado, timeout) sin resultado"""
+
 class AcademicRAGProcessor:
     
     def __init__(self, llm_client: GroqLLMClient, data_manager: IntelligentDataManager):
         self.llm = llm_client
         self.data_manager = data_manager
         self.query_analyzer = AcademicQueryAnalyzer()
+        self.query_engine = StructuredQueryEngine()
+        self.query_plans = QueryPlanCache(
+            self.query_analyzer, self.query_engine,
+            max_entries=int(os.getenv("QUERY_PLAN_CACHE_SIZE", "2048"))
+        )
+        self.router = ModelRouter(
+            default_model=llm_client.model,
+            fallback_model=os.getenv("LLM_FALLBACK_MODEL", "llama3-70b-8192"),
+            routes=json.loads(os.getenv("LLM_ROUTES", "{}")),
+            fallback_max_tokens=int(os.getenv("LLM_FALLBACK_MAX_TOKENS", "400")),
+            percentile=float(os.getenv("LLM_BUDGET_PERCENTILE", "95")),
+            headroom=float(os.getenv("LLM_BUDGET_HEADROOM", "1.25")),
+            min_samples=int(os.getenv("LLM_BUDGET_MIN_SAMPLES", "20"))
+        )
+        self.retriever = RelevanceRetriever()
+        self.fallback_engine = LocalFallbackEngine(self.query_engine, self.retriever)
+        self.prompt_encoder = CompactContextEncoder(
+            llm_client._get_system_prompt(),
+            token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "1500")),
+            max_records=int(os.getenv("PROMPT_MAX_RECORDS", "50"))
+        )
+        self.response_cache = ResponseCache(
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512")),
+            ttl=timedelta(seconds=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))),
+            backend=data_manager.state_backend
+        )
+        self.state_backend = data_manager.state_backend
+        self.metrics_writer = StateBackendWriter(
+            self.state_backend,
+            flush_interval=float(os.getenv("CLUSTER_METRICS_FLUSH_SECONDS", "2")),
+            purge_interval=float(os.getenv("STATE_BACKEND_PURGE_SECONDS", "300"))
+        )
+        self.batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+        self.batch_pack_size = int(os.getenv("BATCH_PACK_MAX_QUERIES", "5"))
+        self.batch_pack_token_budget = int(os.getenv("BATCH_PACK_TOKEN_BUDGET", "6000"))
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Espera máxima por una llamada idéntica ajena; vencida, se llama al LLM directamente
+        self.coalesce_wait = float(os.getenv("COALESCE_WAIT_SECONDS", str(llm_client.request_deadline)))
         self.metrics = SystemMetrics()
 
-    def _build_statistics_for_llm(self, records: list, total_records: int) -> dict:
-        """Pre-calcula estadísticas para que el LLM las use directamente"""
-        
-        total_personas = len(records)
-        personas_con_edad = [r for r in records if r.edad is not None and r.edad >= 0]
-        
-        hombres = [r for r in records if r.genero and r.genero.lower() in ["masculino", "hombre", "m"]]
-        mujeres = [r for r in records if r.genero and r.genero.lower() in ["femenino", "mujer", "f"]]
-        
-        stats_edad = {}
-        if personas_con_edad:
-            edades = [r.edad for r in personas_con_edad]
-            stats_edad = {
-                "edad_minima": min(edades),
-                "edad_maxima": max(edades),
-                "promedio_edad": round(sum(edades) / len(edades), 1),
-                "personas_mayor_edad": len([e for e in edades if e >= 18]),
-                "personas_menor_edad": len([e for e in edades if e < 18])
-            }
-        
-        distribucion_meses = {}
-        personas_con_mes = [r for r in records if hasattr(r, 'mes_nacimiento') and r.mes_nacimiento]
-        if personas_con_mes:
-            meses_nombres = {1: 'enero', 2: 'febrero', 3: 'marzo', 4: 'abril', 5: 'mayo', 6: 'junio',
-                            7: 'julio', 8: 'agosto', 9: 'septiembre', 10: 'octubre', 11: 'noviembre', 12: 'diciembre'}
-            
-            conteo_meses = {}
-            for persona in personas_con_mes:
-                mes = persona.mes_nacimiento
-                conteo_meses[mes] = conteo_meses.get(mes, 0) + 1
-            
-            for mes_num, cantidad in conteo_meses.items():
-                mes_nombre = meses_nombres.get(mes_num, f"mes_{mes_num}")
-                distribucion_meses[mes_nombre] = cantidad
-        
-        personas_con_correo = [r for r in records if r.correo and r.correo.strip() and "@" in r.correo]
-        personas_con_telefono = [r for r in records if r.celular and r.celular.strip()]
-        
-        fecha_registro_info = {}
-        personas_con_fecha_registro = [r for r in records if hasattr(r, 'fecha_registro') and r.fecha_registro]
-        if personas_con_fecha_registro:
-            fechas_ordenadas = sorted(personas_con_fecha_registro, key=lambda r: r.fecha_registro)
-            fecha_registro_info = {
-                "primera_persona_registrada": {
-                    "nombre": fechas_ordenadas[0].nombre_completo,
-                    "fecha": fechas_ordenadas[0].fecha_registro.strftime("%Y-%m-%d")
-                },
-                "ultima_persona_registrada": {
-                    "nombre": fechas_ordenadas[-1].nombre_completo,
-                    "fecha": fechas_ordenadas[-1].fecha_registro.strftime("%Y-%m-%d")
-                }
-            }
-        
-        return {
-            "conteos_generales": {
-                "total_personas": total_personas,
-                "total_hombres": len(hombres),
-                "total_mujeres": len(mujeres),
-                "personas_con_edad_valida": len(personas_con_edad),
-                "personas_con_correo": len(personas_con_correo),
-                "personas_con_telefono": len(personas_con_telefono)
-            },
-            "estadisticas_edad": stats_edad,
-            "distribucion_meses_nacimiento": distribucion_meses,
-            "informacion_registro": fecha_registro_info,
-            "porcentajes_genero": {
-                "porcentaje_hombres": round((len(hombres) / total_personas) * 100, 1) if total_personas > 0 else 0,
-                "porcentaje_mujeres": round((len(mujeres) / total_personas) * 100, 1) if total_personas > 0 else 0
-            }
-        }
+    def _build_statistics_for_llm(self, columns: PersonColumns, filtered_ids: np.ndarray) -> dict:
+        """Pre-calcula estadísticas sobre el conjunto filtrado completo, no sobre la muestra del prompt"""
+        if columns.aggregates is not None and filtered_ids is columns.indexes.valid_ids:
+            return columns.aggregates.as_statistics()
+        return columns.statistics(filtered_ids)
 
-    def _build_academic_prompt(self, user_query: str, filtered_records: list, analysis: dict) -> str:
-        """Construye prompt completo para RAG con datos + estadísticas"""
-        
-        sample_records = filtered_records[:15] if len(filtered_records) > 15 else filtered_records
-        
-        statistics = self._build_statistics_for_llm(sample_records, len(filtered_records))
-        
-        context_data = []
-        for record in sample_records:
-            record_data = {
-                "nombre_completo": record.nombre_completo,
-                "edad_anos": record.edad if record.edad is not None else None,
-                "tiene_edad_valida": record.edad is not None and record.edad >= 0,
-                "genero": record.genero if record.genero else None,
-                "documento": record.documento,
-                "correo": record.correo if record.correo and "@" in record.correo else None,
-                "celular": record.celular if record.celular and record.celular.strip() else None,
-                "mes_nacimiento_numero": record.mes_nacimiento if record.mes_nacimiento else None,
-                "mes_nacimiento_nombre": record.mes_nacimiento_nombre if record.mes_nacimiento_nombre else None,
-                "año_nacimiento": record.año_nacimiento if record.año_nacimiento else None,
-                "fecha_registro": record.fecha_registro.strftime("%Y-%m-%d") if record.fecha_registro else None,
-                "es_mayor_edad": record.edad >= 18 if record.edad is not None else None
-            }
-            context_data.append(record_data)
+    def _build_academic_prompt(self, user_query: str, columns: PersonColumns, filtered_ids: np.ndarray,
+                               ranked_ids: np.ndarray) -> Tuple[str, Dict[str, Any]]:
+        """Construye prompt compacto para RAG con datos + estadísticas dentro del presupuesto de tokens"""
+        with telemetry.stage("statistics"):
+            statistics = self._build_statistics_for_llm(columns, filtered_ids)
+        with telemetry.stage("prompt_build"):
+            prompt, prompt_info = self.prompt_encoder.build(
+                user_query,
+                columns.records_at(ranked_ids),
+                statistics,
+                int(filtered_ids.size)
+            )
         
         logger.info(f"🔍 RAG PROMPT - Consulta: '{user_query}'")
-        logger.info(f"🔍 RAG PROMPT - Registros: {len(context_data)}")
-        logger.info(f"🔍 RAG PROMPT - Con edad válida: {statistics['conteos_generales']['personas_con_edad_valida']}")
+        logger.info(f"🔍 RAG PROMPT - Registros: {prompt_info['records_in_prompt']} de {prompt_info['records_available']}, "
+                    f"~{prompt_info['prompt_tokens_estimate']} tokens")
         
-        prompt = f"""
-Eres un experto en análisis de datos demográficos. Analiza los datos proporcionados y responde la pregunta del usuario de manera precisa y directa.
+        return prompt, prompt_info
 
-PREGUNTA: {user_query}
+    async def process_academic_query(self, user_query: str) -> Dict[str, Any]:
+        """Procesamiento RAG PURO - Solo LLM + datos reales"""
+        started = time.perf_counter()
+        result = await self._process_academic_query(user_query)
+        telemetry.record_query(result, time.perf_counter() - started)
+        return result
+
+    async def _process_academic_query(self, user_query: str) -> Dict[str, Any]:
+        start_time = time.time()
+        
+        try:
+            resolved, llm_request = await self._prepare_query(user_query, start_time)
+            if resolved is not None:
+                return resolved
+
+            if not self.llm.is_available:
+                return self._create_fallback_response(llm_request, start_time)
 
-ESTADÍSTICAS PRE-CALCULADAS:
-{json.dumps(statistics, indent=2, ensure_ascii=False)}
+            logger.info("🤖 Enviando a Groq LLM (RAG puro)...")
+            try:
+                with telemetry.stage("llm_call"):
+                    llm_response = await self._complete_coalesced(llm_request)
+            except (CircuitOpenError, RateLimitExceeded, InvalidLLMAnswer) as e:
+                return self._create_fallback_response(llm_request, start_time, reason=e)
 
-DATOS DETALLADOS ({len(context_data)} personas):
-{json.dumps(context_data, indent=2, ensure_ascii=False)}
+            if not llm_response or not llm_response.strip():
+                if not self.llm.is_available:
+                    return self._create_fallback_response(llm_request, start_time)
+                logger.error("❌ LLM no respondió")
+                return self._create_error_response("El sistema de IA no pudo procesar la consulta")
 
-INSTRUCCIONES PARA RESPONDER:
+            logger.info(f"✅ RAG completado: '{llm_response[:100]}...'")
 
-1. PERSONA MÁS JOVEN/MAYOR:
-   - Busca el valor de "edad_anos" MÁS BAJO (joven) o MÁS ALTO (mayor)
-   - Solo considera registros donde "tiene_edad_valida" sea true
-   - Formato: "La persona más joven es [nombre_completo] con [edad_anos] años"
+            processing_time = time.time() - start_time
+            self._update_metrics(processing_time, success=True)
 
-2. CONTEOS SIMPLES:
-   - Usa las estadísticas pre-calculadas en "conteos_generales"
-   - Formato: "Hay X personas/hombres/mujeres registradas"
+            response = self._create_llm_response(llm_response, llm_request, processing_time)
+            await self.response_cache.put(llm_request.cache_key, response)
+            return response
 
-3. FILTROS POR EDAD:
-   - Examina TODOS los registros detallados
-   - Aplica la condición específica (mayor de X, menor de X, entre X y Y)
-   - Cuenta solo registros que cumplan la condición exacta
+        except Exception as e:
+            processing_time = time.time() - start_time
+            self._update_metrics(processing_time, success=False)
+            logger.error(f"❌ Error RAG: {e}")
+            return self._create_error_response(f"Error en el sistema RAG: {str(e)}")
 
-4. CONSULTAS POR MES:
-   - Usa "distribucion_meses_nacimiento" para conteos rápidos
-   - Para nombres específicos, busca en los datos detallados por "mes_nacimiento_nombre"
+    async def stream_academic_query(self, user_query: str) -> AsyncIterator[Dict[str, Any]]:
+        """Variante en streaming: eventos 'token' a medida que llegan y un 'done' final"""
+        started = time.perf_counter()
+        async with aclosing(self._stream_academic_query(user_query)) as events:
+            async for event in events:
+                if event["event"] != "token":
+                    telemetry.record_query(event["data"], time.perf_counter() - started)
+                yield event
 
-5. PROMEDIOS:
-   - Usa "promedio_edad" de las estadísticas pre-calculadas
-   - Para promedios por género, calcula desde los datos detallados
+    async def _stream_academic_query(self, user_query: str) -> AsyncIterator[Dict[str, Any]]:
+        start_time = time.time()
+        
+        try:
+            resolved, llm_request = await self._prepare_query(user_query, start_time)
+            if resolved is not None:
+                yield {"event": "done", "data": resolved}
+                return
 
-6. BÚSQUEDAS ESPECÍFICAS:
-   - Para documentos/correos/teléfonos: busca en los campos respectivos
-   - Para nombres: busca en "nombre_completo"
+            if not self.llm.is_available:
+                yield {"event": "done", "data": self._create_fallback_response(llm_request, start_time)}
+                return
 
-7. CONSULTAS TEMPORALES:
-   - Usa "informacion_registro" para primera/última persona registrada
+            first_token_at = None
+            parts = []
+            llm_started = time.perf_counter()
+            try:
+                # aclosing: si el cliente se desconecta, el stream interno libera su cupo del governor al instante
+                async with aclosing(self.llm.stream_completion(llm_request.prompt, max_tokens=llm_request.max_tokens,
+                                                               model=llm_request.model)) as tokens:
+                    async for token in tokens:
+                        if first_token_at is None:
+                            first_token_at = time.time()
+                            telemetry.observe("llm_first_token", time.perf_counter() - llm_started)
+                        parts.append(token)
+                        yield {"event": "token", "data": {"token": token}}
+            except (CircuitOpenError, RateLimitExceeded) as e:
+                # Rechazada antes de llamar a la API: mismo respaldo local que el endpoint sin streaming
+                yield {"event": "done", "data": self._create_fallback_response(llm_request, start_time, reason=e)}
+                return
+            telemetry.observe("llm_stream", time.perf_counter() - llm_started)
 
-REGLAS CRÍTICAS:
-- Responde SOLO con información de los datos proporcionados
-- Si no hay datos suficientes: "No hay información suficiente para responder esta pregunta"
-- Usa "nombre_completo" exacto de los registros
-- Máximo 2 oraciones de respuesta
-- Sin explicaciones metodológicas
+            answer = ''.join(parts).strip()
+            if not answer:
+                logger.error("❌ LLM no respondió")
+                yield {"event": "error", "data": self._create_error_response("El sistema de IA no pudo procesar la consulta")}
+                return
+            
+            # Los tokens ya se emitieron: una respuesta no válida solo se contabiliza, no se reintenta
+            failure = self.router.validate(answer)
+            if failure is not None:
+                self.router.record_failure(llm_request.query_class, failure, fell_back=False, recovered=False)
+            else:
+                self.router.observe(llm_request.query_class, estimate_tokens(answer))
 
-FORMATO DE RESPUESTA:
-- Directo y específico
-- Números exactos de los datos
-- Nombres completos reales
-- Sin palabras como "análisis" o "metodología"
+            processing_time = time.time() - start_time
+            time_to_first_token = first_token_at - start_time
+            self._update_metrics(processing_time, success=True)
+            self._update_streaming_metrics(time_to_first_token)
 
-RESPUESTA:"""
+            response = self._create_llm_response(answer, llm_request, processing_time)
+            response["metadata"].update({
+                "streamed": True,
+                "time_to_first_token_ms": round(time_to_first_token * 1000, 2),
+                "total_time_ms": round(processing_time * 1000, 2)
+            })
+            if failure is None:
+                await self.response_cache.put(llm_request.cache_key, response)
+            else:
+                response["metadata"]["validation_failure"] = failure
+            yield {"event": "done", "data": response}
 
-        return prompt
+        except Exception as e:
+            processing_time = time.time() - start_time
+            self._update_metrics(processing_time, success=False)
+            logger.error(f"❌ Error RAG (streaming): {e}")
+            yield {"event": "error", "data": self._create_error_response(f"Error en el sistema RAG: {str(e)}")}
 
-    def process_academic_query(self, user_query: str) -> Dict[str, Any]:
-        """Procesamiento RAG PURO - Solo LLM + datos reales"""
+    async def process_batch(self, user_queries: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Resuelve N consultas con una sola vista del dataset y el mínimo de llamadas al LLM"""
         start_time = time.time()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(user_queries)
+        pending: Dict[str, List[int]] = {}
+        requests_by_key: Dict[str, LLMRequest] = {}
         
-        try:
-            logger.info(f"🔍 INICIANDO RAG PURO: '{user_query}'")
-            
-            dataset = self.data_manager.get_enriched_dataset()
-            logger.info(f"🔍 Dataset: {len(dataset)} registros")
+        with telemetry.stage("dataset_fetch"):
+            columns = await asyncio.to_thread(self.data_manager.get_columnar_dataset)
+        for position, user_query in enumerate(user_queries):
+            if not user_query:
+                results[position] = self._create_error_response("Consulta vacía o inválida")
+                continue
+            try:
+                resolved, llm_request = await self._prepare_query(user_query, start_time, columns)
+            except Exception as e:
+                logger.error(f"❌ Error RAG (lote): {e}")
+                self._update_metrics(time.time() - start_time, success=False)
+                results[position] = self._create_error_response(f"Error en el sistema RAG: {str(e)}")
+                continue
+            if resolved is not None:
+                results[position] = resolved
+            else:
+                pending.setdefault(llm_request.cache_key, []).append(position)
+                requests_by_key.setdefault(llm_request.cache_key, llm_request)
+        
+        # Las consultas que otro cliente ya tiene en vuelo solo esperan su resultado
+        shared = {key: self._inflight[key] for key in requests_by_key if key in self._inflight}
+        own = [requests_by_key[key] for key in requests_by_key if key not in shared]
+        groups = self._pack_requests(own) if self.llm.is_available else []
+        
+        semaphore = asyncio.Semaphore(self.batch_max_concurrency)
+        
+        async def run_group(group: List[LLMRequest]) -> Dict[str, Any]:
+            async with semaphore:
+                with telemetry.stage("llm_call_batch"):
+                    return await self._complete_group(group)
+        
+        async def await_shared(key: str) -> Dict[str, Any]:
+            self.metrics.coalesced_queries += 1
+            try:
+                return {key: await self._await_inflight(shared[key])}
+            except (asyncio.TimeoutError, InflightCallCancelled):
+                return await run_group([requests_by_key[key]])
+            except Exception as e:
+                return {key: e}
+        
+        outcomes: Dict[str, Any] = {}
+        for partial in await asyncio.gather(*(run_group(group) for group in groups),
+                                            *(await_shared(key) for key in shared)):
+            outcomes.update(partial)
+        
+        for key, positions in pending.items():
+            llm_request = requests_by_key[key]
+            outcome = outcomes.get(key)
+            processing_time = time.time() - start_time
+            if isinstance(outcome, str) and outcome.strip():
+                self._update_metrics(processing_time, success=True)
+                response = self._create_llm_response(outcome, llm_request, processing_time)
+                await self.response_cache.put(key, response)
+            elif not self.llm.is_available or isinstance(outcome, (CircuitOpenError, RateLimitExceeded, InvalidLLMAnswer)):
+                response = self._create_fallback_response(llm_request, start_time,
+                                                          reason=outcome if isinstance(outcome, Exception) else None)
+            else:
+                logger.error(f"❌ LLM no respondió (lote): {outcome}")
+                self._update_metrics(processing_time, success=False)
+                response = self._create_error_response("El sistema de IA no pudo procesar la consulta")
+            for position in positions:
+                results[position] = response
+        
+        self.metrics.batched_queries += len(user_queries)
+        self.metrics.batch_llm_calls += len(groups)
+        batch_time = time.time() - start_time
+        for result in results:
+            telemetry.record_query(result, batch_time)
+        
+        return results, {
+            "total_queries": len(user_queries),
+            "resolved_locally": len(user_queries) - sum(len(positions) for positions in pending.values()),
+            "llm_queries": len(own),
+            "coalesced_queries": len(shared) + sum(len(positions) - 1 for positions in pending.values()),
+            "llm_calls": len(groups),
+            "processing_time_ms": round((time.time() - start_time) * 1000, 2)
+        }
 
-            if not dataset:
-                return self._create_error_response("No hay datos disponibles en la base de datos")
+    def _pack_requests(self, llm_requests: List[LLMRequest]) -> List[List[LLMRequest]]:
+        """Agrupa peticiones en prompts combinados respetando tamaño máximo y presupuesto de tokens"""
+        groups: List[List[LLMRequest]] = []
+        current: List[LLMRequest] = []
+        current_tokens = 0
+        # Solo se combinan peticiones enrutadas al mismo modelo
+        for llm_request in sorted(llm_requests, key=lambda llm_request: llm_request.model or ''):
+            tokens = llm_request.prompt_info.get("prompt_tokens_estimate", estimate_tokens(llm_request.prompt))
+            if current and (len(current) >= self.batch_pack_size
+                            or current[0].model != llm_request.model
+                            or current_tokens + tokens > self.batch_pack_token_budget):
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(llm_request)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
 
-            valid_records = [r for r in dataset if r.nombre_completo and r.nombre_completo.strip()]
-            if not valid_records:
-                return self._create_error_response("No hay registros válidos en la base de datos")
+    async def _complete_group(self, group: List[LLMRequest]) -> Dict[str, Any]:
+        """Una llamada para todo el grupo; las respuestas que falten se piden de forma individual"""
+        futures = {llm_request.cache_key: self._claim_inflight(llm_request.cache_key) for llm_request in group}
+        outcomes: Dict[str, Any] = {}
+        try:
+            if len(group) == 1:
+                answers = [await self._complete_routed(group[0])]
+            else:
+                logger.info(f"🤖 Enviando lote de {len(group)} consultas a Groq LLM...")
+                packed_prompt = self.prompt_encoder.pack(
+                    [self.prompt_encoder.context_of(llm_request.prompt) for llm_request in group]
+                )
+                # Un rechazo del circuito o del governor se propaga: todo el grupo va una vez al respaldo local
+                packed = await self.llm.complete(
+                    packed_prompt, max_tokens=sum(llm_request.max_tokens for llm_request in group),
+                    model=group[0].model, raise_rejections=True,
+                    system_prompt=self.llm._get_packed_system_prompt()
+                )
+                answers = self.prompt_encoder.unpack(packed.text if packed is not None else None, len(group))
+                if packed is not None and packed.finish_reason == 'length':
+                    # La salida se cortó: la última respuesta numerada puede estar incompleta
+                    numbered = [position for position, answer in enumerate(answers) if answer is not None]
+                    if numbered:
+                        answers[numbered[-1]] = None
+                for position, (llm_request, answer) in enumerate(zip(group, answers)):
+                    if answer is not None and self.router.validate(answer) is None:
+                        self.router.observe(llm_request.query_class, estimate_tokens(answer))
+                    else:
+                        answers[position] = None
+            
+            for llm_request, answer in zip(group, answers):
+                if answer is None:
+                    try:
+                        answer = await self._complete_routed(llm_request)
+                    except InvalidLLMAnswer as e:
+                        # Solo esta consulta va al respaldo local; el resto del grupo sigue
+                        answer = e
+                outcomes[llm_request.cache_key] = answer
+        except Exception as e:
+            logger.error(f"❌ Error en lote LLM: {e}")
+            for llm_request in group:
+                outcomes.setdefault(llm_request.cache_key, e)
+        except BaseException as e:
+            for llm_request in group:
+                outcomes.setdefault(llm_request.cache_key, e)
+            raise
+        finally:
+            for key, future in futures.items():
+                self._resolve_inflight(key, future, outcomes.get(key))
+        return outcomes
 
-            query_analysis = self.query_analyzer.analyze_complexity(user_query)
-            logger.info(f"🔍 Análisis: {query_analysis}")
+    async def _complete_coalesced(self, llm_request: LLMRequest) -> Optional[str]:
+        """Consultas idénticas en vuelo (misma clave de cache) comparten una sola llamada al LLM"""
+        existing = self._inflight.get(llm_request.cache_key)
+        if existing is not None:
+            self.metrics.coalesced_queries += 1
+            logger.info("🔗 Consulta idéntica en vuelo: esperando su respuesta")
+            try:
+                return await self._await_inflight(existing)
+            except (asyncio.TimeoutError, InflightCallCancelled) as e:
+                logger.warning(f"⚠️ La consulta idéntica en vuelo no respondió ({type(e).__name__}): llamada propia al LLM")
+        
+        future = self._claim_inflight(llm_request.cache_key)
+        outcome: Any = None
+        try:
+            outcome = await self._complete_routed(llm_request)
+            return outcome
+        except BaseException as e:
+            outcome = e
+            raise
+        finally:
+            self._resolve_inflight(llm_request.cache_key, future, outcome)
 
-            filtered_records = self._filter_records_by_query(user_query, valid_records, query_analysis)
-            if not filtered_records:
-                filtered_records = valid_records
+    async def _complete_routed(self, llm_request: LLMRequest) -> Optional[str]:
+        """Modelo de la ruta; si la respuesta no pasa la validación, un reintento (ver ModelRouter.retry_route).
+        
+        Si tampoco pasa, InvalidLLMAnswer: quien llama responde con el respaldo local, sin cachear."""
+        model = llm_request.model or self.llm.model
+        completion = await self.llm.complete(llm_request.prompt, max_tokens=llm_request.max_tokens, model=model,
+                                             raise_rejections=True)
+        if completion is None:
+            return None
+        
+        failure = self.router.validate(completion.text, completion.finish_reason)
+        if failure is not None:
+            retry = self.router.retry_route(model, llm_request.max_tokens, failure)
+            recovered = False
+            if retry is not None:
+                retry_model, retry_tokens = retry
+                logger.warning(f"🔀 Respuesta de {model} no válida ({failure}): reintentando con {retry_model} "
+                               f"({retry_tokens} tokens)")
+                with telemetry.stage("llm_fallback"):
+                    retried = await self.llm.complete(llm_request.prompt, max_tokens=retry_tokens, model=retry_model)
+                if retried is not None:
+                    recovered = self.router.validate(retried.text, retried.finish_reason) is None
+                    completion = retried
+            self.router.record_failure(llm_request.query_class, failure,
+                                       fell_back=retry is not None and retry[0] != model, recovered=recovered)
+            if not recovered:
+                raise InvalidLLMAnswer(f"respuesta no válida ({failure})")
+        
+        self.router.observe(llm_request.query_class, completion.completion_tokens or estimate_tokens(completion.text))
+        llm_request.routing = {
+            "model_used": completion.model,
+            "validation_failure": failure,
+            "model_fallback": failure is not None and completion.model != model
+        }
+        return completion.text
 
-            logger.info(f"🔍 Registros filtrados: {len(filtered_records)}")
+    def _claim_inflight(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
 
-            academic_prompt = self._build_academic_prompt(user_query, filtered_records, query_analysis)
+    def _resolve_inflight(self, key: str, future: asyncio.Future, outcome: Any) -> None:
+        """Libera la clave y entrega el resultado a quienes esperan; una cancelación cancela el futuro"""
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.done():
+            return
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+            future.exception()
+        elif isinstance(outcome, BaseException):
+            future.cancel()
+        else:
+            future.set_result(outcome)
+    
+    async def _await_inflight(self, future: asyncio.Future) -> Optional[str]:
+        """Espera acotada por coalesce_wait al resultado de otra llamada idéntica"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.coalesce_wait)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            raise InflightCallCancelled("la llamada idéntica en vuelo se canceló")
 
-            max_tokens = 100 if query_analysis['complexity_level'] == 'simple' else 200
+    async def _prepare_query(self, user_query: str, start_time: float,
+                             columns: Optional[PersonColumns] = None) -> Tuple[Optional[Dict[str, Any]], Optional[LLMRequest]]:
+        """Resuelve localmente o desde cache; si no, arma la petición al LLM"""
+        logger.info(f"🔍 INICIANDO RAG PURO: '{user_query}'")
+        
+        if columns is None:
+            with telemetry.stage("dataset_fetch"):
+                columns = await asyncio.to_thread(self.data_manager.get_columnar_dataset)
+        logger.info(f"🔍 Dataset: {len(columns)} registros")
 
-            logger.info("🤖 Enviando a Groq LLM (RAG puro)...")
-            llm_response = self.llm._make_request_with_retry(academic_prompt, max_tokens=max_tokens)
+        if not len(columns):
+            return self._create_error_response("No hay datos disponibles en la base de datos"), None
 
-            if not llm_response or not llm_response.strip():
-                logger.error("❌ LLM no respondió")
-                return self._create_error_response("El sistema de IA no pudo procesar la consulta")
+        valid_count = int(np.count_nonzero(columns.valid))
+        if not valid_count:
+            return self._create_error_response("No hay registros válidos en la base de datos"), None
 
-            logger.info(f"✅ RAG completado: '{llm_response[:100]}...'")
+        with telemetry.stage("query_planning"):
+            compiled = self.query_plans.compile(user_query)
+        query_analysis = compiled.analysis
+        query_plan = compiled.plan
+        logger.info(f"🔍 Análisis: {query_analysis}")
 
+        if query_plan is not None:
+            with telemetry.stage("structured_engine"):
+                answer = self.query_engine.execute(query_plan, columns)
             processing_time = time.time() - start_time
             self._update_metrics(processing_time, success=True)
+            logger.info(f"⚡ Consulta resuelta localmente: {query_plan}")
+            return self._create_structured_response(answer, query_plan, query_analysis,
+                                                    valid_count, processing_time), None
 
+        cache_key = self.response_cache.build_key(user_query, self.data_manager.dataset_version)
+        with telemetry.stage("cache_lookup"):
+            cached_response = await self.response_cache.get(cache_key)
+        self.metrics.cache_hit_rate = self.response_cache.hit_rate
+        if cached_response is not None:
+            processing_time = time.time() - start_time
+            self._update_metrics(processing_time, success=True)
+            logger.info("📋 Cache: Respuesta servida desde cache")
             return {
-                "answer": llm_response.strip(),
+                "answer": cached_response["answer"],
                 "metadata": {
-                    "query_type": "rag_pure",
-                    "query_complexity": query_analysis['complexity_level'],
-                    "dataset_size": len(filtered_records),
-                    "processing_time_ms": round(processing_time * 1000, 2),
-                    "patterns_detected": query_analysis['detected_patterns'],
-                    "data_enrichment": "full_rag_with_statistics",
-                    "llm_provider": "groq",
-                    "model_used": self.llm.model,
-                    "rag_mode": "pure_no_fallback"
+                    **cached_response["metadata"],
+                    "query_path": "cache",
+                    "cache_hit": True,
+                    "processing_time_ms": round(processing_time * 1000, 3)
                 }
+            }, None
+
+        with telemetry.stage("filtering"):
+            filtered_ids, ranked_ids = self._retrieve_context(compiled, columns)
+
+        logger.info(f"🔍 Registros filtrados: {filtered_ids.size}")
+
+        prompt, prompt_info = self._build_academic_prompt(user_query, columns, filtered_ids, ranked_ids)
+
+        route = self.router.route(query_analysis)
+        return None, LLMRequest(
+            prompt=prompt,
+            max_tokens=route.max_tokens,
+            cache_key=cache_key,
+            analysis=query_analysis,
+            dataset_size=int(filtered_ids.size),
+            prompt_info=prompt_info,
+            user_query=user_query,
+            columns=columns,
+            query_class=route.query_class,
+            model=route.model
+        )
+
+    def _create_llm_response(self, llm_response: str, llm_request: LLMRequest, processing_time: float) -> Dict[str, Any]:
+        return {
+            "answer": llm_response.strip(),
+            "metadata": {
+                "query_type": "rag_pure",
+                "query_path": "llm",
+                "cache_hit": False,
+                "query_complexity": llm_request.analysis['complexity_level'],
+                "dataset_size": llm_request.dataset_size,
+                "dataset_version": self.data_manager.dataset_version,
+                "processing_time_ms": round(processing_time * 1000, 2),
+                "patterns_detected": llm_request.analysis['detected_patterns'],
+                **llm_request.prompt_info,
+                "data_enrichment": "full_rag_with_statistics",
+                "llm_provider": "groq",
+                "model_used": llm_request.routing.get("model_used", llm_request.model or self.llm.model),
+                "query_class": llm_request.query_class,
+                "max_tokens": llm_request.max_tokens,
+                "model_fallback": llm_request.routing.get("model_fallback", False),
+                "rag_mode": "pure_no_fallback"
+            }
+        }
+
+    def _retrieve_context(self, compiled: CompiledQuery, columns: PersonColumns) -> Tuple[np.ndarray, np.ndarray]:
+        """Conjunto filtrado completo (para estadísticas) y top-k por relevancia (para el detalle)"""
+        filtered_ids = columns.indexes.lookup(compiled.filters)
+        if not filtered_ids.size:
+            filtered_ids = columns.indexes.valid_ids
+        
+        # Texto original sin los filtros: el canónico pierde '@' y '.', y con ellos los correos
+        _, remaining_text = self.query_engine.extract_filters(compiled.query or compiled.canonical)
+        ranked_ids = self.retriever.rank(remaining_text, columns, filtered_ids, k=self.prompt_encoder.max_records)
+        return filtered_ids, ranked_ids
+
+    def _create_structured_response(self, answer: str, plan: QueryPlan, analysis: Mapping[str, Any],
+                                    dataset_size: int, processing_time: float) -> Dict[str, Any]:
+        return {
+            "answer": answer,
+            "metadata": {
+                "query_type": "structured",
+                "query_path": "structured_engine",
+                "query_complexity": analysis['complexity_level'],
+                "dataset_size": dataset_size,
+                "processing_time_ms": round(processing_time * 1000, 3),
+                "patterns_detected": analysis['detected_patterns'],
+                "query_plan": asdict(plan),
+                "llm_provider": None,
+                "model_used": None
+            }
+        }
+
+    def _create_fallback_response(self, llm_request: LLMRequest, start_time: float,
+                                  reason: Optional[Exception] = None) -> Dict[str, Any]:
+        """Respuesta local determinista: circuito abierto, rechazo del governor o respuesta del LLM no válida"""
+        answer, strategy = self.fallback_engine.answer(llm_request.user_query, llm_request.columns)
+        processing_time = time.time() - start_time
+        self._update_metrics(processing_time, success=True)
+        self.metrics.fallback_queries += 1
+        self._record_cluster_metric("fallback_queries")
+        if isinstance(reason, RateLimitExceeded):
+            cause = "límite de tasa hacia Groq"
+        elif isinstance(reason, InvalidLLMAnswer):
+            cause = f"Groq devolvió una {reason}"
+        else:
+            cause = "circuito hacia Groq abierto"
+        logger.info(f"🛟 Respuesta local de respaldo ({strategy}): {cause}")
+        return {
+            "answer": answer,
+            "metadata": {
+                "query_type": "local_fallback",
+                "query_path": "local_fallback",
+                "fallback_strategy": strategy,
+                "cache_hit": False,
+                "query_complexity": llm_request.analysis['complexity_level'],
+                "dataset_size": llm_request.dataset_size,
+                "dataset_version": self.data_manager.dataset_version,
+                "processing_time_ms": round(processing_time * 1000, 2),
+                "patterns_detected": llm_request.analysis['detected_patterns'],
+                "llm_provider": None,
+                "model_used": None,
+                "circuit_breaker": self.llm.breaker.state.value
             }
+        }
+
+    def _create_error_response(self, message: str) -> Dict[str, Any]:
+        return {
+            "answer": message,
+            "metadata": {
+                "query_type": "error",
+                "query_path": "error",
+                "query_complexity": "unknown",
+                "processing_time_ms": 0
+            }
+        }
+
+    def _update_metrics(self, processing_time: float, success: bool) -> None:
+        """Actualiza contadores y tiempo promedio de respuesta"""
+        self.metrics.total_queries += 1
+        if success:
+            self.metrics.successful_queries += 1
+        else:
+            self.metrics.failed_queries += 1
+        
+        self.metrics.avg_response_time += (processing_time - self.metrics.avg_response_time) / self.metrics.total_queries
+        self.metrics.last_updated = datetime.now()
+        
+        self._record_cluster_metric("total_queries")
+        self._record_cluster_metric("successful_queries" if success else "failed_queries")
+        self._record_cluster_metric("response_time_sum", processing_time)
+
+    def _update_streaming_metrics(self, time_to_first_token: float) -> None:
+        self.metrics.streamed_queries += 1
+        self.metrics.avg_time_to_first_token += (
+            (time_to_first_token - self.metrics.avg_time_to_first_token) / self.metrics.streamed_queries
+        )
+        self._record_cluster_metric("streamed_queries")
+        self._record_cluster_metric("time_to_first_token_sum", time_to_first_token)
+
+    def _record_cluster_metric(self, name: str, amount: float = 1.0) -> None:
+        """Contadores agregados entre workers: se acumulan en memoria y un hilo los vuelca al backend"""
+        self.metrics_writer.incr(f"metrics:{name}", amount)
 
+    def cluster_metrics(self) -> Dict[str, Any]:
+        """Métricas sumadas de todos los workers que comparten el backend (más lo aún no volcado aquí)"""
+        try:
+            counters = dict(self.state_backend.counters("metrics:"))
         except Exception as e:
-            processing_time = time.time() - start_time
-            self._update_metrics(processing_time, success=False)
-            logger.error(f"❌ Error RAG: {e}")
-            return self._create_error_response(f"Error en el sistema RAG: {str(e)}")
+            logger.warning(f"⚠️ Métricas compartidas no disponibles: {e}")
+            counters = {}
+        for key, amount in self.metrics_writer.pending("metrics:").items():
+            counters[key] = counters.get(key, 0.0) + amount
+        counters = {key.split(":", 1)[1]: value for key, value in counters.items()}
+        total = counters.get("total_queries", 0.0)
+        streamed = counters.get("streamed_queries", 0.0)
+        return {
+            "backend": self.state_backend.describe(),
+            "writer": self.metrics_writer.stats(),
+            "worker_pid": os.getpid(),
+            "total_queries": int(total),
+            "successful_queries": int(counters.get("successful_queries", 0.0)),
+            "failed_queries": int(counters.get("failed_queries", 0.0)),
+            "avg_response_time": round(counters.get("response_time_sum", 0.0) / total, 4) if total else 0.0,
+            "streamed_queries": int(streamed),
+            "avg_time_to_first_token": round(counters.get("time_to_first_token_sum", 0.0) / streamed, 4) if streamed else 0.0,
+            "fallback_queries": int(counters.get("fallback_queries", 0.0))
+        }
+
+
+
+# ============================================================================
+# CICLO DE VIDA DEL SERVICIO
+# ============================================================================
 
+class ComponentState(Enum):
+    """Estado de inicialización de un componente"""
+    PENDING = "pending"
+    STARTING = "starting"
+    READY = "ready"
+    FAILED = "failed"
+    SKIPPED = "skipped"
 
+class ServiceLifecycle:
+    """Inicializa Firebase, Groq y el dataset en segundo plano; separa liveness de readiness"""
+    
+    def __init__(self, firebase_manager: FirebaseManager, groq_client: GroqLLMClient,
+                 data_manager: IntelligentDataManager, dataset_warmup: bool = False,
+                 incremental_sync: bool = False, retry_max_delay: float = 30.0):
+        self.firebase = firebase_manager
+        self.groq = groq_client
+        self.data_manager = data_manager
+        self.dataset_warmup = dataset_warmup
+        self.incremental_sync = incremental_sync
+        self.retry_max_delay = retry_max_delay
+        
+        self.created_at = time.monotonic()
+        self.states: Dict[str, ComponentState] = {
+            "snapshot": ComponentState.PENDING if data_manager.snapshot_path else ComponentState.SKIPPED,
+            "firebase": ComponentState.PENDING,
+            "groq": ComponentState.PENDING,
+            "dataset": ComponentState.PENDING if dataset_warmup else ComponentState.SKIPPED
+        }
+        self.errors: Dict[str, str] = {}
+        self.timings: Dict[str, float] = {}
+        self.firebase_attempts = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def ready(self) -> bool:
+        """Listo para atender consultas: Firestore conectado (o snapshot local mapeado) y, si se pidió, dataset precargado"""
+        return (ComponentState.READY in (self.states["firebase"], self.states["snapshot"])
+                and self.states["dataset"] in (ComponentState.READY, ComponentState.SKIPPED, ComponentState.FAILED))
+    
+    def start(self) -> None:
+        """Lanza la inicialización sin bloquear el arranque del servidor"""
+        if self._task is None:
+            self.timings["server_started_s"] = round(time.monotonic() - self.created_at, 4)
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _run(self) -> None:
+        if self.states["snapshot"] == ComponentState.PENDING:
+            await self._load_snapshot()
+        
+        await asyncio.gather(self._initialize_firebase(), self._initialize_groq())
+        
+        if self.incremental_sync:
+            self.data_manager.start_incremental_sync(FirestoreChangeSource(self.firebase.collection))
+        
+        if self.states["snapshot"] == ComponentState.READY:
+            self.data_manager.reconcile_snapshot()
+        elif self.dataset_warmup:
+            await self._step("dataset", self.data_manager.get_columnar_dataset)
+        
+        self.timings["ready_s"] = round(time.monotonic() - self.created_at, 4)
+        logger.info(f"✅ Servicio listo en {self.timings['ready_s']:.2f}s: {self.component_status()}")
+    
+    async def _load_snapshot(self) -> None:
+        """Mapea el snapshot local antes de conectar: con él se atiende sin esperar a Firestore"""
+        started = time.monotonic()
+        self.states["snapshot"] = ComponentState.STARTING
+        loaded = await asyncio.to_thread(self.data_manager.load_snapshot)
+        self.timings["snapshot_s"] = round(time.monotonic() - started, 4)
+        self.states["snapshot"] = ComponentState.READY if loaded else ComponentState.SKIPPED
+        if loaded and self.dataset_warmup:
+            self.states["dataset"] = ComponentState.READY
+    
+    async def _initialize_firebase(self) -> None:
+        """Reintenta con backoff hasta conectar: sin Firestore no hay datos que consultar"""
+        delay = 1.0
+        while True:
+            self.firebase_attempts += 1
+            if await self._step("firebase", self.firebase.connect):
+                return
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.retry_max_delay)
+    
+    async def _initialize_groq(self) -> None:
+        """Un único intento: si falla, el circuit breaker queda abierto y se sondea solo"""
+        await self._step("groq", self.groq.initialize)
+    
+    async def _step(self, name: str, action) -> bool:
+        self.states[name] = ComponentState.STARTING
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(action)
+        except Exception as e:
+            self.states[name] = ComponentState.FAILED
+            self.errors[name] = str(e)
+            logger.error(f"❌ Inicialización de {name} falló: {e}")
+            return False
+        finally:
+            self.timings[f"{name}_s"] = round(time.monotonic() - started, 4)
+        
+        self.states[name] = ComponentState.READY
+        self.errors.pop(name, None)
+        return True
+    
+    def component_status(self) -> Dict[str, str]:
+        return {name: state.value for name, state in self.states.items()}
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "liveness": "alive",
+            "readiness": "ready" if self.ready else "starting",
+            "components": self.component_status(),
+            "errors": dict(self.errors),
+            "firebase_attempts": self.firebase_attempts,
+            "timings": dict(self.timings),
+            "uptime_s": round(time.monotonic() - self.created_at, 2)
+        }
 
 # ============================================================================
 # INICIALIZACIÓN DEL SISTEMA
 # ============================================================================
 
 firebase_manager = FirebaseManager()
+query_log_writer = QueryLogWriter(
+    firebase_manager,
+    max_queue=int(os.getenv("LOG_QUEUE_MAX_SIZE", "1000")),
+    batch_size=int(os.getenv("LOG_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", "2")),
+    drop_policy=os.getenv("LOG_DROP_POLICY", QueryLogWriter.DROP_OLDEST)
+)
 groq_client = GroqLLMClient()
-data_manager = IntelligentDataManager(firebase_manager)
+state_backend = create_state_backend()
+data_manager = IntelligentDataManager(firebase_manager, state_backend)
 rag_processor = AcademicRAGProcessor(groq_client, data_manager)
 
+lifecycle = ServiceLifecycle(
+    firebase_manager,
+    groq_client,
+    data_manager,
+    dataset_warmup=os.getenv("DATASET_WARMUP", "false").lower() == "true",
+    incremental_sync=os.getenv("DATASET_INCREMENTAL_SYNC", "false").lower() == "true",
+    retry_max_delay=float(os.getenv("STARTUP_RETRY_MAX_DELAY", "30"))
+)
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "50"))
+
+def not_ready_response() -> Optional[JSONResponse]:
+    """503 mientras Firestore no esté conectado (la inicialización sigue en segundo plano)"""
+    if lifecycle.ready:
+        return None
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "5"},
+        content={"error": "Servicio iniciando, intenta de nuevo en unos segundos",
+                 "components": lifecycle.component_status()}
+    )
+
 # ============================================================================
 # ENDPOINTS DE LA API - CORRECCIÓN PRINCIPAL
 # ============================================================================
@@ -741,24 +5384,103 @@ async def process_natural_language_query(request: Dict = Body(...)):
             content={"error": "Consulta vacía o inválida"}
         )
     
+    unavailable = not_ready_response()
+    if unavailable is not None:
+        return unavailable
+    
     logger.info(f"🎓 Consulta académica recibida: {query_text}")
     
-    result = rag_processor.process_academic_query(query_text)
+    result = await rag_processor.process_academic_query(query_text)
     
-    if firebase_manager.is_healthy():
-        try:
-            firebase_manager.logs_collection.add({
-                "accion": "Consulta RAG Académica",
-                "consulta": query_text,
-                "complejidad": result.get("metadata", {}).get("query_complexity", "unknown"),
-                "tiempo_procesamiento": result.get("metadata", {}).get("processing_time_ms", 0),
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
-        except Exception as e:
-            logger.warning(f"⚠️ Error logging: {e}")
+    log_query_result(query_text, result)
     
     return result
 
+@app.post("/consulta-natural/stream")
+async def stream_natural_language_query(request: Dict = Body(...)):
+    """
+    Variante con Server-Sent Events: eventos 'token' durante la generación y 'done' con la respuesta final
+    """
+    query_text = request.get("consulta", "").strip()
+    
+    if not query_text:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Consulta vacía o inválida"}
+        )
+    
+    unavailable = not_ready_response()
+    if unavailable is not None:
+        return unavailable
+    
+    logger.info(f"🎓 Consulta académica (streaming) recibida: {query_text}")
+    
+    async def event_stream():
+        result = None
+        async for event in rag_processor.stream_academic_query(query_text):
+            if event["event"] != "token":
+                result = event["data"]
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False, default=str)}\n\n"
+        
+        if result is not None:
+            log_query_result(query_text, result)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/consulta-natural/batch", response_model=Dict[str, Any])
+async def process_natural_language_batch(request: Dict = Body(...)):
+    """
+    Lote de consultas: una sola vista del dataset, respuestas locales directas y el resto agrupado hacia el LLM
+    """
+    queries = request.get("consultas")
+    
+    if not isinstance(queries, list) or not queries:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Se requiere una lista 'consultas' no vacía"}
+        )
+    
+    if len(queries) > BATCH_MAX_QUERIES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Máximo {BATCH_MAX_QUERIES} consultas por lote"}
+        )
+    
+    unavailable = not_ready_response()
+    if unavailable is not None:
+        return unavailable
+    
+    query_texts = [str(query or "").strip() for query in queries]
+    logger.info(f"🎓 Lote de {len(query_texts)} consultas recibido")
+    
+    results, batch_info = await rag_processor.process_batch(query_texts)
+    
+    for query_text, result in zip(query_texts, results):
+        if query_text:
+            log_query_result(query_text, result)
+    
+    return {
+        "resultados": [
+            {"consulta": query_text, **result} for query_text, result in zip(query_texts, results)
+        ],
+        "metadata": batch_info
+    }
+
+def log_query_result(query_text: str, result: Dict[str, Any]) -> None:
+    """Encola la consulta para la colección de logs; la escritura ocurre fuera de la petición"""
+    with telemetry.stage("logging"):
+        query_log_writer.enqueue({
+            "accion": "Consulta RAG Académica",
+            "consulta": query_text,
+            "complejidad": result.get("metadata", {}).get("query_complexity", "unknown"),
+            "tiempo_procesamiento": result.get("metadata", {}).get("processing_time_ms", 0),
+            "timestamp": firestore.SERVER_TIMESTAMP
+        })
+
 @app.post("/query", response_model=Dict[str, Any])
 async def process_query_legacy(query: Dict = Body(...)):
     """Endpoint legacy - redirige al nuevo"""
@@ -769,6 +5491,17 @@ async def process_query_legacy(query: Dict = Body(...)):
 # HEALTH CHECK Y MÉTRICAS DEL SISTEMA
 # ============================================================================
 
+@app.get("/health/live", response_model=Dict[str, Any])
+async def liveness_probe():
+    """El proceso responde; no depende de servicios externos"""
+    return {"status": "alive", "uptime_s": lifecycle.status()["uptime_s"]}
+
+@app.get("/health/ready", response_model=Dict[str, Any])
+async def readiness_probe():
+    """200 solo cuando el servicio puede atender consultas"""
+    status = lifecycle.status()
+    return JSONResponse(status_code=200 if lifecycle.ready else 503, content=status)
+
 @app.get("/health", response_model=Dict[str, Any])
 async def system_health_check():
     firebase_healthy = firebase_manager.is_healthy()
@@ -784,6 +5517,8 @@ async def system_health_check():
         "firebase": "connected" if firebase_healthy else "disconnected",
         "data_retriever": "available" if firebase_healthy else "unavailable",
         "llm_model": "loaded" if groq_healthy else "not loaded",
+        "llm_circuit_breaker": groq_client.breaker.state.value,
+        "lifecycle": lifecycle.status(),
         "rag_service_url": "http://rag_service:8000",
         "components": {
             "firebase": "healthy" if firebase_healthy else "unhealthy",
@@ -802,6 +5537,7 @@ async def system_health_check():
         "model_info": {
             "llm_provider": "Groq",
             "model": groq_client.model,
+            "fallback_model": rag_processor.router.fallback_model or None,
             "max_tokens": 800
         },
         "timestamp": datetime.now().isoformat(),
@@ -809,19 +5545,61 @@ async def system_health_check():
     }
 
 @app.get("/metrics", response_model=Dict[str, Any])
-async def get_system_metrics():
+async def get_system_metrics(request: Request, format: Optional[str] = None):
+    accept = request.headers.get("accept", "")
+    if format == "prometheus" or "openmetrics" in accept or accept.startswith("text/plain"):
+        return PlainTextResponse(
+            telemetry.render_prometheus(prometheus_gauges()),
+            media_type="text/plain; version=0.0.4"
+        )
+    
+    aggregates = data_manager.aggregates
+    if aggregates is None and lifecycle.ready:
+        await asyncio.to_thread(data_manager.get_enriched_dataset)
+        aggregates = data_manager.aggregates
+    
     return {
         "performance_metrics": asdict(rag_processor.metrics),
+        "latency": telemetry.snapshot(),
+        "cluster_metrics": await asyncio.to_thread(rag_processor.cluster_metrics),
         "cache_statistics": {
             "cache_size": len(data_manager.cache),
-            "cache_duration_minutes": data_manager.cache_duration.total_seconds() / 60
+            "cache_duration_minutes": data_manager.cache_duration.total_seconds() / 60,
+            "dataset_version": data_manager.dataset_version,
+            "dataset_refresh": data_manager.refresh_status(),
+            "response_cache": rag_processor.response_cache.stats(),
+            "query_plan_cache": rag_processor.query_plans.stats()
         },
+        "llm_routing": rag_processor.router.stats(),
+        "llm_rate_limit": groq_client.governor.stats(),
+        "llm_circuit_breaker": groq_client.breaker.stats(),
+        "query_log": query_log_writer.stats(),
         "dataset_info": {
-            "total_records": len(data_manager.get_enriched_dataset()),
+            "total_records": aggregates.record_count if aggregates is not None else 0,
+            "aggregates": aggregates.summary() if aggregates is not None else {},
             "last_refresh": data_manager.cache_metadata.get("enriched_persons", "Never").isoformat() if isinstance(data_manager.cache_metadata.get("enriched_persons"), datetime) else "Never"
         }
     }
 
+def prometheus_gauges() -> Dict[str, Tuple[str, float]]:
+    """Estado puntual de los componentes para la exposición de Prometheus"""
+    governor = groq_client.governor.stats()
+    log_stats = query_log_writer.stats()
+    aggregates = data_manager.aggregates
+    return {
+        "rag_ready": ("1 si el servicio acepta consultas", 1 if lifecycle.ready else 0),
+        "rag_llm_available": ("1 si el circuito hacia Groq está cerrado", 1 if groq_client.is_available else 0),
+        "rag_llm_queue_depth": ("Peticiones esperando turno del governor", governor["queue_depth"]),
+        "rag_llm_in_flight": ("Peticiones en curso hacia Groq", governor["in_flight"]),
+        "rag_llm_rate_limited_total": ("Respuestas 429 recibidas", governor["rate_limited_responses"]),
+        "rag_llm_model_fallbacks_total": ("Reintentos con el modelo de respaldo por validación fallida", rag_processor.router.fallbacks),
+        "rag_response_cache_hit_rate": ("Tasa de aciertos del cache de respuestas", rag_processor.response_cache.hit_rate),
+        "rag_query_plan_cache_hit_rate": ("Tasa de aciertos del cache de planes de consulta", rag_processor.query_plans.hit_rate),
+        "rag_log_queue_depth": ("Logs de consultas pendientes de escribir", log_stats["queue_depth"]),
+        "rag_log_dropped_total": ("Logs descartados por cola llena", log_stats["dropped"]),
+        "rag_dataset_records": ("Registros en el snapshot del dataset", aggregates.record_count if aggregates is not None else 0)
+    }
+
 @app.get("/documentation", response_model=Dict[str, Any])
 async def get_system_documentation():
     return {
@@ -869,6 +5647,10 @@ async def get_system_documentation():
 
 @app.post("/evaluate", response_model=Dict[str, Any])
 async def evaluate_system_performance():
+    unavailable = not_ready_response()
+    if unavailable is not None:
+        return unavailable
+    
     test_queries = [
         "¿Cuántas personas hay registradas?",
         "¿Cuántos hombres de más de 25 años?", 
@@ -882,7 +5664,7 @@ async def evaluate_system_performance():
         start_time = time.time()
         
         try:
-            result = rag_processor.process_academic_query(query)
+            result = await rag_processor.process_academic_query(query)
             processing_time = time.time() - start_time
             
             evaluation_results.append({
@@ -941,17 +5723,28 @@ async def startup_event():
     
     if missing_vars:
         logger.error(f"❌ Variables de entorno faltantes: {missing_vars}")
-        raise ValueError(f"Variables requeridas: {missing_vars}")
     
     os.makedirs("/app/logs", exist_ok=True)
+    if int(os.getenv("RAG_WORKERS", "1")) > 1 and not state_backend.shared:
+        logger.warning("⚠️ Varios workers con STATE_BACKEND=memory: cada uno tendrá su propia cache y métricas")
+    query_log_writer.start()
+    rag_processor.metrics_writer.start()
+    lifecycle.start()
     
-    logger.info("✅ Sistema RAG Académico iniciado correctamente")
+    logger.info("✅ Sistema RAG Académico aceptando conexiones; inicialización en segundo plano")
 
 @app.on_event("shutdown") 
 async def shutdown_event():
     """Evento de cierre del sistema"""
     logger.info("🛑 Sistema RAG Académico cerrando...")
     
+    await lifecycle.stop()
+    await groq_client.aclose()
+    data_manager.stop_incremental_sync()
+    await asyncio.to_thread(query_log_writer.stop)
+    logger.info(f"🗂️ Logs de consultas: {query_log_writer.stats()}")
+    await asyncio.to_thread(rag_processor.metrics_writer.stop)
+    
     final_metrics = asdict(rag_processor.metrics)
     logger.info(f"📈 Métricas finales: {final_metrics}")
 
@@ -0,0 +1,161 @@
+"""
+Configuración común de las pruebas: importa rag_service sin Firebase ni Groq reales
+y construye datasets sintéticos deterministas.
+
+    cd llm_service && python -m pytest -q tests
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools")
+
+os.environ.setdefault("RAG_LOG_FILE", os.path.join(tempfile.gettempdir(), "rag_tests.log"))
+os.environ.setdefault("RAG_LOG_LEVEL", "WARNING")
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ.setdefault("GROQ_API_KEY", "gsk_test")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, TOOLS_DIR)
+
+import httpx
+import pytest
+
+import fake_groq
+import rag_service
+
+CURRENT_DATE = datetime(2026, 6, 15)
+FIRST_NAMES = ["José", "María", "Ana", "Luis", "Carlos", "Sofía", "Juan", "Lucía", "Andrés", "Valentina"]
+SECOND_NAMES = ["", "Alberto", "Isabel", "Camila", "David"]
+SURNAMES = ["Pérez", "Gómez", "Rodríguez", "López", "Martínez", "Zuluaga"]
+GENDERS = ["Masculino", "Femenino", "M", "F", "Otro"]
+
+def make_documents(count: int, seed: int = 7):
+    """(doc_id, documento) con los campos que escribe el frontend, incluidos registros incompletos"""
+    rng = random.Random(seed)
+    epoch = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    documents = []
+    for number in range(count):
+        birth = datetime(rng.randint(1950, 2015), rng.randint(1, 12), rng.randint(1, 28))
+        first = rng.choice(FIRST_NAMES)
+        created = epoch + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+        raw = {
+            "primerNombre": first,
+            "segundoNombre": rng.choice(SECOND_NAMES),
+            "apellidos": f"{rng.choice(SURNAMES)} {rng.choice(SURNAMES)}",
+            "nroDocumento": str(10_000_000 + number),
+            "genero": rng.choice(GENDERS),
+            "correo": f"{rag_service.fold_accents(first)}.{number}@correo.test",
+            "celular": f"3{rng.randint(0, 99):02d}{rng.randint(0, 9_999_999):07d}",
+            "fechaNacimiento": birth.strftime("%d/%m/%Y") if number % 10 == 0 else birth.strftime("%Y-%m-%d"),
+            "createdAt": created.isoformat().replace("+00:00", "Z")
+        }
+        if number % 37 == 0:
+            raw["fechaNacimiento"] = ""
+        documents.append((f"doc{number:05d}", raw))
+    return documents
+
+def build_columns(manager, records, version="test-version"):
+    """Columnas con el snapshot de agregados de la misma versión, como las publica el gestor"""
+    columns = rag_service.PersonColumns.from_records(records, version)
+    columns.aggregates = rag_service.AggregateSnapshot.from_records(records, manager.age_ranges, version)
+    return columns
+
+@pytest.fixture(scope="session")
+def data_manager():
+    return rag_service.IntelligentDataManager(rag_service.FirebaseManager())
+
+@pytest.fixture(scope="session")
+def records(data_manager):
+    return data_manager.enrich_documents(make_documents(400), CURRENT_DATE)
+
+@pytest.fixture
+def columns(records):
+    return rag_service.PersonColumns.from_records(records)
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+    
+    def to_dict(self):
+        return dict(self._data)
+
+class FakeQuery:
+    """Subconjunto de la API de consultas de Firestore que usa FirestoreBulkLoader"""
+    
+    def __init__(self, documents, fields=None, start=None, end=None, after=None, size=None):
+        self.documents = documents
+        self.fields, self.start, self.end, self.after, self.size = fields, start, end, after, size
+    
+    def _with(self, **changes):
+        state = dict(fields=self.fields, start=self.start, end=self.end, after=self.after, size=self.size)
+        state.update(changes)
+        return FakeQuery(self.documents, **state)
+    
+    def select(self, fields):
+        return self._with(fields=list(fields))
+    
+    def order_by(self, field):
+        return self
+    
+    def start_at(self, cursor):
+        return self._with(start=cursor["__name__"])
+    
+    def end_before(self, cursor):
+        return self._with(end=cursor["__name__"])
+    
+    def start_after(self, snapshot):
+        return self._with(after=snapshot.id)
+    
+    def limit(self, size):
+        return self._with(size=size)
+    
+    def stream(self):
+        emitted = 0
+        for doc_id in sorted(self.documents):
+            if self.start is not None and doc_id < self.start or self.end is not None and doc_id >= self.end:
+                continue
+            if self.after is not None and doc_id <= self.after:
+                continue
+            if self.size is not None and emitted >= self.size:
+                return
+            data = self.documents[doc_id]
+            if self.fields is not None:
+                data = {name: data[name] for name in self.fields if name in data}
+            emitted += 1
+            yield FakeSnapshot(doc_id, data)
+
+class FakeFirebase:
+    """Sustituye a FirebaseManager: colección en memoria, siempre sana"""
+    
+    def __init__(self, documents):
+        self.collection = FakeQuery(dict(documents))
+    
+    def is_healthy(self):
+        return True
+
+@pytest.fixture
+def fake_groq_server(monkeypatch):
+    """fake_groq.py sin latencia y con contadores limpios; los tests ajustan sus módulos a gusto"""
+    monkeypatch.setattr(fake_groq, "LATENCY_MS", 0.0)
+    monkeypatch.setattr(fake_groq, "TOKEN_DELAY_MS", 0.0)
+    monkeypatch.setattr(fake_groq, "MODEL_LATENCY_MS", {})
+    monkeypatch.setattr(fake_groq, "INVALID_MODELS", set())
+    monkeypatch.setattr(fake_groq, "FIXED_ANSWER", None)
+    monkeypatch.setattr(fake_groq, "REQUESTS_PER_MINUTE", 0)
+    monkeypatch.setattr(fake_groq, "TOKENS_PER_MINUTE", 0)
+    monkeypatch.setattr(fake_groq, "_window", fake_groq.deque())
+    monkeypatch.setattr(fake_groq, "stats", {"accepted": 0, "rate_limited": 0, "truncated": 0, "by_model": {}})
+    return fake_groq
+
+def groq_client_for(server) -> "rag_service.GroqLLMClient":
+    """GroqLLMClient cuyo pool HTTP llega a la app de fake_groq en el mismo proceso (sin red)"""
+    client = rag_service.GroqLLMClient()
+    client.base_url = "http://fake-groq/openai/v1/chat/completions"
+    client._async_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app),
+                                             limits=client.pool_limits)
+    client.ready = True
+    return client
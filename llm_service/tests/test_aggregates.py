@@ -0,0 +1,110 @@
+"""Snapshot de agregados mantenido incrementalmente (user-011)"""
+import random
+from dataclasses import replace
+from datetime import datetime
+
+import pytest
+
+import rag_service
+from rag_service import AggregateSnapshot, DatasetSnapshotFile, InMemoryChangeSource, IntelligentDataManager, PersonColumns
+
+from tests.conftest import CURRENT_DATE, make_documents
+
+def snapshot_of(manager, records):
+    return AggregateSnapshot.from_records(records, manager.age_ranges)
+
+def comparable(snapshot):
+    snapshot._refresh_registration()
+    return (snapshot.total, snapshot.record_count, snapshot.gender_counts.tolist(),
+            snapshot.age_histogram.tolist(), snapshot.month_histogram.tolist(),
+            snapshot.with_email, snapshot.with_phone, snapshot.first_registered, snapshot.last_registered)
+
+def test_statistics_match_columnar_scan(data_manager, records):
+    columns = PersonColumns.from_records(records)
+    assert snapshot_of(data_manager, records).as_statistics() == columns.statistics(columns.indexes.valid_ids)
+
+def test_add_remove_matches_rebuild(data_manager, records):
+    rng = random.Random(3)
+    removed = rng.sample(records, 60)
+    kept = [record for record in records if record not in removed]
+    
+    snapshot = snapshot_of(data_manager, records)
+    snapshot.records_provider = lambda: kept
+    for record in removed:
+        snapshot.remove(record)
+    assert comparable(snapshot) == comparable(snapshot_of(data_manager, kept))
+    
+    for record in removed:
+        snapshot.add(record)
+    assert comparable(snapshot) == comparable(snapshot_of(data_manager, records))
+
+def test_copy_is_independent(data_manager, records):
+    snapshot = snapshot_of(data_manager, records)
+    clone = snapshot.copy()
+    clone.remove(records[0])
+    assert snapshot.record_count == len(records)
+    assert clone.record_count == len(records) - 1
+
+def test_incremental_removal_of_first_registered_updates_statistics():
+    manager = IntelligentDataManager(rag_service.FirebaseManager())
+    source = InMemoryChangeSource(dict(make_documents(80, seed=11)))
+    manager.start_incremental_sync(source)
+    try:
+        first = min((record for record in manager.records_by_id.values()
+                     if record.nombre_completo.strip() and record.fecha_registro),
+                    key=lambda record: record.fecha_registro)
+        statistics = manager.aggregates.as_statistics()
+        assert statistics["informacion_registro"]["primera_persona_registrada"]["nombre"] == first.nombre_completo
+        
+        source.remove(first.doc_id)
+        assert manager.aggregates.as_statistics() == snapshot_of(manager, list(manager.records_by_id.values())).as_statistics()
+        assert manager.aggregates.first_registered[1] != first.doc_id
+    finally:
+        manager.stop_incremental_sync()
+
+def with_outliers(records):
+    """Edades imposibles (fechas de nacimiento mal cargadas) y varios registros en el mismo instante"""
+    changed = list(records)
+    for position, age in ((5, 180), (40, 212), (41, 151), (90, 150)):
+        changed[position] = replace(changed[position], edad=age)
+    registered = [record.fecha_registro for record in changed if record.fecha_registro]
+    for position in (12, 60, 200):
+        changed[position] = replace(changed[position], fecha_registro=min(registered))
+    for position in (3, 150, 300):
+        changed[position] = replace(changed[position], fecha_registro=max(registered))
+    return changed
+
+def test_outlier_ages_match_columnar_statistics(data_manager, records):
+    outlying = with_outliers(records)
+    columns = PersonColumns.from_records(outlying)
+    snapshot = snapshot_of(data_manager, outlying)
+    expected = columns.statistics(columns.indexes.valid_ids)
+    
+    assert snapshot.as_statistics() == expected
+    assert expected["estadisticas_edad"]["edad_maxima"] == 212
+    for code in (PersonColumns.MALE, PersonColumns.FEMALE):
+        ages = columns.edad[columns.indexes.valid_ids[columns.genero_code[columns.indexes.valid_ids] == code]]
+        assert snapshot.mean_age(code) == pytest.approx(ages[ages >= 0].mean())
+
+def test_registration_ties_do_not_depend_on_insertion_order(data_manager, records):
+    outlying = with_outliers(records)
+    shuffled = list(outlying)
+    random.Random(5).shuffle(shuffled)
+    columns = PersonColumns.from_records(outlying)
+    expected = columns.statistics(columns.indexes.valid_ids)["informacion_registro"]
+    assert snapshot_of(data_manager, shuffled).as_statistics()["informacion_registro"] == expected
+
+def test_outliers_survive_removal_and_snapshot_file(tmp_path, data_manager, records):
+    outlying = with_outliers(records)
+    snapshot = snapshot_of(data_manager, outlying)
+    snapshot.remove(outlying[40])
+    assert snapshot.age_bounds()[1] == 180
+    assert snapshot.age_outliers == snapshot_of(data_manager, outlying[:40] + outlying[41:]).age_outliers
+    
+    columns = PersonColumns.from_records(outlying, "outliers")
+    columns.aggregates = snapshot_of(data_manager, outlying)
+    path = str(tmp_path / "dataset.snap")
+    DatasetSnapshotFile.write(path, columns, columns.aggregates, datetime(2026, 6, 15))
+    restored = DatasetSnapshotFile.open(path).aggregates
+    assert restored.age_outliers == columns.aggregates.age_outliers
+    assert restored.as_statistics() == columns.statistics(columns.indexes.valid_ids)
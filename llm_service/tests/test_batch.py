@@ -0,0 +1,83 @@
+"""Lotes de consultas empaquetadas en una sola llamada al LLM, contra fake_groq (user-012)"""
+import asyncio
+
+import pytest
+
+import rag_service
+from rag_service import RateLimitExceeded
+
+from tests.conftest import build_columns, groq_client_for
+
+QUERIES = ["¿Quién es Ana?", "¿Cuántos hombres hay?", "¿Correo de Luis?"]
+
+@pytest.fixture
+def processor(fake_groq_server, data_manager, records, monkeypatch):
+    processor = rag_service.AcademicRAGProcessor(groq_client_for(fake_groq_server), data_manager)
+    processor.batch_pack_size = len(QUERIES)
+    columns = build_columns(data_manager, records)
+
+    async def prepare(user_query, start_time, prepared_columns=None):
+        compiled = processor.query_plans.compile(user_query)
+        llm_request = rag_service.LLMRequest(
+            prompt=f"PREGUNTA: {user_query}{processor.prompt_encoder.RESPONSE_SUFFIX}", max_tokens=60,
+            cache_key=f"clave:{user_query}", analysis=compiled.analysis, dataset_size=len(columns),
+            user_query=user_query, columns=columns
+        )
+        return None, llm_request
+
+    monkeypatch.setattr(processor, "_prepare_query", prepare)
+    return processor
+
+@pytest.fixture
+def payloads(processor, monkeypatch):
+    """Cuerpos enviados a la API, para revisar el prompt de sistema de cada llamada"""
+    sent = []
+    build_payload = processor.llm._build_payload
+
+    def spy(*args, **kwargs):
+        payload = build_payload(*args, **kwargs)
+        sent.append(payload)
+        return payload
+
+    monkeypatch.setattr(processor.llm, "_build_payload", spy)
+    return sent
+
+def test_group_is_answered_by_one_packed_call(processor, payloads, fake_groq_server):
+    fake_groq_server.FIXED_ANSWER = "[1] Ana Pérez.\n[2] Hay 120 hombres.\n[3] luis.3@correo.test"
+    results, summary = asyncio.run(processor.process_batch(QUERIES))
+
+    assert [result["answer"] for result in results] == ["Ana Pérez.", "Hay 120 hombres.", "luis.3@correo.test"]
+    assert (summary["llm_calls"], len(payloads)) == (1, 1)
+    system_prompt = payloads[0]["messages"][0]["content"]
+    assert system_prompt == processor.llm._get_packed_system_prompt()
+    assert "[número] respuesta" in system_prompt
+    assert all(f"### CONSULTA {number}" in payloads[0]["messages"][1]["content"] for number in (1, 2, 3))
+    assert all(asyncio.run(processor.response_cache.get(f"clave:{query}")) for query in QUERIES)
+
+def test_missing_answers_are_completed_individually(processor, payloads, fake_groq_server):
+    fake_groq_server.FIXED_ANSWER = "[2] Hay 120 hombres."
+    results, _ = asyncio.run(processor.process_batch(QUERIES))
+
+    assert len(payloads) == 3
+    individual = [payload["messages"][0]["content"] for payload in payloads[1:]]
+    assert individual == [processor.llm._get_system_prompt()] * 2
+    assert results[1]["answer"] == "Hay 120 hombres."
+
+def test_rejected_group_falls_back_locally_once(processor, payloads):
+    attempts = []
+
+    async def acquire(estimated_tokens, deadline_at=None):
+        attempts.append(estimated_tokens)
+        raise RateLimitExceeded("cola llena")
+    processor.llm.governor.acquire = acquire
+
+    results, summary = asyncio.run(processor.process_batch(QUERIES))
+    assert [result["metadata"]["query_type"] for result in results] == ["local_fallback"] * 3
+    assert len(attempts) == 1
+    assert payloads == []
+    assert processor._inflight == {}
+
+def test_single_request_groups_use_the_default_prompt(processor, payloads, fake_groq_server):
+    results, summary = asyncio.run(processor.process_batch(QUERIES[:1]))
+    assert results[0]["answer"] == f"Respuesta simulada para: {QUERIES[0]}"
+    assert payloads[0]["messages"][0]["content"] == processor.llm._get_system_prompt()
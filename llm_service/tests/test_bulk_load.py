@@ -0,0 +1,118 @@
+"""Carga paralela y proyectada desde Firestore con enriquecimiento en bloque (user-020, user-022)"""
+import pytest
+
+import rag_service
+
+from tests.conftest import FakeFirebase, make_documents
+
+@pytest.fixture
+def documents():
+    # Ids como los automáticos de Firestore para repartir entre particiones
+    return [(f"{index:03d}{doc_id}", raw) for index, (doc_id, raw) in enumerate(make_documents(300, seed=5))]
+
+def loading_manager(documents, **settings):
+    manager = rag_service.IntelligentDataManager(rag_service.FirebaseManager())
+    manager.firebase = FakeFirebase(documents)
+    manager.load_page_size = 40
+    for name, value in settings.items():
+        setattr(manager, name, value)
+    return manager
+
+def test_partitioned_load_matches_direct_enrichment(documents):
+    manager = loading_manager(documents)
+    loaded = manager._load_enriched_data()
+    expected = manager.enrich_documents(sorted(documents), rag_service.datetime.now())
+    assert [record.doc_id for record in loaded] == [record.doc_id for record in expected]
+    assert loaded == expected
+
+def test_process_pool_respects_threshold(documents):
+    manager = loading_manager(documents, enrich_processes=2, enrich_process_threshold=10_000)
+    loaded = manager._load_enriched_data()
+    assert manager.last_enrichment["processes"] == 1
+    assert manager.last_enrichment["documents"] == len(documents)
+    assert manager.last_enrichment["firestore_load"]["pages"] > 1
+    assert len(loaded) == manager.last_enrichment["records"]
+
+def test_process_pool_above_threshold_uses_chunks(documents):
+    manager = loading_manager(documents, enrich_processes=2, enrich_process_threshold=100, enrich_chunk_size=100)
+    loaded = manager._load_enriched_data()
+    assert manager.last_enrichment["processes"] == 2
+    expected = manager.enrich_documents(sorted(documents), rag_service.datetime.now())
+    assert [record.doc_id for record in loaded] == [record.doc_id for record in expected]
+
+@pytest.fixture
+def numbered_documents():
+    # Ids propios (números de documento): todos caen antes de 'G', el primer corte del alfabeto
+    return [(str(1_000_000_000 + index * 7919), raw) for index, (_, raw) in enumerate(make_documents(300, seed=9))]
+
+class FakeReference:
+    def __init__(self, doc_id, parent=None):
+        self.id = doc_id
+        self.parent = parent
+
+def partitioned(documents, cut_ids, subcollection_cut=None):
+    """FakeQuery con id y un cliente cuyo collection_group devuelve cortes como PartitionQuery"""
+    collection = FakeFirebase(documents).collection
+    collection.id, collection.parent = "personas", None
+    ends = [FakeReference(doc_id, FakeReference("personas")) for doc_id in cut_ids]
+    if subcollection_cut:
+        # Misma colección anidada bajo otro documento: su cursor no sirve para esta consulta
+        ends.append(FakeReference(subcollection_cut, FakeReference("personas", parent=FakeReference("grupo"))))
+
+    class Client:
+        def collection_group(self, collection_id):
+            assert collection_id == "personas"
+            return self
+
+        def get_partitions(self, count):
+            assert count == 3
+            for end in sorted(ends, key=lambda reference: reference.id) + [None]:
+                yield type("Partition", (), {"end_at": end})()
+
+    collection._client = Client()
+    return collection
+
+def test_alphabet_split_leaves_custom_ids_in_one_partition(numbered_documents):
+    loader = rag_service.FirestoreBulkLoader(FakeFirebase(numbered_documents).collection, page_size=40)
+    pages = loader.load(lambda page: page)
+    assert loader.split_source == "id_alphabet"
+    assert loader.documents_by_partition == [300, 0, 0, 0]
+    assert sum(len(page) for page in pages) == 300
+
+def test_sampled_ids_balance_custom_ids(numbered_documents):
+    sample = [doc_id for doc_id, _ in numbered_documents[::3]]
+    added = [("0999", {"primerNombre": "Nueva"}), ("9999999999", {"primerNombre": "Última"})]
+    loader = rag_service.FirestoreBulkLoader(FakeFirebase(numbered_documents + added).collection, page_size=40,
+                                             sample_ids=sample)
+    pages = loader.load(lambda page: page)
+    assert loader.split_source == "sampled_ids"
+    assert max(loader.documents_by_partition) - min(loader.documents_by_partition) <= 3
+    loaded = [doc_id for page in pages for doc_id, _ in page]
+    assert loaded == sorted(doc_id for doc_id, _ in numbered_documents + added)
+
+def test_partition_query_cuts_are_used_without_a_sample(numbered_documents):
+    ids = sorted(doc_id for doc_id, _ in numbered_documents)
+    collection = partitioned(numbered_documents, [ids[75], ids[150], ids[225]], subcollection_cut=ids[10])
+    loader = rag_service.FirestoreBulkLoader(collection, page_size=40)
+    loader.load(lambda page: page)
+    assert loader.split_source == "partition_query"
+    assert loader.documents_by_partition == [75, 75, 75, 75]
+
+def test_failed_partition_query_falls_back_to_the_alphabet(numbered_documents):
+    collection = FakeFirebase(numbered_documents).collection
+    collection.id, collection._client = "personas", object()
+    loader = rag_service.FirestoreBulkLoader(collection)
+    loader.load(lambda page: page)
+    assert loader.split_source == "id_alphabet"
+    assert loader.documents == 300
+
+def test_reload_splits_by_the_previous_dataset(numbered_documents):
+    manager = loading_manager(numbered_documents)
+    first = manager._load_enriched_data()
+    assert manager.last_enrichment["firestore_load"]["split_source"] == "id_alphabet"
+    manager.cache["enriched_persons"] = first
+
+    assert manager._load_enriched_data() == first
+    load = manager.last_enrichment["firestore_load"]
+    assert load["split_source"] == "sampled_ids"
+    assert max(load["documents_by_partition"]) - min(load["documents_by_partition"]) <= 3
@@ -0,0 +1,117 @@
+"""Circuit breaker hacia Groq: transiciones de estado y sonda única en semiabierto (user-014)"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from rag_service import CircuitBreaker, CircuitOpenError, CircuitState
+
+from tests.conftest import groq_client_for
+
+def make_breaker(threshold=3, reset=0.05):
+    return CircuitBreaker(failure_threshold=threshold, reset_timeout=reset)
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+def test_opens_after_consecutive_failures():
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN and breaker.is_open
+    assert breaker.stats()["times_opened"] == 1
+
+def test_success_resets_the_failure_count():
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.consecutive_failures == 1
+
+def test_open_circuit_rejects_until_the_reset_timeout():
+    breaker = make_breaker(reset=10)
+    open_breaker(breaker)
+    assert not breaker.allow_request()
+    assert not breaker.allow_request()
+    stats = breaker.stats()
+    assert stats["rejected_requests"] == 2
+    assert 9 < stats["retry_in_s"] <= 10
+
+def test_half_open_admits_a_single_probe():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert not breaker.is_open
+    assert breaker.allow_request()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.is_open
+    assert not breaker.allow_request()
+
+def test_probe_success_closes():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+def test_probe_failure_reopens_immediately():
+    breaker = make_breaker(threshold=5)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.stats()["times_opened"] == 2
+    assert not breaker.allow_request()
+
+def test_released_probe_lets_the_next_request_probe():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow_request()
+
+def test_trip_opens_from_closed():
+    breaker = make_breaker(reset=10)
+    breaker.trip()
+    assert breaker.state == CircuitState.OPEN and not breaker.allow_request()
+
+def test_client_opens_on_connection_errors_and_recovers_through_the_fake(fake_groq_server):
+    client = groq_client_for(fake_groq_server)
+    client.max_retries = 1
+    client.breaker = make_breaker(threshold=2, reset=0.05)
+    connections = []
+
+    def refuse(request):
+        connections.append(request)
+        raise httpx.ConnectError("conexión rechazada", request=request)
+
+    healthy = client._async_client
+    client._async_client = httpx.AsyncClient(transport=httpx.MockTransport(refuse))
+
+    async def scenario():
+        assert await client.complete("PREGUNTA: uno", max_tokens=20) is None
+        assert await client.complete("PREGUNTA: dos", max_tokens=20) is None
+        assert client.breaker.state == CircuitState.OPEN
+        with pytest.raises(CircuitOpenError):
+            await client.complete("PREGUNTA: tres", max_tokens=20, raise_rejections=True)
+        assert len(connections) == 2
+
+        client._async_client = healthy
+        await asyncio.sleep(0.06)
+        return await client.complete("PREGUNTA: cuatro", max_tokens=20)
+
+    probe = asyncio.run(scenario())
+    assert probe.text == "Respuesta simulada para: cuatro"
+    assert client.breaker.state == CircuitState.CLOSED
+    assert client.governor.stats()["in_flight"] == 0
@@ -0,0 +1,110 @@
+"""Coalescencia de llamadas idénticas al LLM, también bajo cancelación (user-012)"""
+import asyncio
+
+import pytest
+
+import rag_service
+from rag_service import LLMRequest
+
+class FakeCompletion:
+    """Sustituye a _complete_routed: cuenta llamadas y puede quedarse colgada hasta que se la libere"""
+    
+    def __init__(self, answer: str = "respuesta", hang: bool = False):
+        self.answer = answer
+        self.hang = hang
+        self.calls = 0
+        self.started = asyncio.Event()
+    
+    async def __call__(self, llm_request):
+        self.calls += 1
+        self.started.set()
+        if self.hang:
+            await asyncio.Event().wait()
+        await asyncio.sleep(0.01)
+        return self.answer
+
+@pytest.fixture
+def processor():
+    return rag_service.AcademicRAGProcessor(rag_service.groq_client, rag_service.data_manager)
+
+def make_request(key: str = "clave") -> LLMRequest:
+    return LLMRequest(prompt="contexto", max_tokens=50, cache_key=key, analysis={}, dataset_size=0)
+
+def test_identical_requests_share_one_call(processor):
+    fake = FakeCompletion()
+    processor._complete_routed = fake
+    
+    async def scenario():
+        return await asyncio.gather(*(processor._complete_coalesced(make_request()) for _ in range(5)))
+    
+    assert asyncio.run(scenario()) == ["respuesta"] * 5
+    assert fake.calls == 1
+    assert processor._inflight == {}
+
+def test_cancelled_owner_releases_key_and_waiter_calls_again(processor):
+    fake = FakeCompletion(hang=True)
+    processor._complete_routed = fake
+    
+    async def scenario():
+        owner = asyncio.create_task(processor._complete_coalesced(make_request()))
+        await fake.started.wait()
+        waiter = asyncio.create_task(processor._complete_coalesced(make_request()))
+        await asyncio.sleep(0)
+        fake.hang = False
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        answer = await asyncio.wait_for(waiter, 1)
+        later = await asyncio.wait_for(processor._complete_coalesced(make_request()), 1)
+        return answer, later
+    
+    assert asyncio.run(scenario()) == ("respuesta", "respuesta")
+    assert processor._inflight == {}
+
+def test_waiter_gives_up_after_coalesce_wait(processor):
+    fake = FakeCompletion(hang=True)
+    processor._complete_routed = fake
+    processor.coalesce_wait = 0.05
+    
+    async def scenario():
+        owner = asyncio.create_task(processor._complete_coalesced(make_request()))
+        await fake.started.wait()
+        fake.hang = False
+        answer = await asyncio.wait_for(processor._complete_coalesced(make_request()), 1)
+        owner.cancel()
+        await asyncio.gather(owner, return_exceptions=True)
+        return answer
+    
+    assert asyncio.run(scenario()) == "respuesta"
+    assert fake.calls == 2
+    assert processor._inflight == {}
+
+def test_cancelled_group_releases_all_keys(processor):
+    fake = FakeCompletion(hang=True)
+    processor._complete_routed = fake
+    
+    async def scenario():
+        group = asyncio.create_task(processor._complete_group([make_request("a")]))
+        await fake.started.wait()
+        waiter = processor._inflight["a"]
+        group.cancel()
+        await asyncio.gather(group, return_exceptions=True)
+        with pytest.raises(rag_service.InflightCallCancelled):
+            await processor._await_inflight(waiter)
+    
+    asyncio.run(scenario())
+    assert processor._inflight == {}
+
+def test_failed_owner_propagates_error_to_waiters(processor):
+    async def failing(llm_request):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("groq caído")
+    processor._complete_routed = failing
+    
+    async def scenario():
+        return await asyncio.gather(*(processor._complete_coalesced(make_request()) for _ in range(3)),
+                                    return_exceptions=True)
+    
+    outcomes = asyncio.run(scenario())
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    assert processor._inflight == {}
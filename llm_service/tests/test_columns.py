@@ -0,0 +1,72 @@
+"""Vista columnar del dataset y estadísticas vectorizadas (user-005)"""
+import numpy as np
+
+from rag_service import FEMALE_VALUES, MALE_VALUES, PersonColumns
+
+def test_columns_mirror_records(records, columns):
+    assert len(columns) == len(records)
+    for i, record in enumerate(records):
+        assert columns.edad[i] == (record.edad if record.edad is not None and record.edad >= 0 else -1)
+        assert columns.mes_nacimiento[i] == (record.mes_nacimiento or 0)
+        assert columns.año_nacimiento[i] == (record.año_nacimiento or 0)
+        assert columns.genero_values[columns.genero_index[i]] == (record.genero or '')
+        assert columns.nombre_completo[i] == (record.nombre_completo or '')
+        if record.fecha_registro:
+            assert columns.registro_ts[i] == record.fecha_registro.timestamp()
+        else:
+            assert np.isnan(columns.registro_ts[i])
+
+def test_gender_codes(records, columns):
+    for i, record in enumerate(records):
+        genero = (record.genero or '').lower()
+        expected = (PersonColumns.MALE if genero in MALE_VALUES
+                    else PersonColumns.FEMALE if genero in FEMALE_VALUES else PersonColumns.UNKNOWN)
+        assert columns.genero_code[i] == expected
+
+def test_statistics_match_brute_force(records, columns):
+    valid = [record for record in records if record.nombre_completo and record.nombre_completo.strip()]
+    statistics = columns.statistics(columns.indexes.valid_ids)
+    ages = [record.edad for record in valid if record.edad is not None and record.edad >= 0]
+    men = sum((record.genero or '').lower() in MALE_VALUES for record in valid)
+    women = sum((record.genero or '').lower() in FEMALE_VALUES for record in valid)
+
+    assert statistics["conteos_generales"] == {
+        "total_personas": len(valid),
+        "total_hombres": men,
+        "total_mujeres": women,
+        "personas_con_edad_valida": len(ages),
+        "personas_con_correo": sum(bool(record.correo and "@" in record.correo) for record in valid),
+        "personas_con_telefono": sum(bool(record.celular and record.celular.strip()) for record in valid)
+    }
+    assert statistics["estadisticas_edad"] == {
+        "edad_minima": min(ages),
+        "edad_maxima": max(ages),
+        "promedio_edad": round(sum(ages) / len(ages), 1),
+        "personas_mayor_edad": sum(age >= 18 for age in ages),
+        "personas_menor_edad": sum(age < 18 for age in ages)
+    }
+    months = {}
+    for record in valid:
+        if record.mes_nacimiento:
+            name = PersonColumns.MONTH_NAMES[record.mes_nacimiento]
+            months[name] = months.get(name, 0) + 1
+    assert statistics["distribucion_meses_nacimiento"] == months
+    assert statistics["porcentajes_genero"] == {
+        "porcentaje_hombres": round(men / len(valid) * 100, 1),
+        "porcentaje_mujeres": round(women / len(valid) * 100, 1)
+    }
+
+    registered = [record for record in valid if record.fecha_registro]
+    first = min(registered, key=lambda record: (record.fecha_registro, record.doc_id))
+    last = max(registered, key=lambda record: (record.fecha_registro, record.doc_id))
+    assert statistics["informacion_registro"] == {
+        "primera_persona_registrada": {"nombre": first.nombre_completo, "fecha": first.fecha_registro.strftime("%Y-%m-%d")},
+        "ultima_persona_registrada": {"nombre": last.nombre_completo, "fecha": last.fecha_registro.strftime("%Y-%m-%d")}
+    }
+
+def test_statistics_of_empty_selection(columns):
+    statistics = columns.statistics(np.empty(0, dtype=np.int64))
+    assert statistics["conteos_generales"]["total_personas"] == 0
+    assert statistics["estadisticas_edad"] == {}
+    assert statistics["informacion_registro"] == {}
+    assert statistics["porcentajes_genero"] == {"porcentaje_hombres": 0, "porcentaje_mujeres": 0}
@@ -0,0 +1,95 @@
+"""Codificación compacta del contexto: tablas, presupuesto de tokens y prompts agrupados (user-009)"""
+from dataclasses import replace
+
+import pytest
+
+from rag_service import CompactContextEncoder, estimate_tokens
+
+SYSTEM_PROMPT = "Eres un asistente que responde con datos reales."
+
+@pytest.fixture
+def encoder():
+    return CompactContextEncoder(SYSTEM_PROMPT, token_budget=1500, max_records=50)
+
+def decode_table(table):
+    """Inversa de encode_table: {columna: valor} por fila"""
+    header, *lines = table.split('\n')
+    names = header.split('|')
+    return [dict(zip(names, line.split('|'))) for line in lines]
+
+def test_table_round_trip(encoder, records):
+    selected = records[:30]
+    rows = [encoder.encode_row(record) for record in selected]
+    legend, table = encoder.encode_table(rows)
+    decoded = decode_table(table)
+
+    assert len(decoded) == len(selected)
+    for row, values in zip(rows, decoded):
+        expected = {name: value for (name, _), value in zip(encoder.COLUMNS, row) if name in values}
+        assert values == expected
+    for name in decoded[0]:
+        assert f"{name}=" in legend
+
+def test_empty_columns_are_dropped(encoder, records):
+    selected = [replace(record, correo=None, celular="  ") for record in records[:10]]
+    legend, table = encoder.encode_table([encoder.encode_row(record) for record in selected])
+    header = table.split('\n')[0].split('|')
+    assert 'c' not in header and 't' not in header
+    assert 'c=correo' not in legend and 't=celular' not in legend
+    assert 'n' in header
+
+def test_separator_inside_a_value_does_not_break_the_row(encoder, records):
+    record = replace(records[0], nombre_completo="Ana | Pérez")
+    _, table = encoder.encode_table([encoder.encode_row(record)])
+    assert decode_table(table)[0]['n'] == "Ana / Pérez"
+
+def test_empty_table_keeps_only_the_header(encoder):
+    assert encoder.encode_table([]) == ('', '')
+
+def test_build_trims_records_to_the_budget(records, columns):
+    statistics = columns.statistics(columns.indexes.valid_ids)
+    roomy = CompactContextEncoder(SYSTEM_PROMPT, token_budget=100_000, max_records=50)
+    tight = CompactContextEncoder(SYSTEM_PROMPT, token_budget=1200, max_records=50)
+
+    full_prompt, full_info = roomy.build("¿Quién es Ana?", records, statistics, len(records))
+    prompt, info = tight.build("¿Quién es Ana?", records, statistics, len(records))
+
+    assert full_info["records_in_prompt"] == 50
+    assert 0 < info["records_in_prompt"] < 50
+    assert info["prompt_tokens_estimate"] <= 1200
+    assert info["prompt_tokens_estimate"] == estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt)
+    assert info["records_available"] == len(records)
+
+    kept = decode_table(tight.context_of(prompt).split('vacío = sin dato):\n', 1)[1])
+    assert [row['n'] for row in kept] == [record.nombre_completo for record in records[:info["records_in_prompt"]]]
+    assert prompt.endswith(CompactContextEncoder.RESPONSE_SUFFIX)
+
+def test_statistics_block(encoder, columns):
+    statistics = columns.statistics(columns.indexes.valid_ids)
+    text = encoder.encode_statistics(statistics)
+    total = statistics["conteos_generales"]["total_personas"]
+    assert f"total_personas={total}" in text
+    assert f"edad_minima={statistics['estadisticas_edad']['edad_minima']}" in text
+    assert encoder.encode_statistics({}) == ''
+
+def test_pack_and_unpack_round_trip(encoder, records, columns):
+    statistics = columns.statistics(columns.indexes.valid_ids)
+    queries = ["¿Quién es Ana?", "¿Cuántos hombres hay?", "¿Correo de Luis?"]
+    prompts = [encoder.build(query, records[:5], statistics, len(records))[0] for query in queries]
+    contexts = [encoder.context_of(prompt) for prompt in prompts]
+
+    packed = encoder.pack(contexts)
+    assert packed.count(CompactContextEncoder.INSTRUCTIONS) == 1
+    for number, (query, context) in enumerate(zip(queries, contexts), 1):
+        assert f"### CONSULTA {number}\n{context}" in packed
+        assert not context.endswith("RESPUESTA:")
+
+    answers = ["Ana Pérez tiene 30 años.", "Hay 120 hombres.", "luis.3@correo.test"]
+    text = '\n'.join(f"[{number}] {answer}" for number, answer in enumerate(answers, 1))
+    assert encoder.unpack(text, 3) == answers
+
+def test_unpack_tolerates_missing_duplicate_and_stray_lines(encoder):
+    text = "Aquí van:\n[2] segunda\n[2] repetida\n[7] fuera de rango\n[1]   \n  [3] tercera  "
+    assert encoder.unpack(text, 3) == [None, "segunda", "tercera"]
+    assert encoder.unpack("", 2) == [None, None]
+    assert encoder.unpack(None, 1) == [None]
@@ -0,0 +1,41 @@
+"""Enriquecimiento en bloque: mismas fechas aceptadas que el strptime original (user-020)"""
+from datetime import datetime
+
+import pytest
+
+from rag_service import BIRTH_DATE_FORMATS, BulkEnricher
+
+from tests.conftest import CURRENT_DATE
+
+def baseline_parse(value):
+    for date_format in BIRTH_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+@pytest.fixture
+def enricher(data_manager):
+    return BulkEnricher(data_manager.age_ranges, data_manager.month_names, CURRENT_DATE)
+
+@pytest.mark.parametrize("value", [
+    "1990-05-03", "1990-5-3", "1990-05-3", "03/05/1990", "3/5/1990", "1990-05-03T10:20:30", "1990-5-3T1:2:3",
+    "1990-05-03T10:20:30Z", "1990-05-03T10:20:30.5", "1990-02-30", "31/02/1990", "1990/05/03", "1990-+5-03",
+    " 1990-05-03", "1990-05-03 ", "", "sin fecha", "2000-02-29", "29/02/2001"
+])
+def test_parse_date_accepts_the_same_dates_as_strptime(enricher, value):
+    assert enricher.parse_date(value) == baseline_parse(value)
+
+def test_parse_date_after_format_switches(enricher):
+    values = ["1990-05-03", "3/5/1990", "1990-5-3", "03/05/1990", "1990-05-03T10:20:30", "1990-05-03"]
+    assert [enricher.parse_date(value) for value in values] == [baseline_parse(value) for value in values]
+
+def test_unpadded_birth_date_is_enriched(enricher):
+    record = enricher.build("doc", {
+        "primerNombre": "Ana", "apellidos": "Pérez", "nroDocumento": "1",
+        "genero": "F", "fechaNacimiento": "1990-5-3"
+    })
+    assert record is not None
+    assert (record.año_nacimiento, record.mes_nacimiento, record.edad) == (1990, 5, 36)
+    assert not enricher.rejected
@@ -0,0 +1,60 @@
+"""Cliente asíncrono de Groq con pool de conexiones, contra fake_groq (user-001)"""
+import asyncio
+import time
+
+import rag_service
+
+from tests.conftest import groq_client_for
+
+def test_complete_returns_text_and_usage(fake_groq_server):
+    client = groq_client_for(fake_groq_server)
+    completion = asyncio.run(client.complete("PREGUNTA: ¿Quién es Ana?", max_tokens=50, model="llama3-70b-8192"))
+    assert completion.text == "Respuesta simulada para: ¿Quién es Ana?"
+    assert completion.model == "llama3-70b-8192"
+    assert completion.finish_reason == "stop"
+    assert completion.completion_tokens == len(completion.text.split())
+    assert fake_groq_server.stats["by_model"] == {"llama3-70b-8192": 1}
+
+def test_concurrent_calls_do_not_block_the_event_loop(fake_groq_server):
+    fake_groq_server.LATENCY_MS = 100.0
+    client = groq_client_for(fake_groq_server)
+
+    async def scenario():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        beating = asyncio.create_task(heartbeat())
+        started = time.perf_counter()
+        answers = await asyncio.gather(*(client._make_request_with_retry_async(f"PREGUNTA: {i}", 20) for i in range(5)))
+        elapsed = time.perf_counter() - started
+        beating.cancel()
+        return answers, elapsed, ticks
+
+    answers, elapsed, ticks = asyncio.run(scenario())
+    assert answers == [f"Respuesta simulada para: {i}" for i in range(5)]
+    assert elapsed < 0.4
+    assert ticks >= 5
+
+def test_stream_completion_yields_deltas(fake_groq_server):
+    client = groq_client_for(fake_groq_server)
+
+    async def scenario():
+        return [delta async for delta in client.stream_completion("PREGUNTA: hola mundo", max_tokens=50)]
+
+    deltas = asyncio.run(scenario())
+    assert len(deltas) > 1
+    assert ''.join(deltas) == "Respuesta simulada para: hola mundo"
+    assert client.governor.stats()["in_flight"] == 0
+
+def test_connection_pool_is_shared_and_recreated_after_close():
+    client = rag_service.GroqLLMClient()
+    pooled = client._get_async_client()
+    assert client._get_async_client() is pooled
+    asyncio.run(client.aclose())
+    assert pooled.is_closed
+    assert client._get_async_client() is not pooled
@@ -0,0 +1,102 @@
+"""Mantenimiento incremental del dataset con cambios por documento (user-004)"""
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+import rag_service
+from rag_service import InMemoryChangeSource, IntelligentDataManager
+
+from tests.conftest import FakeFirebase, make_documents
+
+class BlockingFirebase(FakeFirebase):
+    """La lectura completa espera a que la prueba la libere"""
+    
+    def __init__(self, documents):
+        super().__init__(documents)
+        self.release = threading.Event()
+        self.reading = threading.Event()
+        self.healthy = True
+    
+    def is_healthy(self):
+        self.reading.set()
+        assert self.release.wait(5)
+        return self.healthy
+
+@pytest.fixture
+def documents():
+    return dict(make_documents(60, seed=21))
+
+@pytest.fixture
+def synced(documents):
+    manager = IntelligentDataManager(rag_service.FirebaseManager())
+    source = InMemoryChangeSource(documents)
+    manager.start_incremental_sync(source)
+    yield manager, source
+    manager.stop_incremental_sync()
+
+def wait_for_resync(manager, timeout=5.0):
+    give_up_at = time.monotonic() + timeout
+    while manager._resync_thread is not None and time.monotonic() < give_up_at:
+        time.sleep(0.01)
+    assert manager._resync_thread is None
+
+def doc_ids(records):
+    return sorted(record.doc_id for record in records)
+
+def test_changes_match_full_enrichment(synced, documents):
+    manager, source = synced
+    source.remove("doc00003")
+    changed = dict(documents["doc00004"], primerNombre="Renombrada")
+    source.set("doc00004", changed)
+    source.set("nuevo", dict(documents["doc00005"], nroDocumento="999"))
+    
+    expected = dict(documents, doc00004=changed, nuevo=dict(documents["doc00005"], nroDocumento="999"))
+    del expected["doc00003"]
+    full = manager.enrich_documents(sorted(expected.items()), rag_service.datetime.now())
+    dataset = manager.get_enriched_dataset()
+    assert doc_ids(dataset) == doc_ids(full)
+    assert sorted(dataset, key=lambda record: record.doc_id) == full
+    assert manager.dataset_version == manager._compute_fingerprint(full)
+
+def test_daily_resync_runs_in_background(synced, documents):
+    manager, source = synced
+    firebase = BlockingFirebase(documents)
+    manager.firebase = firebase
+    served = manager.get_enriched_dataset()
+    manager._synced_on = manager._synced_on - timedelta(days=1)
+    
+    # La consulta no espera a Firestore: sirve el dataset vigente
+    assert doc_ids(manager.get_enriched_dataset()) == doc_ids(served)
+    assert firebase.reading.wait(5)
+    source.remove("doc00007")
+    firebase.release.set()
+    wait_for_resync(manager)
+    
+    assert manager._synced_on == rag_service.datetime.now().date()
+    # La baja llegada durante la relectura prevalece sobre la lectura completa
+    assert "doc00007" not in doc_ids(manager.get_enriched_dataset())
+    assert len(manager.get_enriched_dataset()) == len(served) - 1
+
+def test_failed_resync_keeps_dataset_and_waits_before_retrying(synced, documents):
+    manager, _ = synced
+    firebase = BlockingFirebase(documents)
+    firebase.healthy = False
+    firebase.release.set()
+    manager.firebase = firebase
+    served = manager.get_enriched_dataset()
+    yesterday = manager._synced_on - timedelta(days=1)
+    manager._synced_on = yesterday
+    
+    manager.get_enriched_dataset()
+    assert firebase.reading.wait(5)
+    wait_for_resync(manager)
+    firebase.reading.clear()
+    assert doc_ids(manager.get_enriched_dataset()) == doc_ids(served)
+    assert manager._synced_on == yesterday
+    assert manager._resync_thread is None and not firebase.reading.is_set()
+    manager._resync_attempted_at -= manager.resync_retry
+    manager.get_enriched_dataset()
+    assert firebase.reading.wait(5)
+    wait_for_resync(manager)
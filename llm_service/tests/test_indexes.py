@@ -0,0 +1,70 @@
+"""Índices secundarios y búsqueda por filtros (user-006)"""
+import itertools
+
+import pytest
+
+from rag_service import MALE_VALUES, FEMALE_VALUES, QueryFilter
+
+def brute_force(records, filters):
+    """Ids de los registros válidos que cumplen todos los filtros, recorriendo la lista"""
+    def value_of(record, field):
+        if field == 'edad':
+            return record.edad if record.edad is not None and record.edad >= 0 else None
+        return getattr(record, field) or None
+
+    def holds(record, query_filter):
+        if query_filter.field == 'genero':
+            values = MALE_VALUES if query_filter.value == 'M' else FEMALE_VALUES
+            return (record.genero or '').lower() in values
+        value = value_of(record, query_filter.field)
+        if value is None:
+            return False
+        op, target = query_filter.op, query_filter.value
+        return {
+            'eq': lambda: value == target,
+            'gt': lambda: value > target,
+            'ge': lambda: value >= target,
+            'lt': lambda: value < target,
+            'le': lambda: value <= target,
+            'between': lambda: target[0] <= value <= target[1]
+        }[op]()
+
+    return [
+        i for i, record in enumerate(records)
+        if record.nombre_completo and record.nombre_completo.strip()
+        and all(holds(record, query_filter) for query_filter in filters)
+    ]
+
+AGE_FILTERS = [QueryFilter('edad', op, value) for op, value in
+               [('gt', 30), ('ge', 30), ('lt', 18), ('le', 18), ('eq', 40), ('between', (20, 35)),
+                ('gt', 200), ('lt', 0)]]
+OTHER_FILTERS = [QueryFilter('genero', 'eq', 'M'), QueryFilter('genero', 'eq', 'F'),
+                 QueryFilter('mes_nacimiento', 'eq', 3), QueryFilter('mes_nacimiento', 'ge', 10),
+                 QueryFilter('año_nacimiento', 'lt', 1980)]
+
+@pytest.mark.parametrize("query_filter", AGE_FILTERS + OTHER_FILTERS, ids=repr)
+def test_single_filter_matches_brute_force(records, columns, query_filter):
+    assert columns.indexes.lookup((query_filter,)).tolist() == brute_force(records, [query_filter])
+
+@pytest.mark.parametrize("filters", list(itertools.combinations(AGE_FILTERS[:6] + OTHER_FILTERS, 2)), ids=repr)
+def test_combined_filters_match_brute_force(records, columns, filters):
+    assert columns.indexes.lookup(filters).tolist() == brute_force(records, filters)
+
+def test_no_filters_returns_valid_ids(records, columns):
+    assert columns.indexes.lookup(()).tolist() == brute_force(records, [])
+
+def test_age_extreme(records, columns):
+    valid = brute_force(records, [])
+    ages = [records[i].edad for i in valid if records[i].edad is not None and records[i].edad >= 0]
+    for youngest, target in ((True, min(ages)), (False, max(ages))):
+        age, ids = columns.indexes.age_extreme(youngest)
+        assert age == target
+        assert ids.tolist() == brute_force(records, [QueryFilter('edad', 'eq', target)])
+
+def test_identifier_hits(records, columns):
+    record = records[42]
+    indexes = columns.indexes
+    assert indexes.identifier_hits(f"¿Quién tiene el correo {record.correo.upper()}?") == [42]
+    assert indexes.identifier_hits(f"documento {record.documento}") == [42]
+    assert 42 in indexes.identifier_hits(f"celular {record.celular}")
+    assert indexes.identifier_hits("nadie con 99999999999 ni x@y.test") == []
@@ -0,0 +1,109 @@
+"""Histogramas de latencia por etapa y exposición en formato Prometheus (user-018)"""
+import math
+import random
+import re
+
+import pytest
+
+from rag_service import LatencyHistogram, LatencyTelemetry
+
+RELATIVE_ERROR = LatencyHistogram.GROWTH - 1
+
+@pytest.fixture
+def samples():
+    rng = random.Random(18)
+    return [rng.lognormvariate(-4, 1.2) for _ in range(5000)]
+
+def histogram_of(values):
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+def parse_exposition(text):
+    """{(nombre, etiquetas): valor} de las líneas de muestra"""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        match = re.fullmatch(r'(\w+)(?:\{(.*)\})? (\S+)', line)
+        assert match, line
+        name, labels, value = match.groups()
+        samples[(name, labels or "")] = float(value)
+    return samples
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.99) == 0.0
+    assert histogram.cumulative_at(1.0) == 0
+    assert histogram.summary() == {"count": 0, "avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+@pytest.mark.parametrize("fraction", [0.5, 0.9, 0.95, 0.99, 0.999])
+def test_percentiles_are_within_the_bucket_error(samples, fraction):
+    histogram = histogram_of(samples)
+    exact = sorted(samples)[math.ceil(fraction * len(samples)) - 1]
+    estimate = histogram.percentile(fraction)
+    assert exact <= estimate <= exact * (1 + RELATIVE_ERROR) + 1e-12
+
+def test_percentile_never_exceeds_the_maximum():
+    histogram = histogram_of([0.0123] * 10)
+    assert histogram.percentile(0.5) == histogram.percentile(1.0) == histogram.max == 0.0123
+
+def test_out_of_range_values_are_clamped():
+    histogram = histogram_of([0.0, 1e-7, 500.0])
+    assert histogram.counts[0] == 2
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(1.0) == 500.0
+    assert histogram.count == 3 and histogram.total == pytest.approx(500.0 + 1e-7)
+
+@pytest.mark.parametrize("bound", LatencyTelemetry.PROMETHEUS_BUCKETS)
+def test_cumulative_at_never_counts_values_above_the_bound(samples, bound):
+    histogram = histogram_of(samples)
+    below = sum(value <= bound for value in samples)
+    below_bucket_start = sum(value <= bound / (1 + RELATIVE_ERROR) for value in samples)
+    assert below_bucket_start <= histogram.cumulative_at(bound) <= below
+
+def test_cumulative_at_a_bucket_edge_includes_that_bucket():
+    edge = LatencyHistogram.upper_bound(200)
+    histogram = histogram_of([edge, edge * 1.01])
+    assert histogram.cumulative_at(edge) == 1
+    assert histogram.cumulative_at(LatencyHistogram.upper_bound(201)) == 2
+
+def test_prometheus_exposition(samples):
+    telemetry = LatencyTelemetry()
+    for value in samples[:100]:
+        telemetry.observe("llm_call", value)
+    telemetry.record_query({"metadata": {"query_path": "structured", "query_complexity": "simple"}}, 0.02)
+    telemetry.record_query({"metadata": {"query_path": "structured", "query_complexity": "simple"}}, 0.03)
+    telemetry.record_query({}, 0.5)
+
+    text = telemetry.render_prometheus({"rag_ready": ("1 si el servicio acepta consultas", 1)})
+    assert text.endswith("\n")
+    assert "# TYPE rag_stage_duration_seconds histogram" in text
+    assert "# TYPE rag_queries_total counter" in text
+    assert "# TYPE rag_ready gauge" in text
+    exposed = parse_exposition(text)
+
+    buckets = [exposed[("rag_stage_duration_seconds_bucket", f'stage="llm_call",le="{bound}"')]
+               for bound in LatencyTelemetry.PROMETHEUS_BUCKETS]
+    assert buckets == sorted(buckets)
+    assert exposed[("rag_stage_duration_seconds_bucket", 'stage="llm_call",le="+Inf"')] == 100
+    assert exposed[("rag_stage_duration_seconds_count", 'stage="llm_call"')] == 100
+    assert exposed[("rag_stage_duration_seconds_sum", 'stage="llm_call"')] == pytest.approx(sum(samples[:100]), abs=1e-5)
+
+    histogram = telemetry.histograms["llm_call"]
+    assert exposed[("rag_stage_duration_quantile_seconds", 'stage="llm_call",quantile="0.95"')] == pytest.approx(
+        histogram.percentile(0.95), abs=1e-6)
+
+    assert exposed[("rag_queries_total", 'query_path="structured",complexity="simple"')] == 2
+    assert exposed[("rag_queries_total", 'query_path="unknown",complexity="unknown"')] == 1
+    assert exposed[("rag_stage_duration_seconds_count", 'stage="total"')] == 3
+    assert exposed[("rag_stage_duration_seconds_count", 'stage="total_structured"')] == 2
+    assert exposed[("rag_ready", "")] == 1
+
+def test_stage_context_manager_records_on_error():
+    telemetry = LatencyTelemetry()
+    with pytest.raises(ValueError):
+        with telemetry.stage("filtering"):
+            raise ValueError("filtro inválido")
+    assert telemetry.snapshot()["stages"]["filtering"]["count"] == 1
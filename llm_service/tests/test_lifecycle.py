@@ -0,0 +1,155 @@
+"""Arranque en segundo plano: liveness siempre, readiness solo con datos que servir (user-016)"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+import rag_service
+from rag_service import ComponentState, ServiceLifecycle
+
+class StubFirebase:
+    """connect() falla las primeras `failures` veces y puede quedarse esperando a `gate`"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.collection = None
+
+    def connect(self):
+        self.calls += 1
+        self.gate.wait(5)
+        if self.calls <= self.failures:
+            raise ConnectionError("Firestore no responde")
+
+class StubGroq:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def initialize(self):
+        if self.fail:
+            raise RuntimeError("GROQ_API_KEY inválida")
+
+class StubDataManager:
+    def __init__(self, snapshot=False, dataset_error=None):
+        self.snapshot_path = "/tmp/dataset.snap" if snapshot else ""
+        self.snapshot = snapshot
+        self.dataset_error = dataset_error
+        self.reconciled = False
+        self.dataset_loads = 0
+
+    def load_snapshot(self):
+        return self.snapshot
+
+    def reconcile_snapshot(self):
+        self.reconciled = True
+
+    def get_columnar_dataset(self):
+        self.dataset_loads += 1
+        if self.dataset_error:
+            raise self.dataset_error
+        return object()
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(rag_service.random, "uniform", lambda low, high: 0.01)
+
+def run_startup(lifecycle):
+    async def scenario():
+        lifecycle.start()
+        await asyncio.wait_for(lifecycle._task, 5)
+    asyncio.run(scenario())
+
+def test_not_ready_before_start():
+    lifecycle = ServiceLifecycle(StubFirebase(), StubGroq(), StubDataManager())
+    assert not lifecycle.ready
+    status = lifecycle.status()
+    assert (status["liveness"], status["readiness"]) == ("alive", "starting")
+    assert status["components"] == {"snapshot": "skipped", "firebase": "pending", "groq": "pending", "dataset": "skipped"}
+
+def test_ready_once_firebase_connects_after_retries():
+    firebase = StubFirebase(failures=2)
+    lifecycle = ServiceLifecycle(firebase, StubGroq(), StubDataManager())
+    run_startup(lifecycle)
+    assert lifecycle.ready
+    assert lifecycle.firebase_attempts == 3
+    assert "firebase" not in lifecycle.errors
+    assert lifecycle.status()["readiness"] == "ready"
+
+def test_groq_failure_does_not_block_readiness():
+    lifecycle = ServiceLifecycle(StubFirebase(), StubGroq(fail=True), StubDataManager())
+    run_startup(lifecycle)
+    assert lifecycle.ready
+    assert lifecycle.states["groq"] == ComponentState.FAILED
+    assert "GROQ_API_KEY" in lifecycle.errors["groq"]
+
+def test_warmup_waits_for_the_dataset():
+    manager = StubDataManager()
+    lifecycle = ServiceLifecycle(StubFirebase(), StubGroq(), manager, dataset_warmup=True)
+    lifecycle.states["firebase"] = ComponentState.READY
+    assert not lifecycle.ready
+    run_startup(lifecycle)
+    assert lifecycle.ready
+    assert lifecycle.states["dataset"] == ComponentState.READY
+    assert manager.dataset_loads >= 1
+
+def test_failed_warmup_still_serves():
+    manager = StubDataManager(dataset_error=RuntimeError("lectura parcial"))
+    lifecycle = ServiceLifecycle(StubFirebase(), StubGroq(), manager, dataset_warmup=True)
+    run_startup(lifecycle)
+    assert lifecycle.states["dataset"] == ComponentState.FAILED
+    assert lifecycle.ready
+
+def test_snapshot_makes_the_service_ready_before_firestore():
+    firebase = StubFirebase()
+    firebase.gate.clear()
+    manager = StubDataManager(snapshot=True)
+    lifecycle = ServiceLifecycle(firebase, StubGroq(), manager, dataset_warmup=True)
+
+    async def scenario():
+        lifecycle.start()
+        for _ in range(200):
+            if lifecycle.ready:
+                break
+            await asyncio.sleep(0.01)
+        ready_while_connecting = lifecycle.ready and lifecycle.states["firebase"] == ComponentState.STARTING
+        firebase.gate.set()
+        await asyncio.wait_for(lifecycle._task, 5)
+        return ready_while_connecting
+
+    assert asyncio.run(scenario())
+    assert manager.reconciled
+
+def test_stop_cancels_a_pending_startup():
+    firebase = StubFirebase(failures=10**6)
+    lifecycle = ServiceLifecycle(firebase, StubGroq(), StubDataManager())
+
+    async def scenario():
+        lifecycle.start()
+        await asyncio.sleep(0.05)
+        await lifecycle.stop()
+        return lifecycle._task.cancelled()
+
+    assert asyncio.run(scenario())
+    assert not lifecycle.ready
+
+@pytest.mark.parametrize("firebase_state, ready_code", [(ComponentState.STARTING, 503), (ComponentState.READY, 200)])
+def test_probe_endpoints(monkeypatch, firebase_state, ready_code):
+    lifecycle = ServiceLifecycle(StubFirebase(), StubGroq(), StubDataManager())
+    lifecycle.states["firebase"] = firebase_state
+    monkeypatch.setattr(rag_service, "lifecycle", lifecycle)
+
+    live = asyncio.run(rag_service.liveness_probe())
+    assert live["status"] == "alive"
+
+    ready = asyncio.run(rag_service.readiness_probe())
+    assert ready.status_code == ready_code
+    assert json.loads(ready.body)["components"]["firebase"] == firebase_state.value
+
+    unavailable = rag_service.not_ready_response()
+    if ready_code == 503:
+        assert unavailable.status_code == 503 and unavailable.headers["retry-after"] == "5"
+    else:
+        assert unavailable is None
@@ -0,0 +1,50 @@
+"""Respaldo local cuando el circuito o el governor rechazan la llamada, igual con y sin streaming (user-008, user-014)"""
+import asyncio
+
+import pytest
+
+import rag_service
+from rag_service import RateLimitExceeded
+
+from tests.conftest import build_columns
+
+@pytest.fixture
+def processor(data_manager, records, monkeypatch):
+    client = rag_service.GroqLLMClient()
+    client.ready = True
+    processor = rag_service.AcademicRAGProcessor(client, data_manager)
+    columns = build_columns(data_manager, records)
+    
+    async def prepare(user_query, start_time, prepared_columns=None):
+        compiled = processor.query_plans.compile(user_query)
+        llm_request = rag_service.LLMRequest(
+            prompt="contexto", max_tokens=100, cache_key=f"clave:{user_query}", analysis=compiled.analysis,
+            dataset_size=len(columns), user_query=user_query, columns=columns
+        )
+        return None, llm_request
+    
+    monkeypatch.setattr(processor, "_prepare_query", prepare)
+    return processor
+
+def reject_by_governor(client):
+    async def acquire(estimated_tokens, deadline_at=None):
+        raise RateLimitExceeded("cola llena")
+    client.governor.acquire = acquire
+
+def reject_by_breaker(client):
+    client.breaker.allow_request = lambda: False
+
+async def stream_result(processor, query):
+    events = [event async for event in processor.stream_academic_query(query)]
+    assert [event["event"] for event in events] == ["done"]
+    return events[0]["data"]
+
+@pytest.mark.parametrize("reject", [reject_by_governor, reject_by_breaker])
+def test_stream_and_non_stream_fall_back_alike(processor, reject):
+    reject(processor.llm)
+    query = "¿Quién es la persona más joven registrada?"
+    
+    direct = asyncio.run(processor.process_academic_query(query))
+    streamed = asyncio.run(stream_result(processor, query))
+    assert direct["metadata"]["query_type"] == streamed["metadata"]["query_type"] == "local_fallback"
+    assert direct["answer"] == streamed["answer"]
@@ -0,0 +1,122 @@
+"""Enrutamiento de modelos contra fake_groq: validación, reintentos y respaldo (user-024)"""
+import asyncio
+
+import pytest
+
+import rag_service
+from rag_service import ModelRouter
+
+from tests.conftest import build_columns, groq_client_for
+
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+FALLBACK_MODEL = "llama-3.3-70b-versatile"
+QUERY = "¿Quién es Ana?"
+ANSWER = f"Respuesta simulada para: {QUERY}"
+
+@pytest.fixture
+def processor(fake_groq_server, data_manager, records, monkeypatch):
+    llm = groq_client_for(fake_groq_server)
+    llm.model = DEFAULT_MODEL
+    processor = rag_service.AcademicRAGProcessor(llm, data_manager)
+    processor.router = ModelRouter(DEFAULT_MODEL, FALLBACK_MODEL, fallback_max_tokens=400, min_samples=1)
+    processor.max_tokens = 100
+    columns = build_columns(data_manager, records)
+
+    async def prepare(user_query, start_time, prepared_columns=None):
+        compiled = processor.query_plans.compile(user_query)
+        llm_request = rag_service.LLMRequest(
+            prompt=f"PREGUNTA: {user_query}", max_tokens=processor.max_tokens, cache_key=f"clave:{user_query}",
+            analysis=compiled.analysis, dataset_size=len(columns), user_query=user_query, columns=columns,
+            query_class="lookup"
+        )
+        return None, llm_request
+
+    monkeypatch.setattr(processor, "_prepare_query", prepare)
+    return processor
+
+def ask(processor, query=QUERY):
+    return asyncio.run(processor.process_academic_query(query))
+
+def cached(processor, query=QUERY):
+    return asyncio.run(processor.response_cache.get(f"clave:{query}"))
+
+def test_valid_answer_is_observed_and_cached(processor, fake_groq_server):
+    result = ask(processor)
+    assert result["answer"] == ANSWER
+    assert result["metadata"]["model_used"] == DEFAULT_MODEL
+    assert fake_groq_server.stats["by_model"] == {DEFAULT_MODEL: 1}
+    assert list(processor.router.samples["lookup"]) == [len(ANSWER.split())]
+    assert cached(processor) is result
+
+def test_off_policy_answer_is_retried_on_the_fallback_model(processor, fake_groq_server):
+    fake_groq_server.INVALID_MODELS = {DEFAULT_MODEL}
+    result = ask(processor)
+    assert result["answer"] == ANSWER
+    assert (result["metadata"]["model_used"], result["metadata"]["model_fallback"]) == (FALLBACK_MODEL, True)
+    assert fake_groq_server.stats["by_model"] == {DEFAULT_MODEL: 1, FALLBACK_MODEL: 1}
+    counters = processor.router.counters["lookup"]
+    assert (counters["fallbacks"], counters["recovered"]) == (1, 1)
+    assert processor.router.failure_reasons == {"off_policy": 1}
+    assert cached(processor) is result
+
+def test_answer_invalid_on_both_models_is_not_served(processor, fake_groq_server):
+    fake_groq_server.INVALID_MODELS = {DEFAULT_MODEL, FALLBACK_MODEL}
+    result = ask(processor)
+    assert result["metadata"]["query_type"] == "local_fallback"
+    assert fake_groq_server.INVALID_ANSWER not in result["answer"]
+    assert cached(processor) is None
+    assert not processor.router.samples["lookup"]
+    assert processor.router.counters["lookup"]["recovered"] == 0
+
+def test_without_fallback_model_an_invalid_answer_is_not_served(processor, fake_groq_server):
+    processor.router.fallback_model = ""
+    fake_groq_server.INVALID_MODELS = {DEFAULT_MODEL}
+    result = ask(processor)
+    assert result["metadata"]["query_type"] == "local_fallback"
+    assert fake_groq_server.stats["by_model"] == {DEFAULT_MODEL: 1}
+    assert cached(processor) is None
+    assert not processor.router.samples["lookup"]
+
+def test_truncated_answer_is_retried_on_the_same_model_with_more_tokens(processor, fake_groq_server):
+    processor.max_tokens = 3
+    result = ask(processor)
+    assert result["answer"] == ANSWER
+    assert fake_groq_server.stats["by_model"] == {DEFAULT_MODEL: 2}
+    assert fake_groq_server.stats["truncated"] == 1
+    assert result["metadata"]["model_fallback"] is False
+    assert processor.router.failure_reasons == {"truncated": 1}
+    assert list(processor.router.samples["lookup"]) == [len(ANSWER.split())]
+
+def test_answer_truncated_twice_is_not_served(processor, fake_groq_server):
+    fake_groq_server.FIXED_ANSWER = " ".join(["palabra"] * 50)
+    processor.router.fallback_max_tokens = 10
+    processor.max_tokens = 4
+    result = ask(processor)
+    assert result["metadata"]["query_type"] == "local_fallback"
+    assert fake_groq_server.stats["by_model"] == {DEFAULT_MODEL: 2}
+    assert fake_groq_server.stats["truncated"] == 2
+    assert cached(processor) is None
+    assert not processor.router.samples["lookup"]
+
+def test_invalid_answers_fall_back_per_query_in_a_batch(processor, fake_groq_server):
+    processor.batch_pack_size = 2
+    fake_groq_server.INVALID_MODELS = {DEFAULT_MODEL, FALLBACK_MODEL}
+    results, summary = asyncio.run(processor.process_batch([QUERY, "¿Correo de Luis?"]))
+    # El lote empaquetado no trae respuestas numeradas: cada consulta se reintenta y cae por su cuenta
+    assert [result["metadata"]["query_type"] for result in results] == ["local_fallback"] * 2
+    assert fake_groq_server.stats["by_model"] == {DEFAULT_MODEL: 3, FALLBACK_MODEL: 2}
+    assert cached(processor) is None
+
+@pytest.mark.parametrize("failure, expected", [
+    ("truncated", (DEFAULT_MODEL, 400)),
+    ("off_policy", (FALLBACK_MODEL, 400)),
+    ("empty", (FALLBACK_MODEL, 400)),
+])
+def test_retry_route(failure, expected):
+    assert ModelRouter(DEFAULT_MODEL, FALLBACK_MODEL).retry_route(DEFAULT_MODEL, 150, failure) == expected
+
+def test_retry_route_without_fallback():
+    router = ModelRouter(DEFAULT_MODEL, "")
+    assert router.retry_route(DEFAULT_MODEL, 150, "off_policy") is None
+    assert router.retry_route(DEFAULT_MODEL, 300, "truncated") == (DEFAULT_MODEL, 600)
+    assert ModelRouter(FALLBACK_MODEL, FALLBACK_MODEL).retry_route(FALLBACK_MODEL, 150, "off_policy") is None
@@ -0,0 +1,152 @@
+"""Índice de nombres tolerante a errores y planes name_lookup (user-025)"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import rag_service
+from rag_service import (DatasetSnapshotFile, NameSearchIndex, QueryPlanCache, StructuredQueryEngine, fold_accents,
+                         tokenize, within_one_edit)
+
+from tests.conftest import FakeFirebase, build_columns
+
+@pytest.fixture(scope="module")
+def engine():
+    return StructuredQueryEngine()
+
+def plan_for(engine, query):
+    return engine.build_plan(QueryPlanCache.canonical_form(query)[0])
+
+def name_tokens(columns, row):
+    return set(tokenize(fold_accents(columns.nombre_completo[row])))
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("jose", "jose", True), ("jose", "jsoe", True), ("jose", "joe", True),
+    ("jose", "josep", True), ("jose", "jase", True), ("jose", "ejos", False), ("maria", "mario", True),
+    ("gomez", "gomes", True), ("lopez", "perez", False), ("ana", "anita", False)
+])
+def test_within_one_edit(a, b, expected):
+    assert within_one_edit(a, b) is expected
+
+def test_exact_search_matches_brute_force(columns):
+    names = columns.indexes.names
+    for terms in (["jose"], ["maria", "perez"], ["zuluaga"], ["valentina", "isabel"]):
+        expected = [row for row in columns.indexes.valid_ids.tolist()
+                    if set(terms) <= name_tokens(columns, row)]
+        assert names.search(terms, limit=10_000).exact.tolist() == expected
+
+def test_search_is_accent_insensitive(columns):
+    names = columns.indexes.names
+    assert np.array_equal(names.search([fold_accents("Lucía")]).exact, names.search(["lucia"]).exact)
+    assert names.search(["lucia"]).exact.size > 0
+
+def ranked_brute_force(columns, terms, limit):
+    """Exactas por id y después aproximadas por (ediciones, id), como promete search()"""
+    rows = []
+    for row in columns.indexes.valid_ids.tolist():
+        tokens = name_tokens(columns, row)
+        edits = 0
+        for term in terms:
+            if term in tokens:
+                continue
+            if len(term) < NameSearchIndex.MIN_FUZZY_LENGTH or not any(within_one_edit(term, token) for token in tokens):
+                break
+            edits += 1
+        else:
+            rows.append((edits, row))
+    rows.sort()
+    exact = [row for edits, row in rows if not edits]
+    approximate = [row for edits, row in rows if edits][:max(0, limit - len(exact))]
+    return exact, approximate
+
+@pytest.mark.parametrize("terms", [["jsoe"], ["maria", "gomes"], ["lusi", "lopez"], ["valentina", "isabel"], ["xyzw"]])
+@pytest.mark.parametrize("limit", [5, 10_000])
+def test_approximate_results_ranked_after_exact(columns, terms, limit):
+    matches = columns.indexes.names.search(terms, limit=limit)
+    exact, approximate = ranked_brute_force(columns, terms, limit)
+    assert matches.exact.tolist() == exact
+    assert matches.approximate.tolist() == approximate
+
+def test_search_respects_candidates(columns):
+    names = columns.indexes.names
+    candidates = columns.indexes.valid_ids[::3]
+    restricted = names.search(["jose"], candidates, limit=10_000).exact
+    assert set(restricted.tolist()) <= set(candidates.tolist())
+    assert restricted.tolist() == [row for row in names.search(["jose"], limit=10_000).exact.tolist()
+                                   if row in set(candidates.tolist())]
+
+def test_short_terms_are_not_expanded():
+    index = NameSearchIndex({"ana": np.array([0, 2]), "ena": np.array([1])})
+    assert index.expand("ana") == [("ana", 0)]
+
+@pytest.mark.parametrize("query, terms", [
+    ("¿hay alguien llamado Jose?", ("jose",)),
+    ("hay alguien llamado Josè en el sistema", ("jose",)),
+    ("quien se llama Maria Perez", ("maria", "perez")),
+    ("cuantas mujeres se llaman Ana", ("ana",)),
+    ("personas llamadas Juan nacidas en mayo", ("juan",)),
+    ("¿Hay alguna persona con el nombre de Ana Maria Gomez Perez?", ("ana", "maria", "gomez", "perez")),
+])
+def test_name_lookup_plans(engine, query, terms):
+    plan = plan_for(engine, query)
+    assert plan is not None and plan.aggregate == "name_lookup"
+    assert plan.terms == terms
+
+@pytest.mark.parametrize("query", [
+    "¿Cómo se llama la persona más joven?",
+    "¿Quién se llama María y cuál es su correo?",
+    "personas llamadas Ana que vivan en Cali",
+    "¿Qué edad tiene la persona llamada Ana Gomez?",
+    "quien se llama maria y que edad tiene",
+    "¿Cuál es el correo de la persona llamada Juan Pérez?",
+    "personas con nombre",
+])
+def test_name_phrasings_that_need_the_llm(engine, query):
+    assert plan_for(engine, query) is None
+
+def test_name_lookup_answer(engine, columns):
+    plan = plan_for(engine, "¿hay alguien llamado Jose?")
+    answer = engine.execute(plan, columns)
+    assert answer.startswith("Sí, hay ")
+
+    plan = plan_for(engine, "¿hay alguien llamado Jsoe?")
+    answer = engine.execute(plan, columns)
+    assert answer.startswith("No hay ninguna persona") and "José" in answer
+
+def test_expansion_cache_is_safe_under_concurrent_lookups(columns, monkeypatch):
+    names = NameSearchIndex(columns.indexes.by_name_token)
+    monkeypatch.setattr(names, "EXPANSION_CACHE_SIZE", 16)
+    terms = [token[:-1] + "x" for token in names.vocabulary if len(token) >= NameSearchIndex.MIN_FUZZY_LENGTH][:64]
+    expected = {term: NameSearchIndex(columns.indexes.by_name_token).expand(term) for term in terms}
+
+    def lookups(offset):
+        return [names.expand(term) == expected[term] for term in (terms[offset:] + terms[:offset]) * 20]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert all(all(results) for results in pool.map(lookups, range(8)))
+    assert names.stats()["cached_expansions"] == 16
+
+def test_names_index_is_built_once(columns):
+    indexes = rag_service.DatasetIndexes(columns)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        built = list(pool.map(lambda _: indexes.names, range(8)))
+    assert all(names is built[0] for names in built)
+
+def test_refresh_builds_the_names_index(records):
+    manager = rag_service.IntelligentDataManager(FakeFirebase([]))
+    manager._load_enriched_data = lambda: records
+    manager.get_enriched_dataset()
+    assert manager._columns is not None and manager._columns.records is manager.cache["enriched_persons"]
+    assert manager._columns.indexes._names is not None
+    assert manager.get_columnar_dataset() is manager._columns
+
+def test_snapshot_adoption_builds_the_names_index(tmp_path, data_manager, records):
+    columns = build_columns(data_manager, records)
+    path = str(tmp_path / "dataset.snap")
+    DatasetSnapshotFile.write(path, columns, columns.aggregates, datetime.now())
+
+    manager = rag_service.IntelligentDataManager(FakeFirebase([]))
+    manager.snapshot_path = path
+    assert manager.load_snapshot()
+    assert manager._columns.indexes._names is not None
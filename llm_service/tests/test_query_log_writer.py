@@ -0,0 +1,148 @@
+"""Escritor de logs en segundo plano: lotes, vaciado al cerrar y políticas de descarte (user-015)"""
+import threading
+import time
+
+import pytest
+
+from rag_service import QueryLogWriter
+
+class FakeBatch:
+    def __init__(self, store):
+        self.store = store
+        self.pending = []
+
+    def set(self, reference, entry):
+        self.pending.append(entry)
+
+    def commit(self):
+        if self.store.fail:
+            raise RuntimeError("Firestore no disponible")
+        with self.store.lock:
+            self.store.commits.append(list(self.pending))
+
+class FakeLogStore:
+    """firebase_manager con db.batch() y logs_collection.document() en memoria"""
+
+    def __init__(self, healthy=True, fail=False):
+        self.healthy = healthy
+        self.fail = fail
+        self.commits = []
+        self.lock = threading.Lock()
+        self.db = self
+        self.logs_collection = self
+
+    def is_healthy(self):
+        return self.healthy
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def document(self):
+        return object()
+
+    @property
+    def entries(self):
+        with self.lock:
+            return [entry for commit in self.commits for entry in commit]
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+@pytest.fixture
+def store():
+    return FakeLogStore()
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval(store):
+    writer = QueryLogWriter(store, batch_size=5, flush_interval=30)
+    writer.start()
+    try:
+        for number in range(5):
+            writer.enqueue({"n": number})
+        assert wait_until(lambda: len(store.entries) == 5)
+        assert [len(commit) for commit in store.commits] == [5]
+    finally:
+        writer.stop()
+
+def test_partial_batch_is_flushed_after_the_interval(store):
+    writer = QueryLogWriter(store, batch_size=100, flush_interval=0.05)
+    writer.start()
+    try:
+        writer.enqueue({"n": 1})
+        writer.enqueue({"n": 2})
+        assert wait_until(lambda: len(store.entries) == 2)
+        assert writer.stats()["batches"] == 1
+    finally:
+        writer.stop()
+
+def test_stop_drains_the_queue_in_order(store):
+    writer = QueryLogWriter(store, batch_size=4, flush_interval=30)
+    writer.start()
+    for number in range(10):
+        writer.enqueue({"n": number})
+    writer.stop()
+    assert [entry["n"] for entry in store.entries] == list(range(10))
+    stats = writer.stats()
+    assert (stats["queue_depth"], stats["written"], stats["worker_alive"]) == (0, 10, False)
+
+def test_stop_without_worker_writes_synchronously(store):
+    writer = QueryLogWriter(store, batch_size=3)
+    for number in range(7):
+        writer.enqueue({"n": number})
+    writer.stop()
+    assert [len(commit) for commit in store.commits] == [3, 3, 1]
+
+def test_batch_size_is_capped_by_firestore():
+    assert QueryLogWriter(FakeLogStore(), batch_size=10_000).batch_size == QueryLogWriter.FIRESTORE_BATCH_LIMIT
+
+def test_drop_oldest_keeps_the_latest_entries(store):
+    writer = QueryLogWriter(store, max_queue=3, batch_size=100, drop_policy=QueryLogWriter.DROP_OLDEST)
+    assert all(writer.enqueue({"n": number}) for number in range(5))
+    writer.stop()
+    assert [entry["n"] for entry in store.entries] == [2, 3, 4]
+    assert (writer.dropped, writer.enqueued) == (2, 5)
+
+def test_drop_newest_rejects_new_entries(store):
+    writer = QueryLogWriter(store, max_queue=3, batch_size=100, drop_policy=QueryLogWriter.DROP_NEWEST)
+    accepted = [writer.enqueue({"n": number}) for number in range(5)]
+    writer.stop()
+    assert accepted == [True, True, True, False, False]
+    assert [entry["n"] for entry in store.entries] == [0, 1, 2]
+    assert writer.dropped == 2
+
+def test_unknown_drop_policy_defaults_to_drop_oldest():
+    assert QueryLogWriter(FakeLogStore(), drop_policy="cualquiera").drop_policy == QueryLogWriter.DROP_OLDEST
+
+@pytest.mark.parametrize("store", [FakeLogStore(healthy=False), FakeLogStore(fail=True)], ids=["sin_firebase", "commit_falla"])
+def test_failed_writes_are_counted_not_raised(store):
+    writer = QueryLogWriter(store, batch_size=2)
+    for number in range(5):
+        writer.enqueue({"n": number})
+    writer.stop()
+    stats = writer.stats()
+    assert (stats["written"], stats["failed"], stats["queue_depth"]) == (0, 5, 0)
+    assert store.commits == []
+
+def test_enqueue_does_not_block_while_a_flush_is_slow(store, monkeypatch):
+    gate = threading.Event()
+    commit = FakeBatch.commit
+
+    def slow_commit(batch):
+        gate.wait(2)
+        commit(batch)
+
+    monkeypatch.setattr(FakeBatch, "commit", slow_commit)
+    writer = QueryLogWriter(store, batch_size=1, flush_interval=30)
+    writer.start()
+    try:
+        writer.enqueue({"n": 0})
+        started = time.perf_counter()
+        for number in range(1, 50):
+            writer.enqueue({"n": number})
+        assert time.perf_counter() - started < 0.1
+    finally:
+        gate.set()
+        writer.stop()
+    assert len(store.entries) == 50
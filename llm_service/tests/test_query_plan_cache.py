@@ -0,0 +1,57 @@
+"""Pipeline compilado de comprensión de consultas y su cache de planes (user-023)"""
+import pytest
+
+import rag_service
+from rag_service import AcademicQueryAnalyzer, QueryPlanCache, StructuredQueryEngine
+
+@pytest.fixture
+def plans():
+    return QueryPlanCache(AcademicQueryAnalyzer(), StructuredQueryEngine(), max_entries=4)
+
+def test_equivalent_queries_share_one_compilation(plans):
+    first = plans.compile("¿Cuántas MUJERES hay?")
+    second = plans.compile("cuantas mujeres hay")
+    assert first.canonical == second.canonical
+    assert second.plan is first.plan
+    assert plans.stats()["hits"] == 1 and plans.stats()["misses"] == 1
+
+def test_cached_entry_keeps_the_raw_query_of_each_request(plans):
+    first = plans.compile("correo de juan@correo.test")
+    second = plans.compile("correo de juan correo test")
+    assert first.canonical == second.canonical
+    assert first.query == "correo de juan@correo.test"
+    assert second.query == "correo de juan correo test"
+
+def test_analysis_is_read_only(plans):
+    compiled = plans.compile("mujeres mayores de 30 nacidas en mayo")
+    with pytest.raises(TypeError):
+        compiled.analysis["complexity_level"] = "simple"
+    with pytest.raises(AttributeError):
+        compiled.analysis["detected_patterns"].append("statistical")
+    assert plans.compile("mujeres mayores de 30 nacidas en mayo").analysis == compiled.analysis
+
+def test_lru_evicts_oldest_entry(plans):
+    for number in range(6):
+        plans.compile(f"personas de {number} anos")
+    assert len(plans.entries) == 4
+    assert "personas de 0 anos" not in plans.entries
+
+def test_analysis_matches_uncached_analyzer(plans):
+    analyzer = AcademicQueryAnalyzer()
+    for query in ("promedio de edad por genero", "hombres nacidos en enero mayores de 40", "dame el correo de Ana"):
+        cached = plans.compile(query).analysis
+        direct = analyzer.analyze_complexity(query)
+        assert cached["detected_patterns"] == tuple(direct["detected_patterns"])
+        assert cached["complexity_level"] == direct["complexity_level"]
+
+def test_retrieval_by_email_keeps_the_exact_record(records):
+    columns = rag_service.PersonColumns.from_records(records)
+    processor = rag_service.AcademicRAGProcessor(rag_service.groq_client, rag_service.data_manager)
+    # El último de un nombre repetido: sin el correo, el orden del dataset pondría antes a otro
+    target = max(row for row, record in enumerate(records)
+                 if record.primer_nombre == "José" and record.correo and record.nombre_completo.strip())
+    email = records[target].correo
+    
+    compiled = processor.query_plans.compile(f"¿Cuál es el teléfono de {email}?")
+    _, ranked_ids = processor._retrieve_context(compiled, columns)
+    assert int(ranked_ids[0]) == target
@@ -0,0 +1,129 @@
+"""Governor de tasa hacia Groq: buckets, cola acotada y bloqueo por 429, también contra fake_groq (user-013)"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from rag_service import RateLimitExceeded, RateLimitGovernor
+
+from tests.conftest import groq_client_for
+
+def make_governor(rpm=600, tpm=10_000, concurrency=4, queue=10, wait=1.0):
+    return RateLimitGovernor(requests_per_minute=rpm, tokens_per_minute=tpm, max_concurrency=concurrency,
+                             max_queue_depth=queue, max_queue_wait=wait)
+
+def test_tokens_are_reserved_on_acquire_and_corrected_on_release():
+    governor = make_governor(tpm=1_000)
+    asyncio.run(governor.acquire(300))
+    stats = governor.stats()
+    assert (stats["in_flight"], stats["granted"]) == (1, 1)
+    assert 700 <= stats["available_tokens"] < 705
+
+    governor.release(300, used_tokens=100)
+    stats = governor.stats()
+    assert stats["in_flight"] == 0
+    assert 900 <= stats["available_tokens"] < 905
+
+def test_release_without_usage_keeps_the_estimate():
+    governor = make_governor(tpm=1_000)
+    asyncio.run(governor.acquire(400))
+    governor.release(400)
+    assert 600 <= governor.stats()["available_tokens"] < 605
+
+def test_oversized_request_is_capped_to_the_bucket():
+    governor = make_governor(tpm=1_000)
+    asyncio.run(governor.acquire(5_000))
+    assert governor.stats()["available_tokens"] < 5
+
+def test_empty_token_bucket_rejects_within_the_wait_limit():
+    governor = make_governor(tpm=600, wait=0.2)
+    asyncio.run(governor.acquire(600))
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(governor.acquire(300))
+    assert governor.stats()["rejected"] == 1
+
+def test_full_queue_rejects_immediately():
+    governor = make_governor(queue=0)
+    started = time.perf_counter()
+    with pytest.raises(RateLimitExceeded, match="Cola de peticiones llena"):
+        asyncio.run(governor.acquire(10))
+    assert time.perf_counter() - started < 0.05
+
+def test_concurrency_slot_is_handed_over_on_release():
+    governor = make_governor(concurrency=1, wait=1.0)
+
+    async def scenario():
+        await governor.acquire(10)
+        waiter = asyncio.create_task(governor.acquire(10))
+        await asyncio.sleep(0.1)
+        assert not waiter.done() and governor.stats()["queue_depth"] == 1
+        governor.release(10)
+        await asyncio.wait_for(waiter, 1)
+        return governor.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["in_flight"], stats["granted"], stats["max_queue_depth_seen"]) == (1, 2, 1)
+
+def test_deadline_shortens_the_wait():
+    governor = make_governor(concurrency=1, wait=10.0)
+
+    async def scenario():
+        await governor.acquire(10)
+        with pytest.raises(RateLimitExceeded):
+            await governor.acquire(10, deadline_at=time.monotonic() + 0.02)
+
+    asyncio.run(scenario())
+
+def test_429_blocks_until_retry_after():
+    governor = make_governor(wait=0.5)
+    governor.observe_response(429, httpx.Headers({"retry-after": "2"}))
+    stats = governor.stats()
+    assert stats["rate_limited_responses"] == 1
+    assert 1.5 < stats["blocked_for_s"] <= 2
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(governor.acquire(10))
+
+def test_429_without_retry_after_uses_the_reset_headers():
+    governor = make_governor()
+    governor.observe_response(429, httpx.Headers({"x-ratelimit-reset-requests": "250ms",
+                                                  "x-ratelimit-reset-tokens": "7.5s"}))
+    assert 7 < governor.stats()["blocked_for_s"] <= 7.5
+
+def test_remaining_headers_lower_the_buckets():
+    governor = make_governor(rpm=600, tpm=10_000)
+    governor.observe_response(200, httpx.Headers({"x-ratelimit-remaining-requests": "3",
+                                                  "x-ratelimit-remaining-tokens": "120"}))
+    stats = governor.stats()
+    assert 3 <= stats["available_requests"] < 3.5
+    assert 120 <= stats["available_tokens"] < 125
+
+@pytest.mark.parametrize("value, seconds", [
+    ("12", 12.0), ("12.5", 12.5), ("7.66s", 7.66), ("2m59.56s", 179.56), ("250ms", 0.25),
+    ("1h", 3600.0), ("", None), (None, None), ("pronto", None),
+])
+def test_header_durations(value, seconds):
+    parsed = make_governor()._header_duration(value)
+    assert parsed == pytest.approx(seconds) if seconds is not None else parsed is None
+
+def test_fake_groq_429_blocks_further_calls(fake_groq_server):
+    fake_groq_server.REQUESTS_PER_MINUTE = 1
+    client = groq_client_for(fake_groq_server)
+    client.governor = make_governor(rpm=6_000, wait=0.5)
+
+    async def scenario():
+        first = await client.complete("PREGUNTA: uno", max_tokens=20)
+        second = await client.complete("PREGUNTA: dos", max_tokens=20)
+        with pytest.raises(RateLimitExceeded):
+            await client.complete("PREGUNTA: tres", max_tokens=20, raise_rejections=True)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.text == "Respuesta simulada para: uno"
+    assert second is None
+    assert fake_groq_server.stats["rate_limited"] == 1
+    stats = client.governor.stats()
+    assert stats["rate_limited_responses"] == 1
+    assert stats["blocked_for_s"] > 50
+    assert stats["in_flight"] == 0
+    assert client.breaker.stats()["state"] == "closed"
@@ -0,0 +1,62 @@
+"""Cache de respuestas por consulta normalizada y versión del dataset (user-003)"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from rag_service import InProcessBackend, ResponseCache, SQLiteBackend, normalize_query
+
+@pytest.mark.parametrize("a, b", [
+    ("¿Quién es Ana Pérez?", "quien es ana perez"),
+    ("¿Cuál es el CORREO de José?", "cual correo jose"),
+    ("Dame las mujeres nacidas en abril.", "dame mujeres nacidas abril"),
+    ("  hombres   mayores  ", "hombres mayores"),
+])
+def test_equivalent_phrasings_share_a_key(a, b):
+    assert normalize_query(a) == normalize_query(b)
+
+@pytest.mark.parametrize("a, b", [
+    ("hombres y mujeres", "hombres o mujeres"),
+    ("personas con correo", "personas sin correo"),
+    ("personas que tienen celular", "personas que no tienen celular"),
+    ("ni hombres ni mujeres", "hombres mujeres"),
+])
+def test_logical_connectives_are_kept(a, b):
+    assert normalize_query(a) != normalize_query(b)
+
+def test_key_depends_on_dataset_version():
+    cache = ResponseCache()
+    assert cache.build_key("¿Quién es Ana?", "v1") == cache.build_key("quien es ana", "v1")
+    assert cache.build_key("quien es ana", "v1") != cache.build_key("quien es ana", "v2")
+    assert cache.build_key("quien es ana", None).startswith("sin-version:")
+
+def test_hits_misses_and_ttl():
+    cache = ResponseCache(ttl=timedelta(seconds=60))
+    key = cache.build_key("quien es ana", "v1")
+    assert asyncio.run(cache.get(key)) is None
+    asyncio.run(cache.put(key, {"answer": "Ana Pérez"}))
+    assert asyncio.run(cache.get(key)) == {"answer": "Ana Pérez"}
+
+    cache.entries[key] = (datetime.now() - timedelta(seconds=61), cache.entries[key][1])
+    assert asyncio.run(cache.get(key)) is None
+    assert (cache.hits, cache.misses, cache.hit_rate) == (1, 2, round(1 / 3, 4))
+    assert key not in cache.entries
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    for key in ("a", "b"):
+        asyncio.run(cache.put(key, {"answer": key}))
+    asyncio.run(cache.get("a"))
+    asyncio.run(cache.put("c", {"answer": "c"}))
+    assert list(cache.entries) == ["a", "c"]
+
+def test_shared_backend_is_read_by_other_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer = ResponseCache(backend=SQLiteBackend(path))
+    reader = ResponseCache(backend=SQLiteBackend(path))
+    asyncio.run(writer.put("v1:ana", {"answer": "Ana Pérez", "metadata": {}}))
+    assert asyncio.run(reader.get("v1:ana")) == {"answer": "Ana Pérez", "metadata": {}}
+    assert reader.shared_hits == 1
+
+def test_in_process_backend_is_not_shared():
+    assert ResponseCache(backend=InProcessBackend()).backend is None
@@ -0,0 +1,56 @@
+"""Recuperación por relevancia del contexto que se envía al LLM (user-010)"""
+import numpy as np
+import pytest
+
+from rag_service import RelevanceRetriever, fold_accents, tokenize
+
+@pytest.fixture(scope="module")
+def retriever():
+    return RelevanceRetriever()
+
+def has_token(columns, row, token):
+    return token in tokenize(fold_accents(columns.nombre_completo[row]))
+
+def test_identifier_ranks_first(retriever, columns):
+    valid = columns.indexes.valid_ids
+    for row in (valid[3], valid[150], valid[-1]):
+        record = columns.records[row]
+        for query in (f"datos de {record.documento}", f"¿de quién es el correo {record.correo}?"):
+            assert retriever.rank(query, columns, valid, 5)[0] == row
+
+def test_name_matches_rank_before_the_rest(retriever, columns):
+    valid = columns.indexes.valid_ids
+    expected = [row for row in valid.tolist() if has_token(columns, row, 'zuluaga')]
+    top = retriever.rank("información de Zuluaga", columns, valid, len(expected))
+    assert top.tolist() == expected
+
+def test_fuzzy_name_matches(retriever, columns):
+    valid = columns.indexes.valid_ids
+    top = retriever.rank("información de Zuluga", columns, valid, 10)
+    assert all(has_token(columns, row, 'zuluaga') for row in top.tolist())
+    matched = retriever.matches("información de Zuluga", columns, valid)
+    assert matched.size and all(has_token(columns, row, 'zuluaga') for row in matched.tolist())
+
+def test_order_words_break_ties(retriever, columns):
+    valid = columns.indexes.valid_ids
+    aged = valid[columns.has_age[valid]]
+    youngest = retriever.rank("la persona más joven", columns, aged, 1)[0]
+    oldest = retriever.rank("la persona más vieja", columns, aged, 1)[0]
+    assert columns.edad[youngest] == columns.edad[aged].min()
+    assert columns.edad[oldest] == columns.edad[aged].max()
+
+    registered = valid[~np.isnan(columns.registro_ts[valid])]
+    latest = retriever.rank("la última persona registrada", columns, registered, 1)[0]
+    assert columns.registro_ts[latest] == columns.registro_ts[registered].max()
+
+def test_rank_respects_candidates_and_k(retriever, columns):
+    valid = columns.indexes.valid_ids
+    candidates = valid[::7]
+    top = retriever.rank("información de Zuluaga", columns, candidates, 4)
+    assert len(top) == 4 and set(top.tolist()) <= set(candidates.tolist())
+    assert retriever.rank("cualquier cosa", columns, valid[:1], 5).tolist() == valid[:1].tolist()
+
+def test_no_relevance_keeps_dataset_order(retriever, columns):
+    valid = columns.indexes.valid_ids
+    assert retriever.rank("resumen general", columns, valid, 8).tolist() == valid[:8].tolist()
+    assert retriever.matches("resumen general", columns, valid).size == 0
@@ -0,0 +1,86 @@
+"""Snapshot columnar en disco: escritura, apertura con mmap y descripción (user-021)"""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from rag_service import DatasetSnapshotFile, QueryFilter
+
+from tests.conftest import build_columns
+
+RECORD_FIELDS = ('doc_id', 'nombre_completo', 'primer_nombre', 'segundo_nombre', 'apellidos', 'documento',
+                 'correo', 'celular', 'genero', 'edad', 'es_mayor_edad', 'rango_edad', 'mes_nacimiento',
+                 'mes_nacimiento_nombre', 'año_nacimiento', 'fecha_registro')
+
+@pytest.fixture
+def snapshot(tmp_path, data_manager, records):
+    columns = build_columns(data_manager, records)
+    path = str(tmp_path / "dataset.snap")
+    loaded_at = datetime(2026, 6, 15, 8, 30)
+    written = DatasetSnapshotFile.write(path, columns, columns.aggregates, loaded_at)
+    return columns, DatasetSnapshotFile.open(path), path, written, loaded_at
+
+def test_round_trip_metadata(snapshot):
+    columns, mapped, path, written, loaded_at = snapshot
+    assert mapped.version == columns.version
+    assert mapped.loaded_at == loaded_at
+    assert mapped.file_bytes == written
+    assert len(mapped.records) == len(columns)
+
+def test_round_trip_records(snapshot, records):
+    _, mapped, *_ = snapshot
+    for original, restored in zip(records, mapped.records):
+        for field in RECORD_FIELDS:
+            assert getattr(restored, field) == getattr(original, field), field
+    assert [record.doc_id for record in mapped.records[-3:]] == [record.doc_id for record in records[-3:]]
+    with pytest.raises(IndexError):
+        mapped.records[len(records)]
+
+def test_round_trip_columns_and_indexes(snapshot):
+    columns, mapped, *_ = snapshot
+    restored = mapped.columns
+    for name in ('edad', 'mes_nacimiento', 'año_nacimiento', 'has_correo', 'has_celular', 'valid', 'genero_code'):
+        assert np.array_equal(getattr(restored, name), getattr(columns, name)), name
+    assert np.array_equal(restored.registro_ts, columns.registro_ts, equal_nan=True)
+
+    original, loaded = columns.indexes, restored.indexes
+    for filters in [(), (QueryFilter('edad', 'between', (18, 40)),), (QueryFilter('genero', 'eq', 'F'),),
+                    (QueryFilter('mes_nacimiento', 'eq', 7), QueryFilter('edad', 'ge', 30))]:
+        assert loaded.lookup(filters).tolist() == original.lookup(filters).tolist()
+    assert loaded.age_extreme(True)[1].tolist() == original.age_extreme(True)[1].tolist()
+
+    record = columns.records[17]
+    query = f"{record.correo} {record.documento} {record.celular}"
+    assert sorted(loaded.identifier_hits(query)) == sorted(original.identifier_hits(query))
+    assert set(loaded.by_name_token) == set(original.by_name_token)
+    for token, ids in original.by_name_token.items():
+        assert loaded.by_name_token[token].tolist() == ids.tolist()
+
+def test_round_trip_aggregates(snapshot):
+    columns, mapped, *_ = snapshot
+    assert mapped.aggregates.as_statistics() == columns.aggregates.as_statistics()
+    assert mapped.columns.statistics() == columns.statistics()
+
+def test_describe(snapshot):
+    columns, _, path, written, loaded_at = snapshot
+    summary = DatasetSnapshotFile.describe(path)
+    assert summary["compatible"] is True
+    assert summary["dataset_version"] == columns.version
+    assert summary["record_count"] == len(columns)
+    assert summary["file_bytes"] == written
+    assert summary["loaded_at"] == loaded_at.isoformat()
+    assert sum(summary["bytes_by_group"].values()) == sum(summary["sections"].values())
+
+def test_incompatible_and_missing_files_are_ignored(tmp_path):
+    path = tmp_path / "garbage.snap"
+    path.write_bytes(b"no es un snapshot")
+    assert DatasetSnapshotFile.open(str(path)) is None
+    assert DatasetSnapshotFile.describe(str(path)) == {"path": str(path), "compatible": False}
+    assert DatasetSnapshotFile.open(str(tmp_path / "missing.snap")) is None
+
+def test_truncated_file_is_ignored(snapshot, tmp_path):
+    _, _, path, written, _ = snapshot
+    truncated = tmp_path / "truncated.snap"
+    with open(path, "rb") as handle:
+        truncated.write_bytes(handle.read(written // 2))
+    assert DatasetSnapshotFile.open(str(truncated)) is None
@@ -0,0 +1,113 @@
+"""Dataset servido con stale-while-revalidate y una sola actualización en curso (user-007)"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+import rag_service
+
+from tests.conftest import FakeFirebase
+
+CACHE_KEY = "enriched_persons"
+
+class CountingLoader:
+    """Sustituye a _load_enriched_data: cuenta las lecturas y puede quedarse esperando a `gate`"""
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+        self.fail = False
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.gate.wait(5)
+        if self.fail:
+            raise ConnectionError("Firestore caído")
+        return self.batches[min(self.calls, len(self.batches)) - 1]
+
+@pytest.fixture
+def manager(records):
+    manager = rag_service.IntelligentDataManager(FakeFirebase([]))
+    manager.cache_duration = timedelta(minutes=10)
+    manager.refresh_ahead = timedelta(minutes=1)
+    manager.max_staleness = timedelta(minutes=30)
+    manager._load_enriched_data = CountingLoader([records[:100], records[:200], records[:300]])
+    return manager
+
+def age_cache(manager, age):
+    manager.cache_metadata[CACHE_KEY] = datetime.now() - age
+
+def wait_for_refresh(manager):
+    deadline = time.monotonic() + 5
+    while manager._refresh_done is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager._refresh_done is None
+
+def test_cold_start_loads_once_for_concurrent_callers(manager):
+    loader = manager._load_enriched_data
+    loader.gate.clear()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(manager.get_enriched_dataset) for _ in range(8)]
+        assert loader.started.wait(5)
+        time.sleep(0.05)
+        loader.gate.set()
+        results = [future.result(timeout=5) for future in futures]
+    assert loader.calls == 1
+    assert all(len(result) == 100 for result in results)
+    assert manager.refresh_count == 1
+
+def test_fresh_cache_is_served_without_refresh(manager):
+    manager.get_enriched_dataset()
+    age_cache(manager, timedelta(minutes=5))
+    assert len(manager.get_enriched_dataset()) == 100
+    assert manager._load_enriched_data.calls == 1
+
+def test_stale_cache_is_served_while_refreshing_in_background(manager):
+    loader = manager._load_enriched_data
+    manager.get_enriched_dataset()
+    age_cache(manager, timedelta(minutes=15))
+
+    loader.gate.clear()
+    started = time.perf_counter()
+    assert len(manager.get_enriched_dataset()) == 100
+    assert len(manager.get_enriched_dataset()) == 100
+    assert time.perf_counter() - started < 1
+    assert loader.started.wait(5)
+    assert manager.refresh_status()["refresh_in_progress"]
+
+    loader.gate.set()
+    wait_for_refresh(manager)
+    assert loader.calls == 2
+    assert len(manager.get_enriched_dataset()) == 200
+
+def test_refresh_ahead_starts_before_expiry(manager):
+    loader = manager._load_enriched_data
+    manager.get_enriched_dataset()
+    age_cache(manager, timedelta(minutes=9, seconds=30))
+    loader.gate.clear()
+    assert len(manager.get_enriched_dataset()) == 100
+    loader.gate.set()
+    wait_for_refresh(manager)
+    assert manager._load_enriched_data.calls == 2
+
+def test_beyond_max_staleness_the_caller_waits_for_fresh_data(manager):
+    manager.get_enriched_dataset()
+    age_cache(manager, timedelta(minutes=31))
+    assert len(manager.get_enriched_dataset()) == 200
+    assert manager._load_enriched_data.calls == 2
+
+def test_failed_refresh_keeps_previous_data(manager):
+    loader = manager._load_enriched_data
+    manager.get_enriched_dataset()
+    version = manager.dataset_version
+    age_cache(manager, timedelta(minutes=31))
+    loader.fail = True
+    assert len(manager.get_enriched_dataset()) == 100
+    assert manager.dataset_version == version
+    assert manager._refresh_done is None
@@ -0,0 +1,212 @@
+"""Estado compartido entre workers: SQLite, volcado de contadores y snapshot publicado (user-017)"""
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+import rag_service
+from rag_service import InProcessBackend, ResponseCache, SQLiteBackend, StateBackend, StateBackendWriter
+
+from tests.conftest import FakeFirebase
+
+CACHE_KEY = "enriched_persons"
+
+class FailingBackend(InProcessBackend):
+    """Backend compartido que falla tras `fail_after` incrementos, como un SQLite bloqueado"""
+
+    shared = True
+
+    def __init__(self, fail_after=None):
+        super().__init__()
+        self.fail_after = fail_after
+        self.increments = 0
+
+    def incr(self, key, amount=1.0):
+        if self.fail_after is not None and self.increments >= self.fail_after:
+            raise rag_service.sqlite3.OperationalError("database is locked")
+        self.increments += 1
+        super().incr(key, amount)
+
+    def get(self, key):
+        raise rag_service.sqlite3.OperationalError("database is locked")
+
+    def set(self, key, value, ttl=None):
+        raise rag_service.sqlite3.OperationalError("database is locked")
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+def in_thread(function, *args):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function(*args)))
+    thread.start()
+    thread.join(5)
+    return result[0]
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_incr_accumulates_across_connections_and_threads(db_path):
+    first, second = SQLiteBackend(db_path), SQLiteBackend(db_path)
+    workers = [threading.Thread(target=lambda backend=backend: [backend.incr("metrics:total_queries") for _ in range(50)])
+               for backend in (first, second) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+    second.incr("metrics:response_time_sum", 0.25)
+    second.incr("otros:x")
+
+    assert first.counters("metrics:") == {"metrics:total_queries": 200.0, "metrics:response_time_sum": 0.25}
+
+def test_lock_is_exclusive_until_release_or_expiry(db_path):
+    owner, other = SQLiteBackend(db_path), SQLiteBackend(db_path)
+    assert owner.acquire_lock("refresh", ttl=0.2)
+    assert not in_thread(other.acquire_lock, "refresh", 0.2)
+
+    in_thread(other.release_lock, "refresh")
+    assert not in_thread(other.acquire_lock, "refresh", 0.2)
+
+    owner.release_lock("refresh")
+    assert in_thread(other.acquire_lock, "refresh", 0.2)
+
+    time.sleep(0.25)
+    assert owner.acquire_lock("refresh", ttl=10)
+
+def test_in_process_lock_has_the_same_semantics():
+    backend = InProcessBackend()
+    assert backend.acquire_lock("refresh", ttl=10)
+    assert not in_thread(backend.acquire_lock, "refresh", 10)
+    in_thread(backend.release_lock, "refresh")
+    assert not backend.acquire_lock("refresh", ttl=10)
+    backend.release_lock("refresh")
+    assert in_thread(backend.acquire_lock, "refresh", 10)
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_purge_expired_counts_removed_keys(backend, db_path):
+    backend = InProcessBackend() if backend == "memory" else SQLiteBackend(db_path)
+    backend.set("viva", b"1")
+    backend.set("vence", b"2", ttl=0.05)
+    backend.acquire_lock("refresh", ttl=0.05)
+    time.sleep(0.06)
+    assert backend.purge_expired() == 2
+    assert backend.purge_expired() == 0
+    assert backend.get("viva") == b"1"
+
+def test_writer_buffers_until_flush(db_path):
+    backend = SQLiteBackend(db_path)
+    writer = StateBackendWriter(backend)
+    writer.incr("metrics:total_queries")
+    writer.incr("metrics:total_queries")
+    writer.incr("metrics:response_time_sum", 0.5)
+    assert backend.counters("metrics:") == {}
+    assert writer.pending("metrics:") == {"metrics:total_queries": 2.0, "metrics:response_time_sum": 0.5}
+
+    writer.flush()
+    assert backend.counters("metrics:") == {"metrics:total_queries": 2.0, "metrics:response_time_sum": 0.5}
+    assert writer.pending() == {}
+    assert writer.stats()["flushes"] == 1
+
+def test_failed_flush_requeues_only_unwritten_counters():
+    backend = FailingBackend(fail_after=1)
+    writer = StateBackendWriter(backend)
+    writer.incr("metrics:a", 1)
+    writer.incr("metrics:b", 2)
+    writer.flush()
+    assert backend.counters("metrics:") == {"metrics:a": 1.0}
+    assert writer.pending() == {"metrics:b": 2.0}
+    assert writer.stats()["flush_failures"] == 1
+
+    backend.fail_after = None
+    writer.incr("metrics:b", 1)
+    writer.flush()
+    assert backend.counters("metrics:") == {"metrics:a": 1.0, "metrics:b": 3.0}
+
+def test_worker_flushes_periodically_and_on_stop(db_path):
+    backend = SQLiteBackend(db_path)
+    writer = StateBackendWriter(backend, flush_interval=0.02)
+    writer.start()
+    writer.incr("metrics:total_queries")
+    deadline = time.monotonic() + 2
+    while not backend.counters("metrics:") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend.counters("metrics:") == {"metrics:total_queries": 1.0}
+
+    writer.flush_interval = 30
+    time.sleep(0.05)
+    writer.incr("metrics:total_queries")
+    writer.stop()
+    assert backend.counters("metrics:") == {"metrics:total_queries": 2.0}
+    assert not writer.stats()["worker_alive"]
+
+def test_stop_without_worker_flushes_synchronously(db_path):
+    backend = SQLiteBackend(db_path)
+    writer = StateBackendWriter(backend)
+    writer.incr("metrics:total_queries", 3)
+    writer.stop()
+    assert backend.counters("metrics:") == {"metrics:total_queries": 3.0}
+
+def test_cluster_metrics_include_pending_counts(db_path):
+    backend = SQLiteBackend(db_path)
+    backend.incr("metrics:total_queries", 4)
+    manager = rag_service.IntelligentDataManager(FakeFirebase([]), state_backend=backend)
+    processor = rag_service.AcademicRAGProcessor(rag_service.GroqLLMClient(), manager)
+    processor._record_cluster_metric("total_queries")
+    processor._record_cluster_metric("response_time_sum", 2.5)
+
+    metrics = processor.cluster_metrics()
+    assert metrics["total_queries"] == 5
+    assert metrics["avg_response_time"] == 0.5
+    assert metrics["writer"]["pending_counters"] == 2
+    assert backend.counters("metrics:") == {"metrics:total_queries": 4.0}
+
+def test_response_cache_fails_open_when_the_backend_is_locked():
+    cache = ResponseCache(backend=FailingBackend())
+    asyncio.run(cache.put("v1:ana", {"answer": "Ana Pérez"}))
+    assert asyncio.run(cache.get("v1:ana")) == {"answer": "Ana Pérez"}
+    assert asyncio.run(cache.get("v1:luis")) is None
+    assert cache.stats()["shared_errors"] == 2
+
+def make_manager(db_path, snapshot_path, fresh):
+    manager = rag_service.IntelligentDataManager(FakeFirebase([]), state_backend=SQLiteBackend(db_path))
+    manager.snapshot_path = snapshot_path
+    manager.cache_duration = timedelta(minutes=10)
+    manager.refresh_ahead = timedelta(minutes=1)
+    manager.loads = 0
+
+    def load():
+        manager.loads += 1
+        return fresh
+    manager._load_enriched_data = load
+    return manager
+
+def test_second_worker_maps_the_published_snapshot(records, db_path, tmp_path):
+    snapshot_path = str(tmp_path / "dataset.snap")
+    leader = make_manager(db_path, snapshot_path, records[:150])
+    follower = make_manager(db_path, snapshot_path, records[:50])
+
+    assert len(leader.get_enriched_dataset()) == 150
+    meta = json.loads(leader.state_backend.get(f"dataset:{CACHE_KEY}:meta"))
+    assert set(meta) == {"loaded_at", "version", "path"}
+    assert (meta["version"], meta["path"]) == (leader.dataset_version, snapshot_path)
+
+    dataset = follower.get_enriched_dataset()
+    assert (follower.loads, leader.loads) == (0, 1)
+    assert isinstance(dataset, rag_service.SnapshotRecords)
+    assert [record.doc_id for record in dataset] == [record.doc_id for record in records[:150]]
+    assert follower.dataset_version == leader.dataset_version
+    assert follower.refresh_status()["shared_snapshot_adoptions"] == 1
+
+def test_unpublished_snapshot_falls_back_to_firestore(records, db_path, tmp_path):
+    follower = make_manager(db_path, str(tmp_path / "dataset.snap"), records[:50])
+    follower.shared_refresh_wait = 0.3
+    other = SQLiteBackend(db_path)
+    assert in_thread(other.acquire_lock, f"refresh:{CACHE_KEY}", 10)
+
+    assert len(follower.get_enriched_dataset()) == 50
+    assert follower.loads == 1
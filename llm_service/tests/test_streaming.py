@@ -0,0 +1,62 @@
+"""Respuesta en streaming contra fake_groq: cache, validación y desconexión del cliente (user-008)"""
+import asyncio
+
+import pytest
+
+import rag_service
+
+from tests.conftest import build_columns, groq_client_for
+
+@pytest.fixture
+def processor(fake_groq_server, data_manager, records, monkeypatch):
+    processor = rag_service.AcademicRAGProcessor(groq_client_for(fake_groq_server), data_manager)
+    columns = build_columns(data_manager, records)
+
+    async def prepare(user_query, start_time, prepared_columns=None):
+        compiled = processor.query_plans.compile(user_query)
+        llm_request = rag_service.LLMRequest(
+            prompt=f"PREGUNTA: {user_query}", max_tokens=100, cache_key=f"clave:{user_query}",
+            analysis=compiled.analysis, dataset_size=len(columns), user_query=user_query, columns=columns
+        )
+        return None, llm_request
+
+    monkeypatch.setattr(processor, "_prepare_query", prepare)
+    return processor
+
+async def collect(processor, query):
+    return [event async for event in processor.stream_academic_query(query)]
+
+def test_tokens_then_done_and_cached(processor):
+    query = "¿Quién es Ana?"
+    events = asyncio.run(collect(processor, query))
+    tokens = [event["data"]["token"] for event in events if event["event"] == "token"]
+    assert events[-1]["event"] == "done"
+    done = events[-1]["data"]
+    assert ''.join(tokens).strip() == done["answer"] == f"Respuesta simulada para: {query}"
+    assert done["metadata"]["streamed"]
+    assert asyncio.run(processor.response_cache.get(f"clave:{query}")) is done
+
+def test_invalid_answer_is_not_cached_nor_observed(processor, fake_groq_server):
+    fake_groq_server.FIXED_ANSWER = "Como modelo de lenguaje no tengo esos datos; puedes preguntar otra cosa."
+    query = "¿Quién es Ana?"
+    events = asyncio.run(collect(processor, query))
+    done = events[-1]["data"]
+    assert done["metadata"]["validation_failure"] == "off_policy"
+    assert asyncio.run(processor.response_cache.get(f"clave:{query}")) is None
+    assert processor.router.failure_reasons == {"off_policy": 1}
+    assert not any(processor.router.samples.values())
+
+def test_client_disconnect_releases_the_governor_slot(processor, fake_groq_server):
+    fake_groq_server.TOKEN_DELAY_MS = 5.0
+    governor = processor.llm.governor
+
+    async def disconnect_after_first_token():
+        stream = processor.stream_academic_query("una pregunta con bastantes palabras para varios tokens")
+        first = await stream.__anext__()
+        assert first["event"] == "token"
+        assert governor.stats()["in_flight"] == 1
+        await stream.aclose()
+        return governor.stats()["in_flight"]
+
+    assert asyncio.run(disconnect_after_first_token()) == 0
+    assert asyncio.run(processor.response_cache.get("clave:una pregunta con bastantes palabras para varios tokens")) is None
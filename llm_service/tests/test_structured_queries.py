@@ -0,0 +1,141 @@
+"""Respuestas estructuradas sin LLM comparadas con un recorrido directo de los registros (user-002)"""
+import pytest
+
+from rag_service import FEMALE_VALUES, MALE_VALUES, PersonColumns, QueryPlanCache, StructuredQueryEngine
+
+from tests.conftest import build_columns
+
+def is_valid(record):
+    return bool(record.nombre_completo and record.nombre_completo.strip())
+
+def is_male(record):
+    return (record.genero or '').lower() in MALE_VALUES
+
+def is_female(record):
+    return (record.genero or '').lower() in FEMALE_VALUES
+
+def age(record):
+    return record.edad if record.edad is not None and record.edad >= 0 else None
+
+def everyone(record):
+    return True
+
+COUNT_CASES = [
+    ("¿Cuántas personas hay registradas?", everyone),
+    ("¿Cuántos hombres hay?", is_male),
+    ("¿Cuántas mujeres nacieron en marzo?", lambda r: is_female(r) and r.mes_nacimiento == 3),
+    ("¿Cuántas personas tienen más de 30 años?", lambda r: age(r) is not None and age(r) > 30),
+    ("cuantas personas hay entre 35 y 20 años", lambda r: age(r) is not None and 20 <= age(r) <= 35),
+    ("¿Cuántos hombres mayores de edad hay?", lambda r: is_male(r) and age(r) is not None and age(r) >= 18),
+    ("¿Cuántas personas de 40 años o menos nacieron en diciembre?",
+     lambda r: age(r) is not None and age(r) <= 40 and r.mes_nacimiento == 12),
+    ("cuantas mujeres menores de 5 años", lambda r: is_female(r) and age(r) is not None and age(r) < 5),
+]
+
+AVERAGE_CASES = [
+    ("¿Cuál es el promedio de edad?", everyone),
+    ("promedio de edad de las mujeres", is_female),
+    ("edad promedio de los hombres nacidos en enero", lambda r: is_male(r) and r.mes_nacimiento == 1),
+    ("promedio de edad de personas con más de 60 años", lambda r: age(r) is not None and age(r) > 60),
+]
+
+EXTREME_CASES = [
+    ("¿Quién es la persona más joven?", everyone, min),
+    ("¿Quién es la mujer de mayor edad?", is_female, max),
+    ("el hombre más viejo nacido en mayo", lambda r: is_male(r) and r.mes_nacimiento == 5, max),
+    ("la persona más joven con más de 30 años", lambda r: age(r) is not None and age(r) > 30, min),
+]
+
+GROUP_CASES = [
+    "¿Cuántas personas hay por género?",
+    "¿Cuántos hombres y mujeres hay?",
+]
+
+@pytest.fixture(scope="module")
+def engine():
+    return StructuredQueryEngine()
+
+@pytest.fixture(params=["columnas", "agregados"])
+def dataset(request, data_manager, records):
+    """Mismas preguntas contra el recorrido por índices y contra el snapshot de agregados"""
+    if request.param == "agregados":
+        return build_columns(data_manager, records)
+    return PersonColumns.from_records(records)
+
+def answer(engine, columns, query):
+    plan = engine.build_plan(QueryPlanCache.canonical_form(query)[0])
+    assert plan is not None, query
+    return plan, engine.execute(plan, columns)
+
+def selected(records, predicate):
+    return [record for record in records if is_valid(record) and predicate(record)]
+
+@pytest.mark.parametrize("query, predicate", COUNT_CASES, ids=[case[0] for case in COUNT_CASES])
+def test_counts(engine, dataset, records, query, predicate):
+    plan, text = answer(engine, dataset, query)
+    assert plan.aggregate == 'count'
+    expected = len(selected(records, predicate))
+    if expected:
+        assert text.startswith(f"Hay {expected} ")
+    else:
+        assert text.startswith("No hay ")
+
+@pytest.mark.parametrize("query, predicate", AVERAGE_CASES, ids=[case[0] for case in AVERAGE_CASES])
+def test_average_age(engine, dataset, records, query, predicate):
+    plan, text = answer(engine, dataset, query)
+    assert plan.aggregate == 'avg_age'
+    ages = [age(record) for record in selected(records, predicate) if age(record) is not None]
+    assert text.endswith(f" es {round(sum(ages) / len(ages), 1)} años")
+
+@pytest.mark.parametrize("query, predicate, extreme", EXTREME_CASES, ids=[case[0] for case in EXTREME_CASES])
+def test_extreme_age(engine, dataset, records, query, predicate, extreme):
+    plan, text = answer(engine, dataset, query)
+    assert plan.aggregate == ('youngest' if extreme is min else 'oldest')
+    aged = [record for record in selected(records, predicate) if age(record) is not None]
+    target = extreme(age(record) for record in aged)
+    tied = [record.nombre_completo for record in aged if age(record) == target]
+    assert f"{target} años" in text
+    if len(tied) == 1:
+        assert text.endswith(f"es {tied[0]} con {target} años")
+    else:
+        assert text.startswith(f"{len(tied)} personas comparten")
+        assert all(name in text for name in tied[:StructuredQueryEngine.MAX_LISTED_NAMES])
+
+@pytest.mark.parametrize("query", GROUP_CASES)
+def test_count_by_gender(engine, dataset, records, query):
+    plan, text = answer(engine, dataset, query)
+    assert (plan.aggregate, plan.group_by) == ('count', 'genero')
+    men, women = len(selected(records, is_male)), len(selected(records, is_female))
+    assert text.startswith(f"Hay {men} hombres y {women} mujeres")
+
+def test_average_age_by_gender(engine, dataset, records):
+    plan, text = answer(engine, dataset, "promedio de edad por género")
+    assert (plan.aggregate, plan.group_by) == ('avg_age', 'genero')
+    for label, predicate in (('hombres', is_male), ('mujeres', is_female)):
+        ages = [age(record) for record in selected(records, predicate) if age(record) is not None]
+        assert f"{label} {round(sum(ages) / len(ages), 1)} años" in text
+
+def test_list_of_matching_people(engine, dataset, records):
+    plan, text = answer(engine, dataset, "mujeres nacidas en abril con 70 años o más")
+    assert plan.aggregate == 'list'
+    names = [record.nombre_completo for record in selected(
+        records, lambda r: is_female(r) and r.mes_nacimiento == 4 and age(r) is not None and age(r) >= 70)]
+    if names:
+        assert text.startswith(f"Hay {len(names)} ")
+        assert names[0] in text
+    else:
+        assert text.startswith("No hay ")
+
+@pytest.mark.parametrize("query", [
+    "hola",
+    "¿Cuál es el correo de la persona más joven?",
+    "¿Cuántas personas viven en Cali?",
+    "personas nacidas en enero y febrero",
+    "la persona más joven y la más vieja",
+    "¿Quién es la persona más joven por género?",
+    "lista de personas",
+    "¿Cuántas personas tienen correo?",
+    "¿Qué porcentaje de personas son mujeres?",
+])
+def test_planner_falls_through_to_the_llm(engine, query):
+    assert engine.build_plan(QueryPlanCache.canonical_form(query)[0]) is None
@@ -0,0 +1,823 @@
+"""
+Benchmark reproducible de carga y latencia del servicio RAG, sin red.
+
+Genera un dataset sintético de 'personas' con la misma forma que los documentos
+de Firestore, lo sirve desde un Firestore simulado en memoria (dentro del mismo
+proceso que rag_service) y responde las llamadas al LLM con fake_groq.py. Ejecuta
+tres suites de escenarios y emite un JSON para comparar entre commits:
+
+    dataset_scaling    tiempo hasta ready, primera consulta y latencias por tamaño
+    cache              consulta en frío frente a cache caliente (dataset y respuestas)
+    concurrency        throughput y p50/p95/p99 con varios niveles de concurrencia
+    enrichment         registros/s del enriquecimiento masivo, en serie y con pool de procesos
+    warm_restart       arranque en frío frente a reinicio desde el snapshot local mapeado
+    bulk_load          lectura de Firestore única frente a páginas proyectadas por particiones
+    routing            todo al modelo grande frente a enrutamiento por clase con respaldo
+    name_search        construcción del índice de nombres y latencia de búsquedas exactas y con errores
+
+    python benchmark.py run --preset quick --output bench.json
+    python benchmark.py run --sizes 1000,100000,1000000 --concurrency 1,8,32
+    python benchmark.py serve --size 100000 --port 8200    # solo el servicio con datos sintéticos
+    python benchmark.py enrich --size 1000000 --processes 4
+    python benchmark.py load --size 100000 --partitions 4 --page-latency-ms 20
+    python benchmark.py names --size 1000000 --vocabulary 50000
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(TOOLS_DIR, "..", "app")
+
+PRESETS = {
+    "quick": [1_000, 100_000],
+    "full": [1_000, 100_000, 1_000_000]
+}
+ROUTED_MODEL = "llama3-8b-8192"
+FALLBACK_MODEL = "llama3-70b-8192"
+
+FIRST_NAMES = ["José", "María", "Ana", "Luis", "Carlos", "Sofía", "Juan", "Lucía", "Andrés", "Valentina",
+               "Camila", "Santiago", "Daniela", "Mateo", "Isabella", "Sebastián", "Mariana", "Felipe"]
+SECOND_NAMES = ["", "", "Alejandro", "Fernanda", "David", "Paola", "Esteban", "Carolina", "José", "Inés"]
+SURNAMES = ["Pérez", "Gómez", "Rodríguez", "López", "Martínez", "García", "Hernández", "Díaz", "Torres",
+            "Ramírez", "Castro", "Vargas", "Moreno", "Rojas", "Muñoz", "Ortiz", "Jiménez", "Suárez"]
+NAME_SYLLABLES = ["ba", "be", "ca", "co", "da", "do", "fa", "ga", "go", "la", "le", "li", "lo", "ma", "me", "mi",
+                  "na", "ne", "no", "pa", "ra", "re", "ri", "ro", "sa", "se", "ta", "te", "to", "va", "ve", "za",
+                  "al", "an", "ar", "el", "en", "er", "es", "ez", "in", "or", "os", "ul"]
+AUTO_ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+GENDERS = ["Masculino", "Femenino", "No binario", "Prefiero no reportar"]
+
+STRUCTURED_QUERIES = [
+    "¿Cuántas personas hay registradas?",
+    "¿Cuál es la edad promedio?",
+    "¿Cuántas personas nacieron en marzo?",
+    "¿Cuántos son mayores de edad?",
+]
+LLM_QUERIES = [
+    "¿Quién se llama María?",
+    "¿Cuál es el correo de Juan Pérez?",
+    "Dime el teléfono de Ana Gómez",
+    "Describe la distribución de género de los registrados",
+]
+
+# ============================================================================
+# DATASET SINTÉTICO
+# ============================================================================
+
+def generate_personas(count: int, seed: int = 42) -> Iterator[tuple]:
+    """Produce (doc_id, documento) deterministas con los campos que escribe el frontend"""
+    rng = random.Random(seed)
+    id_rng = random.Random(seed ^ 0x5EED)
+    epoch = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for number in range(count):
+        birth = datetime(rng.randint(1945, 2015), rng.randint(1, 12), rng.randint(1, 28))
+        first = rng.choice(FIRST_NAMES)
+        surname = f"{rng.choice(SURNAMES)} {rng.choice(SURNAMES)}"
+        # Una fracción usa el formato dd/mm/aaaa, como los registros antiguos
+        birth_text = birth.strftime("%d/%m/%Y") if number % 10 == 0 else birth.strftime("%Y-%m-%d")
+        created = epoch + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+        # Ids como los automáticos de Firestore: 20 caracteres de [0-9A-Za-z]
+        yield "".join(id_rng.choices(AUTO_ID_ALPHABET, k=20)), {
+            "primerNombre": first,
+            "segundoNombre": rng.choice(SECOND_NAMES),
+            "apellidos": surname,
+            "nroDocumento": str(10_000_000 + number),
+            "genero": rng.choice(GENDERS),
+            "correo": f"{first.lower()}.{number}@correo.test",
+            "celular": f"3{rng.randint(0, 99):02d}{rng.randint(0, 9_999_999):07d}",
+            "fechaNacimiento": birth_text,
+            "createdAt": created.isoformat().replace("+00:00", "Z")
+        }
+
+# ============================================================================
+# FIRESTORE SIMULADO EN MEMORIA
+# ============================================================================
+
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id: str, data: Optional[Dict[str, Any]], fields: Optional[List[str]] = None):
+        self.id = doc_id
+        self._data = data
+        self._fields = fields
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        if self._data is None:
+            return None
+        if self._fields is None:
+            return dict(self._data)
+        return {name: self._data[name] for name in self._fields if name in self._data}
+
+class FakeDocumentReference:
+    def __init__(self, collection: "FakeCollection", doc_id: str):
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data: Dict[str, Any]) -> None:
+        self.collection.documents[self.id] = dict(data)
+        self.collection.invalidate()
+
+    def get(self) -> FakeDocumentSnapshot:
+        return FakeDocumentSnapshot(self.id, self.collection.documents.get(self.id))
+
+class FakeQuery:
+    """Consulta inmutable: select, order_by('__name__'), cursores por id y limit, como el cliente real"""
+
+    def __init__(self, collection: "FakeCollection", **options):
+        self.collection = collection
+        self._options = {"limit": None, "fields": None, "start": None, "end": None, **options}
+
+    def _with(self, **options) -> "FakeQuery":
+        return FakeQuery(self.collection, **{**self._options, **options})
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._with(limit=count)
+
+    def select(self, field_paths) -> "FakeQuery":
+        return self._with(fields=list(field_paths))
+
+    def order_by(self, field_path: str) -> "FakeQuery":
+        if field_path != "__name__":
+            raise NotImplementedError("el Firestore simulado solo ordena por id")
+        return self
+
+    def start_at(self, cursor) -> "FakeQuery":
+        return self._with(start=(self._cursor_id(cursor), True))
+
+    def start_after(self, cursor) -> "FakeQuery":
+        return self._with(start=(self._cursor_id(cursor), False))
+
+    def end_before(self, cursor) -> "FakeQuery":
+        return self._with(end=self._cursor_id(cursor))
+
+    @staticmethod
+    def _cursor_id(cursor) -> str:
+        return cursor.id if isinstance(cursor, FakeDocumentSnapshot) else cursor["__name__"]
+
+    def stream(self) -> Iterator[FakeDocumentSnapshot]:
+        options = self._options
+        ids = self.collection.sorted_ids()
+        low = 0
+        if options["start"] is not None:
+            doc_id, inclusive = options["start"]
+            low = (bisect.bisect_left if inclusive else bisect.bisect_right)(ids, doc_id)
+        high = len(ids) if options["end"] is None else bisect.bisect_left(ids, options["end"])
+        if options["limit"] is not None:
+            high = min(high, low + options["limit"])
+
+        database = self.collection.database
+        page = ids[low:high]
+        if database is not None:
+            database.simulate_latency(len(page), options["fields"])
+        documents = self.collection.documents
+        for doc_id in page:
+            yield FakeDocumentSnapshot(doc_id, documents[doc_id], options["fields"])
+
+    def get(self) -> List[FakeDocumentSnapshot]:
+        return list(self.stream())
+
+class FakeCollection(FakeQuery):
+    """Colección con la parte de la API que usa rag_service: consultas, document, add y on_snapshot"""
+
+    def __init__(self, name: str, database: Optional["FakeFirestore"] = None):
+        self.name = name
+        self.database = database
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._next_id = 0
+        self._sorted: Optional[List[str]] = None
+        super().__init__(self)
+
+    def sorted_ids(self) -> List[str]:
+        if self._sorted is None or len(self._sorted) != len(self.documents):
+            self._sorted = sorted(self.documents)
+        return self._sorted
+
+    def invalidate(self) -> None:
+        self._sorted = None
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentReference:
+        if doc_id is None:
+            self._next_id += 1
+            doc_id = f"{self.name}_{self._next_id:08d}"
+        return FakeDocumentReference(self, doc_id)
+
+    def add(self, data: Dict[str, Any]):
+        reference = self.document()
+        reference.set(data)
+        return None, reference
+
+    def on_snapshot(self, callback):
+        """Entrega el estado inicial como ADDED, igual que el listener real en su primera llamada"""
+        added = types.SimpleNamespace(name="ADDED")
+        changes = [types.SimpleNamespace(type=added, document=snapshot) for snapshot in self.stream()]
+        callback(self.get(), changes, datetime.now(timezone.utc))
+        return types.SimpleNamespace(unsubscribe=lambda: None)
+
+class FakeWriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, reference: FakeDocumentReference, data: Dict[str, Any]) -> None:
+        self._writes.append((reference, data))
+
+    def commit(self) -> None:
+        for reference, data in self._writes:
+            reference.set(data)
+        self._writes.clear()
+
+class FakeFirestore:
+    """Base de datos en memoria; page_latency_ms y field_latency_us simulan la red por página y por campo"""
+
+    FULL_DOCUMENT_FIELDS = 12
+
+    def __init__(self, page_latency_ms: float = 0.0, field_latency_us: float = 0.0):
+        self.collections: Dict[str, FakeCollection] = {}
+        self.page_latency_ms = page_latency_ms
+        self.field_latency_us = field_latency_us
+        self.requests = 0
+        self.fields_served = 0
+
+    def collection(self, name: str) -> FakeCollection:
+        return self.collections.setdefault(name, FakeCollection(name, self))
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch()
+
+    def simulate_latency(self, documents: int, fields: Optional[List[str]]) -> None:
+        # Los documentos reales traen más campos que los que usa el enriquecimiento (ids, auditoría...)
+        served = documents * (len(fields) if fields is not None else self.FULL_DOCUMENT_FIELDS)
+        self.requests += 1
+        self.fields_served += served
+        delay = self.page_latency_ms / 1000 + served * self.field_latency_us / 1e6
+        if delay > 0:
+            time.sleep(delay)
+
+def install_fake_firestore(size: int, seed: int, page_latency_ms: float = 0.0,
+                           field_latency_us: float = 0.0) -> FakeFirestore:
+    """Sustituye las credenciales y el cliente de firebase_admin antes de importar rag_service"""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    database = FakeFirestore(page_latency_ms, field_latency_us)
+    database.collection("personas").documents.update(generate_personas(size, seed))
+
+    def no_app(*args, **kwargs):
+        raise ValueError("sin app")
+
+    credentials.Certificate = lambda *args, **kwargs: None
+    firebase_admin.get_app = no_app
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firestore.client = lambda *args, **kwargs: database
+    return database
+
+def serve(size: int, seed: int, port: int) -> None:
+    """Proceso del servicio: Firestore simulado en memoria y rag_service bajo uvicorn"""
+    import uvicorn
+
+    install_fake_firestore(size, seed)
+    sys.path.insert(0, APP_DIR)
+    import rag_service
+
+    uvicorn.run(rag_service.app, host="127.0.0.1", port=port, log_level="warning")
+
+def enrich(size: int, seed: int, processes: int) -> Dict[str, Any]:
+    """Mide BulkEnricher sobre el dataset sintético sin levantar el servidor"""
+    install_fake_firestore(0, seed)
+    sys.path.insert(0, APP_DIR)
+    import rag_service
+
+    documents = list(generate_personas(size, seed))
+    manager = rag_service.IntelligentDataManager(rag_service.FirebaseManager())
+    results = {}
+    for label, workers in (("serial", 1), ("pool", processes)):
+        if label == "pool" and workers <= 1:
+            continue
+        manager.enrich_processes = workers
+        manager.enrich_process_threshold = 0
+        manager.enrich_documents(documents, datetime.now())
+        results[label] = manager.last_enrichment
+    return {"size": size, **results}
+
+def rare_surnames(count: int, seed: int) -> List[str]:
+    """Apellidos sintéticos poco frecuentes para un vocabulario de nombres realista"""
+    rng = random.Random(seed ^ 0xA11CE)
+    surnames = set()
+    while len(surnames) < count:
+        surnames.add("".join(rng.choice(NAME_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    return sorted(surnames)
+
+def name_search(size: int, seed: int, vocabulary: int, repeat: int) -> Dict[str, Any]:
+    """Índice de nombres sobre el dataset sintético: construcción y latencia por tipo de búsqueda"""
+    install_fake_firestore(0, seed)
+    sys.path.insert(0, APP_DIR)
+    import rag_service
+
+    rng = random.Random(seed)
+    extra = rare_surnames(vocabulary, seed)
+    documents = []
+    for number, (doc_id, raw) in enumerate(generate_personas(size, seed)):
+        if extra and number % 7 == 0:
+            raw["apellidos"] = f"{rng.choice(extra)} {raw['apellidos'].split()[0]}"
+        documents.append((doc_id, raw))
+    manager = rag_service.IntelligentDataManager(rag_service.FirebaseManager())
+    columns = rag_service.PersonColumns.from_records(manager.enrich_documents(documents, datetime.now()))
+    del documents
+
+    started = time.perf_counter()
+    indexes = columns.indexes
+    indexes_s = time.perf_counter() - started
+    names = indexes.names
+
+    rare = next((token for token, ids in names.postings.items() if len(token) >= 6 and ids.size <= 5), "zuloaga")
+    searches = {
+        "common_exact": ["jose"],
+        "common_typo": ["jsoe"],
+        "full_name": ["maria", "gomez"],
+        "full_name_typo": ["maria", "gomes"],
+        "rare_exact": [rare],
+        "rare_typo": [rare[:1] + rare[2:]],
+        "missing": ["wxyzq"]
+    }
+    results = {}
+    for label, terms in searches.items():
+        cold, warm = [], []
+        for _ in range(repeat):
+            names._expansions.clear()
+            started = time.perf_counter()
+            matches = names.search(terms, limit=10)
+            cold.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            names.search(terms, limit=10)
+            warm.append(time.perf_counter() - started)
+        results[label] = {
+            "terms": terms,
+            "exact": int(matches.exact.size),
+            "approximate": int(matches.approximate.size),
+            "cold_p50_us": round(percentile(cold, 0.5) * 1e6, 1),
+            "cold_p95_us": round(percentile(cold, 0.95) * 1e6, 1),
+            "warm_p50_us": round(percentile(warm, 0.5) * 1e6, 1)
+        }
+    return {"size": len(columns), "indexes_build_s": round(indexes_s, 3), **names.stats(), "searches": results}
+
+def bulk_load(size: int, seed: int, partitions: int, page_size: int, page_latency_ms: float,
+              field_latency_us: float) -> Dict[str, Any]:
+    """Carga completa contra el Firestore simulado; partitions=0 reproduce la lectura única sin proyección"""
+    database = install_fake_firestore(size, seed, page_latency_ms, field_latency_us)
+    sys.path.insert(0, APP_DIR)
+    import rag_service
+
+    manager = rag_service.IntelligentDataManager(rag_service.FirebaseManager())
+    manager.firebase.connect()
+    requests_before, fields_before = database.requests, database.fields_served
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    if partitions == 0:
+        snapshot = manager.firebase.collection.get()
+        documents = [(doc.id, doc.to_dict()) for doc in snapshot]
+        records = manager.enrich_documents(documents, datetime.now())
+        del snapshot, documents
+    else:
+        manager.load_partitions = partitions
+        manager.load_page_size = page_size
+        records = manager._load_enriched_data()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "size": size,
+        "partitions": partitions,
+        "page_size": page_size if partitions else None,
+        "records": len(records),
+        "dataset_version": manager._compute_fingerprint(records),
+        "duration_s": round(elapsed, 3),
+        "documents_per_s": round(size / elapsed) if elapsed else None,
+        "firestore_requests": database.requests - requests_before,
+        "fields_served": database.fields_served - fields_before,
+        "peak_rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1)
+    }
+
+# ============================================================================
+# PROCESOS AUXILIARES
+# ============================================================================
+
+def wait_until(url: str, timeout: float) -> Optional[float]:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    return None
+
+def start_fake_groq(port: int, latency_ms: float, model_latency_ms: Optional[Dict[str, float]] = None) -> subprocess.Popen:
+    env = dict(os.environ, FAKE_GROQ_LATENCY_MS=str(latency_ms), FAKE_GROQ_RPM="0", FAKE_GROQ_TPM="0",
+               FAKE_GROQ_MODEL_LATENCY_MS=json.dumps(model_latency_ms or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fake_groq:app", "--app-dir", TOOLS_DIR,
+         "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if wait_until(f"http://127.0.0.1:{port}/stats", 30) is None:
+        process.terminate()
+        raise RuntimeError("fake_groq no arrancó")
+    return process
+
+class ServiceProcess:
+    """rag_service en un subproceso con un dataset sintético del tamaño pedido"""
+
+    def __init__(self, size: int, args, workdir: str, warmup: bool, snapshot_path: str = "",
+                 extra_env: Optional[Dict[str, str]] = None):
+        self.size = size
+        self.seed = args.seed
+        self.port = args.port
+        self.base_url = f"http://127.0.0.1:{args.port}"
+        self.timeout = args.timeout
+        self.env = dict(
+            os.environ,
+            GROQ_API_KEY="gsk_benchmark",
+            GROQ_BASE_URL=f"http://127.0.0.1:{args.groq_port}/openai/v1/chat/completions",
+            GROQ_REQUESTS_PER_MINUTE=str(args.llm_rpm),
+            GROQ_TOKENS_PER_MINUTE=str(args.llm_tpm),
+            FIREBASE_PROJECT_ID="benchmark",
+            FIREBASE_PRIVATE_KEY="benchmark",
+            FIREBASE_CLIENT_EMAIL="benchmark@benchmark.test",
+            RAG_LOG_FILE=os.path.join(workdir, "rag_system.log"),
+            RAG_LOG_LEVEL=args.log_level,
+            STATE_BACKEND="memory",
+            DATASET_WARMUP="true" if warmup else "false",
+            DATASET_INCREMENTAL_SYNC="false",
+            DATASET_SNAPSHOT_PATH=snapshot_path,
+            **(extra_env or {})
+        )
+        self.process = None
+        self.started = 0.0
+
+    def __enter__(self) -> "ServiceProcess":
+        self.started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", "--size", str(self.size),
+             "--seed", str(self.seed), "--port", str(self.port)],
+            env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def wait_ready(self) -> Dict[str, Optional[float]]:
+        live = wait_until(f"{self.base_url}/health/live", self.timeout)
+        ready = wait_until(f"{self.base_url}/health/ready", self.timeout) if live is not None else None
+        elapsed = time.perf_counter() - self.started
+        if ready is None:
+            raise RuntimeError(f"el servicio con {self.size} registros no quedó listo en {self.timeout}s")
+        lifecycle = httpx.get(f"{self.base_url}/health/ready", timeout=10).json()
+        return {"time_to_ready_s": round(elapsed, 3), "lifecycle_timings": lifecycle.get("timings", {})}
+
+    def dataset_refresh(self) -> Dict[str, Any]:
+        metrics = httpx.get(f"{self.base_url}/metrics", timeout=60).json()
+        return metrics.get("cache_statistics", {}).get("dataset_refresh", {})
+
+# ============================================================================
+# MEDICIÓN
+# ============================================================================
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 2)
+    }
+
+async def timed_query(client: httpx.AsyncClient, query: str) -> tuple:
+    started = time.perf_counter()
+    try:
+        response = await client.post("/consulta-natural", json={"consulta": query})
+        path = response.json().get("metadata", {}).get("query_path", "unknown")
+    except (httpx.HTTPError, ValueError):
+        path = "http_error"
+    return time.perf_counter() - started, path
+
+async def run_sequence(base_url: str, queries: List[str]) -> Dict[str, Any]:
+    latencies, paths = [], {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        for query in queries:
+            elapsed, path = await timed_query(client, query)
+            latencies.append(elapsed)
+            paths[path] = paths.get(path, 0) + 1
+    return {"latency": latency_summary(latencies), "query_paths": paths}
+
+async def run_concurrent(base_url: str, queries: List[str], concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, paths = [], {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        async def one(query: str) -> None:
+            async with semaphore:
+                elapsed, path = await timed_query(client, query)
+            latencies.append(elapsed)
+            paths[path] = paths.get(path, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(query) for query in queries))
+        elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": len(queries),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(queries) / elapsed, 2) if elapsed else 0.0,
+        "latency": latency_summary(latencies),
+        "query_paths": paths,
+        "errors": paths.get("error", 0) + paths.get("http_error", 0)
+    }
+
+def service_metrics(base_url: str) -> Dict[str, Any]:
+    metrics = httpx.get(f"{base_url}/metrics", timeout=30).json()
+    return {"latency": metrics.get("latency", {}),
+            "response_cache": metrics.get("cache_statistics", {}).get("response_cache", {})}
+
+def unique_queries(templates: List[str], count: int, tag: str) -> List[str]:
+    """Variantes únicas para esquivar el cache de respuestas y la coalescencia"""
+    return [f"{templates[number % len(templates)]} ({tag} #{number})" for number in range(count)]
+
+# ============================================================================
+# ESCENARIOS
+# ============================================================================
+
+def scenario_dataset_scaling(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Arranque con precarga y latencias de consultas estructuradas y con LLM"""
+    with ServiceProcess(size, args, workdir, warmup=True)as service:
+        result = {"size": size, **service.wait_ready()}
+        result["structured"] = asyncio.run(run_sequence(
+            service.base_url, unique_queries(STRUCTURED_QUERIES, args.requests, f"s{size}")))
+        result["llm"] = asyncio.run(run_sequence(
+            service.base_url, unique_queries(LLM_QUERIES, args.requests, f"l{size}")))
+        result["service_metrics"] = service_metrics(service.base_url)
+    return result
+
+def scenario_cache(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Primera consulta sin dataset cargado frente a repeticiones servidas desde los caches"""
+    with ServiceProcess(size, args, workdir, warmup=False)as service:
+        result = {"size": size, **service.wait_ready()}
+        query = LLM_QUERIES[0]
+        result["cold_first_query"] = asyncio.run(run_sequence(service.base_url, [query]))
+        result["dataset_hot_unique_queries"] = asyncio.run(run_sequence(
+            service.base_url, unique_queries(LLM_QUERIES, args.requests, "hot")))
+        result["response_cache_hits"] = asyncio.run(run_sequence(service.base_url, [query] * args.requests))
+        result["service_metrics"] = service_metrics(service.base_url)
+    return result
+
+def scenario_concurrency(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Throughput y colas con consultas únicas (peor caso) y repetidas (cache y coalescencia)"""
+    with ServiceProcess(size, args, workdir, warmup=True)as service:
+        result = {"size": size, **service.wait_ready(), "levels": []}
+        templates = STRUCTURED_QUERIES + LLM_QUERIES
+        for level in args.concurrency:
+            total = max(args.requests, level * 4)
+            result["levels"].append({
+                "unique": asyncio.run(run_concurrent(
+                    service.base_url, unique_queries(templates, total, f"c{level}"), level)),
+                "repeated": asyncio.run(run_concurrent(
+                    service.base_url, [templates[number % len(templates)] for number in range(total)], level))
+            })
+        result["service_metrics"] = service_metrics(service.base_url)
+    return result
+
+def scenario_enrichment(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Throughput del enriquecimiento en un proceso aparte para no arrastrar memoria entre tamaños"""
+    env = dict(os.environ, RAG_LOG_FILE=os.path.join(workdir, "rag_system.log"), RAG_LOG_LEVEL=args.log_level)
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "enrich", "--size", str(size),
+         "--seed", str(args.seed), "--processes", str(args.enrich_processes)],
+        env=env, stderr=subprocess.DEVNULL, text=True
+    )
+    return json.loads(output)
+
+def scenario_name_search(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Índice de nombres en un proceso aparte, como el enriquecimiento"""
+    env = dict(os.environ, RAG_LOG_FILE=os.path.join(workdir, "rag_system.log"), RAG_LOG_LEVEL=args.log_level)
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "names", "--size", str(size), "--seed", str(args.seed),
+         "--vocabulary", str(args.name_vocabulary)],
+        env=env, stderr=subprocess.DEVNULL, text=True
+    )
+    return json.loads(output)
+
+def scenario_bulk_load(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Lectura única sin proyección frente al cargador por particiones, cada uno en su propio proceso"""
+    env = dict(os.environ, RAG_LOG_FILE=os.path.join(workdir, "rag_system.log"), RAG_LOG_LEVEL=args.log_level)
+    runs = []
+    for partitions in [0] + args.load_partitions:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), "load", "--size", str(size), "--seed", str(args.seed),
+             "--partitions", str(partitions), "--page-size", str(args.page_size),
+             "--page-latency-ms", str(args.firestore_page_latency_ms),
+             "--field-latency-us", str(args.firestore_field_latency_us)],
+            env=env, stderr=subprocess.DEVNULL, text=True
+        )
+        runs.append(json.loads(output))
+    return {
+        "size": size,
+        "consistent": len({run["dataset_version"] for run in runs}) == 1,
+        "runs": runs
+    }
+
+def scenario_warm_restart(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Arranque sin snapshot frente a un reinicio que mapea el snapshot local escrito por el anterior"""
+    snapshot_path = os.path.join(workdir, f"dataset_{size}.snapshot")
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    result = {"size": size}
+    for label in ("cold", "warm"):
+        with ServiceProcess(size, args, workdir, warmup=True, snapshot_path=snapshot_path) as service:
+            result[label] = service.wait_ready()
+            result[label]["first_query"] = asyncio.run(run_sequence(service.base_url, [STRUCTURED_QUERIES[0]]))
+            give_up_at = time.perf_counter() + service.timeout
+            while label == "cold" and not service.dataset_refresh().get("snapshot", {}).get("written_version"):
+                if time.perf_counter() > give_up_at:
+                    raise RuntimeError("el servicio no escribió el snapshot")
+                time.sleep(0.5)
+            result[label]["snapshot"] = service.dataset_refresh().get("snapshot", {})
+    return result
+
+def scenario_routing(size: int, args, workdir: str) -> Dict[str, Any]:
+    """Latencia de las consultas al LLM con un único modelo grande frente al enrutamiento por clase"""
+    configs = {
+        "large_only": {"GROQ_MODEL": FALLBACK_MODEL, "LLM_FALLBACK_MODEL": ""},
+        "routed": {"GROQ_MODEL": ROUTED_MODEL, "LLM_FALLBACK_MODEL": FALLBACK_MODEL,
+                   "LLM_BUDGET_MIN_SAMPLES": str(max(1, args.requests // 4))}
+    }
+    result = {"size": size}
+    for label, extra_env in configs.items():
+        with ServiceProcess(size, args, workdir, warmup=True, extra_env=extra_env) as service:
+            result[label] = service.wait_ready()
+            result[label]["llm"] = asyncio.run(run_sequence(
+                service.base_url, unique_queries(LLM_QUERIES, args.requests, f"r{label}")))
+            metrics = httpx.get(f"{service.base_url}/metrics", timeout=30).json()
+            result[label]["llm_routing"] = metrics.get("llm_routing", {})
+    return result
+
+SCENARIOS = {
+    "dataset_scaling": scenario_dataset_scaling,
+    "cache": scenario_cache,
+    "concurrency": scenario_concurrency,
+    "enrichment": scenario_enrichment,
+    "warm_restart": scenario_warm_restart,
+    "bulk_load": scenario_bulk_load,
+    "routing": scenario_routing,
+    "name_search": scenario_name_search
+}
+
+def git_revision() -> Dict[str, Any]:
+    def git(*command) -> Optional[str]:
+        try:
+            return subprocess.check_output(["git", *command], cwd=TOOLS_DIR, text=True,
+                                           stderr=subprocess.DEVNULL).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--", ".."))}
+
+def run(args) -> Dict[str, Any]:
+    sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else PRESETS[args.preset]
+    report = {
+        "benchmark": "rag_service",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git": git_revision(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "config": {"sizes": sizes, "seed": args.seed, "requests": args.requests,
+                   "concurrency": args.concurrency, "enrich_processes": args.enrich_processes,
+                   "concurrency_size": args.concurrency_size or sizes[0],
+                   "llm_latency_ms": args.llm_latency_ms,
+                   "llm_fallback_latency_ms": args.llm_fallback_latency_ms or args.llm_latency_ms * 3,
+                   "scenarios": args.scenarios},
+        "scenarios": {name: [] for name in args.scenarios}
+    }
+
+    groq = start_fake_groq(args.groq_port, args.llm_latency_ms,
+                           {FALLBACK_MODEL: args.llm_fallback_latency_ms or args.llm_latency_ms * 3})
+    try:
+        with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+            for name in args.scenarios:
+                # La concurrencia se mide sobre un único tamaño para acotar la duración
+                scenario_sizes = sizes if name != "concurrency" else [args.concurrency_size or sizes[0]]
+                for size in scenario_sizes:
+                    print(f"▶ {name} con {size} registros", file=sys.stderr)
+                    report["scenarios"][name].append(SCENARIOS[name](size, args, workdir))
+    finally:
+        groq.terminate()
+        groq.wait(10)
+    return report
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark reproducible del servicio RAG")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="ejecuta las suites y emite JSON")
+    run_parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    run_parser.add_argument("--sizes", help="tamaños separados por comas; sustituye al preset")
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            type=lambda value: [name for name in value.split(",") if name])
+    run_parser.add_argument("--concurrency", default="1,8,32",
+                            type=lambda value: [int(level) for level in value.split(",")])
+    run_parser.add_argument("--concurrency-size", type=int, help="tamaño del dataset de la suite de concurrencia")
+    run_parser.add_argument("--requests", type=int, default=20, help="consultas por medición")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    run_parser.add_argument("--llm-fallback-latency-ms", type=float,
+                            help="latencia del modelo de respaldo (3x --llm-latency-ms por defecto)")
+    run_parser.add_argument("--llm-rpm", type=int, default=100_000, help="límite del governor hacia el LLM")
+    run_parser.add_argument("--llm-tpm", type=int, default=100_000_000)
+    run_parser.add_argument("--port", type=int, default=8200)
+    run_parser.add_argument("--groq-port", type=int, default=8201)
+    run_parser.add_argument("--timeout", type=float, default=1800.0, help="espera máxima hasta ready")
+    run_parser.add_argument("--load-partitions", default="1,2,4,8",
+                            type=lambda value: [int(level) for level in value.split(",")])
+    run_parser.add_argument("--page-size", type=int, default=1000)
+    run_parser.add_argument("--firestore-page-latency-ms", type=float, default=20.0)
+    run_parser.add_argument("--firestore-field-latency-us", type=float, default=1.0)
+    run_parser.add_argument("--enrich-processes", type=int, default=os.cpu_count() or 1)
+    run_parser.add_argument("--name-vocabulary", type=int, default=50_000,
+                            help="apellidos sintéticos poco frecuentes para la suite name_search")
+    run_parser.add_argument("--log-level", default="WARNING")
+    run_parser.add_argument("--output", help="fichero JSON de salida (stdout por defecto)")
+
+    serve_parser = commands.add_parser("serve", help="sirve rag_service con Firestore simulado")
+    serve_parser.add_argument("--size", type=int, default=1_000)
+    serve_parser.add_argument("--seed", type=int, default=42)
+    serve_parser.add_argument("--port", type=int, default=8200)
+
+    enrich_parser = commands.add_parser("enrich", help="mide el enriquecimiento masivo en registros/s")
+    enrich_parser.add_argument("--size", type=int, default=100_000)
+    enrich_parser.add_argument("--seed", type=int, default=42)
+    enrich_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+
+    load_parser = commands.add_parser("load", help="mide la carga completa desde el Firestore simulado")
+    load_parser.add_argument("--size", type=int, default=100_000)
+    load_parser.add_argument("--seed", type=int, default=42)
+    load_parser.add_argument("--partitions", type=int, default=4, help="0 = lectura única sin proyección")
+    load_parser.add_argument("--page-size", type=int, default=1000)
+    load_parser.add_argument("--page-latency-ms", type=float, default=20.0)
+    load_parser.add_argument("--field-latency-us", type=float, default=1.0)
+
+    names_parser = commands.add_parser("names", help="mide el índice aproximado de nombres")
+    names_parser.add_argument("--size", type=int, default=1_000_000)
+    names_parser.add_argument("--seed", type=int, default=42)
+    names_parser.add_argument("--vocabulary", type=int, default=50_000)
+    names_parser.add_argument("--repeat", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "names":
+        print(json.dumps(name_search(args.size, args.seed, args.vocabulary, args.repeat), indent=2, ensure_ascii=False))
+        return
+    if args.command == "load":
+        print(json.dumps(bulk_load(args.size, args.seed, args.partitions, args.page_size,
+                                   args.page_latency_ms, args.field_latency_us), indent=2))
+        return
+    if args.command == "serve":
+        serve(args.size, args.seed, args.port)
+        return
+    if args.command == "enrich":
+        print(json.dumps(enrich(args.size, args.seed, args.processes), indent=2, ensure_ascii=False))
+        return
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(unknown)}")
+
+    report = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
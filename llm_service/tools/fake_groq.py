@@ -0,0 +1,183 @@
+"""
+Servidor local compatible con la API de chat completions de Groq/OpenAI.
+
+Permite probar el servicio RAG sin red ni API key:
+
+    uvicorn fake_groq:app --port 8001
+    GROQ_BASE_URL=http://localhost:8001/openai/v1/chat/completions
+
+Variables de entorno:
+    FAKE_GROQ_LATENCY_MS      latencia antes de la respuesta / primer token
+    FAKE_GROQ_TOKEN_DELAY_MS  pausa entre tokens en modo streaming
+    FAKE_GROQ_ANSWER          texto fijo de respuesta (por defecto se deriva de la pregunta)
+    FAKE_GROQ_RPM             peticiones por minuto permitidas; por encima responde 429 (0 = sin límite)
+    FAKE_GROQ_TPM             tokens por minuto permitidos; por encima responde 429 (0 = sin límite)
+    FAKE_GROQ_WINDOW_SECONDS  duración de la ventana de límites (60 por defecto; menor para pruebas rápidas)
+    FAKE_GROQ_MODEL_LATENCY_MS  latencia por modelo en JSON, p. ej. {"llama3-70b-8192": 600}
+    FAKE_GROQ_INVALID_MODELS    modelos (separados por comas) que responden fuera de las reglas del prompt
+
+Las respuestas se cortan en max_tokens palabras con finish_reason "length", como
+haría la API, para probar el enrutamiento de modelos y el respaldo por validación.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict
+
+from collections import deque
+
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Groq simulado")
+
+LATENCY_MS = float(os.getenv("FAKE_GROQ_LATENCY_MS", "200"))
+TOKEN_DELAY_MS = float(os.getenv("FAKE_GROQ_TOKEN_DELAY_MS", "20"))
+FIXED_ANSWER = os.getenv("FAKE_GROQ_ANSWER")
+REQUESTS_PER_MINUTE = int(os.getenv("FAKE_GROQ_RPM", "0"))
+TOKENS_PER_MINUTE = int(os.getenv("FAKE_GROQ_TPM", "0"))
+
+WINDOW_SECONDS = float(os.getenv("FAKE_GROQ_WINDOW_SECONDS", "60"))
+MODEL_LATENCY_MS = json.loads(os.getenv("FAKE_GROQ_MODEL_LATENCY_MS", "{}"))
+INVALID_MODELS = {model for model in os.getenv("FAKE_GROQ_INVALID_MODELS", "").split(",") if model}
+INVALID_ANSWER = "Puedes preguntar por conteos, edades o nombres de las personas registradas."
+_window = deque()
+stats = {"accepted": 0, "rate_limited": 0, "truncated": 0, "by_model": {}}
+
+
+def estimate_request_tokens(payload: Dict[str, Any]) -> int:
+    return len(json.dumps(payload.get("messages", []))) // 4 + int(payload.get("max_tokens", 0))
+
+
+def rate_limit_headers(now: float, tokens: int) -> Dict[str, str]:
+    """Cabeceras al estilo de Groq con lo que queda en la ventana deslizante"""
+    while _window and now - _window[0][0] >= WINDOW_SECONDS:
+        _window.popleft()
+    used_tokens = sum(entry[1] for entry in _window)
+    reset = WINDOW_SECONDS - (now - _window[0][0]) if _window else 0.0
+    headers = {}
+    if REQUESTS_PER_MINUTE:
+        headers["x-ratelimit-limit-requests"] = str(REQUESTS_PER_MINUTE)
+        headers["x-ratelimit-remaining-requests"] = str(max(0, REQUESTS_PER_MINUTE - len(_window)))
+        headers["x-ratelimit-reset-requests"] = f"{reset:.2f}s"
+    if TOKENS_PER_MINUTE:
+        headers["x-ratelimit-limit-tokens"] = str(TOKENS_PER_MINUTE)
+        headers["x-ratelimit-remaining-tokens"] = str(max(0, TOKENS_PER_MINUTE - used_tokens))
+        headers["x-ratelimit-reset-tokens"] = f"{reset:.2f}s"
+    return headers
+
+
+def check_rate_limit(tokens: int):
+    """None si la petición entra en la ventana; si no, la respuesta 429 con Retry-After"""
+    now = time.monotonic()
+    headers = rate_limit_headers(now, tokens)
+    over_requests = REQUESTS_PER_MINUTE and len(_window) >= REQUESTS_PER_MINUTE
+    over_tokens = TOKENS_PER_MINUTE and sum(entry[1] for entry in _window) + tokens > TOKENS_PER_MINUTE
+    if over_requests or over_tokens:
+        stats["rate_limited"] += 1
+        retry_after = WINDOW_SECONDS - (now - _window[0][0]) if _window else 1.0
+        headers["retry-after"] = str(max(1, int(retry_after + 0.999)))
+        return JSONResponse(
+            status_code=429,
+            headers=headers,
+            content={"error": {"message": "Rate limit reached", "type": "tokens" if over_tokens else "requests",
+                               "code": "rate_limit_exceeded"}}
+        )
+    
+    _window.append((now, tokens))
+    stats["accepted"] += 1
+    return None
+
+
+def build_answer(payload: Dict[str, Any]) -> str:
+    """Respuesta determinista a partir de la pregunta del prompt"""
+    if payload.get("model") in INVALID_MODELS:
+        return INVALID_ANSWER
+    if FIXED_ANSWER:
+        return FIXED_ANSWER
+    
+    prompt = payload.get("messages", [{}])[-1].get("content", "")
+    if "Responde solo 'OK'" in prompt:
+        return "OK"
+    
+    match = re.search(r"PREGUNTA:\s*(.+)", prompt)
+    question = match.group(1).strip() if match else prompt[:80]
+    return f"Respuesta simulada para: {question}"
+
+
+def latency_seconds(payload: Dict[str, Any]) -> float:
+    return float(MODEL_LATENCY_MS.get(payload.get("model"), LATENCY_MS)) / 1000
+
+
+def truncate(payload: Dict[str, Any], content: str) -> tuple:
+    """(texto, finish_reason) con la salida limitada a max_tokens palabras"""
+    words = content.split()
+    max_tokens = int(payload.get("max_tokens") or 0)
+    if max_tokens and len(words) > max_tokens:
+        stats["truncated"] += 1
+        return " ".join(words[:max_tokens]), "length"
+    return content, "stop"
+
+
+def completion_body(payload: Dict[str, Any], content: str) -> Dict[str, Any]:
+    content, finish_reason = truncate(payload, content)
+    return {
+        "id": f"chatcmpl-fake-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason
+        }],
+        "usage": {
+            "prompt_tokens": len(json.dumps(payload.get("messages", []))) // 4,
+            "completion_tokens": len(content.split()),
+            "total_tokens": len(json.dumps(payload.get("messages", []))) // 4 + len(content.split())
+        }
+    }
+
+
+async def stream_chunks(payload: Dict[str, Any], content: str):
+    await asyncio.sleep(latency_seconds(payload))
+    content, finish_reason = truncate(payload, content)
+    tokens = re.findall(r"\S+\s*", content)
+    for token in tokens:
+        chunk = {
+            "object": "chat.completion.chunk",
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(TOKEN_DELAY_MS / 1000)
+    
+    final = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(payload: Dict[str, Any] = Body(...)):
+    tokens = estimate_request_tokens(payload)
+    limited = check_rate_limit(tokens)
+    if limited is not None:
+        return limited
+    
+    content = build_answer(payload)
+    headers = rate_limit_headers(time.monotonic(), tokens)
+    model = payload.get("model", "fake")
+    stats["by_model"][model] = stats["by_model"].get(model, 0) + 1
+    
+    if payload.get("stream"):
+        return StreamingResponse(stream_chunks(payload, content), media_type="text/event-stream", headers=headers)
+    
+    await asyncio.sleep(latency_seconds(payload))
+    return JSONResponse(completion_body(payload, content), headers=headers)
+
+
+@app.get("/stats")
+async def fake_stats():
+    return stats
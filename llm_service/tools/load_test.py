@@ -0,0 +1,95 @@
+"""
+Prueba de carga contra el servicio RAG.
+
+Lanza consultas concurrentes a /consulta-natural y resume latencias, errores y
+el estado del governor de tasa expuesto en /metrics. Pensado para usarse con
+GROQ_BASE_URL apuntando a fake_groq.py con FAKE_GROQ_RPM / FAKE_GROQ_TPM:
+
+    FAKE_GROQ_RPM=20 uvicorn fake_groq:app --port 8001
+    GROQ_BASE_URL=http://localhost:8001/openai/v1/chat/completions uvicorn rag_service:app --port 8000
+    python load_test.py --url http://localhost:8000 --requests 100 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+DEFAULT_QUERIES = [
+    "¿Quién se llama María?",
+    "¿Cuál es el correo de Juan Pérez?",
+    "Dime el teléfono de Ana Gómez",
+    "¿Hay alguien con documento 1010?",
+    "¿Quiénes nacieron en 1990 y tienen correo?",
+]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run(url: str, total: int, concurrency: int, queries: List[str], unique: bool) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    paths: Dict[str, int] = {}
+    errors = 0
+    
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        async def one(number: int) -> None:
+            nonlocal errors
+            query = queries[number % len(queries)]
+            if unique:
+                query = f"{query} (#{number})"
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/consulta-natural", json={"consulta": query})
+                    path = response.json().get("metadata", {}).get("query_path", "unknown")
+                except (httpx.HTTPError, ValueError):
+                    path = "http_error"
+                latencies.append(time.perf_counter() - started)
+                paths[path] = paths.get(path, 0) + 1
+                if path in ("error", "http_error"):
+                    errors += 1
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(one(number) for number in range(total)))
+        elapsed = time.perf_counter() - started
+        metrics = (await client.get("/metrics")).json()
+    
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "errors": errors,
+        "query_paths": paths,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(latencies, 0.99) * 1000, 1),
+            "max": round(max(latencies, default=0.0) * 1000, 1)
+        },
+        "llm_rate_limit": metrics.get("llm_rate_limit", {})
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio RAG")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--unique", action="store_true", help="evita el cache de respuestas y la coalescencia")
+    args = parser.parse_args()
+    
+    result = asyncio.run(run(args.url, args.requests, args.concurrency, DEFAULT_QUERIES, args.unique))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Inspección del snapshot local del dataset (DATASET_SNAPSHOT_PATH).
+
+Lee solo la cabecera: versión del dataset, antigüedad, número de registros y
+bytes por sección, para dimensionar la memoria mapeada de colecciones grandes
+sin cargar el archivo.
+
+    python snapshot_info.py /app/state/dataset.snapshot
+    python snapshot_info.py /app/state/dataset.snapshot --sections
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspección del snapshot local del dataset")
+    parser.add_argument("path")
+    parser.add_argument("--sections", action="store_true", help="incluye los bytes de cada sección")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        parser.error(f"no existe {args.path}")
+
+    os.environ.setdefault("RAG_LOG_FILE", os.path.join(tempfile.gettempdir(), "rag_snapshot_info.log"))
+    os.environ.setdefault("RAG_LOG_LEVEL", "WARNING")
+    sys.path.insert(0, APP_DIR)
+    from rag_service import DatasetSnapshotFile
+
+    info = DatasetSnapshotFile.describe(args.path)
+    if not args.sections:
+        info.pop("sections", None)
+    print(json.dumps(info, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark de arranque del servicio RAG.
+
+Lanza uvicorn varias veces y mide cuánto tarda en responder /health/live
+(proceso aceptando conexiones) y /health/ready (Firestore conectado y, con
+DATASET_WARMUP=true, dataset precargado). Usa las variables de entorno del
+proceso actual, así que puede apuntar a Groq simulado con GROQ_BASE_URL.
+
+    python startup_benchmark.py --runs 5 --port 8100
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def wait_for(url: str, started: float, timeout: float) -> Optional[float]:
+    """Segundos desde el lanzamiento hasta el primer 200 de la URL, o None si vence el plazo"""
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def run_once(port: int, timeout: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "rag_service:app", "--app-dir", APP_DIR,
+         "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        live = wait_for(f"{base_url}/health/live", started, timeout)
+        ready = wait_for(f"{base_url}/health/ready", started, timeout) if live is not None else None
+        lifecycle = {}
+        if live is not None:
+            lifecycle = httpx.get(f"{base_url}/health/ready", timeout=2.0).json()
+        return {"live_s": live, "ready_s": ready, "lifecycle_timings": lifecycle.get("timings", {})}
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def summarize(values) -> Dict[str, Optional[float]]:
+    values = [value for value in values if value is not None]
+    if not values:
+        return {"min": None, "median": None, "max": None}
+    return {
+        "min": round(min(values), 3),
+        "median": round(statistics.median(values), 3),
+        "max": round(max(values), 3)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de arranque del servicio RAG")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    
+    runs = [run_once(args.port, args.timeout) for _ in range(args.runs)]
+    print(json.dumps({
+        "runs": runs,
+        "time_to_live_s": summarize(run["live_s"] for run in runs),
+        "time_to_ready_s": summarize(run["ready_s"] for run in runs)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()